@@ -0,0 +1,108 @@
+"""
+Local stand-in for the KABİS API used by the outbox and the status reconciler.
+
+Accepts notifications (POST /bildirim, honouring Idempotency-Key), answers
+status queries (GET /bildirim/{no}) and cancellations, with a configurable
+response latency, failure rate and per-company (X-Firma-Kodu) rate limit
+answered with 429.
+
+    python scripts/fake_kabis.py --port 9910 --latency-ms 80 --fail-rate 0.02 --rate-limit 5
+
+Status answers cycle beklemede -> onaylandi / reddedildi by notification
+number, so a reconciler run sees a mix of final and open states.
+Point a company's KABİS settings api_url at http://127.0.0.1:9910.
+"""
+
+import time
+import random
+import asyncio
+import argparse
+import itertools
+from typing import Dict, Any
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+STATES = ['beklemede', 'onaylandi', 'onaylandi', 'onaylandi', 'reddedildi']
+
+
+def create_app(latency_ms: float, fail_rate: float, rate_limit: float) -> FastAPI:
+    app = FastAPI(title="Fake KABIS")
+    numbers = itertools.count(100000)
+    by_key: Dict[str, str] = {}
+    notifications: Dict[str, Dict[str, Any]] = {}
+    windows: Dict[str, list] = {}
+    stats = {'requests': 0, 'rate_limited': 0, 'failed': 0}
+
+    async def gate(request: Request):
+        """Latency, random 503s and a one-second sliding-window rate limit per firm"""
+        stats['requests'] += 1
+        await asyncio.sleep(latency_ms / 1000 * random.uniform(0.5, 1.5))
+        firm = request.headers.get('X-Firma-Kodu', '')
+        if rate_limit:
+            now = time.monotonic()
+            window = [t for t in windows.get(firm, []) if now - t < 1.0]
+            if len(window) >= rate_limit:
+                stats['rate_limited'] += 1
+                windows[firm] = window
+                return JSONResponse({'hata': 'rate limit'}, status_code=429)
+            windows[firm] = window + [now]
+        if random.random() < fail_rate:
+            stats['failed'] += 1
+            return JSONResponse({'hata': 'gecici hata'}, status_code=503)
+        return None
+
+    @app.post("/bildirim")
+    async def create(request: Request):
+        blocked = await gate(request)
+        if blocked:
+            return blocked
+        key = request.headers.get('Idempotency-Key')
+        if key and key in by_key:
+            return notifications[by_key[key]]
+        number = str(next(numbers))
+        notifications[number] = {'bildirim_no': number, 'durum': 'beklemede', **(await request.json())}
+        if key:
+            by_key[key] = number
+        return JSONResponse(notifications[number], status_code=201)
+
+    @app.get("/bildirim/{number}")
+    async def status(number: str, request: Request):
+        blocked = await gate(request)
+        if blocked:
+            return blocked
+        digits = ''.join(c for c in number if c.isdigit()) or '0'
+        return {'bildirim_no': number, 'durum': STATES[int(digits[-6:]) % len(STATES)]}
+
+    @app.delete("/bildirim/{number}")
+    async def cancel(number: str, request: Request):
+        blocked = await gate(request)
+        if blocked:
+            return blocked
+        return {'bildirim_no': number, 'durum': 'iptal'}
+
+    @app.get("/ping")
+    async def ping():
+        return {'ok': True}
+
+    @app.get("/_stats")
+    async def get_stats():
+        return {**stats, 'notifications': len(notifications)}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=9910)
+    parser.add_argument('--latency-ms', type=float, default=80)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=0, help='requests per second per firm (0 = none)')
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.latency_ms, args.fail_rate, args.rate_limit),
+                host='127.0.0.1', port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
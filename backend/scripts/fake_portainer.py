@@ -0,0 +1,187 @@
+"""
+Local stand-in for the Portainer API used by the placement scheduler.
+
+Simulates several Docker endpoints (hosts) in memory: docker info, container
+list / one-shot stats / start / stop / restart, image inspect and stack
+create / start / stop / update / delete. Stacks get one container per
+`container_name:` line of their compose file, each using a fixed amount of
+memory and CPU, so placement decisions can be checked without Docker hosts.
+
+    python scripts/fake_portainer.py --port 9900 --host small:1:8:4 --host big:2:32:16
+
+--host is name:endpoint_id:memory_gb:cpus. Point the superadmin backend at it with
+PORTAINER_URL=http://127.0.0.1:9900 and PLACEMENT_ENDPOINTS listing the same ids.
+"""
+
+import re
+import argparse
+import itertools
+from typing import Dict, Any
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+
+GB = 1024 ** 3
+CONTAINER_MEMORY = {'mongodb': 300, 'backend': 180, 'frontend': 20, 'customer_app': 15, 'operation_app': 15}
+CONTAINER_CPU = 0.02  # fraction of one core per idle container
+NANO = 10 ** 9
+
+
+class FakeHost:
+    def __init__(self, name: str, endpoint_id: int, memory_gb: float, cpus: int, base_memory_mb: int = 512):
+        self.name = name
+        self.endpoint_id = endpoint_id
+        self.memory = int(memory_gb * GB)
+        self.cpus = cpus
+        self.containers: Dict[str, Dict[str, Any]] = {}
+        # Daemon, Traefik and other non-tenant load
+        self.add_container('system', 'system', base_memory_mb, 0.05)
+
+    def add_container(self, name: str, stack: str, memory_mb: int, cpu: float):
+        self.containers[name] = {
+            'Id': f"{self.endpoint_id}-{name}", 'name': name, 'stack': stack,
+            'memory': memory_mb * 1024 * 1024, 'cpu': cpu, 'running': True, 'cpu_total': 0
+        }
+
+    def stats(self, container: Dict[str, Any]) -> Dict[str, Any]:
+        """Docker stats shape with a one-second precpu window"""
+        system_delta = self.cpus * NANO
+        cpu_delta = int(container['cpu'] * NANO) if container['running'] else 0
+        pre = container['cpu_total']
+        container['cpu_total'] += cpu_delta
+        return {
+            'memory_stats': {'usage': container['memory'] if container['running'] else 0, 'stats': {'inactive_file': 0}},
+            'cpu_stats': {'cpu_usage': {'total_usage': pre + cpu_delta}, 'system_cpu_usage': 2 * system_delta, 'online_cpus': self.cpus},
+            'precpu_stats': {'cpu_usage': {'total_usage': pre}, 'system_cpu_usage': system_delta},
+        }
+
+
+def create_app(hosts: Dict[int, FakeHost]) -> FastAPI:
+    app = FastAPI(title="Fake Portainer")
+    stacks: Dict[int, Dict[str, Any]] = {}
+    stack_ids = itertools.count(1)
+
+    def host_for(endpoint_id: int) -> FakeHost:
+        if endpoint_id not in hosts:
+            raise HTTPException(status_code=404, detail=f"Endpoint {endpoint_id} not found")
+        return hosts[endpoint_id]
+
+    def container_for(host: FakeHost, ref: str) -> Dict[str, Any]:
+        for container in host.containers.values():
+            if ref in (container['Id'], container['name']):
+                return container
+        raise HTTPException(status_code=404, detail=f"No such container: {ref}")
+
+    def deploy(host: FakeHost, stack_name: str, compose: str):
+        for name in re.findall(r'container_name:\s*(\S+)', compose):
+            role = name.split('_', 1)[1] if '_' in name else name
+            host.add_container(name, stack_name, CONTAINER_MEMORY.get(role, 50), CONTAINER_CPU)
+
+    @app.get("/api/system/status")
+    async def status():
+        return {'Version': 'fake'}
+
+    @app.get("/api/endpoints")
+    async def endpoints():
+        return [{'Id': h.endpoint_id, 'Name': h.name} for h in hosts.values()]
+
+    @app.get("/api/endpoints/{endpoint_id}/docker/info")
+    async def info(endpoint_id: int):
+        host = host_for(endpoint_id)
+        running = sum(1 for c in host.containers.values() if c['running'])
+        return {'Name': host.name, 'MemTotal': host.memory, 'NCPU': host.cpus,
+                'Containers': len(host.containers), 'ContainersRunning': running}
+
+    @app.get("/api/endpoints/{endpoint_id}/docker/containers/json")
+    async def containers(endpoint_id: int, all: bool = False):
+        host = host_for(endpoint_id)
+        return [
+            {'Id': c['Id'], 'Names': [f"/{c['name']}"], 'State': 'running' if c['running'] else 'exited',
+             'Labels': {'com.docker.compose.project': c['stack']}, 'Ports': []}
+            for c in host.containers.values() if all or c['running']
+        ]
+
+    @app.get("/api/endpoints/{endpoint_id}/docker/containers/{ref}/stats")
+    async def container_stats(endpoint_id: int, ref: str):
+        host = host_for(endpoint_id)
+        return host.stats(container_for(host, ref))
+
+    @app.post("/api/endpoints/{endpoint_id}/docker/containers/{ref}/{action}")
+    async def container_action(endpoint_id: int, ref: str, action: str):
+        container = container_for(host_for(endpoint_id), ref)
+        if action not in ('start', 'stop', 'restart'):
+            raise HTTPException(status_code=404, detail=action)
+        container['running'] = action != 'stop'
+        return {}
+
+    @app.get("/api/endpoints/{endpoint_id}/docker/images/{tag:path}/json")
+    async def image(endpoint_id: int, tag: str):
+        host_for(endpoint_id)
+        return {'Id': f"sha256:{abs(hash(tag)):x}", 'RepoTags': [tag]}
+
+    @app.get("/api/stacks")
+    async def list_stacks():
+        return [{'Id': i, 'Name': s['name'], 'EndpointId': s['endpoint_id']} for i, s in stacks.items()]
+
+    @app.post("/api/stacks/create/standalone/string")
+    async def create_stack(endpointId: int, request: Request):
+        host = host_for(endpointId)
+        body = await request.json()
+        if any(s['name'] == body['name'] and s['endpoint_id'] == endpointId for s in stacks.values()):
+            raise HTTPException(status_code=409, detail=f"A stack with the name {body['name']} already exists")
+        stack_id = next(stack_ids)
+        stacks[stack_id] = {'name': body['name'], 'endpoint_id': endpointId}
+        deploy(host, body['name'], body['stackFileContent'])
+        return {'Id': stack_id, 'Name': body['name']}
+
+    @app.put("/api/stacks/{stack_id}")
+    async def update_stack(stack_id: int, endpointId: int, request: Request):
+        stack = stacks.get(stack_id) or {}
+        if stack.get('endpoint_id') != endpointId:
+            raise HTTPException(status_code=404, detail="Stack not found")
+        host = host_for(endpointId)
+        body = await request.json()
+        host.containers = {n: c for n, c in host.containers.items() if c['stack'] != stack['name']}
+        deploy(host, stack['name'], body['stackFileContent'])
+        return {'Id': stack_id}
+
+    @app.post("/api/stacks/{stack_id}/{action}")
+    async def stack_action(stack_id: int, action: str, endpointId: int):
+        stack = stacks.get(stack_id) or {}
+        if stack.get('endpoint_id') != endpointId or action not in ('start', 'stop'):
+            raise HTTPException(status_code=404, detail="Stack not found")
+        for container in host_for(endpointId).containers.values():
+            if container['stack'] == stack['name']:
+                container['running'] = action == 'start'
+        return {'Id': stack_id}
+
+    @app.delete("/api/stacks/{stack_id}")
+    async def delete_stack(stack_id: int, endpointId: int):
+        stack = stacks.get(stack_id) or {}
+        if stack.get('endpoint_id') != endpointId:
+            raise HTTPException(status_code=404, detail="Stack not found")
+        host = host_for(endpointId)
+        host.containers = {n: c for n, c in host.containers.items() if c['stack'] != stack['name']}
+        del stacks[stack_id]
+        return {}
+
+    return app
+
+
+def parse_host(value: str) -> FakeHost:
+    name, endpoint_id, memory_gb, cpus = value.split(':')
+    return FakeHost(name, int(endpoint_id), float(memory_gb), int(cpus))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=9900)
+    parser.add_argument('--host', action='append', type=parse_host,
+                        help='name:endpoint_id:memory_gb:cpus (repeatable)')
+    args = parser.parse_args()
+    hosts = args.host or [parse_host('default:3:16:8')]
+    uvicorn.run(create_app({h.endpoint_id: h for h in hosts}), host='127.0.0.1', port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+KABİS reconciliation benchmark - one reconciler run against scripts/fake_kabis.py.
+
+Seeds submitted notifications for several companies in a throwaway database
+(kabisbench), points their KABİS settings at a local fake KABİS and reports
+how many status checks per second one run achieves, for a few concurrency /
+per-company rate settings.
+
+    python scripts/kabis_reconcile_benchmark.py --companies 20 --per-company 100 \
+        --latency-ms 80 --concurrency 4 --concurrency 16 --company-rps 5 --company-rps 20
+
+Per-company batches are capped by KABIS_RECONCILE_BATCH (default 200).
+The database is dropped afterwards.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import subprocess
+from datetime import datetime, timezone
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND_DIR)
+from services.kabis_reconciler import KabisReconciler  # noqa: E402
+
+DB_NAME = 'kabisbench'
+
+
+def start_fake(port: int, latency_ms: float) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BACKEND_DIR, 'scripts', 'fake_kabis.py'),
+         '--port', str(port), '--latency-ms', str(latency_ms)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    for _ in range(50):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/ping", timeout=0.5)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("fake KABIS did not start")
+
+
+async def seed(db, companies: int, per_company: int, api_url: str):
+    await db.kabis_notifications.delete_many({})
+    await db.integration_settings.delete_many({})
+    now = datetime.now(timezone.utc).isoformat()
+    await db.integration_settings.insert_many([
+        {'company_id': f"c{c}", 'type': 'kabis', 'is_active': True,
+         'api_key': 'bench', 'firma_kodu': f"F{c}", 'api_url': api_url}
+        for c in range(companies)
+    ])
+    await db.kabis_notifications.insert_many([
+        {'id': f"c{c}-{i}", 'company_id': f"c{c}", 'status': 'submitted',
+         'kabis_notification_no': str(100000 + c * per_company + i), 'created_at': now}
+        for c in range(companies) for i in range(per_company)
+    ])
+
+
+async def run(args):
+    process = start_fake(args.port, args.latency_ms)
+    client = AsyncIOMotorClient(args.mongo_url)
+    db = client[DB_NAME]
+    try:
+        print(f"{args.companies} companies x {args.per_company} notifications, "
+              f"fake KABIS latency {args.latency_ms}ms")
+        for concurrency in args.concurrency or [8]:
+            for rps in args.company_rps or [2]:
+                await seed(db, args.companies, args.per_company, f"http://127.0.0.1:{args.port}")
+                reconciler = KabisReconciler(db, concurrency=concurrency, company_rps=rps)
+                await reconciler.ensure_indexes()
+                result = await reconciler.run_once()
+                await reconciler.stop()
+                print(f"  concurrency {concurrency:>3}, {rps:>5} req/s per company: "
+                      f"{result['checked']} checked in {result['duration_seconds']}s "
+                      f"= {result['per_second']}/s ({result['changed']} changed, {result['errors']} errors)")
+    finally:
+        await client.drop_database(DB_NAME)
+        client.close()
+        process.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-url', default='mongodb://localhost:27017')
+    parser.add_argument('--port', type=int, default=9910)
+    parser.add_argument('--companies', type=int, default=20)
+    parser.add_argument('--per-company', type=int, default=100)
+    parser.add_argument('--latency-ms', type=float, default=80)
+    parser.add_argument('--concurrency', type=int, action='append')
+    parser.add_argument('--company-rps', type=float, action='append')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Placement simulation - provisions N tenants through the placement scheduler
+against scripts/fake_portainer.py and reports how they spread over the hosts.
+
+    python scripts/placement_simulation.py --tenants 40 --host small:1:8:4 --host big:2:32:16
+
+Each placement measures the fake hosts (docker info + container stats), picks
+an endpoint and creates the real tenant compose there, so later placements
+see the memory of earlier ones. Hosts that fill up drop out until every host
+is at its memory limit.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+
+import httpx
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def start_fake(port: int, hosts: list) -> subprocess.Popen:
+    command = [sys.executable, os.path.join(BACKEND_DIR, 'scripts', 'fake_portainer.py'), '--port', str(port)]
+    for host in hosts:
+        command += ['--host', host]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/api/system/status", timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('fake Portainer did not start')
+
+
+async def simulate(tenants: int, concurrency: int):
+    # Imported after the environment points the services at the fake
+    from services.placement import placement_scheduler
+
+    slots = asyncio.Semaphore(concurrency)
+    placed, rejected = {}, 0
+
+    async def provision(i: int):
+        nonlocal rejected
+        async with slots:
+            company_id = f"sim{i:04d}"
+            endpoint = await placement_scheduler.place(company_id)
+            if not endpoint:
+                rejected += 1
+                return
+            portainer = placement_scheduler.portainer.for_endpoint(endpoint['endpoint_id'], endpoint['server_ip'])
+            result = await portainer.create_full_stack(company_id, company_id, f"{company_id}.test", i)
+            placement_scheduler.release(company_id)
+            if result.get('success'):
+                placed[endpoint['name']] = placed.get(endpoint['name'], 0) + 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(provision(i) for i in range(tenants)))
+    elapsed = time.monotonic() - started
+
+    print(f"{tenants} placements in {elapsed:.2f}s ({rejected} rejected - no host with room)")
+    print(f"{'host':<12}{'tenants':>8}{'memory':>9}{'cpu':>7}{'containers':>12}")
+    for endpoint in await placement_scheduler.overview(fresh=True):
+        print(
+            f"{endpoint['name']:<12}{placed.get(endpoint['name'], 0):>8}"
+            f"{endpoint.get('memory_fraction', 0):>9.1%}{endpoint.get('cpu_fraction', 0):>7.1%}"
+            f"{endpoint.get('containers_total', 0):>12}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tenants', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--port', type=int, default=9900)
+    parser.add_argument('--host', action='append', help='name:endpoint_id:memory_gb:cpus (repeatable)')
+    args = parser.parse_args()
+    hosts = args.host or ['small:1:8:4', 'medium:2:16:8', 'big:3:32:16']
+
+    os.environ['PORTAINER_URL'] = f"http://127.0.0.1:{args.port}"
+    os.environ['PLACEMENT_ENDPOINTS'] = json.dumps([
+        {'endpoint_id': int(h.split(':')[1]), 'name': h.split(':')[0], 'server_ip': '127.0.0.1'} for h in hosts
+    ])
+    os.environ.setdefault('PLACEMENT_CAPACITY_TTL', '0')
+    sys.path.insert(0, BACKEND_DIR)
+
+    fake = start_fake(args.port, hosts)
+    try:
+        asyncio.run(simulate(args.tenants, args.concurrency))
+    finally:
+        fake.terminate()
+
+
+if __name__ == '__main__':
+    main()
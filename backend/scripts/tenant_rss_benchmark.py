@@ -0,0 +1,134 @@
+"""
+Tenant backend memory benchmark - shared runtime vs one process per tenant.
+
+Starts the template tenant backend both ways against a local MongoDB, warms
+every tenant with the same requests (health, public company info, a failed
+login - each touching the tenant database) and reports resident memory.
+
+    python scripts/tenant_rss_benchmark.py --tenants 20 --mongo-url mongodb://localhost:27017
+
+Per-process mode approximates per-container deployment; real containers add
+their own runtime overhead on top, so the measured gap is a lower bound.
+Uses throwaway databases named rssbench_* and drops them afterwards.
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+import httpx
+from pymongo import MongoClient
+
+TEMPLATE_BACKEND = os.path.join(os.path.dirname(__file__), '..', 'template', 'backend')
+REGISTRY_DB = 'rssbench_registry'
+
+
+def rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def start_backend(port: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'server:app', '--host', '127.0.0.1', '--port', str(port)],
+        cwd=TEMPLATE_BACKEND, env={**os.environ, **env},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def wait_ready(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/api/health", timeout=1).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"backend on :{port} did not start")
+
+
+def warm(port: int, host: str, rounds: int):
+    with httpx.Client(base_url=f"http://127.0.0.1:{port}", headers={'Host': host}, timeout=10) as client:
+        for _ in range(rounds):
+            client.get('/api/health')
+            client.get('/api/public/company')
+            client.post('/api/auth/login', json={'email': 'nobody@example.com', 'password': 'x'})
+
+
+def tenant_names(count: int):
+    return [f"rssbench{i}" for i in range(count)]
+
+
+def run_per_process(args) -> int:
+    procs = []
+    try:
+        for i, code in enumerate(tenant_names(args.tenants)):
+            port = args.base_port + i
+            procs.append((port, code, start_backend(port, {
+                'MONGO_URL': args.mongo_url, 'DB_NAME': f"{code}_db",
+                'JWT_SECRET': f"{code}_secret", 'COMPANY_CODE': code
+            })))
+        for port, code, _ in procs:
+            wait_ready(port)
+            warm(port, f"api.{code}.test", args.rounds)
+        return sum(rss_kb(proc.pid) for _, _, proc in procs)
+    finally:
+        for _, _, proc in procs:
+            proc.terminate()
+            proc.wait()
+
+
+def run_shared(args, mongo: MongoClient) -> int:
+    registry = mongo[REGISTRY_DB].tenant_registry
+    registry.delete_many({})
+    registry.insert_many([{
+        'code': code, 'hosts': [f"api.{code}.test"], 'domain': f"{code}.test",
+        'mongo_url': args.mongo_url, 'db_name': f"{code}_db", 'jwt_secret': f"{code}_secret",
+        'company_name': code, 'active': True
+    } for code in tenant_names(args.tenants)])
+
+    port = args.base_port
+    proc = start_backend(port, {
+        'TENANT_MODE': 'shared', 'TENANT_REGISTRY_URL': args.mongo_url, 'TENANT_REGISTRY_DB': REGISTRY_DB
+    })
+    try:
+        wait_ready(port)
+        for code in tenant_names(args.tenants):
+            warm(port, f"api.{code}.test", args.rounds)
+        return rss_kb(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tenants', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=20, help='warm-up request rounds per tenant')
+    parser.add_argument('--mongo-url', default='mongodb://localhost:27017')
+    parser.add_argument('--base-port', type=int, default=18000)
+    args = parser.parse_args()
+
+    mongo = MongoClient(args.mongo_url)
+    try:
+        per_process_kb = run_per_process(args)
+        shared_kb = run_shared(args, mongo)
+    finally:
+        for code in tenant_names(args.tenants):
+            mongo.drop_database(f"{code}_db")
+        mongo.drop_database(REGISTRY_DB)
+
+    print(f"{'mode':<14}{'total RSS (MB)':>16}{'per tenant (MB)':>18}")
+    for mode, kb in (('per-process', per_process_kb), ('shared', shared_kb)):
+        print(f"{mode:<14}{kb / 1024:>16.1f}{kb / 1024 / args.tenants:>18.1f}")
+    print(f"shared runtime uses {per_process_kb / max(shared_kb, 1):.1f}x less memory for {args.tenants} tenants")
+
+
+if __name__ == '__main__':
+    main()
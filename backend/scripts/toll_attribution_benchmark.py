@@ -0,0 +1,68 @@
+"""
+Toll attribution benchmark - times the passage/reservation sort-merge join
+(services.blocking_tasks.match_intervals) on a synthetic fleet.
+
+    python scripts/toll_attribution_benchmark.py --vehicles 1000 --days 365 --passages-per-day 2
+
+Each vehicle gets back-to-back rentals of 1-14 days with 0-3 idle days in
+between; passages are spread uniformly over the year. The result is checked
+against a per-passage scan on a sample.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from services.blocking_tasks import match_intervals  # noqa: E402
+
+DAY = 86400.0
+
+
+def synthetic_fleet(vehicles: int, days: int, passages_per_day: float, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    start_of_year = 1_704_067_200.0  # 2024-01-01T00:00:00Z
+    i_vehicle, i_start, i_end = [], [], []
+    for vehicle in range(vehicles):
+        t = start_of_year + rng.uniform(0, 3) * DAY
+        while t < start_of_year + days * DAY:
+            length = rng.uniform(1, 14) * DAY
+            i_vehicle.append(vehicle)
+            i_start.append(t)
+            i_end.append(t + length)
+            t += length + rng.uniform(0, 3) * DAY
+    count = int(vehicles * days * passages_per_day)
+    p_vehicle = rng.integers(0, vehicles, count)
+    p_time = start_of_year + rng.uniform(0, days * DAY, count)
+    return (p_vehicle, p_time, np.array(i_vehicle), np.array(i_start), np.array(i_end))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vehicles', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--passages-per-day', type=float, default=2)
+    parser.add_argument('--check', type=int, default=2000, help='passages verified with a linear scan')
+    args = parser.parse_args()
+
+    p_vehicle, p_time, i_vehicle, i_start, i_end = synthetic_fleet(args.vehicles, args.days, args.passages_per_day)
+    print(f"{len(p_time):,} passages, {len(i_start):,} rentals, {args.vehicles} vehicles")
+
+    started = time.perf_counter()
+    matches = match_intervals(p_vehicle, p_time, i_vehicle, i_start, i_end)
+    elapsed = time.perf_counter() - started
+    print(f"join: {elapsed:.3f}s ({len(p_time) / elapsed:,.0f} passages/s), "
+          f"{np.count_nonzero(matches >= 0):,} attributed")
+
+    for i in np.random.default_rng(2).integers(0, len(p_time), min(args.check, len(p_time))):
+        inside = np.flatnonzero((i_vehicle == p_vehicle[i]) & (i_start <= p_time[i]) & (p_time[i] <= i_end))
+        expected = inside[0] if len(inside) else -1
+        assert matches[i] == expected, f"passage {i}: {matches[i]} != {expected}"
+    print(f"checked {min(args.check, len(p_time))} passages against a linear scan: ok")
+
+
+if __name__ == '__main__':
+    main()
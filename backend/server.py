@@ -1,6 +1,7 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, BackgroundTasks, UploadFile, File, Form, Request, Body
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -13,9 +14,9 @@ from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional, Union
 import uuid
+import time
 from datetime import datetime, timezone, timedelta
 from enum import Enum
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 import secrets
 
@@ -23,13 +24,33 @@ ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # Import Portainer service
-from services.portainer_service import portainer_service
+from services.portainer_service import portainer_service, portainer_for
+from services.portainer_client import PortainerCircuitOpen
 from services.arvento_service import ArventoService
+from services.gps_collector import gps_collector, mock_position
+from services.gps_history import gps_history, parse_timestamp
+from services.gps_stream import gps_stream, GPSStreamFull, ALL_COMPANIES
+from services.gps_geo import gps_geo, validate_polygon, GEOFENCE_MODES, GPS_NEARBY_DEFAULT_RADIUS
 from services.kabis_service import KabisService, kabis_service
-from services.hgs_service import HGSService, hgs_service
-import subprocess
-import tarfile
-import io
+from services.kabis_outbox import kabis_outbox
+from services.kabis_reconciler import kabis_reconciler
+from services.hgs_service import HGSService, hgs_service, parse_passage_statement
+from services.toll_attribution import toll_attribution
+from services.artifact_store import artifact_store
+from services.port_allocator import port_allocator
+from services.fleet_status import fleet_status
+from services.traefik_routes import traefik_for, tenant_router_names
+from services.tenant_image import TenantImageBuilder, tenant_image_builder
+from services.tenant_registry import tenant_registry
+from services.tenant_mongo import tenant_mongo
+from services.hibernation import hibernation
+from services.placement import placement_scheduler
+from services.tenant_db import tenant_databases
+from services.ticket_replication import ticket_replicator
+from services.template_versions import template_versions, TEMPLATE_COMPONENTS
+from services.portainer_service import get_full_company_stack_template, SERVER_IP
+from services.executor import blocking_executor, loop_lag_monitor
+from services import blocking_tasks
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
@@ -41,7 +62,6 @@ SECRET_KEY = os.environ.get('JWT_SECRET', secrets.token_hex(32))
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
 app = FastAPI(title="FleetEase - Kurumsal Rent a Car Platform")
@@ -412,6 +432,7 @@ class ReturnCreate(BaseModel):
     fuel_level: str
     damage_notes: Optional[str] = None
     extra_charges: float = 0
+    include_tolls: bool = True  # add HGS passages of the rental to extra_charges
 
 class PaymentCreate(BaseModel):
     reservation_id: str
@@ -430,11 +451,12 @@ class DashboardStats(BaseModel):
     pending_returns: int
 
 # ============== AUTH HELPERS ==============
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    # bcrypt is CPU-bound - run it in the process pool, not on the event loop
+    return await blocking_executor.run_cpu(blocking_tasks.verify_password, plain_password, hashed_password)
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+async def get_password_hash(password: str) -> str:
+    return await blocking_executor.run_cpu(blocking_tasks.hash_password, password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
@@ -475,7 +497,7 @@ async def register(user_data: UserCreate):
     user_doc = {
         "id": user_id,
         "email": user_data.email,
-        "password_hash": get_password_hash(user_data.password),
+        "password_hash": await get_password_hash(user_data.password),
         "full_name": user_data.full_name,
         "role": user_data.role.value,
         "company_id": user_data.company_id,
@@ -501,7 +523,7 @@ async def register(user_data: UserCreate):
 @api_router.post("/auth/login", response_model=TokenResponse)
 async def login(credentials: UserLogin):
     user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
-    if not user or not verify_password(credentials.password, user["password_hash"]):
+    if not user or not await verify_password(credentials.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     if not user.get("is_active", True):
@@ -581,7 +603,7 @@ async def create_company_superadmin(company: CompanyCreate, user: dict = Depends
             admin_user_doc = {
                 "id": admin_user_id,
                 "email": company.admin_email,
-                "password_hash": get_password_hash(company.admin_password),
+                "password_hash": await get_password_hash(company.admin_password),
                 "full_name": company.admin_full_name or f"{company.name} Admin",
                 "role": UserRole.FIRMA_ADMIN.value,
                 "company_id": company_id,
@@ -712,16 +734,24 @@ async def delete_company_superadmin(company_id: str, hard_delete: bool = False,
     errors = []
     
     # 1. Delete Portainer stack if exists
+    stack_removed = not company.get("portainer_stack_id")
     if company.get("portainer_stack_id"):
         try:
-            stack_result = await portainer_service.delete_stack(company["portainer_stack_id"])
+            stack_result = await portainer_for(company).delete_stack(company["portainer_stack_id"])
             if stack_result.get("success"):
+                stack_removed = True
                 deleted_resources.append(f"Portainer Stack (ID: {company['portainer_stack_id']})")
             else:
                 errors.append(f"Portainer stack silme hatası: {stack_result.get('error')}")
         except Exception as e:
             errors.append(f"Portainer hatası: {str(e)}")
     
+    # Port offset goes back to the pool only once no container holds its ports
+    if stack_removed and company.get("port_offset") is not None:
+        await port_allocator.release(company["port_offset"])
+    if stack_removed:
+        await tenant_registry.unregister(company["code"])
+    
     # 2. Delete all company data from database
     try:
         # Delete vehicles
@@ -803,66 +833,30 @@ async def deploy_company_frontend(company_code: str, backend_url: str, container
         # Wait for container to be ready
         await asyncio.sleep(15)
         
-        frontend_dir = "/app/frontend"
-        build_dir = f"{frontend_dir}/build"
-        
-        # Build frontend with company's backend URL (should be HTTPS for domains)
-        env = os.environ.copy()
-        env["REACT_APP_BACKEND_URL"] = backend_url
-        env["CI"] = "false"
-        
-        logger.info(f"[FRONTEND-DEPLOY] Building frontend with REACT_APP_BACKEND_URL={backend_url}")
-        
-        result = subprocess.run(
-            ["yarn", "build"],
-            cwd=frontend_dir,
-            env=env,
-            capture_output=True,
-            text=True,
-            timeout=300
-        )
+        # Reuse the frontend artifact for the current source tree (built once, config.js set per tenant)
+        artifact_result = await artifact_store.get_or_build("superadmin")
         
-        if result.returncode != 0:
-            logger.error(f"[FRONTEND-DEPLOY] Build failed for {company_code}: {result.stderr}")
-            return {"success": False, "error": result.stderr}
+        if not artifact_result.get("success"):
+            logger.error(f"[FRONTEND-DEPLOY] Build failed for {company_code}: {artifact_result.get('details') or artifact_result.get('error')}")
+            return {"success": False, "error": artifact_result.get("error")}
         
-        logger.info(f"[FRONTEND-DEPLOY] Build completed successfully for {company_code}")
-        
-        # Create tar archive
-        tar_buffer = io.BytesIO()
-        with tarfile.open(fileobj=tar_buffer, mode='w') as tar:
-            for root, dirs, files in os.walk(build_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, build_dir)
-                    tar.add(file_path, arcname=arcname)
-        
-        tar_data = tar_buffer.getvalue()
+        artifact = artifact_result["artifact"]
+        logger.info(f"[FRONTEND-DEPLOY] Using artifact v{artifact['version']} (reused: {artifact_result.get('reused')})")
         
         logger.info(f"[FRONTEND-DEPLOY] Uploading build to container {container_name}...")
         
-        # Upload to container
-        upload_result = await portainer_service.upload_to_container(
+        deploy_result = await portainer_service.deploy_frontend_bundle(
             container_name=container_name,
-            tar_data=tar_data,
-            dest_path="/usr/share/nginx/html"
+            bundle=await artifact_store.load_bundle(artifact),
+            api_url=backend_url
         )
         
-        if upload_result.get('error'):
-            logger.error(f"[FRONTEND-DEPLOY] Upload failed for {company_code}: {upload_result.get('error')}")
-            return {"success": False, "error": upload_result.get('error')}
-        
-        logger.info(f"[FRONTEND-DEPLOY] Upload successful, configuring Nginx...")
-        
-        # Configure Nginx for SPA routing
-        nginx_result = await portainer_service.configure_nginx_spa(container_name)
-        
-        if nginx_result.get('error'):
-            logger.error(f"[FRONTEND-DEPLOY] Nginx config failed for {company_code}: {nginx_result.get('error')}")
-            return {"success": False, "error": nginx_result.get('error')}
+        if not deploy_result.get('success'):
+            logger.error(f"[FRONTEND-DEPLOY] Deploy failed for {company_code}: {deploy_result.get('error')}")
+            return {"success": False, "error": deploy_result.get('error')}
         
         logger.info(f"[FRONTEND-DEPLOY] Frontend deployed successfully for {company_code}")
-        return {"success": True}
+        return {"success": True, "artifact_id": artifact["id"]}
             
     except Exception as e:
         logger.error(f"[FRONTEND-DEPLOY] Error for {company_code}: {str(e)}")
@@ -885,40 +879,18 @@ async def deploy_company_backend(company_code: str, container_name: str, mongo_s
         
         backend_dir = "/app/backend"
         
-        # Create tar with backend files
-        tar_buffer = io.BytesIO()
-        with tarfile.open(fileobj=tar_buffer, mode='w') as tar:
-            # Add server.py
-            tar.add(f"{backend_dir}/server.py", arcname="server.py")
-            tar.add(f"{backend_dir}/requirements.txt", arcname="requirements.txt")
-            
-            # Add services folder
-            services_dir = f"{backend_dir}/services"
-            if os.path.exists(services_dir):
-                for root, dirs, files in os.walk(services_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, backend_dir)
-                        tar.add(file_path, arcname=arcname)
-            
-            # Add .env with correct settings
-            env_content = f"""MONGO_URL=mongodb://{mongo_service_name}:27017
+        # Create tar with backend files (server.py, requirements, services, .env, main.py)
+        env_content = f"""MONGO_URL=mongodb://{mongo_service_name}:27017
 DB_NAME={db_name}
 JWT_SECRET={company_code}_jwt_secret_2024
 """
-            env_info = tarfile.TarInfo(name=".env")
-            env_bytes = env_content.encode('utf-8')
-            env_info.size = len(env_bytes)
-            tar.addfile(env_info, io.BytesIO(env_bytes))
-            
-            # Add main.py
-            main_py = "from server import app\n"
-            main_info = tarfile.TarInfo(name="main.py")
-            main_bytes = main_py.encode('utf-8')
-            main_info.size = len(main_bytes)
-            tar.addfile(main_info, io.BytesIO(main_bytes))
-        
-        tar_data = tar_buffer.getvalue()
+        services_dir = f"{backend_dir}/services"
+        tar_data = await blocking_executor.run_io(
+            blocking_tasks.build_tar_archive,
+            [(f"{backend_dir}/server.py", "server.py"), (f"{backend_dir}/requirements.txt", "requirements.txt")],
+            [(services_dir, backend_dir)] if os.path.exists(services_dir) else [],
+            {".env": env_content, "main.py": "from server import app\n"}
+        )
         
         logger.info(f"[BACKEND-DEPLOY] Uploading backend code to {container_name}...")
         
@@ -972,9 +944,9 @@ async def setup_company_database(company: dict, mongo_port: int, db_name: str =
     logger.info(f"[DB-SETUP] Database name: {db_name}")
     
     try:
-        # Connect to company's MongoDB
-        mongo_url = f"mongodb://72.61.158.147:{mongo_port}"
-        logger.info(f"[DB-SETUP] Connecting to MongoDB at {mongo_url}")
+        # Connect directly to the company's MongoDB (its own mongod or the shared tenant mongod)
+        mongo_url = tenant_mongo.admin_url(company, mongo_port)
+        logger.info(f"[DB-SETUP] Connecting to MongoDB for {db_name}")
         
         client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=15000)
         company_db = client[db_name]
@@ -1009,7 +981,7 @@ async def setup_company_database(company: dict, mongo_port: int, db_name: str =
             admin_user = {
                 "id": str(uuid.uuid4()),
                 "email": admin_email,
-                "password_hash": pwd_context.hash(admin_password),
+                "password_hash": await get_password_hash(admin_password),
                 "full_name": admin_name,
                 "role": "firma_admin",
                 "company_id": company_id,
@@ -1096,9 +1068,9 @@ async def full_auto_provision(company: dict, result: dict, port_offset: int):
         mongo_port = result.get('ports', {}).get('mongodb', 21000 + port_offset)
         await setup_company_database(company, mongo_port, db_name)
         
-        # Step 4: Restart Traefik to pick up new labels
-        logger.info(f"[AUTO-PROVISION] Step 4: Refreshing Traefik routing...")
-        await restart_traefik_for_new_labels()
+        # Step 4: Wait for Traefik to discover the new labels
+        logger.info(f"[AUTO-PROVISION] Step 4: Waiting for Traefik routes...")
+        await wait_for_tenant_routes(company)
         
         logger.info(f"[AUTO-PROVISION] Full auto provision completed for {company['name']}")
         
@@ -1115,39 +1087,29 @@ async def full_auto_provision(company: dict, result: dict, port_offset: int):
         logger.error(f"[AUTO-PROVISION] Error during auto provision for {company['name']}: {str(e)}")
 
 
-async def restart_traefik_for_new_labels():
+async def wait_for_tenant_routes(company: dict, started_at: float = None) -> dict:
     """
-    Restart Traefik container to pick up new Docker labels from newly created containers
+    Wait until Traefik serves the tenant's label-defined routers and record
+    time-to-route on the company. Traefik's docker provider watches container
+    events, so new routes go live without restarting Traefik.
     """
-    try:
-        # Find and restart Traefik container
-        containers = await portainer_service._request('GET', f"endpoints/{portainer_service.endpoint_id}/docker/containers/json")
-        
-        traefik_id = None
-        if isinstance(containers, list):
-            for c in containers:
-                names = c.get('Names', [])
-                for name in names:
-                    if 'traefik' in name.lower():
-                        traefik_id = c.get('Id')
-                        break
-                if traefik_id:
-                    break
-        
-        if traefik_id:
-            restart_result = await portainer_service.restart_container_by_id(traefik_id)
-            if restart_result.get('success'):
-                logger.info("[AUTO-PROVISION] Traefik restarted successfully")
-                # Wait for Traefik to be ready
-                import asyncio
-                await asyncio.sleep(5)
-            else:
-                logger.warning(f"[AUTO-PROVISION] Traefik restart warning: {restart_result.get('error')}")
-        else:
-            logger.warning("[AUTO-PROVISION] Traefik container not found")
-            
-    except Exception as e:
-        logger.warning(f"[AUTO-PROVISION] Traefik restart error (non-critical): {str(e)}")
+    safe_code = company["code"].replace('-', '').replace('_', '')
+    result = await traefik_for(company.get("server_ip")).wait_for_routes(tenant_router_names(safe_code), started_at=started_at)
+    
+    update = {
+        "routes_ready": result.get("success", False),
+        "route_status": result.get("routers"),
+        "routes_checking": False,
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }
+    if result.get("success"):
+        update["time_to_route_seconds"] = result["time_to_route_seconds"]
+        update["routes_ready_at"] = datetime.now(timezone.utc).isoformat()
+    else:
+        logger.warning(f"[PROVISION] Routes for {company['code']} not ready: {result.get('routers')}")
+    
+    await db.companies.update_one({"id": company["id"]}, {"$set": update})
+    return result
 
 
 @api_router.post("/superadmin/companies/{company_id}/provision")
@@ -1163,37 +1125,79 @@ async def provision_company(company_id: str, background_tasks: BackgroundTasks,
     if company.get("portainer_stack_id"):
         raise HTTPException(status_code=400, detail="Company already has a provisioned stack")
     
-    # Get next available port offset
-    port_offset = await portainer_service.get_next_port_offset(db)
-    
-    # Update status to provisioning
-    await db.companies.update_one(
-        {"id": company_id},
-        {"$set": {
-            "status": CompanyStatus.PROVISIONING.value,
-            "port_offset": port_offset,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
-    
-    # Check if domain is set - use full stack if domain exists
-    domain = company.get("domain")
-    
-    if domain:
-        # Create full stack with Traefik labels for domain routing
-        result = await portainer_service.create_full_stack(
-            company_code=company["code"],
-            company_name=company["name"],
-            domain=domain,
-            port_offset=port_offset
-        )
-    else:
-        # Create minimal stack (MongoDB only) for IP-based access
-        result = await portainer_service.create_stack(
-            company_code=company["code"],
-            company_name=company["name"],
-            port_offset=port_offset
+    # Reuse the company's offset from a previous attempt, otherwise allocate atomically
+    port_offset = company.get("port_offset")
+    if port_offset is None:
+        port_offset = await port_allocator.allocate(company_id)
+        if port_offset is None:
+            raise HTTPException(status_code=503, detail="Boş port aralığı kalmadı")
+    
+    # Least-loaded Docker host; the stack and every later lifecycle call go there
+    placement = await placement_scheduler.place(company_id)
+    if not placement:
+        await db.companies.update_one({"id": company_id}, {"$set": {"port_offset": None}})
+        await port_allocator.release(port_offset)
+        raise HTTPException(status_code=503, detail="Yeni firma için kapasitesi olan sunucu yok")
+    # The pending reservation holds room on the endpoint until the stack exists - always give it back
+    try:
+        placement_fields = placement_scheduler.placement_fields(placement)
+        company.update(placement_fields)
+        portainer = portainer_for(company)
+        
+        # Update status to provisioning
+        await db.companies.update_one(
+            {"id": company_id},
+            {"$set": {
+                "status": CompanyStatus.PROVISIONING.value,
+                "port_offset": port_offset,
+                **placement_fields,
+                "updated_at": datetime.now(timezone.utc).isoformat()
+            }}
         )
+        
+        # Check if domain is set - use full stack if domain exists
+        domain = company.get("domain")
+        backend_image = None
+        
+        if domain:
+            # Prebuilt tenant backend image - only rebuilt when template code/requirements change
+            # (built on the chosen host - images are local to each Docker daemon)
+            image_builder = tenant_image_builder if portainer is portainer_service else TenantImageBuilder(portainer, db)
+            image_result = await image_builder.get_or_build(built_by=user["email"])
+            if image_result.get("success"):
+                backend_image = image_result["image"]
+            else:
+                logger.warning(f"[PROVISION] Tenant image unavailable, falling back to template copy: {image_result.get('error')}")
+        
+            # Database on the consolidated tenant mongod instead of a per-stack container
+            if tenant_mongo.shared_enabled and not tenant_mongo.is_shared(company):
+                try:
+                    mongo_fields = await tenant_mongo.ensure_tenant_user(company)
+                    await db.companies.update_one({"id": company_id}, {"$set": mongo_fields})
+                    company.update(mongo_fields)
+                except Exception as e:
+                    logger.warning(f"[PROVISION] Shared MongoDB unavailable, using a dedicated mongod: {str(e)}")
+        
+            stack_started_at = time.monotonic()
+        
+            # Create full stack with Traefik labels for domain routing
+            result = await portainer.create_full_stack(
+                company_code=company["code"],
+                company_name=company["name"],
+                domain=domain,
+                port_offset=port_offset,
+                backend_image=backend_image["tag"] if backend_image else None,
+                mongo_url=company.get("mongo_url") if tenant_mongo.is_shared(company) else None
+            )
+        else:
+            # Create minimal stack (MongoDB only) for IP-based access
+            result = await portainer.create_stack(
+                company_code=company["code"],
+                company_name=company["name"],
+                port_offset=port_offset
+            )
+    finally:
+        placement_scheduler.release(company_id)
     
     if result.get("success"):
         # Update company with stack info
@@ -1220,16 +1224,43 @@ async def provision_company(company_id: str, background_tasks: BackgroundTasks,
             backend_port = result.get("ports", {}).get("backend")
             
             # Run full deployment via Portainer API
-            deploy_result = await portainer_service.full_tenant_deployment(
+            deploy_result = await portainer.full_tenant_deployment(
                 company_code=company["code"],
                 domain=domain,
                 admin_email=admin_email,
                 admin_password=admin_password,
                 mongo_port=mongo_port,
-                backend_port=backend_port
+                backend_port=backend_port,
+                backend_image=backend_image["tag"] if backend_image else None,
+                stack_started_at=stack_started_at,
+                mongo_url=tenant_mongo.admin_url(company) if tenant_mongo.is_shared(company) else None
             )
             
             logger.info(f"[PROVISION] Full deployment result: {deploy_result.get('success')}")
+            if deploy_result.get("success"):
+                # Fresh from the template - the first rollout can skip it
+                await template_versions.record(company, await template_versions.get_manifest())
+            
+            await db.companies.update_one(
+                {"id": company_id},
+                {"$set": {
+                    "backend_image": backend_image["tag"] if backend_image else None,
+                    "backend_image_version": backend_image["version"] if backend_image else None,
+                    "backend_requirements_hash": backend_image["requirements_hash"] if backend_image else None,
+                    "cold_start_seconds": deploy_result.get("cold_start_seconds")
+                }}
+            )
+            
+            # Routes come from container labels; Traefik picking them up is verified in the
+            # background and reported on the company (GET .../routes)
+            await db.companies.update_one(
+                {"id": company_id},
+                {"$set": {"routes_ready": False, "route_status": None, "routes_checking": True}}
+            )
+            background_tasks.add_task(wait_for_tenant_routes, dict(company), stack_started_at)
+            
+            # Lets a shared-runtime tenant backend serve this company as well
+            await tenant_registry.register(company)
             
             return {
                 "message": "Company provisioned and deployed successfully",
@@ -1238,6 +1269,9 @@ async def provision_company(company_id: str, background_tasks: BackgroundTasks,
                 "urls": result.get("urls"),
                 "ports": result.get("ports"),
                 "deployment": deploy_result,
+                "routing": {"status": "checking", "status_url": f"/api/superadmin/companies/{company_id}/routes"},
+                "backend_image": backend_image["tag"] if backend_image else None,
+                "cold_start_seconds": deploy_result.get("cold_start_seconds"),
                 "admin_email": admin_email,
                 "note": "Stack oluşturuldu, template'den kod kopyalandı, database kuruldu."
             }
@@ -1252,17 +1286,34 @@ async def provision_company(company_id: str, background_tasks: BackgroundTasks,
                 "note": "Domain belirtilmediği için sadece MongoDB kuruldu."
             }
     else:
-        # Revert status
+        # Revert status and give the port offset back
         await db.companies.update_one(
             {"id": company_id},
             {"$set": {
                 "status": CompanyStatus.PENDING.value,
+                "port_offset": None,
                 "provisioning_error": result.get("error"),
                 "updated_at": datetime.now(timezone.utc).isoformat()
             }}
         )
+        await port_allocator.release(port_offset)
         raise HTTPException(status_code=500, detail=f"Provisioning failed: {result.get('error')}")
 
+@api_router.get("/superadmin/companies/{company_id}/routes")
+async def get_company_routes(company_id: str, user: dict = Depends(get_current_user)):
+    """SuperAdmin: Traefik route readiness recorded after provisioning"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view company routes")
+    
+    company = await db.companies.find_one(
+        {"id": company_id},
+        {"_id": 0, "code": 1, "routes_checking": 1, "routes_ready": 1, "route_status": 1,
+         "routes_ready_at": 1, "time_to_route_seconds": 1}
+    )
+    if not company:
+        raise HTTPException(status_code=404, detail="Company not found")
+    return company
+
 @api_router.delete("/superadmin/companies/{company_id}/provision")
 async def deprovision_company(company_id: str, user: dict = Depends(get_current_user)):
     """SuperAdmin: Remove a company stack from Portainer"""
@@ -1278,7 +1329,7 @@ async def deprovision_company(company_id: str, user: dict = Depends(get_current_
         raise HTTPException(status_code=400, detail="Company has no provisioned stack")
     
     # Delete stack from Portainer
-    result = await portainer_service.delete_stack(stack_id)
+    result = await portainer_for(company).delete_stack(stack_id)
     
     if result.get("success"):
         await db.companies.update_one(
@@ -1287,20 +1338,275 @@ async def deprovision_company(company_id: str, user: dict = Depends(get_current_
                 "status": CompanyStatus.PENDING.value,
                 "portainer_stack_id": None,
                 "stack_name": None,
+                "port_offset": None,
                 "ports": None,
                 "urls": None,
                 "updated_at": datetime.now(timezone.utc).isoformat()
             }}
         )
+        await port_allocator.release(company.get("port_offset"))
+        await tenant_registry.unregister(company["code"])
         return {"message": "Company stack removed successfully"}
     else:
         raise HTTPException(status_code=500, detail=f"Deprovisioning failed: {result.get('error')}")
 
+async def reconcile_port_offsets() -> dict:
+    """Reconcile the port offset allocator against containers actually running on Portainer"""
+    # Offsets are fleet-wide, so a port held on any placement endpoint keeps its offset
+    published_ports = set()
+    for endpoint in await placement_scheduler.get_endpoints():
+        ports = await portainer_service.for_endpoint(endpoint["endpoint_id"], endpoint["server_ip"]).get_published_ports()
+        if ports is None:
+            return {"success": False, "error": f"Portainer container listesi alınamadı (endpoint {endpoint['endpoint_id']})"}
+        published_ports.update(ports)
+    return await port_allocator.reconcile(sorted(published_ports))
+
+@api_router.get("/superadmin/ports")
+async def get_port_allocations(user: dict = Depends(get_current_user)):
+    """SuperAdmin: Port offset allocator state"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view port allocations")
+    
+    return await port_allocator.get_state()
+
+@api_router.post("/superadmin/ports/reconcile")
+async def reconcile_port_allocations(user: dict = Depends(get_current_user)):
+    """SuperAdmin: Rebuild the free list and next offset from companies and container ports"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can reconcile port allocations")
+    
+    result = await reconcile_port_offsets()
+    if not result.get("success"):
+        raise HTTPException(status_code=502, detail=result.get("error"))
+    return result
+
+@api_router.get("/superadmin/shared-runtime/tenants")
+async def get_shared_runtime_tenants(user: dict = Depends(get_current_user)):
+    """SuperAdmin: Tenants a shared-runtime backend can serve (secrets omitted)"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view the tenant registry")
+
+    return {"tenants": await tenant_registry.list_entries()}
+
+@api_router.post("/superadmin/shared-runtime/tenants/sync")
+async def sync_shared_runtime_tenants(user: dict = Depends(get_current_user)):
+    """SuperAdmin: Rebuild the tenant registry from provisioned companies"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can sync the tenant registry")
+
+    return await tenant_registry.sync()
+
+@api_router.get("/superadmin/hibernation")
+async def get_hibernation_report(user: dict = Depends(get_current_user)):
+    """SuperAdmin: Hibernated tenants, per-plan thresholds and memory reclaimed"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view hibernation")
+
+    return await hibernation.get_report()
+
+@api_router.post("/superadmin/hibernation/check")
+async def run_hibernation_check(user: dict = Depends(get_current_user)):
+    """SuperAdmin: Run one idle check now"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can run hibernation checks")
+
+    return await hibernation.check()
+
+@api_router.post("/superadmin/hibernation/waker-route")
+async def install_hibernation_waker_route(user: dict = Depends(get_current_user)):
+    """SuperAdmin: (Re)write the Traefik catch-all route that sends hibernated hosts to the waker"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can manage the waker route")
+
+    return await hibernation.install_waker_route()
+
+@api_router.post("/superadmin/companies/{company_id}/hibernate")
+async def hibernate_company(company_id: str, user: dict = Depends(get_current_user)):
+    """SuperAdmin: Stop a tenant stack until its next request"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can hibernate companies")
+
+    company = await db.companies.find_one({"id": company_id}, {"_id": 0})
+    if not company or not company.get("portainer_stack_id") or not company.get("domain"):
+        raise HTTPException(status_code=404, detail="Deploy edilmiş firma bulunamadı")
+
+    result = await hibernation.hibernate(company)
+    if not result.get("success"):
+        raise HTTPException(status_code=400, detail=result.get("error"))
+    return result
+
+@api_router.post("/superadmin/companies/{company_id}/wake")
+async def wake_company(company_id: str, user: dict = Depends(get_current_user)):
+    """SuperAdmin: Start a hibernated tenant stack"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can wake companies")
+
+    company = await db.companies.find_one({"id": company_id}, {"_id": 0})
+    if not company:
+        raise HTTPException(status_code=404, detail="Company not found")
+    if not company.get("hibernated"):
+        raise HTTPException(status_code=400, detail="Firma uyku modunda değil")
+
+    result = await hibernation.wake(company)
+    if not result.get("success"):
+        raise HTTPException(status_code=503, detail=result.get("error"))
+    return result
+
+@api_router.get("/superadmin/tenant-mongo/status")
+async def get_tenant_mongo_status(user: dict = Depends(get_current_user)):
+    """SuperAdmin: Tenant database placement and shared mongod memory"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view tenant MongoDB status")
+
+    return await tenant_mongo.get_status()
+
+@api_router.get("/superadmin/tenant-databases")
+async def get_tenant_database_connections(check: bool = False, user: dict = Depends(get_current_user)):
+    """SuperAdmin: Pooled tenant database clients (check=true pings them now)"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view tenant database connections")
+    return await tenant_databases.check_health() if check else tenant_databases.get_status()
+
+@api_router.post("/superadmin/tenant-mongo/deploy")
+async def deploy_shared_tenant_mongo(user: dict = Depends(get_current_user)):
+    """SuperAdmin: Deploy the consolidated tenant MongoDB stack"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can deploy the shared MongoDB")
+
+    result = await portainer_service.deploy_shared_mongo()
+    if not result.get("success"):
+        raise HTTPException(status_code=500, detail=f"Deployment failed: {result.get('error')}")
+    return result
+
+@api_router.post("/superadmin/companies/{company_id}/migrate-mongo")
+async def migrate_company_mongo(company_id: str, force: bool = False, user: dict = Depends(get_current_user)):
+    """SuperAdmin: Move a company's database from its own mongod to the shared tenant mongod"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can migrate company databases")
+
+    company = await db.companies.find_one({"id": company_id}, {"_id": 0})
+    if not company:
+        raise HTTPException(status_code=404, detail="Company not found")
+
+    stack_started_at = time.monotonic()
+    result = await tenant_mongo.migrate(company, force=force)
+    if not result.get("success"):
+        raise HTTPException(status_code=400, detail=result.get("error"))
+
+    company.update(result["company_fields"])
+    backend_port = (company.get("ports") or {}).get("backend")
+    if backend_port:
+        result["backend_ready"] = await portainer_for(company).wait_for_backend_ready(backend_port, started_at=stack_started_at)
+    await tenant_registry.register(company)
+    result.pop("company_fields")
+    return result
+
+# ============== TENANT PLACEMENT ==============
+class PlacementEndpointRequest(BaseModel):
+    endpoint_id: int
+    server_ip: str
+    name: Optional[str] = None
+    enabled: bool = True
+    max_memory_fraction: Optional[float] = None
+    max_containers: Optional[int] = None
+
+@api_router.get("/superadmin/placement/endpoints")
+async def get_placement_endpoints(fresh: bool = False, user: dict = Depends(get_current_user)):
+    """SuperAdmin: Docker hosts with measured capacity, placement score and tenant count"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view placement")
+    return {"endpoints": await placement_scheduler.overview(fresh=fresh)}
+
+@api_router.post("/superadmin/placement/endpoints")
+async def upsert_placement_endpoint(request: PlacementEndpointRequest, user: dict = Depends(get_current_user)):
+    """SuperAdmin: Add a Docker host or change its limits (enabled=false drains it for new tenants)"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can manage placement")
+    return await placement_scheduler.upsert_endpoint(**request.model_dump())
+
+@api_router.post("/superadmin/companies/{company_id}/migrate-endpoint")
+async def migrate_company_endpoint(company_id: str, target_endpoint_id: Optional[int] = None,
+                                   user: dict = Depends(get_current_user)):
+    """SuperAdmin: Move a company stack to another Docker host (least-loaded one if no target)"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can migrate companies")
+
+    company = await db.companies.find_one({"id": company_id}, {"_id": 0})
+    if not company:
+        raise HTTPException(status_code=404, detail="Company not found")
+    if company.get("hibernated"):
+        raise HTTPException(status_code=400, detail="Uyku modundaki firma taşınamaz, önce uyandırın")
+
+    result = await placement_scheduler.migrate(company, target_endpoint_id)
+    if not result.get("success"):
+        raise HTTPException(status_code=400, detail=result.get("error"))
+
+    company.update(result.pop("company_fields"))
+    await tenant_registry.register(company)
+    await hibernation.refresh_hosts()
+    return result
+
+async def prepare_tenant_backend_update(company: dict, built_by: str = None) -> dict:
+    """
+    Backend side of a template update.
+    Image-based tenants: redeploy the stack when the tenant image changed.
+    Volume-based tenants: pass requirements hashes so pip only runs when they differ.
+    Returns extra kwargs for update_tenant_from_template.
+    """
+    if not company.get("backend_image"):
+        return {
+            "requirements_hash": await tenant_image_builder.requirements_hash(),
+            "installed_requirements_hash": company.get("backend_requirements_hash")
+        }
+    
+    portainer = portainer_for(company)
+    image_builder = tenant_image_builder if portainer is portainer_service else TenantImageBuilder(portainer, db)
+    image_result = await image_builder.get_or_build(built_by=built_by)
+    if not image_result.get("success"):
+        raise RuntimeError(f"Tenant image build failed: {image_result.get('error')}")
+    image = image_result["image"]
+    
+    if image["tag"] != company["backend_image"]:
+        compose = get_full_company_stack_template(
+            company["code"], company["name"], company["domain"], company["port_offset"], image["tag"],
+            company.get("mongo_url") if tenant_mongo.is_shared(company) else None
+        )
+        stack_started_at = time.monotonic()
+        redeploy = await portainer.update_stack(company["portainer_stack_id"], compose)
+        if not redeploy.get("success"):
+            raise RuntimeError(f"Stack redeploy failed: {redeploy.get('error')}")
+        
+        ready = await portainer.wait_for_backend_ready(
+            (company.get("ports") or {}).get("backend"), started_at=stack_started_at
+        ) if (company.get("ports") or {}).get("backend") else {}
+        await db.companies.update_one(
+            {"id": company["id"]},
+            {"$set": {
+                "backend_image": image["tag"],
+                "backend_image_version": image["version"],
+                "backend_requirements_hash": image["requirements_hash"],
+                "cold_start_seconds": ready.get("cold_start_seconds")
+            }}
+        )
+        logger.info(f"[UPDATE-TEMPLATE] {company['code']} backend -> {image['tag']} (cold start {ready.get('cold_start_seconds')}s)")
+    
+    return {"backend_image": image["tag"]}
+
+async def record_tenant_backend_update(company: dict, result: dict):
+    """Remember the requirements hash installed into a volume-based tenant"""
+    installed = (result.get("results") or {}).get("installed_requirements_hash")
+    if installed:
+        await db.companies.update_one(
+            {"id": company["id"]},
+            {"$set": {"backend_requirements_hash": installed}}
+        )
+
 @api_router.post("/superadmin/companies/{company_id}/update-from-template")
-async def update_company_from_template(company_id: str, user: dict = Depends(get_current_user)):
+async def update_company_from_template(company_id: str, force: bool = False, user: dict = Depends(get_current_user)):
     """
     SuperAdmin: Update company code from template WITHOUT touching database.
     This updates Frontend and Backend code while preserving all customer data.
+    Only components whose template hash differs from the company's are deployed (force=true: all).
     """
     if user["role"] != UserRole.SUPERADMIN.value:
         raise HTTPException(status_code=403, detail="Only SuperAdmin can update companies")
@@ -1320,15 +1626,37 @@ async def update_company_from_template(company_id: str, user: dict = Depends(get
     
     company_code = company.get("code")
     
-    logger.info(f"[UPDATE-TEMPLATE] Starting template update for {company['name']} ({company_code})")
+    manifest = await template_versions.get_manifest(refresh=True)
+    components = list(TEMPLATE_COMPONENTS) if force else template_versions.pending_components(company, manifest)
+    if not components:
+        return {
+            "success": True,
+            "skipped": True,
+            "message": f"{company['name']} zaten güncel (template v{manifest['version']})",
+            "company_name": company['name'],
+            "domain": domain
+        }
+    
+    logger.info(f"[UPDATE-TEMPLATE] Starting template update for {company['name']} ({company_code}): {', '.join(components)}")
     
     # Update from template
-    result = await portainer_service.update_tenant_from_template(
+    try:
+        backend_update = await prepare_tenant_backend_update(company, built_by=user["email"]) if "backend" in components else {}
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=f"Güncelleme başarısız: {str(e)}")
+    
+    result = await portainer_for(company).update_tenant_from_template(
         company_code=company_code,
-        domain=domain
+        domain=domain,
+        components=components,
+        **backend_update
     )
     
     if result.get("success"):
+        await record_tenant_backend_update(company, result)
+        updated = template_versions.completed_components(components, result.get("results"))
+        failed = [c for c in components if c not in updated]
+        await template_versions.record(company, manifest, updated if failed else None)
         # Update company record
         await db.companies.update_one(
             {"id": company_id},
@@ -1340,9 +1668,13 @@ async def update_company_from_template(company_id: str, user: dict = Depends(get
         
         return {
             "success": True,
-            "message": f"{company['name']} template'den güncellendi",
+            "message": f"{company['name']} template'den güncellendi"
+                       + (f" (başarısız: {', '.join(failed)})" if failed else ""),
             "company_name": company['name'],
             "domain": domain,
+            "components": updated,
+            "pending_components": failed,
+            "template_version": manifest["version"],
             "results": result.get("results"),
             "note": "Veritabanı verileri korundu. Sadece kod güncellendi."
         }
@@ -1353,10 +1685,11 @@ async def update_company_from_template(company_id: str, user: dict = Depends(get
         )
 
 @api_router.post("/superadmin/companies/update-all-from-template")
-async def update_all_companies_from_template(user: dict = Depends(get_current_user)):
+async def update_all_companies_from_template(force: bool = False, user: dict = Depends(get_current_user)):
     """
     SuperAdmin: Update ALL active companies from template.
     This is a batch operation that updates all deployed companies.
+    Companies already on the current template version are skipped (force=true: update all).
     """
     if user["role"] != UserRole.SUPERADMIN.value:
         raise HTTPException(status_code=403, detail="Only SuperAdmin can perform batch updates")
@@ -1371,24 +1704,42 @@ async def update_all_companies_from_template(user: dict = Depends(get_current_us
     if not companies:
         raise HTTPException(status_code=404, detail="Güncellenecek aktif firma bulunamadı")
     
-    logger.info(f"[BATCH-UPDATE] Starting batch update for {len(companies)} companies")
+    manifest = await template_versions.get_manifest(refresh=True)
+    logger.info(f"[BATCH-UPDATE] Starting batch update for {len(companies)} companies (template v{manifest['version']})")
     
     results = []
     success_count = 0
     fail_count = 0
+    skipped_count = 0
     
     for company in companies:
         company_code = company.get("code")
         domain = company.get("domain")
+        components = list(TEMPLATE_COMPONENTS) if force else template_versions.pending_components(company, manifest)
+        if not components:
+            skipped_count += 1
+            results.append({
+                "company": company["name"],
+                "code": company_code,
+                "success": True,
+                "skipped": True
+            })
+            continue
         
         try:
-            result = await portainer_service.update_tenant_from_template(
+            backend_update = await prepare_tenant_backend_update(company, built_by=user["email"]) if "backend" in components else {}
+            result = await portainer_for(company).update_tenant_from_template(
                 company_code=company_code,
-                domain=domain
+                domain=domain,
+                components=components,
+                **backend_update
             )
             
+            updated = template_versions.completed_components(components, result.get("results"))
+            failed = [c for c in components if c not in updated]
             if result.get("success"):
-                success_count += 1
+                await record_tenant_backend_update(company, result)
+                await template_versions.record(company, manifest, updated if failed else None)
                 # Update company record
                 await db.companies.update_one(
                     {"id": company["id"]},
@@ -1397,10 +1748,23 @@ async def update_all_companies_from_template(user: dict = Depends(get_current_us
                         "updated_at": datetime.now(timezone.utc).isoformat()
                     }}
                 )
+            if result.get("success") and not failed:
+                success_count += 1
                 results.append({
                     "company": company["name"],
                     "code": company_code,
-                    "success": True
+                    "success": True,
+                    "components": components
+                })
+            elif result.get("success"):
+                fail_count += 1
+                results.append({
+                    "company": company["name"],
+                    "code": company_code,
+                    "success": False,
+                    "components": updated,
+                    "pending_components": failed,
+                    "error": f"Başarısız bileşenler: {', '.join(failed)}"
                 })
             else:
                 fail_count += 1
@@ -1419,18 +1783,34 @@ async def update_all_companies_from_template(user: dict = Depends(get_current_us
                 "error": str(e)
             })
     
-    logger.info(f"[BATCH-UPDATE] Completed: {success_count} success, {fail_count} failed")
+    logger.info(f"[BATCH-UPDATE] Completed: {success_count} success, {fail_count} failed, {skipped_count} already current")
     
     return {
         "success": fail_count == 0,
-        "message": f"Toplu güncelleme tamamlandı: {success_count} başarılı, {fail_count} başarısız",
+        "message": f"Toplu güncelleme tamamlandı: {success_count} başarılı, {fail_count} başarısız, {skipped_count} zaten güncel",
         "total_companies": len(companies),
         "success_count": success_count,
         "fail_count": fail_count,
+        "skipped_count": skipped_count,
+        "template_version": manifest["version"],
         "results": results,
         "note": "Veritabanı verileri korundu. Sadece kodlar güncellendi."
     }
 
+@api_router.get("/superadmin/template/versions")
+async def get_template_versions(user: dict = Depends(get_current_user)):
+    """SuperAdmin: Template manifest and per-component fleet drift"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view template versions")
+    return await template_versions.drift_report()
+
+@api_router.post("/superadmin/template/versions/refresh")
+async def refresh_template_versions(user: dict = Depends(get_current_user)):
+    """SuperAdmin: Re-hash the template containers now"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can refresh template versions")
+    return await template_versions.get_manifest(refresh=True)
+
 @api_router.post("/superadmin/template/update-master")
 async def update_master_template(user: dict = Depends(get_current_user)):
     """
@@ -1537,74 +1917,105 @@ async def get_template_info(user: dict = Depends(get_current_user)):
     return info
 
 @api_router.get("/superadmin/template/status")
-async def get_template_status(user: dict = Depends(get_current_user)):
+async def get_template_status(fresh: bool = False, user: dict = Depends(get_current_user)):
     """SuperAdmin: Get master template status"""
     if user["role"] != UserRole.SUPERADMIN.value:
         raise HTTPException(status_code=403, detail="Only SuperAdmin can view template status")
     
-    # Get template status from database
+    # Get template status from database, container states from the fleet snapshot
     status = await db.system_settings.find_one({"key": "master_template"}, {"_id": 0})
+    snapshot = await fleet_status.get(fresh)
+    containers = {
+        name.lstrip("/"): c.get("state")
+        for c in snapshot["containers"]
+        for name in c.get("names", [])
+        if name.lstrip("/").startswith("rentacar_template_")
+    }
     
     if status:
         return {
             "status": status.get("status", "unknown"),
             "last_updated": status.get("last_updated"),
-            "updated_by": status.get("updated_by")
+            "updated_by": status.get("updated_by"),
+            "containers": containers
         }
     
     return {
         "status": "not_initialized",
         "last_updated": None,
-        "updated_by": None
+        "updated_by": None,
+        "containers": containers
     }
 
 @api_router.get("/superadmin/portainer/stacks")
-async def get_portainer_stacks(user: dict = Depends(get_current_user)):
-    """SuperAdmin: Get all stacks from Portainer"""
+async def get_portainer_stacks(fresh: bool = False, user: dict = Depends(get_current_user)):
+    """SuperAdmin: Get all stacks from Portainer (fleet snapshot, ?fresh=1 to refresh)"""
     if user["role"] != UserRole.SUPERADMIN.value:
         raise HTTPException(status_code=403, detail="Only SuperAdmin can view Portainer stacks")
     
-    stacks = await portainer_service.get_stacks()
-    return {"stacks": stacks}
+    snapshot = await fleet_status.get(fresh)
+    return {"stacks": snapshot["stacks"], "collected_at": snapshot["collected_at"]}
 
 @api_router.get("/superadmin/portainer/containers")
-async def get_portainer_containers(user: dict = Depends(get_current_user)):
-    """SuperAdmin: Get all containers from Portainer"""
+async def get_portainer_containers(fresh: bool = False, user: dict = Depends(get_current_user)):
+    """SuperAdmin: Get all containers from Portainer (fleet snapshot, ?fresh=1 to refresh)"""
     if user["role"] != UserRole.SUPERADMIN.value:
         raise HTTPException(status_code=403, detail="Only SuperAdmin can view Portainer containers")
     
-    containers = await portainer_service.get_containers()
-    return {"containers": containers}
+    snapshot = await fleet_status.get(fresh)
+    return {"containers": snapshot["containers"], "collected_at": snapshot["collected_at"]}
 
 @api_router.get("/superadmin/portainer/status")
-async def get_portainer_status(user: dict = Depends(get_current_user)):
-    """SuperAdmin: Check Portainer connection status"""
+async def get_portainer_status(fresh: bool = False, user: dict = Depends(get_current_user)):
+    """SuperAdmin: Check Portainer connection status (fleet snapshot, ?fresh=1 for a live check)"""
     if user["role"] != UserRole.SUPERADMIN.value:
         raise HTTPException(status_code=403, detail="Only SuperAdmin can check Portainer status")
     
+    if not fresh:
+        snapshot = fleet_status.get_snapshot()
+        if snapshot["collected_at"]:
+            return {
+                "connected": bool(snapshot["portainer_connected"]),
+                "url": portainer_service.base_url,
+                "endpoint_id": portainer_service.endpoint_id,
+                "stack_count": len(snapshot["stacks"]),
+                "error": snapshot["last_error"],
+                "collected_at": snapshot["collected_at"],
+                "client": portainer_service.client.get_stats()
+            }
+    
     try:
-        # Direct test to Portainer API with SSL disabled
+        # Through the resilient client so a tripped breaker shows up here as well
         import httpx
         import traceback
-        async with httpx.AsyncClient(verify=False, timeout=10.0, http2=False) as client:
-            url = f"{portainer_service.base_url}/api/system/status"
-            logger.info(f"Testing Portainer connection to: {url}")
-            response = await client.get(url, headers=portainer_service.headers)
-            
-            if response.status_code == 200:
-                stacks = await portainer_service.get_stacks()
-                return {
-                    "connected": True,
-                    "url": portainer_service.base_url,
-                    "endpoint_id": portainer_service.endpoint_id,
-                    "stack_count": len(stacks) if isinstance(stacks, list) else 0
-                }
-            else:
-                return {
-                    "connected": False,
-                    "url": portainer_service.base_url,
-                    "error": f"HTTP {response.status_code}: {response.text[:200]}"
-                }
+        logger.info(f"Testing Portainer connection to: {portainer_service.base_url}/api/system/status")
+        response = await portainer_service.client.request(
+            'GET', 'system/status', headers=portainer_service.headers, timeout=10.0
+        )
+        
+        if response.status_code == 200:
+            stacks = await portainer_service.get_stacks()
+            return {
+                "connected": True,
+                "url": portainer_service.base_url,
+                "endpoint_id": portainer_service.endpoint_id,
+                "stack_count": len(stacks) if isinstance(stacks, list) else 0,
+                "client": portainer_service.client.get_stats()
+            }
+        else:
+            return {
+                "connected": False,
+                "url": portainer_service.base_url,
+                "error": f"HTTP {response.status_code}: {response.text[:200]}",
+                "client": portainer_service.client.get_stats()
+            }
+    except PortainerCircuitOpen as e:
+        return {
+            "connected": False,
+            "url": portainer_service.base_url,
+            "error": f"Portainer devre kesici açık: {str(e)}",
+            "client": portainer_service.client.get_stats()
+        }
     except httpx.ConnectError as e:
         logger.error(f"Portainer connection error: {traceback.format_exc()}")
         return {
@@ -1621,6 +2032,14 @@ async def get_portainer_status(user: dict = Depends(get_current_user)):
             "error": f"Hata: {type(e).__name__}: {str(e)}"
         }
 
+@api_router.get("/superadmin/portainer/client-stats")
+async def get_portainer_client_stats(user: dict = Depends(get_current_user)):
+    """SuperAdmin: Portainer client latency, error, retry and circuit breaker counters"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view Portainer stats")
+    
+    return portainer_service.client.get_stats()
+
 @api_router.post("/superadmin/deploy-superadmin-stack")
 async def deploy_superadmin_stack(user: dict = Depends(get_current_user)):
     """SuperAdmin: Deploy SuperAdmin stack to Portainer"""
@@ -1641,12 +2060,47 @@ async def deploy_superadmin_stack(user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=f"Deployment failed: {result.get('error')}")
 
 @api_router.get("/superadmin/traefik/status")
-async def get_traefik_status(user: dict = Depends(get_current_user)):
-    """SuperAdmin: Check Traefik installation status"""
+async def get_traefik_status(fresh: bool = False, user: dict = Depends(get_current_user)):
+    """SuperAdmin: Check Traefik installation status (fleet snapshot, ?fresh=1 to refresh)"""
     if user["role"] != UserRole.SUPERADMIN.value:
         raise HTTPException(status_code=403, detail="Only SuperAdmin can check Traefik status")
     
-    return await portainer_service.check_traefik_status()
+    snapshot = await fleet_status.get(fresh)
+    return snapshot["traefik"]
+
+@api_router.get("/superadmin/fleet/status")
+async def get_fleet_status(fresh: bool = False, user: dict = Depends(get_current_user)):
+    """SuperAdmin: Per-tenant container health from the fleet snapshot"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view fleet status")
+    
+    snapshot = await fleet_status.get(fresh)
+    tenants = snapshot["tenants"]
+    summary = {}
+    for tenant in tenants.values():
+        summary[tenant["health"]] = summary.get(tenant["health"], 0) + 1
+    
+    return {
+        "tenants": tenants,
+        "summary": summary,
+        "traefik": snapshot["traefik"],
+        "portainer_connected": snapshot["portainer_connected"],
+        "collected_at": snapshot["collected_at"],
+        "age_seconds": snapshot["age_seconds"],
+        "events_connected": snapshot["events_connected"],
+        "collector": fleet_status.stats
+    }
+
+@api_router.get("/superadmin/fleet/status/{company_code}")
+async def get_tenant_fleet_status(company_code: str, fresh: bool = False, user: dict = Depends(get_current_user)):
+    """SuperAdmin: Container health of one tenant"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view fleet status")
+    
+    tenant = await fleet_status.get_tenant(company_code, fresh)
+    if not tenant:
+        raise HTTPException(status_code=404, detail="Tenant not found in fleet snapshot")
+    return tenant
 
 @api_router.post("/superadmin/traefik/deploy")
 async def deploy_traefik(user: dict = Depends(get_current_user), admin_email: str = "admin@rentafleet.com"):
@@ -1691,65 +2145,42 @@ async def deploy_code_to_template(user: dict = Depends(get_current_user)):
     results = {"frontend": None, "backend": None}
     
     try:
-        # Step 1: Build TENANT frontend template (NOT SuperAdmin!)
-        logger.info("[TEMPLATE] Building TENANT frontend template...")
-        
-        template_frontend_dir = "/app/backend/template/frontend"
-        
-        env = os.environ.copy()
-        env["REACT_APP_BACKEND_URL"] = ""  # Empty - will use runtime config
-        env["CI"] = "false"
+        # Step 1: TENANT frontend template artifact (NOT SuperAdmin!) - built only when sources changed
+        logger.info("[TEMPLATE] Resolving TENANT frontend artifact...")
         
-        build_result = subprocess.run(
-            ["yarn", "build"],
-            cwd=template_frontend_dir,  # Use template frontend, NOT SuperAdmin
-            env=env,
-            capture_output=True,
-            text=True,
-            timeout=300
-        )
+        artifact_result = await artifact_store.get_or_build("tenant", built_by=user["email"])
         
-        if build_result.returncode != 0:
-            return {"success": False, "error": "Frontend build failed", "details": build_result.stderr}
+        if not artifact_result.get("success"):
+            return {"success": False, "error": "Frontend build failed", "details": artifact_result.get("details") or artifact_result.get("error")}
         
-        logger.info("[TEMPLATE] Tenant frontend build successful, uploading...")
+        artifact = artifact_result["artifact"]
+        logger.info(f"[TEMPLATE] Tenant frontend artifact v{artifact['version']} ready (reused: {artifact_result.get('reused')}), uploading...")
         
         # Upload to template frontend container
-        build_dir = f"{template_frontend_dir}/build"  # Template build, NOT SuperAdmin
-        tar_buffer = io.BytesIO()
-        with tarfile.open(fileobj=tar_buffer, mode='w') as tar:
-            for root, dirs, files in os.walk(build_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, build_dir)
-                    tar.add(file_path, arcname=arcname)
-        
-        tar_data = tar_buffer.getvalue()
-        
         frontend_upload = await portainer_service.upload_to_container(
             container_name="rentacar_template_frontend",
-            tar_data=tar_data,
+            tar_data=await artifact_store.load_bundle(artifact),
             dest_path="/usr/share/nginx/html"
         )
-        results["frontend"] = {"success": not frontend_upload.get("error"), "error": frontend_upload.get("error")}
+        results["frontend"] = {
+            "success": not frontend_upload.get("error"),
+            "error": frontend_upload.get("error"),
+            "artifact_id": artifact["id"],
+            "artifact_version": artifact["version"],
+            "reused": artifact_result.get("reused")
+        }
         
         # Step 2: Upload TENANT backend code to template backend container
         # IMPORTANT: Use template backend, NOT SuperAdmin backend!
         logger.info("[TEMPLATE] Uploading TENANT backend code...")
         template_backend_dir = "/app/backend/template/backend"
         
-        backend_tar = io.BytesIO()
-        with tarfile.open(fileobj=backend_tar, mode='w') as tar:
-            tar.add(f"{template_backend_dir}/server.py", arcname="server.py")
-            tar.add(f"{template_backend_dir}/requirements.txt", arcname="requirements.txt")
-            
-            # Add main.py
-            main_content = b"from server import app\n"
-            main_info = tarfile.TarInfo(name="main.py")
-            main_info.size = len(main_content)
-            tar.addfile(main_info, io.BytesIO(main_content))
-        
-        backend_tar_data = backend_tar.getvalue()
+        backend_tar_data = await blocking_executor.run_io(
+            blocking_tasks.build_tar_archive,
+            [(f"{template_backend_dir}/server.py", "server.py"), (f"{template_backend_dir}/requirements.txt", "requirements.txt")],
+            [],
+            {"main.py": "from server import app\n"}
+        )
         
         backend_upload = await portainer_service.upload_to_container(
             container_name="rentacar_template_backend",
@@ -1880,7 +2311,7 @@ async def update_company_mobile_apps(company_id: str, user: dict = Depends(get_c
     # Copy both apps
     for app_type in ["customer", "operation"]:
         logger.info(f"[MOBILE-UPDATE] Copying {app_type} app to {company_code}")
-        result = await portainer_service.copy_mobile_app_to_tenant(
+        result = await portainer_for(company).copy_mobile_app_to_tenant(
             company_code=company_code,
             app_type=app_type,
             company_name=company_name,
@@ -1909,68 +2340,40 @@ async def update_company_mobile_apps(company_id: str, user: dict = Depends(get_c
 @api_router.post("/superadmin/deploy-frontend-to-kvm")
 async def deploy_frontend_to_kvm(background_tasks: BackgroundTasks, user: dict = Depends(get_current_user)):
     """
-    SuperAdmin: Build and deploy frontend to KVM server's SuperAdmin container
-    This builds the React app with correct REACT_APP_BACKEND_URL and uploads to Nginx container
+    SuperAdmin: Deploy frontend to KVM server's SuperAdmin container
+    Reuses the frontend artifact for the current sources (builds only when they changed)
+    and points it at the KVM backend through the runtime config.js
     """
     if user["role"] != UserRole.SUPERADMIN.value:
         raise HTTPException(status_code=403, detail="Only SuperAdmin can deploy frontend")
     
-    import subprocess
-    import tarfile
-    import io
-    import shutil
-    
     kvm_backend_url = "http://72.61.158.147:9001"
-    frontend_dir = "/app/frontend"
-    build_dir = f"{frontend_dir}/build"
     
     try:
-        # Step 1: Build frontend with correct backend URL
-        env = os.environ.copy()
-        env["REACT_APP_BACKEND_URL"] = kvm_backend_url
-        env["CI"] = "true"  # Skip warnings as errors
+        # Step 1: Resolve build artifact
+        artifact_result = await artifact_store.get_or_build("superadmin", built_by=user["email"])
         
-        # Run yarn build (CI=false to avoid treating warnings as errors)
-        env["CI"] = "false"
-        result = subprocess.run(
-            ["yarn", "build"],
-            cwd=frontend_dir,
-            env=env,
-            capture_output=True,
-            text=True,
-            timeout=180
-        )
-        
-        if result.returncode != 0:
+        if not artifact_result.get("success"):
             return {
                 "success": False,
-                "error": "Build failed",
-                "details": result.stderr
+                "error": artifact_result.get("error"),
+                "details": artifact_result.get("details")
             }
         
-        # Step 2: Create tar archive of build folder
-        tar_buffer = io.BytesIO()
-        with tarfile.open(fileobj=tar_buffer, mode='w') as tar:
-            for root, dirs, files in os.walk(build_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, build_dir)
-                    tar.add(file_path, arcname=arcname)
+        artifact = artifact_result["artifact"]
         
-        tar_data = tar_buffer.getvalue()
-        
-        # Step 3: Upload to Portainer container
-        upload_result = await portainer_service.upload_to_container(
+        # Step 2: Upload bundle and write config.js
+        deploy_result = await portainer_service.deploy_frontend_bundle(
             container_name="superadmin_frontend",
-            tar_data=tar_data,
-            dest_path="/usr/share/nginx/html"
+            bundle=await artifact_store.load_bundle(artifact),
+            api_url=kvm_backend_url
         )
         
-        if upload_result.get('error'):
+        if not deploy_result.get('success'):
             return {
                 "success": False,
                 "error": "Upload to container failed",
-                "details": upload_result.get('error')
+                "details": deploy_result.get('error')
             }
         
         return {
@@ -1978,14 +2381,12 @@ async def deploy_frontend_to_kvm(background_tasks: BackgroundTasks, user: dict =
             "message": "Frontend deployed successfully to KVM server",
             "backend_url": kvm_backend_url,
             "frontend_url": "http://72.61.158.147:9000",
-            "files_uploaded": len([f for r, d, files in os.walk(build_dir) for f in files])
+            "artifact_id": artifact["id"],
+            "artifact_version": artifact["version"],
+            "reused_artifact": artifact_result.get("reused"),
+            "bytes_uploaded": deploy_result.get("bytes_uploaded")
         }
         
-    except subprocess.TimeoutExpired:
-        return {
-            "success": False,
-            "error": "Build timed out (180s)"
-        }
     except Exception as e:
         return {
             "success": False,
@@ -2001,41 +2402,21 @@ async def deploy_backend_to_kvm(user: dict = Depends(get_current_user)):
     if user["role"] != UserRole.SUPERADMIN.value:
         raise HTTPException(status_code=403, detail="Only SuperAdmin can deploy backend")
     
-    import tarfile
-    import io
-    
     backend_dir = "/app/backend"
     
     try:
-        # Create tar archive of backend files
-        tar_buffer = io.BytesIO()
-        with tarfile.open(fileobj=tar_buffer, mode='w') as tar:
-            # Add server.py
-            tar.add(f"{backend_dir}/server.py", arcname="server.py")
-            
-            # Add requirements.txt
-            tar.add(f"{backend_dir}/requirements.txt", arcname="requirements.txt")
-            
-            # Add services folder
-            services_dir = f"{backend_dir}/services"
-            if os.path.exists(services_dir):
-                for root, dirs, files in os.walk(services_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, backend_dir)
-                        tar.add(file_path, arcname=arcname)
-            
-            # Add .env file for KVM
-            env_content = """MONGO_URL=mongodb://superadmin_mongodb:27017
+        # Create tar archive of backend files (server.py, requirements, services, KVM .env)
+        env_content = """MONGO_URL=mongodb://superadmin_mongodb:27017
 DB_NAME=superadmin_db
 JWT_SECRET=kvm_superadmin_jwt_secret_2024
 """
-            env_info = tarfile.TarInfo(name=".env")
-            env_bytes = env_content.encode('utf-8')
-            env_info.size = len(env_bytes)
-            tar.addfile(env_info, io.BytesIO(env_bytes))
-        
-        tar_data = tar_buffer.getvalue()
+        services_dir = f"{backend_dir}/services"
+        tar_data = await blocking_executor.run_io(
+            blocking_tasks.build_tar_archive,
+            [(f"{backend_dir}/server.py", "server.py"), (f"{backend_dir}/requirements.txt", "requirements.txt")],
+            [(services_dir, backend_dir)] if os.path.exists(services_dir) else [],
+            {".env": env_content}
+        )
         
         # Upload to backend container
         upload_result = await portainer_service.upload_to_container(
@@ -2101,7 +2482,7 @@ async def seed_kvm_database(user: dict = Depends(get_current_user)):
         admin_user = {
             "id": str(uuid.uuid4()),
             "email": "admin@fleetease.com",
-            "password_hash": pwd_context.hash("admin123"),
+            "password_hash": await get_password_hash("admin123"),
             "full_name": "Super Admin",
             "role": "superadmin",
             "company_id": None,
@@ -2179,8 +2560,6 @@ async def deploy_local_build_to_tenant(request: DeployBuildRequest, user: dict =
     if user["role"] != UserRole.SUPERADMIN.value:
         raise HTTPException(status_code=403, detail="Only SuperAdmin can deploy builds")
     
-    import tarfile
-    import io as std_io
     import os
     
     build_path = "/app/frontend/build"
@@ -2211,19 +2590,14 @@ async def deploy_local_build_to_tenant(request: DeployBuildRequest, user: dict =
         
         logger.info(f"[DEPLOY-BUILD] Creating tar archive from {build_path}...")
         
-        # Create tar archive of build directory
-        tar_buffer = std_io.BytesIO()
-        with tarfile.open(fileobj=tar_buffer, mode='w') as tar:
-            for root, dirs, files in os.walk(build_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, build_path)
-                    # Skip downloads folder
-                    if arcname.startswith('downloads/'):
-                        continue
-                    tar.add(file_path, arcname=arcname)
-        
-        tar_data = tar_buffer.getvalue()
+        # Create tar archive of build directory (skip downloads folder)
+        tar_data = await blocking_executor.run_io(
+            blocking_tasks.build_tar_archive,
+            [],
+            [(build_path, build_path)],
+            None,
+            ('downloads/',)
+        )
         logger.info(f"[DEPLOY-BUILD] Tar archive size: {len(tar_data)} bytes")
         
         # Upload to container
@@ -2260,6 +2634,144 @@ async def deploy_local_build_to_tenant(request: DeployBuildRequest, user: dict =
         logger.error(f"[DEPLOY-BUILD] Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ============== FRONTEND ARTIFACTS ==============
+class ArtifactBuildRequest(BaseModel):
+    app: str = "tenant"  # "tenant" or "superadmin"
+    force: bool = False
+
+class ArtifactDeployRequest(BaseModel):
+    artifact_id: str
+
+async def deploy_artifact_to_company(company: dict, artifact: dict) -> dict:
+    """Upload a tenant frontend artifact to a company's frontend container and record it"""
+    safe_code = company["code"].replace('-', '').replace('_', '')
+    frontend_container = f"{safe_code}_frontend"
+    domain = company.get("domain")
+    
+    if domain:
+        api_url = f"https://api.{domain}"
+    else:
+        api_url = f"http://{company.get('server_ip') or SERVER_IP}:{(company.get('ports') or {}).get('backend', 11000)}"
+    
+    result = await portainer_for(company).deploy_frontend_bundle(
+        container_name=frontend_container,
+        bundle=await artifact_store.load_bundle(artifact),
+        api_url=api_url
+    )
+    
+    if result.get("success"):
+        update = {
+            "frontend_artifact_id": artifact["id"],
+            "frontend_artifact_version": artifact["version"],
+            "frontend_deployed_at": datetime.now(timezone.utc).isoformat(),
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }
+        if company.get("frontend_artifact_id") and company.get("frontend_artifact_id") != artifact["id"]:
+            update["previous_frontend_artifact_id"] = company.get("frontend_artifact_id")
+        await db.companies.update_one({"id": company["id"]}, {"$set": update})
+    
+    return {**result, "container": frontend_container, "api_url": api_url}
+
+@api_router.get("/superadmin/frontend-artifacts")
+async def list_frontend_artifacts(app: Optional[str] = None, limit: int = 50, user: dict = Depends(get_current_user)):
+    """SuperAdmin: List stored frontend build artifacts"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view artifacts")
+    
+    return {"artifacts": await artifact_store.list_artifacts(app, limit)}
+
+@api_router.post("/superadmin/frontend-artifacts/build")
+async def build_frontend_artifact(request: ArtifactBuildRequest, user: dict = Depends(get_current_user)):
+    """SuperAdmin: Build (or reuse) the frontend artifact for the current sources"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can build artifacts")
+    
+    result = await artifact_store.get_or_build(request.app, built_by=user["email"], force=request.force)
+    if not result.get("success"):
+        raise HTTPException(status_code=500, detail=f"Artifact build failed: {result.get('error')}")
+    
+    return result
+
+@api_router.post("/superadmin/companies/{company_id}/frontend-artifact")
+async def deploy_company_frontend_artifact(company_id: str, request: ArtifactDeployRequest, user: dict = Depends(get_current_user)):
+    """SuperAdmin: Roll a tenant's frontend forward or back to a specific artifact"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can deploy artifacts")
+    
+    company = await db.companies.find_one({"id": company_id}, {"_id": 0})
+    if not company:
+        raise HTTPException(status_code=404, detail="Company not found")
+    
+    if not company.get("portainer_stack_id"):
+        raise HTTPException(status_code=400, detail="Company stack not provisioned yet")
+    
+    artifact = await artifact_store.get_artifact(request.artifact_id)
+    if not artifact or artifact.get("status") != "ready":
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    
+    if artifact.get("app") != "tenant":
+        raise HTTPException(status_code=400, detail="Only tenant artifacts can be deployed to companies")
+    
+    result = await deploy_artifact_to_company(company, artifact)
+    if not result.get("success"):
+        raise HTTPException(status_code=500, detail=f"Artifact deploy failed: {result.get('error')}")
+    
+    return {
+        "success": True,
+        "message": f"{company['name']} frontend v{artifact['version']} sürümüne geçirildi",
+        "artifact_id": artifact["id"],
+        "artifact_version": artifact["version"],
+        "previous_artifact_id": company.get("frontend_artifact_id"),
+        "api_url": result.get("api_url")
+    }
+
+@api_router.post("/superadmin/companies/{company_id}/frontend-artifact/rollback")
+async def rollback_company_frontend_artifact(company_id: str, user: dict = Depends(get_current_user)):
+    """SuperAdmin: Roll a tenant's frontend back to the previously deployed artifact"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can deploy artifacts")
+    
+    company = await db.companies.find_one({"id": company_id}, {"_id": 0})
+    if not company:
+        raise HTTPException(status_code=404, detail="Company not found")
+    
+    previous_id = company.get("previous_frontend_artifact_id")
+    if not previous_id:
+        raise HTTPException(status_code=400, detail="Geri alınacak önceki bir sürüm yok")
+    
+    return await deploy_company_frontend_artifact(company_id, ArtifactDeployRequest(artifact_id=previous_id), user)
+
+# ============== TENANT BACKEND IMAGES ==============
+class TenantImageBuildRequest(BaseModel):
+    force: bool = False
+
+@api_router.get("/superadmin/tenant-images")
+async def list_tenant_images(limit: int = 20, user: dict = Depends(get_current_user)):
+    """SuperAdmin: List built tenant backend images"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view tenant images")
+    
+    cold_starts = await db.companies.find(
+        {"cold_start_seconds": {"$ne": None}},
+        {"_id": 0, "code": 1, "backend_image": 1, "cold_start_seconds": 1}
+    ).to_list(1000)
+    
+    return {
+        "images": await tenant_image_builder.list_images(limit),
+        "cold_starts": cold_starts
+    }
+
+@api_router.post("/superadmin/tenant-images/build")
+async def build_tenant_image(request: TenantImageBuildRequest, user: dict = Depends(get_current_user)):
+    """SuperAdmin: Build (or reuse) the tenant backend image for the current template"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can build tenant images")
+    
+    result = await tenant_image_builder.get_or_build(built_by=user["email"], force=request.force)
+    if not result.get("success"):
+        raise HTTPException(status_code=500, detail=result.get("error"))
+    return result
+
 # ============== TENANT DEPLOYMENT ENDPOINT ==============
 @api_router.post("/superadmin/companies/{company_id}/deploy-code")
 async def deploy_code_to_tenant(company_id: str, user: dict = Depends(get_current_user)):
@@ -2663,10 +3175,14 @@ async def update_reservation_status(reservation_id: str, status: ReservationStat
     if status.value not in valid_transitions.get(current_status, []):
         raise HTTPException(status_code=400, detail=f"Invalid status transition from {current_status} to {status.value}")
     
-    await db.reservations.update_one(
-        {"id": reservation_id},
-        {"$set": {"status": status.value, "updated_at": datetime.now(timezone.utc).isoformat()}}
-    )
+    now = datetime.now(timezone.utc).isoformat()
+    update = {"status": status.value, "updated_at": now}
+    # Rental window used by toll attribution, as create_delivery / create_return stamp it
+    if status == ReservationStatus.DELIVERED and not reservation.get("delivered_at"):
+        update["delivered_at"] = now
+    elif status == ReservationStatus.RETURNED and not reservation.get("returned_at"):
+        update["returned_at"] = now
+    await db.reservations.update_one({"id": reservation_id}, {"$set": update})
     
     # Update vehicle status based on reservation status
     if status == ReservationStatus.DELIVERED:
@@ -2702,10 +3218,45 @@ async def create_delivery(delivery: DeliveryCreate, user: dict = Depends(get_cur
     await db.deliveries.insert_one(delivery_doc)
     
     # Update reservation and vehicle status
-    await db.reservations.update_one({"id": delivery.reservation_id}, {"$set": {"status": ReservationStatus.DELIVERED.value}})
+    await db.reservations.update_one(
+        {"id": delivery.reservation_id},
+        {"$set": {"status": ReservationStatus.DELIVERED.value, "delivered_at": delivery_doc["delivered_at"]}}
+    )
     await db.vehicles.update_one({"id": reservation["vehicle_id"]}, {"$set": {"status": VehicleStatus.RENTED.value, "mileage": delivery.delivery_mileage}})
     
-    return {"message": "Delivery completed", "delivery_id": delivery_id}
+    # KABIS rental notification, submitted in the background
+    kabis = await enqueue_delivery_kabis_notification(reservation, delivery_doc, user)
+    
+    return {"message": "Delivery completed", "delivery_id": delivery_id, "kabis": kabis}
+
+async def enqueue_delivery_kabis_notification(reservation: dict, delivery_doc: dict, user: dict) -> Optional[dict]:
+    """Queue the KABIS notification of a delivery when the company has KABIS configured"""
+    settings = await db.integration_settings.find_one(
+        {"company_id": reservation.get("company_id"), "type": "kabis", "is_active": True}, {"_id": 1}
+    )
+    if not settings:
+        return None
+    vehicle = await db.vehicles.find_one({"id": reservation["vehicle_id"]}, {"_id": 0, "plate": 1}) or {}
+    customer = await db.customers.find_one(
+        {"id": reservation.get("customer_id")}, {"_id": 0, "tc_no": 1, "full_name": 1, "phone": 1}
+    ) or {}
+    rental_data = {
+        "vehicle_plate": vehicle.get("plate"),
+        "customer_tc": customer.get("tc_no"),
+        "customer_name": customer.get("full_name"),
+        "customer_phone": customer.get("phone", ""),
+        "rental_start": delivery_doc["delivered_at"],
+        "rental_end": reservation.get("end_date"),
+        "pickup_location": reservation.get("pickup_location") or "",
+        "dropoff_location": reservation.get("return_location") or ""
+    }
+    return await kabis_outbox.enqueue(
+        reservation.get("company_id"),
+        rental_data,
+        idempotency_key=f"delivery:{reservation['id']}",
+        reservation_id=reservation["id"],
+        created_by=user.get("id")
+    )
 
 @api_router.post("/returns")
 async def create_return(return_data: ReturnCreate, user: dict = Depends(get_current_user)):
@@ -2717,6 +3268,14 @@ async def create_return(return_data: ReturnCreate, user: dict = Depends(get_curr
         raise HTTPException(status_code=400, detail="Vehicle must be delivered before return")
     
     return_id = str(uuid.uuid4())
+    returned_at = datetime.now(timezone.utc).isoformat()
+    
+    # Tolls passed during the rental are charged with the return
+    toll_charges = 0.0
+    if return_data.include_tolls:
+        await toll_attribution.attribute(reservation.get("company_id"), vehicle_ids=[reservation["vehicle_id"]])
+        toll_charges = (await toll_attribution.reservation_tolls(return_data.reservation_id))["total_amount"]
+    
     return_doc = {
         "id": return_id,
         "company_id": user.get("company_id"),
@@ -2726,17 +3285,21 @@ async def create_return(return_data: ReturnCreate, user: dict = Depends(get_curr
         "return_mileage": return_data.return_mileage,
         "fuel_level": return_data.fuel_level,
         "damage_notes": return_data.damage_notes,
-        "extra_charges": return_data.extra_charges,
-        "returned_at": datetime.now(timezone.utc).isoformat(),
+        "toll_charges": toll_charges,
+        "extra_charges": round(return_data.extra_charges + toll_charges, 2),
+        "returned_at": returned_at,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.returns.insert_one(return_doc)
     
     # Update reservation and vehicle status
-    await db.reservations.update_one({"id": return_data.reservation_id}, {"$set": {"status": ReservationStatus.RETURNED.value}})
+    await db.reservations.update_one(
+        {"id": return_data.reservation_id},
+        {"$set": {"status": ReservationStatus.RETURNED.value, "returned_at": returned_at}}
+    )
     await db.vehicles.update_one({"id": reservation["vehicle_id"]}, {"$set": {"status": VehicleStatus.AVAILABLE.value, "mileage": return_data.return_mileage}})
     
-    return {"message": "Return completed", "return_id": return_id}
+    return {"message": "Return completed", "return_id": return_id, "toll_charges": toll_charges, "extra_charges": return_doc["extra_charges"]}
 
 # ============== PAYMENT ROUTES ==============
 @api_router.post("/payments")
@@ -2809,74 +3372,170 @@ async def get_dashboard_stats(user: dict = Depends(get_current_user)):
     )
 
 # ============== GPS / ARVENTO ROUTES ==============
-@api_router.get("/gps/vehicles")
-async def get_vehicle_locations(user: dict = Depends(get_current_user)):
-    """Get vehicle GPS locations - Arvento integration or mock data"""
-    # Get company GPS settings
+def gps_stream_scope(user: dict) -> str:
+    """Stream scope of the caller: own company, or the whole fleet for superadmin"""
+    if user["role"] == UserRole.SUPERADMIN.value and not gps_collector.is_collected(user.get("company_id")):
+        return ALL_COMPANIES
+    return user.get("company_id")
+
+async def gps_positions_for(user: dict) -> List[dict]:
+    """Current positions visible to the caller - collector store, or mock data"""
     company_id = user.get("company_id")
-    gps_settings = await db.integration_settings.find_one(
-        {"company_id": company_id, "type": "arvento"},
-        {"_id": 0}
-    )
     
-    # Create Arvento service with company settings
-    if gps_settings and gps_settings.get("is_active"):
-        arvento = ArventoService(
-            api_key=gps_settings.get("api_key"),
-            company_code=gps_settings.get("company_code"),
-            api_url=gps_settings.get("api_url")
-        )
-    else:
-        arvento = ArventoService()  # Will use mock data
+    if user["role"] == UserRole.SUPERADMIN.value and not gps_collector.is_collected(company_id):
+        collected = gps_collector.get_all_positions()
+        if collected:
+            return collected
+    elif gps_collector.is_collected(company_id):
+        return await gps_collector.get_positions(company_id)
     
-    result = await arvento.get_all_vehicles()
+    # No active Arvento integration: stable demo positions for rented vehicles
+    query = {"status": VehicleStatus.RENTED.value}
+    if user["role"] != UserRole.SUPERADMIN.value:
+        query["company_id"] = company_id
     
-    # If mock, enhance with actual vehicle data
-    if result.get("source") == "mock":
-        query = {"status": VehicleStatus.RENTED.value}
-        if user["role"] != UserRole.SUPERADMIN.value:
-            query["company_id"] = company_id
-        
-        vehicles = await db.vehicles.find(query, {"_id": 0}).to_list(100)
-        
-        import random
-        locations = []
-        for v in vehicles:
-            locations.append({
-                "vehicle_id": v["id"],
-                "plate": v["plate"],
-                "lat": 41.0082 + random.uniform(-0.1, 0.1),
-                "lng": 28.9784 + random.uniform(-0.1, 0.1),
-                "speed": random.randint(0, 120),
-                "heading": random.randint(0, 360),
-                "ignition": random.choice([True, False]),
-                "last_update": datetime.now(timezone.utc).isoformat(),
-                "address": random.choice(["Taksim", "Kadikoy", "Besiktas", "Uskudar"]) + ", Istanbul",
-                "source": "mock"
-            })
-        return locations
+    vehicles = await db.vehicles.find(query, {"_id": 0, "id": 1, "plate": 1}).to_list(100)
+    return [mock_position(v) for v in vehicles]
+
+@api_router.get("/gps/vehicles")
+async def get_vehicle_locations(user: dict = Depends(get_current_user)):
+    """Get vehicle GPS locations - served from the background Arvento collector, or mock data"""
+    return await gps_positions_for(user)
+
+@api_router.get("/gps/stream")
+async def stream_vehicle_locations(user: dict = Depends(get_current_user)):
+    """Server-Sent Events: a 'snapshot' event with all positions, then 'positions' events with changed vehicles"""
+    try:
+        # Subscribe before reading the snapshot so no poll falls between the two
+        subscriber = gps_stream.subscribe(gps_stream_scope(user))
+    except GPSStreamFull:
+        raise HTTPException(status_code=503, detail="Canlı konum akışı şu anda dolu, lütfen daha sonra tekrar deneyin")
+    try:
+        positions = await gps_positions_for(user)
+    except Exception:
+        gps_stream.unsubscribe(subscriber)
+        raise
+    return StreamingResponse(
+        gps_stream.stream(subscriber, positions),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/gps/collector/status")
+async def get_gps_collector_status(user: dict = Depends(get_current_user)):
+    """SuperAdmin: GPS collector poll status per company"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view GPS collector status")
+    return {**gps_collector.get_status(), "stream": gps_stream.get_status(), "geo": gps_geo.get_status()}
+
+@api_router.get("/gps/nearby")
+async def get_nearby_vehicles(
+    lat: float,
+    lng: float,
+    radius: float = GPS_NEARBY_DEFAULT_RADIUS,
+    status: Optional[str] = None,
+    limit: int = 20,
+    user: dict = Depends(get_current_user)
+):
+    """Vehicles closest to a point (radius in meters), e.g. available cars near a branch"""
+    if not -90 <= lat <= 90 or not -180 <= lng <= 180 or radius <= 0:
+        raise HTTPException(status_code=400, detail="Geçersiz konum veya yarıçap")
+    if status and status not in [s.value for s in VehicleStatus]:
+        raise HTTPException(status_code=400, detail="Geçersiz araç durumu")
+    company_id = None if user["role"] == UserRole.SUPERADMIN.value else user.get("company_id")
+    vehicles = await gps_geo.nearby(lat, lng, radius, company_id=company_id, status=status, limit=limit)
+    return {"vehicles": vehicles, "count": len(vehicles), "radius": radius}
+
+class GeofenceCreate(BaseModel):
+    name: str
+    polygon: dict
+    mode: str = "keep_inside"
+    vehicle_statuses: List[str] = [VehicleStatus.RENTED.value]
+    is_active: bool = True
+
+@api_router.get("/gps/geofences")
+async def get_geofences(user: dict = Depends(get_current_user)):
+    """Company geofences"""
+    return await db.geofences.find({"company_id": user.get("company_id")}, {"_id": 0}).to_list(1000)
+
+@api_router.post("/gps/geofences")
+async def create_geofence(data: GeofenceCreate, user: dict = Depends(get_current_user)):
+    """Create a geofence polygon ([lng, lat] GeoJSON coordinates)"""
+    if user["role"] not in [UserRole.SUPERADMIN.value, UserRole.FIRMA_ADMIN.value]:
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    if data.mode not in GEOFENCE_MODES:
+        raise HTTPException(status_code=400, detail="Geçersiz geofence modu")
+    error = validate_polygon(data.polygon)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
     
-    return result.get("vehicles", [])
+    geofence = {
+        "id": str(uuid.uuid4()),
+        "company_id": user.get("company_id"),
+        **data.model_dump(),
+        "created_by": user["id"],
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.geofences.insert_one(dict(geofence))
+    gps_geo.invalidate_fences(geofence["company_id"])
+    return {"success": True, "geofence": geofence}
+
+@api_router.delete("/gps/geofences/{geofence_id}")
+async def delete_geofence(geofence_id: str, user: dict = Depends(get_current_user)):
+    """Delete a geofence and resolve its open violations"""
+    if user["role"] not in [UserRole.SUPERADMIN.value, UserRole.FIRMA_ADMIN.value]:
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    result = await db.geofences.delete_one({"id": geofence_id, "company_id": user.get("company_id")})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Geofence bulunamadı")
+    gps_geo.invalidate_fences(user.get("company_id"))
+    await gps_geo.close_violations(geofence_id)
+    return {"success": True}
+
+@api_router.get("/gps/geofences/violations")
+async def get_geofence_violations(active: bool = True, limit: int = 100, user: dict = Depends(get_current_user)):
+    """Geofence violations of the company, newest first"""
+    query = {"company_id": user.get("company_id")}
+    if active:
+        query["resolved_at"] = None
+    return await db.geofence_violations.find(query, {"_id": 0}).sort("started_at", -1).to_list(min(limit, 1000))
 
 @api_router.get("/gps/vehicle/{vehicle_id}/history")
 async def get_vehicle_history(
     vehicle_id: str,
     start_date: str = None,
     end_date: str = None,
+    zoom: Optional[int] = None,
+    max_points: Optional[int] = None,
     user: dict = Depends(get_current_user)
 ):
-    """Get vehicle route history"""
-    vehicle = await db.vehicles.find_one({"id": vehicle_id})
+    """Get vehicle route history from the local GPS history, simplified for the map zoom level"""
+    query = {"id": vehicle_id}
+    if user["role"] != UserRole.SUPERADMIN.value:
+        query["company_id"] = user.get("company_id")
+    vehicle = await db.vehicles.find_one(query, {"_id": 0, "id": 1, "plate": 1, "company_id": 1})
     if not vehicle:
         raise HTTPException(status_code=404, detail="Vehicle not found")
+    if zoom is not None and not 0 <= zoom <= 22:
+        raise HTTPException(status_code=400, detail="Geçersiz zoom seviyesi")
     
-    # Mock history data for now
-    return {
+    end = parse_timestamp(end_date) if end_date else datetime.now(timezone.utc)
+    start = parse_timestamp(start_date) if start_date else (end - timedelta(hours=24) if end else None)
+    if not start or not end or start >= end:
+        raise HTTPException(status_code=400, detail="Geçersiz tarih aralığı")
+    
+    result = await gps_history.history(vehicle.get("company_id"), vehicle.get("plate"), start, end, zoom, max_points)
+    response = {
         "vehicle_id": vehicle_id,
         "plate": vehicle.get("plate"),
-        "history": [],
-        "message": "Rota gecmisi icin Arvento API yapilandirilmali"
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "source": "gps_history",
+        **result
     }
+    if not result["raw_points"] and not gps_collector.is_collected(vehicle.get("company_id")):
+        response["message"] = "Rota gecmisi icin Arvento API yapilandirilmali"
+    return response
 
 @api_router.get("/gps/settings")
 async def get_gps_settings(user: dict = Depends(get_current_user)):
@@ -2916,6 +3575,8 @@ async def update_gps_settings(
         "company_code": settings.get("company_code"),
         "api_url": settings.get("api_url", "https://api.arvento.com/v1"),
         "is_active": settings.get("is_active", True),
+        # Collector poll interval for this company (None = GPS_POLL_INTERVAL)
+        "poll_interval_seconds": settings.get("poll_interval_seconds"),
         "updated_at": now
     }
     
@@ -2924,6 +3585,7 @@ async def update_gps_settings(
         {"$set": settings_doc},
         upsert=True
     )
+    await gps_collector.reload()
     
     return {"success": True, "message": "GPS ayarlari guncellendi"}
 
@@ -2956,6 +3618,12 @@ async def get_hgs_summary(user: dict = Depends(get_current_user)):
     summary = await hgs_service.get_summary(company_id)
     return summary
 
+@api_router.get("/hgs/tolls/monthly")
+async def get_hgs_monthly_tolls(month: str = None, user: dict = Depends(get_current_user)):
+    """Monthly toll totals per vehicle (month: YYYY-MM)"""
+    hgs_service.set_db(db)
+    return await hgs_service.get_monthly_tolls(user.get("company_id"), month)
+
 @api_router.get("/hgs/tags")
 async def get_hgs_tags(user: dict = Depends(get_current_user)):
     """Get all HGS tags"""
@@ -2971,7 +3639,7 @@ async def add_hgs_tag(tag_data: dict, user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Insufficient permissions")
     
     hgs_service.set_db(db)
-    result = await hgs_service.add_hgs_tag(tag_data.get("vehicle_id"), tag_data)
+    result = await hgs_service.add_hgs_tag(tag_data.get("vehicle_id"), tag_data, user.get("company_id"))
     
     if not result.get("success"):
         raise HTTPException(status_code=400, detail=result.get("error"))
@@ -3009,6 +3677,42 @@ async def add_hgs_passage(
     """Add HGS passage record"""
     hgs_service.set_db(db)
     result = await hgs_service.add_passage(tag_id, passage_data)
+    if result.get("success"):
+        passage = await db.hgs_passages.find_one({"id": result["passage_id"]}, {"_id": 0, "company_id": 1, "vehicle_id": 1})
+        if passage and passage.get("vehicle_id"):
+            await toll_attribution.attribute(passage.get("company_id"), vehicle_ids=[passage["vehicle_id"]])
+    return result
+
+@api_router.post("/hgs/passages/bulk")
+async def bulk_add_hgs_passages(request: Request, user: dict = Depends(get_current_user)):
+    """Import a provider statement: CSV or JSON body, or a multipart 'file' upload"""
+    if user["role"] not in [UserRole.SUPERADMIN.value, UserRole.FIRMA_ADMIN.value, UserRole.OPERASYON.value]:
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if not upload or not hasattr(upload, "read"):
+            raise HTTPException(status_code=400, detail="Ekstre dosyası gerekli")
+        content, content_type = await upload.read(), upload.content_type or upload.filename or ""
+    else:
+        content = await request.body()
+    
+    try:
+        rows = parse_passage_statement(content, content_type)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Ekstre okunamadı: {str(e)}")
+    if not rows:
+        raise HTTPException(status_code=400, detail="Ekstrede geçiş bulunamadı")
+    
+    hgs_service.set_db(db)
+    company_id = None if user["role"] == UserRole.SUPERADMIN.value else user.get("company_id")
+    result = await hgs_service.ingest_passages(rows, company_id)
+    if not result.get("success"):
+        raise HTTPException(status_code=400, detail=result.get("error"))
+    if result["inserted"]:
+        result["attribution"] = await toll_attribution.attribute(company_id, batch_id=result["batch_id"])
     return result
 
 @api_router.get("/hgs/passages")
@@ -3025,6 +3729,24 @@ async def get_hgs_passages(
     passages = await hgs_service.get_passages(tag_id, vehicle_id, start_date, end_date, limit)
     return passages
 
+@api_router.post("/hgs/attribution/run")
+async def run_toll_attribution(reattribute: bool = False, user: dict = Depends(get_current_user)):
+    """Attribute HGS passages to the reservations that had the vehicle at passage time"""
+    if user["role"] not in [UserRole.SUPERADMIN.value, UserRole.FIRMA_ADMIN.value]:
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    company_id = None if user["role"] == UserRole.SUPERADMIN.value else user.get("company_id")
+    return await toll_attribution.attribute(company_id, reattribute=reattribute)
+
+@api_router.get("/reservations/{reservation_id}/tolls")
+async def get_reservation_tolls(reservation_id: str, user: dict = Depends(get_current_user)):
+    """HGS passages charged to a reservation"""
+    query = {"id": reservation_id}
+    if user["role"] != UserRole.SUPERADMIN.value:
+        query["company_id"] = user.get("company_id")
+    if not await db.reservations.find_one(query, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    return await toll_attribution.reservation_tolls(reservation_id)
+
 @api_router.delete("/hgs/tags/{tag_id}")
 async def delete_hgs_tag(tag_id: str, user: dict = Depends(get_current_user)):
     """Delete HGS tag"""
@@ -3092,42 +3814,47 @@ async def update_kabis_settings(
 @api_router.post("/kabis/notifications")
 async def create_kabis_notification(
     rental_data: dict,
+    request: Request,
     user: dict = Depends(get_current_user)
 ):
-    """Create KABIS rental notification"""
-    company_id = user.get("company_id")
-    
-    # Get company KABIS settings
-    settings = await db.integration_settings.find_one(
-        {"company_id": company_id, "type": "kabis"}
+    """Queue a KABIS rental notification; the outbox worker submits it"""
+    result = await kabis_outbox.enqueue(
+        user.get("company_id"),
+        rental_data,
+        idempotency_key=request.headers.get("Idempotency-Key") or rental_data.pop("idempotency_key", None),
+        reservation_id=rental_data.get("reservation_id"),
+        created_by=user.get("id")
     )
-    
-    if settings and settings.get("is_active"):
-        kabis = KabisService(
-            api_key=settings.get("api_key"),
-            firma_kodu=settings.get("firma_kodu"),
-            api_url=settings.get("api_url")
-        )
-    else:
-        kabis = KabisService()
-    
-    result = await kabis.create_rental_notification(rental_data)
-    
-    # Save notification to DB
-    if result.get("success"):
-        notification_doc = {
-            "id": result.get("notification_id"),
-            "company_id": company_id,
-            "rental_data": rental_data,
-            "status": result.get("status"),
-            "source": result.get("source"),
-            "created_at": result.get("created_at"),
-            "created_by": user.get("id")
-        }
-        await db.kabis_notifications.insert_one(notification_doc)
-    
     return result
 
+@api_router.get("/kabis/outbox")
+async def get_kabis_outbox_metrics(user: dict = Depends(get_current_user)):
+    """KABIS outbox depth, oldest pending age and worker counters"""
+    company_id = None if user["role"] == UserRole.SUPERADMIN.value else user.get("company_id")
+    return await kabis_outbox.metrics(company_id)
+
+@api_router.get("/kabis/reconcile/status")
+async def get_kabis_reconcile_status(user: dict = Depends(get_current_user)):
+    """SuperAdmin: KABIS status reconciliation settings and last run"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view KABIS reconciliation")
+    return kabis_reconciler.get_status()
+
+@api_router.post("/kabis/reconcile/run")
+async def run_kabis_reconcile(user: dict = Depends(get_current_user)):
+    """SuperAdmin: sync submitted KABIS notifications now"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can run KABIS reconciliation")
+    return await kabis_reconciler.run_once()
+
+@api_router.post("/kabis/notifications/{notification_id}/retry")
+async def retry_kabis_notification(notification_id: str, user: dict = Depends(get_current_user)):
+    """Re-queue a failed KABIS notification"""
+    company_id = None if user["role"] == UserRole.SUPERADMIN.value else user.get("company_id")
+    if not await kabis_outbox.retry(notification_id, company_id):
+        raise HTTPException(status_code=404, detail="Başarısız bildirim bulunamadı")
+    return {"success": True, "message": "Bildirim yeniden kuyruğa alındı"}
+
 @api_router.get("/kabis/notifications")
 async def get_kabis_notifications(
     limit: int = 100,
@@ -3256,6 +3983,17 @@ async def root():
 async def health():
     return {"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat()}
 
+@api_router.get("/superadmin/system/executor")
+async def get_executor_stats(user: dict = Depends(get_current_user)):
+    """SuperAdmin: Blocking-work executor counters and event loop lag"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view system stats")
+    
+    return {
+        "executor": blocking_executor.get_stats(),
+        "loop_lag": loop_lag_monitor.get_stats()
+    }
+
 # Include router
 # ============== PUBLIC ROUTES (No Auth Required) ==============
 @api_router.get("/public/vehicles")
@@ -4056,6 +4794,7 @@ async def get_finance_summary(user: dict = Depends(get_current_user)):
 # ============== IYZICO PAYMENT INTEGRATION ==============
 
 from services.iyzico_service import iyzico_service
+from services.iyzico_events import iyzico_events, webhook_event_key
 
 class IyzicoCheckoutRequest(BaseModel):
     company_id: str
@@ -4189,181 +4928,66 @@ async def initialize_iyzico_checkout(
 
 @api_router.post("/payment/iyzico/callback")
 async def iyzico_payment_callback(request: Request):
-    """Handle iyzico payment callback"""
+    """Store the iyzico checkout callback; the payment is applied by iyzico_events"""
+    content_type = request.headers.get("content-type", "")
     try:
-        # Get token from form data or JSON
-        content_type = request.headers.get("content-type", "")
-        
         if "application/x-www-form-urlencoded" in content_type:
             form_data = await request.form()
             token = form_data.get("token")
         else:
             body = await request.json()
             token = body.get("token")
-        
-        if not token:
-            raise HTTPException(status_code=400, detail="Token is required")
-        
-        # Retrieve checkout result
-        result = await iyzico_service.retrieve_checkout_result(token)
-        
-        # Find the session
-        session = await db.iyzico_sessions.find_one({"token": token})
-        
-        if result.get("status") == "success" and result.get("paymentStatus") == "SUCCESS":
-            # Payment successful
-            now = datetime.now(timezone.utc)
-            
-            # Update session
-            await db.iyzico_sessions.update_one(
-                {"token": token},
-                {"$set": {
-                    "status": "completed",
-                    "payment_id": result.get("paymentId"),
-                    "completed_at": now.isoformat()
-                }}
-            )
-            
-            if session:
-                company_id = session["company_id"]
-                plan = session["plan"]
-                billing_cycle = session["billing_cycle"]
-                amount = session["amount"]
-                
-                # Calculate subscription period
-                if billing_cycle == "yearly":
-                    months = 12
-                else:
-                    months = 1
-                
-                new_end = now + timedelta(days=30 * months)
-                
-                # Update company subscription
-                await db.companies.update_one(
-                    {"id": company_id},
-                    {"$set": {
-                        "status": CompanyStatus.ACTIVE.value,
-                        "subscription_plan": plan,
-                        "billing_cycle": billing_cycle,
-                        "subscription_start": now.isoformat(),
-                        "subscription_end": new_end.isoformat(),
-                        "last_payment_date": now.isoformat(),
-                        "updated_at": now.isoformat()
-                    }}
-                )
-                
-                # Record payment
-                payment_record = {
-                    "id": str(uuid.uuid4()),
-                    "company_id": company_id,
-                    "plan": plan,
-                    "billing_cycle": billing_cycle,
-                    "amount": amount,
-                    "currency": "TRY",
-                    "payment_method": "iyzico",
-                    "payment_id": result.get("paymentId"),
-                    "status": PaymentStatus.COMPLETED.value,
-                    "created_at": now.isoformat()
-                }
-                await db.subscription_payments.insert_one(payment_record)
-                
-                logger.info(f"iyzico payment completed for company {company_id}: ₺{amount}")
-            
-            return {"status": "success", "message": "Payment completed successfully"}
-        else:
-            # Payment failed
-            await db.iyzico_sessions.update_one(
-                {"token": token},
-                {"$set": {
-                    "status": "failed",
-                    "error": result.get("errorMessage"),
-                    "failed_at": datetime.now(timezone.utc).isoformat()
-                }}
-            )
-            
-            logger.error(f"iyzico payment failed: {result}")
-            return {"status": "failed", "message": result.get("errorMessage", "Payment failed")}
+    except Exception:
+        token = None
     
-    except Exception as e:
-        logger.error(f"iyzico callback error: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    if not token:
+        raise HTTPException(status_code=400, detail="Token is required")
+    
+    event = await iyzico_events.record(f"token:{token}", "callback", event_type="CHECKOUT_FORM", token=token)
+    return {"status": "received", "message": "Ödeme bildirimi alındı, işleniyor", **event}
 
 @api_router.post("/payment/iyzico/webhook")
 async def iyzico_webhook(request: Request):
-    """Handle iyzico webhooks for subscription events"""
+    """Store an iyzico webhook; subscription events are applied by iyzico_events"""
+    payload = await request.body()
+    signature = request.headers.get("X-IYZ-SIGNATURE-V3", "")
+    
+    # Verify signature
+    if not iyzico_service.verify_webhook_signature(payload, signature):
+        logger.warning("Invalid iyzico webhook signature")
+        raise HTTPException(status_code=401, detail="Invalid signature")
+    
     try:
-        payload = await request.body()
-        signature = request.headers.get("X-IYZ-SIGNATURE-V3", "")
-        
-        # Verify signature
-        if not iyzico_service.verify_webhook_signature(payload, signature):
-            logger.warning("Invalid iyzico webhook signature")
-            raise HTTPException(status_code=401, detail="Invalid signature")
-        
         body = json.loads(payload)
-        event_type = body.get("iyziEventType")
-        
-        logger.info(f"iyzico webhook received: {event_type}")
-        
-        if event_type == "SUBSCRIPTION_PAYMENT_SUCCESS":
-            # Handle recurring payment success
-            subscription_ref = body.get("subscriptionReferenceCode")
-            payment_id = body.get("paymentId")
-            
-            # Find company by subscription reference
-            company = await db.companies.find_one({"iyzico_subscription_ref": subscription_ref})
-            if company:
-                now = datetime.now(timezone.utc)
-                
-                # Extend subscription
-                current_end = datetime.fromisoformat(company.get("subscription_end", now.isoformat()).replace("Z", "+00:00"))
-                new_end = max(current_end, now) + timedelta(days=30)
-                
-                await db.companies.update_one(
-                    {"id": company["id"]},
-                    {"$set": {
-                        "subscription_end": new_end.isoformat(),
-                        "last_payment_date": now.isoformat(),
-                        "updated_at": now.isoformat()
-                    }}
-                )
-                
-                # Record payment
-                payment_record = {
-                    "id": str(uuid.uuid4()),
-                    "company_id": company["id"],
-                    "plan": company.get("subscription_plan", "starter"),
-                    "billing_cycle": "monthly",
-                    "amount": body.get("paidPrice", 0),
-                    "currency": "TRY",
-                    "payment_method": "iyzico_recurring",
-                    "payment_id": payment_id,
-                    "status": PaymentStatus.COMPLETED.value,
-                    "created_at": now.isoformat()
-                }
-                await db.subscription_payments.insert_one(payment_record)
-                
-                logger.info(f"Recurring payment processed for {company['name']}")
-        
-        elif event_type == "SUBSCRIPTION_CANCELLED":
-            subscription_ref = body.get("subscriptionReferenceCode")
-            company = await db.companies.find_one({"iyzico_subscription_ref": subscription_ref})
-            if company:
-                await db.companies.update_one(
-                    {"id": company["id"]},
-                    {"$set": {
-                        "status": CompanyStatus.SUSPENDED.value,
-                        "suspension_reason": "Subscription cancelled",
-                        "updated_at": datetime.now(timezone.utc).isoformat()
-                    }}
-                )
-                logger.info(f"Subscription cancelled for {company['name']}")
-        
-        return {"status": "received"}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid payload")
     
-    except Exception as e:
-        logger.error(f"iyzico webhook error: {str(e)}")
-        return {"status": "error", "message": str(e)}
+    event_type = body.get("iyziEventType")
+    logger.info(f"iyzico webhook received: {event_type}")
+    event = await iyzico_events.record(
+        webhook_event_key(body, payload), "webhook", event_type=event_type, payload=body
+    )
+    return {"status": "received", **event}
+
+@api_router.get("/payment/iyzico/sessions/{token}")
+async def get_iyzico_session(token: str, user: dict = Depends(get_current_user)):
+    """Checkout session status, for polling after the callback"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view payment sessions")
+    session = await db.iyzico_sessions.find_one({"token": token}, {"_id": 0})
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    event = await db.payment_events.find_one(
+        {"event_key": f"token:{token}"}, {"_id": 0, "payload": 0}
+    )
+    return {**session, "event": event}
+
+@api_router.get("/payment/iyzico/events")
+async def get_iyzico_event_metrics(user: dict = Depends(get_current_user)):
+    """Payment event queue depth and worker counters"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view payment events")
+    return await iyzico_events.metrics()
 
 # ============== SUPPORT TICKET SYSTEM ==============
 
@@ -4457,6 +5081,13 @@ async def receive_tenant_ticket(ticket_data: dict):
     ticket_data["received_at"] = datetime.now(timezone.utc).isoformat()
     ticket_data["source"] = "tenant_panel"
     
+    # Known tenant: same source_key the replicator uses, so the push and the pull meet in one document.
+    # The push is unauthenticated, so it only creates tickets; changes arrive through the pull replicator.
+    company = await db.companies.find_one({"code": ticket_data.get("company_code")}, {"_id": 0, "id": 1, "code": 1, "name": 1})
+    if company and ticket_data.get("id"):
+        await ticket_replicator.upsert_tickets(company, [ticket_data], insert_only=True)
+        return {"success": True, "message": "Ticket received"}
+    
     # Check if ticket already exists
     existing = await db.support_tickets.find_one({"id": ticket_data.get("id")})
     if existing:
@@ -4469,42 +5100,26 @@ async def receive_tenant_ticket(ticket_data: dict):
 
 # SuperAdmin: Get all tickets (including from tenants)
 @api_router.get("/superadmin/support/tickets")
-async def get_all_tickets(user: dict = Depends(get_current_user)):
+async def get_all_tickets(
+    user: dict = Depends(get_current_user),
+    status: Optional[str] = None,
+    priority: Optional[str] = None,
+    limit: int = 100,
+    page: int = 1
+):
     """SuperAdmin: Get all support tickets from all tenants"""
     if user["role"] != UserRole.SUPERADMIN.value:
         raise HTTPException(status_code=403, detail="Only SuperAdmin can view all tickets")
     
-    all_tickets = []
-    
-    # Get local tickets
-    local_tickets = await db.support_tickets.find({}, {"_id": 0}).sort("created_at", -1).to_list(500)
-    all_tickets.extend(local_tickets)
-    
-    # Get tickets from all tenant databases
-    try:
-        companies = await db.companies.find({"is_active": True}, {"_id": 0}).to_list(100)
-        for company in companies:
-            try:
-                company_code = company.get("code", "").lower().replace(" ", "").replace("-", "")
-                if not company_code:
-                    continue
-                    
-                # Connect to tenant's MongoDB via Portainer
-                tenant_tickets = await portainer_service.get_tenant_support_tickets(company_code)
-                for ticket in tenant_tickets:
-                    ticket["company_name"] = company.get("name", company_code)
-                    ticket["company_code"] = company_code
-                    ticket["source"] = "tenant_db"
-                    all_tickets.append(ticket)
-            except Exception as e:
-                logger.warning(f"Could not fetch tickets from {company.get('name')}: {e}")
-    except Exception as e:
-        logger.error(f"Error fetching tenant tickets: {e}")
-    
-    # Sort by created_at
-    all_tickets.sort(key=lambda x: x.get("created_at", ""), reverse=True)
+    # Tenant tickets are replicated into support_tickets in the background
+    query = {}
+    if status:
+        query["status"] = status
+    if priority:
+        query["priority"] = priority
     
-    return all_tickets
+    page = max(page, 1)
+    return await db.support_tickets.find(query, {"_id": 0}).sort("updated_at", -1).skip((page - 1) * limit).limit(limit).to_list(limit)
 
 # Tenant: Get my tickets
 @api_router.get("/support/tickets")
@@ -4585,6 +5200,16 @@ async def reply_to_ticket(ticket_id: str, reply: TicketReply, user: dict = Depen
         }
     )
     
+    # Replicated tenant ticket: the tenant panel reads its own copy
+    if is_superadmin and ticket.get("tenant_ticket_id"):
+        await ticket_replicator.push_to_tenant(ticket, status=new_status, response={
+            "id": new_message["id"],
+            "from": "support",
+            "sender_name": new_message["sender_name"],
+            "message": reply.message,
+            "created_at": now.isoformat()
+        })
+    
     logger.info(f"Reply added to ticket {ticket['ticket_number']} by {user['email']}")
     
     return {"success": True, "message": "Yanıt eklendi"}
@@ -4595,63 +5220,59 @@ async def get_all_tickets(
     user: dict = Depends(get_current_user),
     status: Optional[str] = None,
     priority: Optional[str] = None,
-    limit: int = 100
+    limit: int = 100,
+    page: int = 1,
+    refresh: bool = False
 ):
-    """SuperAdmin: Get all support tickets including from tenants"""
+    """SuperAdmin: Get all support tickets including from tenants (refresh=true replicates first)"""
     if user["role"] != UserRole.SUPERADMIN.value:
         raise HTTPException(status_code=403, detail="Only SuperAdmin can view all tickets")
     
-    all_tickets = []
+    # Tenant tickets are replicated into support_tickets, so this is one indexed local query
+    if refresh:
+        await ticket_replicator.run_once()
     
-    # Get local tickets
     query = {}
-    if status:
-        query["status"] = status
     if priority:
         query["priority"] = priority
-    
-    local_tickets = await db.support_tickets.find(query, {"_id": 0}).sort("updated_at", -1).limit(limit).to_list(limit)
-    all_tickets.extend(local_tickets)
-    
-    # Get tickets from all tenant databases
-    try:
-        companies = await db.companies.find({"is_active": True}, {"_id": 0}).to_list(100)
-        for company in companies:
-            try:
-                company_code = company.get("code", "").lower().replace(" ", "").replace("-", "")
-                if not company_code:
-                    continue
-                    
-                tenant_tickets = await portainer_service.get_tenant_support_tickets(company_code)
-                for ticket in tenant_tickets:
-                    ticket["company_name"] = company.get("name", company_code)
-                    ticket["company_code"] = company_code
-                    ticket["source"] = "tenant"
-                    # Apply filters
-                    if status and ticket.get("status") != status:
-                        continue
-                    if priority and ticket.get("priority") != priority:
-                        continue
-                    all_tickets.append(ticket)
-            except Exception as e:
-                logger.warning(f"Could not fetch tickets from {company.get('name')}: {e}")
-    except Exception as e:
-        logger.error(f"Error fetching tenant tickets: {e}")
-    
-    # Sort by created_at
-    all_tickets.sort(key=lambda x: x.get("created_at", ""), reverse=True)
-    
-    # Get ticket stats
-    stats = {
-        "total": len(all_tickets),
-        "open": len([t for t in all_tickets if t.get("status") == "open"]),
-        "in_progress": len([t for t in all_tickets if t.get("status") == "in_progress"]),
-        "waiting_customer": len([t for t in all_tickets if t.get("status") == "waiting_customer"]),
-        "resolved": len([t for t in all_tickets if t.get("status") == "resolved"]),
-        "closed": len([t for t in all_tickets if t.get("status") == "closed"])
+    filtered = {**query, "status": status} if status else query
+    
+    page = max(page, 1)
+    tickets = await db.support_tickets.find(filtered, {"_id": 0}).sort("updated_at", -1).skip((page - 1) * limit).limit(limit).to_list(limit)
+    
+    # Status counts for the same filter in one aggregation
+    status_counts = {
+        row["_id"]: row["count"]
+        for row in await db.support_tickets.aggregate([
+            {"$match": filtered},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]).to_list(20)
     }
+    stats = {"total": sum(status_counts.values())}
+    for ticket_status in ("open", "in_progress", "waiting_customer", "resolved", "closed"):
+        stats[ticket_status] = status_counts.get(ticket_status, 0)
     
-    return {"tickets": all_tickets[:limit], "stats": stats}
+    return {
+        "tickets": tickets,
+        "stats": stats,
+        "page": page,
+        "limit": limit,
+        "replication": ticket_replicator.last_run
+    }
+
+@api_router.get("/superadmin/tickets/replication")
+async def get_ticket_replication_status(user: dict = Depends(get_current_user)):
+    """SuperAdmin: Per-tenant ticket replication watermarks and errors"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can view ticket replication")
+    return await ticket_replicator.get_status()
+
+@api_router.post("/superadmin/tickets/replication/run")
+async def run_ticket_replication(user: dict = Depends(get_current_user)):
+    """SuperAdmin: Pull changed tenant tickets now"""
+    if user["role"] != UserRole.SUPERADMIN.value:
+        raise HTTPException(status_code=403, detail="Only SuperAdmin can run ticket replication")
+    return await ticket_replicator.run_once()
 
 # SuperAdmin: Update ticket status
 @api_router.patch("/superadmin/tickets/{ticket_id}/status")
@@ -4679,6 +5300,7 @@ async def update_ticket_status(
         update_data["resolved_by"] = user["id"]
     
     await db.support_tickets.update_one({"id": ticket_id}, {"$set": update_data})
+    await ticket_replicator.push_to_tenant(ticket, status=status)
     
     logger.info(f"Ticket {ticket['ticket_number']} status updated to {status}")
     
@@ -5352,6 +5974,44 @@ async def integration_webhook(webhook_data: dict):
 
 app.include_router(api_router)
 
+# Hop-by-hop and body framing headers are not copied when forwarding
+FORWARD_SKIP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "te", "upgrade", "content-length", "content-encoding"}
+
+async def forward_woken_request(request: Request, ports: dict) -> Response:
+    """Send a request that woke a tenant on to the tenant's own container"""
+    import httpx
+    
+    host = request.headers.get("host", "").split(":")[0].lower()
+    port = (ports or {}).get("backend") if host.startswith("api.") else (ports or {}).get("frontend")
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in FORWARD_SKIP_HEADERS}
+    
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        upstream = await client.request(
+            request.method, f"http://{SERVER_IP}:{port}{request.url.path}",
+            params=request.query_params, headers=headers, content=await request.body()
+        )
+    return Response(
+        content=upstream.content,
+        status_code=upstream.status_code,
+        headers={k: v for k, v in upstream.headers.items() if k.lower() not in FORWARD_SKIP_HEADERS}
+    )
+
+# Requests for hibernated tenants reach this app through Traefik's tenant-waker route
+@app.middleware("http")
+async def tenant_waker_middleware(request: Request, call_next):
+    host = request.headers.get("host", "")
+    if not hibernation.hibernated_company_for_host(host):
+        return await call_next(request)
+    
+    result = await hibernation.wake_host(host)
+    if not result.get("success"):
+        return JSONResponse(
+            status_code=503,
+            headers={"Retry-After": "15"},
+            content={"detail": "Firma başlatılıyor, lütfen birkaç saniye sonra tekrar deneyin"}
+        )
+    return await forward_woken_request(request, result.get("ports"))
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -5371,6 +6031,59 @@ async def startup():
     await db.vehicles.create_index("plate")
     await db.customers.create_index("tc_no")
     await db.reservations.create_index("status")
+    await db.frontend_artifacts.create_index([("app", 1), ("source_hash", 1)])
+    await db.frontend_artifacts.create_index("id", unique=True)
+    await db.frontend_artifacts.create_index([("app", 1), ("version", 1)], unique=True)
+    await db.tenant_images.create_index("code_hash")
+    await db.tenant_images.create_index("version", unique=True)
+    await db.template_manifests.create_index("version", unique=True)
+    await db.hibernation_events.create_index([("company_code", 1), ("at", -1)])
+    await db.hibernation_events.create_index("at")
+    
+    artifact_store.set_db(db)
+    tenant_image_builder.set_db(db)
+    port_allocator.set_db(db)
+    await port_allocator.ensure_initialized()
+    tenant_mongo.set_db(db)
+    placement_scheduler.set_db(db)
+    await placement_scheduler.ensure_endpoints()
+    tenant_databases.set_db(db)
+    tenant_databases.start()
+    ticket_replicator.set_db(db)
+    template_versions.set_db(db)
+    gps_history.set_db(db)
+    await gps_history.ensure_collection()
+    gps_geo.set_db(db)
+    await gps_geo.ensure_indexes()
+    hgs_service.set_db(db)
+    await hgs_service.ensure_indexes()
+    toll_attribution.set_db(db)
+    await toll_attribution.ensure_indexes()
+    kabis_outbox.set_db(db)
+    await kabis_outbox.ensure_indexes()
+    kabis_outbox.start()
+    kabis_reconciler.set_db(db)
+    await kabis_reconciler.ensure_indexes()
+    kabis_reconciler.start()
+    iyzico_events.set_db(db)
+    await iyzico_events.ensure_indexes()
+    iyzico_events.start()
+    gps_collector.set_db(db)
+    gps_collector.add_listener(gps_history.record)
+    gps_collector.add_listener(gps_stream.publish)
+    gps_collector.add_listener(gps_geo.record)
+    await gps_collector.reload()
+    gps_collector.start()
+    await ticket_replicator.ensure_indexes()
+    ticket_replicator.start()
+    hibernation.set_db(db)
+    await hibernation.refresh_hosts()
+    hibernation.start()
+    tenant_registry.set_db(db)
+    await tenant_registry.ensure_indexes()
+    fleet_status.set_db(db)
+    fleet_status.start()
+    loop_lag_monitor.start()
     
     # Create default superadmin if not exists
     existing_admin = await db.users.find_one({"role": "superadmin"})
@@ -5378,7 +6091,7 @@ async def startup():
         admin_user = {
             "id": str(uuid.uuid4()),
             "email": "admin@admin.com",
-            "password_hash": pwd_context.hash("admin123"),
+            "password_hash": await get_password_hash("admin123"),
             "full_name": "Super Admin",
             "role": "superadmin",
             "is_active": True,
@@ -5391,4 +6104,16 @@ async def startup():
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    loop_lag_monitor.stop()
+    await fleet_status.stop()
+    await hibernation.stop()
+    await ticket_replicator.stop()
+    await gps_collector.stop()
+    await kabis_outbox.stop()
+    await kabis_reconciler.stop()
+    await iyzico_events.stop()
+    await tenant_databases.stop()
+    blocking_executor.shutdown()
+    await portainer_service.client.close()
+    tenant_mongo.close()
     client.close()
@@ -0,0 +1,266 @@
+"""
+Frontend Artifact Store
+Build-once, deploy-many frontend bundles keyed by source hash.
+
+Frontends read their API URL from a runtime config.js, so a single build
+can be served by every tenant. Bundles are stored as gzip-compressed tar
+archives (Docker's archive API accepts them as-is) together with
+precompressed .gz siblings for nginx gzip_static.
+"""
+
+import os
+import gzip
+import hashlib
+import logging
+import subprocess
+import tarfile
+import io as std_io
+from typing import Optional, Dict, Any, List
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from pymongo.errors import DuplicateKeyError
+
+from services.executor import blocking_executor
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_STORE_DIR = os.environ.get('ARTIFACT_STORE_DIR', '/app/artifacts')
+ARTIFACT_RETENTION = int(os.environ.get('ARTIFACT_RETENTION', '10'))
+FRONTEND_BUILD_TIMEOUT = int(os.environ.get('FRONTEND_BUILD_TIMEOUT', '300'))
+VERSION_ALLOCATION_ATTEMPTS = 5
+
+# Frontend source trees that can be built into artifacts
+ARTIFACT_SOURCES = {
+    'superadmin': '/app/frontend',
+    'tenant': '/app/backend/template/frontend',
+}
+
+# Ignored when hashing sources / packing bundles
+SOURCE_EXCLUDE_DIRS = {'node_modules', 'build', '.cache', '.git', 'downloads'}
+BUNDLE_EXCLUDE_FILES = {'config.js'}
+PRECOMPRESS_EXTENSIONS = ('.js', '.css', '.html', '.json', '.svg', '.map', '.txt')
+
+
+def compute_source_hash(source_dir: str) -> str:
+    """SHA-256 over relative paths and contents of a frontend source tree"""
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(source_dir):
+        dirs[:] = sorted(d for d in dirs if d not in SOURCE_EXCLUDE_DIRS)
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            rel_path = os.path.relpath(file_path, source_dir)
+            # Runtime config is tenant-specific and never part of the build identity
+            if rel_path == os.path.join('public', 'config.js'):
+                continue
+            digest.update(rel_path.encode('utf-8'))
+            digest.update(b'\0')
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    digest.update(chunk)
+            digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def pack_build_dir(build_dir: str) -> bytes:
+    """Pack a build directory into a gzip tar, adding .gz siblings for text assets"""
+    tar_buffer = std_io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode='w:gz', compresslevel=6) as tar:
+        for root, dirs, files in os.walk(build_dir):
+            dirs[:] = sorted(d for d in dirs if d not in SOURCE_EXCLUDE_DIRS)
+            for file in sorted(files):
+                if file in BUNDLE_EXCLUDE_FILES or file.endswith('.gz'):
+                    continue
+                file_path = os.path.join(root, file)
+                arcname = os.path.relpath(file_path, build_dir)
+                tar.add(file_path, arcname=arcname)
+
+                if file.endswith(PRECOMPRESS_EXTENSIONS):
+                    with open(file_path, 'rb') as f:
+                        compressed = gzip.compress(f.read(), compresslevel=9, mtime=0)
+                    gz_info = tarfile.TarInfo(name=f"{arcname}.gz")
+                    gz_info.size = len(compressed)
+                    gz_info.mtime = int(os.path.getmtime(file_path))
+                    tar.addfile(gz_info, std_io.BytesIO(compressed))
+    return tar_buffer.getvalue()
+
+
+class FrontendArtifactStore:
+    """
+    Versioned frontend bundle store
+
+    - Bundles on disk: {ARTIFACT_STORE_DIR}/{app}/{artifact_id}.tar.gz
+    - Metadata in MongoDB: frontend_artifacts
+    """
+
+    def __init__(self, db=None, store_dir: str = ARTIFACT_STORE_DIR):
+        self.db = db
+        self.store_dir = store_dir
+
+    def set_db(self, db):
+        """Database bağlantısını ayarla"""
+        self.db = db
+
+    def _bundle_path(self, app: str, artifact_id: str) -> str:
+        return os.path.join(self.store_dir, app, f"{artifact_id}.tar.gz")
+
+    async def _run_build(self, source_dir: str) -> subprocess.CompletedProcess:
+        """Run yarn build with an empty backend URL - config.js supplies it at runtime"""
+        env = os.environ.copy()
+        env["REACT_APP_BACKEND_URL"] = ""
+        env["CI"] = "false"
+        return await blocking_executor.run_subprocess(
+            ["yarn", "build"],
+            cwd=source_dir,
+            env=env,
+            timeout=FRONTEND_BUILD_TIMEOUT
+        )
+
+    def _write_bundle(self, path: str, data: bytes):
+        """Write bundle atomically so a half-written file is never served"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp-{uuid4().hex[:8]}"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    async def find_by_hash(self, app: str, source_hash: str) -> Optional[Dict[str, Any]]:
+        """Return the ready artifact for a source hash if its bundle is still on disk"""
+        artifact = await self.db.frontend_artifacts.find_one(
+            {'app': app, 'source_hash': source_hash, 'status': 'ready'},
+            {'_id': 0}
+        )
+        if artifact and await blocking_executor.run_io(os.path.exists, artifact.get('path', '')):
+            return artifact
+        return None
+
+    async def get_or_build(self, app: str, built_by: str = None, force: bool = False) -> Dict[str, Any]:
+        """
+        Return an artifact for the current source tree of `app`, building only
+        when no artifact exists for its source hash.
+        """
+        if self.db is None:
+            return {'success': False, 'error': 'Database bağlantısı yok'}
+
+        source_dir = ARTIFACT_SOURCES.get(app)
+        if not source_dir or not os.path.exists(source_dir):
+            return {'success': False, 'error': f'Frontend source not found for {app}'}
+
+        source_hash = await blocking_executor.run_io(compute_source_hash, source_dir)
+
+        if not force:
+            existing = await self.find_by_hash(app, source_hash)
+            if existing:
+                logger.info(f"[ARTIFACT] Reusing {app} artifact v{existing.get('version')} ({source_hash[:12]})")
+                return {'success': True, 'artifact': existing, 'reused': True}
+
+        logger.info(f"[ARTIFACT] Building {app} frontend ({source_hash[:12]})...")
+        started = datetime.now(timezone.utc)
+
+        try:
+            result = await self._run_build(source_dir)
+        except subprocess.TimeoutExpired:
+            return {'success': False, 'error': f'Build timed out ({FRONTEND_BUILD_TIMEOUT}s)'}
+
+        if result.returncode != 0:
+            logger.error(f"[ARTIFACT] Build failed for {app}: {result.stderr[-2000:]}")
+            return {'success': False, 'error': 'Build failed', 'details': result.stderr}
+
+        # gzip of the build output is CPU-heavy - keep it off the loop
+        bundle = await blocking_executor.run_cpu(pack_build_dir, os.path.join(source_dir, 'build'))
+
+        artifact_id = str(uuid4())
+        path = self._bundle_path(app, artifact_id)
+        await blocking_executor.run_io(self._write_bundle, path, bundle)
+
+        artifact = {
+            'id': artifact_id,
+            'app': app,
+            'source_hash': source_hash,
+            'path': path,
+            'size': len(bundle),
+            'compression': 'gzip',
+            'status': 'ready',
+            'build_seconds': round((datetime.now(timezone.utc) - started).total_seconds(), 1),
+            'built_by': built_by,
+            'created_at': datetime.now(timezone.utc).isoformat()
+        }
+        # (app, version) is unique: a concurrent build that took the same number makes us take the next one
+        for _ in range(VERSION_ALLOCATION_ATTEMPTS):
+            last = await self.db.frontend_artifacts.find_one(
+                {'app': app}, {'_id': 0, 'version': 1}, sort=[('version', -1)]
+            )
+            artifact['version'] = (last.get('version', 0) if last else 0) + 1
+            try:
+                await self.db.frontend_artifacts.insert_one(artifact)
+                break
+            except DuplicateKeyError:
+                artifact.pop('_id', None)
+        else:
+            await blocking_executor.run_io(os.remove, path)
+            return {'success': False, 'error': f'Could not allocate a {app} artifact version'}
+        artifact.pop('_id', None)
+
+        logger.info(f"[ARTIFACT] {app} v{artifact['version']} stored ({len(bundle)} bytes, {artifact['build_seconds']}s)")
+
+        await self.prune(app)
+        return {'success': True, 'artifact': artifact, 'reused': False}
+
+    async def get_artifact(self, artifact_id: str) -> Optional[Dict[str, Any]]:
+        """Get artifact metadata by ID"""
+        if self.db is None:
+            return None
+        return await self.db.frontend_artifacts.find_one({'id': artifact_id}, {'_id': 0})
+
+    async def list_artifacts(self, app: str = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """List artifacts, newest first"""
+        if self.db is None:
+            return []
+        query = {'app': app} if app else {}
+        return await self.db.frontend_artifacts.find(query, {'_id': 0}).sort(
+            'created_at', -1
+        ).limit(limit).to_list(limit)
+
+    def _read_bundle(self, path: str) -> bytes:
+        with open(path, 'rb') as f:
+            return f.read()
+
+    async def load_bundle(self, artifact: Dict[str, Any]) -> bytes:
+        """Read the compressed bundle for an artifact"""
+        return await blocking_executor.run_io(self._read_bundle, artifact['path'])
+
+    async def prune(self, app: str, keep: int = ARTIFACT_RETENTION) -> int:
+        """Remove old bundles beyond the retention count, keeping any referenced by a company"""
+        artifacts = await self.db.frontend_artifacts.find(
+            {'app': app, 'status': 'ready'}, {'_id': 0}
+        ).sort('version', -1).to_list(1000)
+
+        if len(artifacts) <= keep:
+            return 0
+
+        in_use = set(await self.db.companies.distinct('frontend_artifact_id'))
+        in_use.update(await self.db.companies.distinct('previous_frontend_artifact_id'))
+
+        removed = 0
+        for artifact in artifacts[keep:]:
+            if artifact['id'] in in_use:
+                continue
+            try:
+                if os.path.exists(artifact['path']):
+                    os.remove(artifact['path'])
+            except OSError as e:
+                logger.warning(f"[ARTIFACT] Could not remove {artifact['path']}: {e}")
+                continue
+            await self.db.frontend_artifacts.update_one(
+                {'id': artifact['id']},
+                {'$set': {'status': 'pruned', 'pruned_at': datetime.now(timezone.utc).isoformat()}}
+            )
+            removed += 1
+
+        if removed:
+            logger.info(f"[ARTIFACT] Pruned {removed} old {app} artifacts")
+        return removed
+
+
+# Singleton instance
+artifact_store = FrontendArtifactStore()
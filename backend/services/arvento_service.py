@@ -20,46 +20,55 @@ class ArventoService:
     - api_url: Arvento API URL (default: https://api.arvento.com)
     """
     
-    def __init__(self, api_key: str = None, company_code: str = None, api_url: str = None):
+    def __init__(self, api_key: str = None, company_code: str = None, api_url: str = None,
+                 client: Optional[httpx.AsyncClient] = None):
         self.api_key = api_key or os.environ.get('ARVENTO_API_KEY', '')
         self.company_code = company_code or os.environ.get('ARVENTO_COMPANY_CODE', '')
         self.api_url = api_url or os.environ.get('ARVENTO_API_URL', 'https://api.arvento.com/v1')
         self.is_configured = bool(self.api_key and self.company_code)
+        # Shared client from the GPS collector; otherwise one client per call
+        self.client = client
     
-    async def get_all_vehicles(self) -> Dict[str, Any]:
+    async def fetch_positions(self) -> Dict[str, Any]:
         """
-        Tüm araçların anlık konumlarını al
+        Anlık konumlar - hata durumunda mock veriye düşmez (collector için)
         """
         if not self.is_configured:
-            return self._mock_vehicles()
+            return {'success': False, 'error': 'Arvento API yapılandırılmamış'}
         
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'X-Company-Code': self.company_code,
+            'Content-Type': 'application/json'
+        }
         try:
-            async with httpx.AsyncClient(timeout=30) as client:
-                headers = {
-                    'Authorization': f'Bearer {self.api_key}',
-                    'X-Company-Code': self.company_code,
-                    'Content-Type': 'application/json'
-                }
-                
-                response = await client.get(
-                    f'{self.api_url}/vehicles/positions',
-                    headers=headers
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    return {
-                        'success': True,
-                        'vehicles': self._transform_arvento_data(data),
-                        'source': 'arvento_api'
-                    }
-                else:
-                    logger.error(f'Arvento API error: {response.status_code}')
-                    return self._mock_vehicles()
-                    
+            if self.client:
+                response = await self.client.get(f'{self.api_url}/vehicles/positions', headers=headers)
+            else:
+                async with httpx.AsyncClient(timeout=30) as client:
+                    response = await client.get(f'{self.api_url}/vehicles/positions', headers=headers)
         except Exception as e:
             logger.error(f'Arvento connection error: {str(e)}')
+            return {'success': False, 'error': str(e)}
+        
+        if response.status_code != 200:
+            logger.error(f'Arvento API error: {response.status_code}')
+            return {'success': False, 'error': f'HTTP {response.status_code}', 'status_code': response.status_code}
+        return {
+            'success': True,
+            'vehicles': self._transform_arvento_data(response.json()),
+            'source': 'arvento_api'
+        }
+    
+    async def get_all_vehicles(self) -> Dict[str, Any]:
+        """
+        Tüm araçların anlık konumlarını al
+        """
+        if not self.is_configured:
             return self._mock_vehicles()
+        
+        result = await self.fetch_positions()
+        return result if result.get('success') else self._mock_vehicles()
     
     async def get_vehicle_history(self, plate: str, start_date: str, end_date: str) -> Dict[str, Any]:
         """
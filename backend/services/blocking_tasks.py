@@ -0,0 +1,158 @@
+"""
+Blocking helpers run through the executor (services.executor).
+Kept module-level and import-light so spawned process-pool workers can
+unpickle them cheaply; archive helpers run in the I/O thread pool, long GPS
+routes are simplified in the process pool.
+"""
+
+import os
+import tarfile
+import io as std_io
+from typing import Dict, Iterable, Tuple, Optional
+
+import numpy as np
+from passlib.context import CryptContext
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def hash_password(password: str) -> str:
+    """bcrypt hash of a password"""
+    return pwd_context.hash(password)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Check a password against its bcrypt hash"""
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def build_tar_archive(files: Iterable[Tuple[str, str]] = (), trees: Iterable[Tuple[str, str]] = (),
+                      inline: Dict[str, str] = None, skip_prefixes: Tuple[str, ...] = ()) -> bytes:
+    """
+    Build an uncompressed tar archive in memory.
+
+    files:  (path, arcname) pairs
+    trees:  (directory, base_dir) pairs - every file under directory is added
+            with its path relative to base_dir
+    inline: {arcname: text content} for generated files (.env, main.py, ...)
+    skip_prefixes: arcname prefixes to leave out of trees (e.g. 'downloads/')
+    """
+    tar_buffer = std_io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode='w') as tar:
+        for path, arcname in files:
+            tar.add(path, arcname=arcname)
+
+        for directory, base_dir in trees:
+            for root, dirs, dir_files in os.walk(directory):
+                for file in dir_files:
+                    file_path = os.path.join(root, file)
+                    arcname = os.path.relpath(file_path, base_dir)
+                    if skip_prefixes and arcname.startswith(skip_prefixes):
+                        continue
+                    tar.add(file_path, arcname=arcname)
+
+        for arcname, content in (inline or {}).items():
+            data = content.encode('utf-8')
+            info = tarfile.TarInfo(name=arcname)
+            info.size = len(data)
+            tar.addfile(info, std_io.BytesIO(data))
+
+    return tar_buffer.getvalue()
+
+
+def filter_tar_archive(tar_data: bytes, exclude_names: Iterable[str]) -> Tuple[bytes, list]:
+    """Copy a tar archive leaving out members whose basename is in exclude_names"""
+    exclude_names = set(exclude_names)
+    excluded = []
+    filtered_tar = std_io.BytesIO()
+    with tarfile.open(fileobj=std_io.BytesIO(tar_data), mode='r') as src_tar:
+        with tarfile.open(fileobj=filtered_tar, mode='w') as dst_tar:
+            for member in src_tar.getmembers():
+                if os.path.basename(member.name) in exclude_names:
+                    excluded.append(member.name)
+                    continue
+                if member.isfile():
+                    dst_tar.addfile(member, src_tar.extractfile(member))
+                else:
+                    dst_tar.addfile(member)
+    return filtered_tar.getvalue(), excluded
+
+
+def _douglas_peucker(xy: np.ndarray, tolerance: float) -> np.ndarray:
+    """Keep-mask of the Douglas-Peucker simplification of a polyline (iterative)"""
+    keep = np.zeros(len(xy), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(xy) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = xy[start], xy[end]
+        segment = xy[start + 1:end] - a
+        direction = b - a
+        length = np.hypot(direction[0], direction[1])
+        if length == 0:
+            dist = np.hypot(segment[:, 0], segment[:, 1])
+        else:
+            dist = np.abs(direction[0] * segment[:, 1] - direction[1] * segment[:, 0]) / length
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            split = start + 1 + i
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+
+def simplify_route(lat: np.ndarray, lng: np.ndarray, method: str, tolerance: float,
+                   max_points: Optional[int] = None) -> np.ndarray:
+    """
+    Indices of the route points to keep.
+    method: 'douglas_peucker' (shape-preserving) or 'grid' (one point per
+    tolerance-sized cell run); tolerance is in degrees of latitude.
+    The result is thinned evenly to max_points when still larger.
+    """
+    n = len(lat)
+    if n <= 2:
+        return np.arange(n)
+    # Equirectangular projection so tolerance means the same distance on both axes
+    xy = np.column_stack((lng * np.cos(np.radians(float(np.mean(lat)))), lat))
+    if tolerance <= 0:
+        keep = np.ones(n, dtype=bool)
+    elif method == 'douglas_peucker':
+        keep = _douglas_peucker(xy, tolerance)
+    else:
+        cells = np.floor(xy / tolerance).astype(np.int64)
+        keep = np.ones(n, dtype=bool)
+        keep[1:] = np.any(cells[1:] != cells[:-1], axis=1)
+        keep[-1] = True
+    indices = np.flatnonzero(keep)
+    if max_points and len(indices) > max_points:
+        indices = indices[np.linspace(0, len(indices) - 1, max_points).round().astype(np.int64)]
+    return indices
+
+
+def match_intervals(p_vehicle: np.ndarray, p_time: np.ndarray, i_vehicle: np.ndarray,
+                    i_start: np.ndarray, i_end: np.ndarray) -> np.ndarray:
+    """
+    Sort-merge join of events against per-vehicle [start, end] intervals.
+    Vehicles are integer codes, times epoch seconds (end may be inf).
+    Returns for every event the index of the interval that contains it, or -1.
+    """
+    result = np.full(len(p_time), -1, dtype=np.int64)
+    if not len(p_time) or not len(i_start):
+        return result
+    base = min(float(p_time.min()), float(i_start.min()))
+
+    def keys(vehicle, t):
+        # vehicle in the high bits, whole seconds since base in the low 34 bits (~540 years)
+        return (vehicle.astype(np.int64) << 34) | np.floor(t - base).astype(np.int64)
+
+    order = np.lexsort((i_start, i_vehicle))
+    interval_keys = keys(i_vehicle[order], i_start[order])
+    pos = np.searchsorted(interval_keys, keys(p_vehicle, p_time), side='right') - 1
+    candidate = order[np.clip(pos, 0, None)]
+    valid = ((pos >= 0) & (i_vehicle[candidate] == p_vehicle)
+             & (i_start[candidate] <= p_time) & (p_time <= i_end[candidate]))
+    result[valid] = candidate[valid]
+    return result
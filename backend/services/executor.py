@@ -0,0 +1,253 @@
+"""
+Blocking Work Executor
+Runs blocking subprocess, archive, hashing and bcrypt work off the event loop.
+
+- run_io:         thread pool for file / archive / network-client work
+- run_cpu:        process pool for CPU-bound work (functions must be module-level)
+- run_subprocess: asyncio subprocess with timeout and kill-on-cancel
+- LoopLagMonitor: logs the stack of any callback blocking the loop too long
+"""
+
+import os
+import sys
+import asyncio
+import logging
+import subprocess
+import threading
+import time
+import traceback
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Optional, Dict, Any, List, Callable
+
+logger = logging.getLogger(__name__)
+
+IO_WORKERS = int(os.environ.get('EXECUTOR_IO_WORKERS', '8'))
+CPU_WORKERS = int(os.environ.get('EXECUTOR_CPU_WORKERS', str(min(4, os.cpu_count() or 2))))
+SUBPROCESS_CONCURRENCY = int(os.environ.get('EXECUTOR_SUBPROCESS_CONCURRENCY', '2'))
+DEFAULT_IO_TIMEOUT = float(os.environ.get('EXECUTOR_IO_TIMEOUT', '120'))
+DEFAULT_CPU_TIMEOUT = float(os.environ.get('EXECUTOR_CPU_TIMEOUT', '60'))
+
+LOOP_LAG_INTERVAL = float(os.environ.get('LOOP_LAG_INTERVAL', '0.1'))
+LOOP_LAG_THRESHOLD = float(os.environ.get('LOOP_LAG_THRESHOLD', '0.25'))
+
+
+class BlockingExecutor:
+    """
+    Managed pools for blocking work with per-kind concurrency limits and timeouts.
+
+    A timed-out or cancelled call is cancelled if it has not started yet; a
+    call already running in a worker finishes in the background but its
+    result is discarded. Subprocesses are killed on timeout or cancellation.
+    """
+
+    def __init__(self, io_workers: int = IO_WORKERS, cpu_workers: int = CPU_WORKERS,
+                 subprocess_concurrency: int = SUBPROCESS_CONCURRENCY):
+        self.io_workers = io_workers
+        self.cpu_workers = cpu_workers
+        self.subprocess_concurrency = subprocess_concurrency
+        self._io_pool: Optional[ThreadPoolExecutor] = None
+        self._cpu_pool: Optional[ProcessPoolExecutor] = None
+        self._io_slots: Optional[asyncio.Semaphore] = None
+        self._cpu_slots: Optional[asyncio.Semaphore] = None
+        self._subprocess_slots: Optional[asyncio.Semaphore] = None
+        self._stats = {
+            'io': {'calls': 0, 'in_flight': 0, 'timeouts': 0, 'errors': 0},
+            'cpu': {'calls': 0, 'in_flight': 0, 'timeouts': 0, 'errors': 0},
+            'subprocess': {'calls': 0, 'in_flight': 0, 'timeouts': 0, 'errors': 0},
+        }
+
+    def _ensure_started(self):
+        # Semaphores are created lazily so they bind to the running loop
+        if self._io_pool is None:
+            self._io_pool = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix='blocking-io')
+            self._io_slots = asyncio.Semaphore(self.io_workers)
+        if self._cpu_pool is None:
+            # spawn: forking a process that already runs the loop and driver threads is unsafe
+            self._cpu_pool = ProcessPoolExecutor(
+                max_workers=self.cpu_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            self._cpu_slots = asyncio.Semaphore(self.cpu_workers)
+        if self._subprocess_slots is None:
+            self._subprocess_slots = asyncio.Semaphore(self.subprocess_concurrency)
+
+    async def _run(self, kind: str, pool, slots: asyncio.Semaphore, timeout: Optional[float],
+                   func: Callable, *args) -> Any:
+        stats = self._stats[kind]
+        async with slots:
+            stats['calls'] += 1
+            stats['in_flight'] += 1
+            future = asyncio.get_running_loop().run_in_executor(pool, func, *args)
+            try:
+                return await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                stats['timeouts'] += 1
+                logger.warning(f"[EXECUTOR] {kind} call {getattr(func, '__name__', func)} timed out after {timeout}s")
+                raise
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                stats['errors'] += 1
+                raise
+            finally:
+                stats['in_flight'] -= 1
+
+    async def run_io(self, func: Callable, *args, timeout: Optional[float] = DEFAULT_IO_TIMEOUT) -> Any:
+        """Run a blocking I/O-bound callable in the thread pool"""
+        self._ensure_started()
+        return await self._run('io', self._io_pool, self._io_slots, timeout, func, *args)
+
+    async def run_cpu(self, func: Callable, *args, timeout: Optional[float] = DEFAULT_CPU_TIMEOUT) -> Any:
+        """Run a CPU-bound, module-level (picklable) callable in the process pool"""
+        self._ensure_started()
+        return await self._run('cpu', self._cpu_pool, self._cpu_slots, timeout, func, *args)
+
+    async def run_subprocess(self, cmd: List[str], cwd: str = None, env: Dict[str, str] = None,
+                             timeout: Optional[float] = None, shell: bool = False) -> subprocess.CompletedProcess:
+        """
+        Run a command without blocking the loop.
+        Returns a CompletedProcess with text output; raises subprocess.TimeoutExpired
+        on timeout so callers written against subprocess.run keep working.
+        """
+        self._ensure_started()
+        stats = self._stats['subprocess']
+
+        async with self._subprocess_slots:
+            stats['calls'] += 1
+            stats['in_flight'] += 1
+            try:
+                if shell:
+                    proc = await asyncio.create_subprocess_shell(
+                        cmd if isinstance(cmd, str) else ' '.join(cmd),
+                        cwd=cwd, env=env,
+                        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+                    )
+                else:
+                    proc = await asyncio.create_subprocess_exec(
+                        *cmd, cwd=cwd, env=env,
+                        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+                    )
+
+                try:
+                    stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+                except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                    proc.kill()
+                    await proc.wait()
+                    if isinstance(e, asyncio.TimeoutError):
+                        stats['timeouts'] += 1
+                        logger.warning(f"[EXECUTOR] Subprocess {cmd} killed after {timeout}s")
+                        raise subprocess.TimeoutExpired(cmd, timeout)
+                    raise
+
+                return subprocess.CompletedProcess(
+                    args=cmd,
+                    returncode=proc.returncode,
+                    stdout=stdout.decode('utf-8', errors='replace'),
+                    stderr=stderr.decode('utf-8', errors='replace')
+                )
+            except (subprocess.TimeoutExpired, asyncio.CancelledError):
+                raise
+            except Exception:
+                stats['errors'] += 1
+                raise
+            finally:
+                stats['in_flight'] -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Pool sizes and per-kind call counters"""
+        return {
+            'io_workers': self.io_workers,
+            'cpu_workers': self.cpu_workers,
+            'subprocess_concurrency': self.subprocess_concurrency,
+            **{kind: dict(values) for kind, values in self._stats.items()}
+        }
+
+    def shutdown(self):
+        """Shut down the pools without waiting for running work"""
+        if self._io_pool:
+            self._io_pool.shutdown(wait=False, cancel_futures=True)
+            self._io_pool = None
+        if self._cpu_pool:
+            self._cpu_pool.shutdown(wait=False, cancel_futures=True)
+            self._cpu_pool = None
+
+
+class LoopLagMonitor:
+    """
+    Event loop lag monitor.
+
+    A heartbeat coroutine stamps the time every `interval` seconds. A watchdog
+    thread checks the stamp; when the loop has not run the heartbeat for longer
+    than `threshold`, it logs the loop thread's current stack - i.e. the
+    callback that is blocking - once per stall.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_LAG_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.stalls = 0
+        self.max_lag = 0.0
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = now - expected
+            if lag > self.max_lag:
+                self.max_lag = lag
+            self._last_beat = now
+
+    def _watch(self):
+        reported = False
+        while not self._stop.wait(self.interval):
+            stalled_for = time.monotonic() - self._last_beat - self.interval
+            if stalled_for > self.threshold:
+                if not reported:
+                    reported = True
+                    self.stalls += 1
+                    frame = sys._current_frames().get(self._loop_thread_id)
+                    stack = ''.join(traceback.format_stack(frame)) if frame else '<unavailable>'
+                    logger.warning(
+                        f"[LOOP-LAG] Event loop blocked for {stalled_for * 1000:.0f}ms "
+                        f"(threshold {self.threshold * 1000:.0f}ms). Blocking stack:\n{stack}"
+                    )
+            elif reported:
+                reported = False
+
+    def start(self):
+        """Start monitoring the running loop"""
+        if self._task:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name='loop-lag-watchdog', daemon=True)
+        self._watchdog.start()
+        logger.info(f"[LOOP-LAG] Monitor started (threshold {self.threshold * 1000:.0f}ms)")
+
+    def stop(self):
+        """Stop monitoring"""
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'threshold_ms': round(self.threshold * 1000),
+            'stalls': self.stalls,
+            'max_lag_ms': round(self.max_lag * 1000, 1)
+        }
+
+
+# Singleton instances
+blocking_executor = BlockingExecutor()
+loop_lag_monitor = LoopLagMonitor()
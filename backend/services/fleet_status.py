@@ -0,0 +1,321 @@
+"""
+Fleet Status Collector
+Keeps an in-memory snapshot of Portainer stacks, containers and Traefik state
+so superadmin pages read status without calling Portainer.
+
+- full refresh every FLEET_STATUS_INTERVAL seconds (safety net)
+- Docker events stream (through Portainer) patches container state as it
+  changes and schedules a debounced container refresh
+- per-tenant health indexed by company code
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Optional, Dict, Any, List
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from services.portainer_service import portainer_service, SERVER_IP
+
+logger = logging.getLogger(__name__)
+
+FLEET_STATUS_INTERVAL = float(os.environ.get('FLEET_STATUS_INTERVAL', '60'))
+FLEET_EVENT_DEBOUNCE = float(os.environ.get('FLEET_EVENT_DEBOUNCE', '2'))
+FLEET_EVENTS_ENABLED = os.environ.get('FLEET_EVENTS_ENABLED', 'true').lower() == 'true'
+
+# Containers every tenant stack must run; the mobile app builders are optional and
+# tenants on the shared Mongo (mongo_mode 'shared') have no mongodb container
+TENANT_REQUIRED_ROLES = ('frontend', 'backend', 'mongodb')
+TENANT_OPTIONAL_ROLES = ('customer_app', 'operation_app')
+
+# Docker event action -> resulting container state
+EVENT_STATES = {
+    'start': 'running',
+    'unpause': 'running',
+    'restart': 'running',
+    'pause': 'paused',
+    'die': 'exited',
+    'stop': 'exited',
+    'kill': 'exited',
+    'oom': 'exited',
+    'create': 'created',
+}
+
+
+def _shape_container(c: Dict[str, Any]) -> Dict[str, Any]:
+    """Same shape PortainerService.get_containers returns"""
+    return {
+        'id': c.get('Id', '')[:12],
+        'names': c.get('Names', []),
+        'state': c.get('State'),
+        'status': c.get('Status'),
+        'image': c.get('Image')
+    }
+
+
+def _container_health(status: str) -> Optional[str]:
+    status = status or ''
+    if '(healthy)' in status:
+        return 'healthy'
+    if '(unhealthy)' in status:
+        return 'unhealthy'
+    if '(health: starting)' in status:
+        return 'starting'
+    return None
+
+
+class FleetStatusCollector:
+    """Background collector for Portainer / Traefik / tenant container state"""
+
+    def __init__(self, portainer, db=None):
+        self.portainer = portainer
+        self.db = db
+        self._snapshot: Dict[str, Any] = {
+            'stacks': [],
+            'containers': [],
+            'traefik': {'installed': False, 'status': 'unknown'},
+            'tenants': {},
+            'portainer_connected': None,
+            'last_error': None,
+            'collected_at': None,
+        }
+        self._raw_containers: Dict[str, Dict[str, Any]] = {}
+        self._shared_mongo: set = set()
+        self._collected_monotonic: Optional[float] = None
+        self._refresh_lock = asyncio.Lock()
+        self._tasks: List[asyncio.Task] = []
+        self._debounce_task: Optional[asyncio.Task] = None
+        self._events_connected = False
+        self.stats = {'full_refreshes': 0, 'container_refreshes': 0, 'events': 0, 'event_stream_reconnects': 0}
+
+    def set_db(self, db):
+        """Database bağlantısını ayarla"""
+        self.db = db
+
+    # ---------- collection ----------
+
+    async def _fetch_raw_containers(self) -> Optional[List[Dict[str, Any]]]:
+        endpoint = f"endpoints/{self.portainer.endpoint_id}/docker/containers/json?all=true"
+        result = await self.portainer._request('GET', endpoint)
+        return result if isinstance(result, list) else None
+
+    async def _company_codes(self) -> Dict[str, str]:
+        """safe container prefix -> company code"""
+        if self.db is None:
+            return {}
+        companies = await self.db.companies.find(
+            {'portainer_stack_id': {'$ne': None}}, {'_id': 0, 'code': 1, 'mongo_mode': 1}
+        ).to_list(5000)
+        self._shared_mongo = {c['code'] for c in companies if c.get('code') and c.get('mongo_mode') == 'shared'}
+        return {
+            c['code'].replace('-', '').replace('_', ''): c['code']
+            for c in companies if c.get('code')
+        }
+
+    def _build_tenants(self, codes: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+        stacks_by_name = {s.get('Name'): s for s in self._snapshot['stacks'] if isinstance(s, dict)}
+        tenants: Dict[str, Dict[str, Any]] = {}
+
+        for safe_code, code in codes.items():
+            stack = stacks_by_name.get(f"rentacar_{code}")
+            tenants[code] = {
+                'code': code,
+                'stack_id': stack.get('Id') if stack else None,
+                'stack_status': stack.get('Status') if stack else None,
+                'containers': {},
+            }
+
+        for container in self._raw_containers.values():
+            for name in container.get('Names', []):
+                name = name.lstrip('/')
+                prefix, _, role = name.partition('_')
+                code = codes.get(prefix)
+                if code and role in TENANT_REQUIRED_ROLES + TENANT_OPTIONAL_ROLES:
+                    tenants[code]['containers'][role] = {
+                        'state': container.get('State'),
+                        'status': container.get('Status'),
+                        'health': _container_health(container.get('Status'))
+                    }
+
+        for tenant in tenants.values():
+            required = TENANT_REQUIRED_ROLES
+            if tenant['code'] in self._shared_mongo:
+                required = tuple(role for role in required if role != 'mongodb')
+            tenant['health'] = self._tenant_health(tenant['containers'], required)
+        return tenants
+
+    @staticmethod
+    def _tenant_health(containers: Dict[str, Dict[str, Any]], required_roles=TENANT_REQUIRED_ROLES) -> str:
+        if not containers:
+            return 'not_deployed'
+        required = [containers.get(role) for role in required_roles]
+        running = [c for c in required if c and c.get('state') == 'running']
+        if not running:
+            return 'down'
+        if len(running) < len(required) or any(c.get('health') == 'unhealthy' for c in running):
+            return 'degraded'
+        return 'healthy'
+
+    def _build_traefik(self) -> Dict[str, Any]:
+        stack = next(
+            (s for s in self._snapshot['stacks'] if isinstance(s, dict) and s.get('Name') == 'traefik'), None
+        )
+        container = next(
+            (c for c in self._raw_containers.values() if '/traefik' in c.get('Names', [])), None
+        )
+        if not stack:
+            return {'installed': False, 'status': 'not_installed'}
+        return {
+            'installed': True,
+            'stack_id': stack.get('Id'),
+            'status': 'active',
+            'container_state': container.get('State') if container else None,
+            'dashboard_url': f"http://{SERVER_IP}:8080"
+        }
+
+    def _publish(self, codes: Optional[Dict[str, str]] = None):
+        """Rebuild derived views so readers get ready-made responses"""
+        self._snapshot['containers'] = [_shape_container(c) for c in self._raw_containers.values()]
+        self._snapshot['traefik'] = self._build_traefik()
+        if codes is None:
+            codes = {t['code'].replace('-', '').replace('_', ''): t['code'] for t in self._snapshot['tenants'].values()}
+        self._snapshot['tenants'] = self._build_tenants(codes)
+        self._snapshot['collected_at'] = datetime.now(timezone.utc).isoformat()
+        self._collected_monotonic = time.monotonic()
+
+    async def refresh(self) -> Dict[str, Any]:
+        """Full refresh: stacks, containers, Traefik and tenant health"""
+        async with self._refresh_lock:
+            stacks_result, containers, codes = await asyncio.gather(
+                self.portainer._request('GET', 'stacks'),
+                self._fetch_raw_containers(),
+                self._company_codes()
+            )
+            if not isinstance(stacks_result, list) or containers is None:
+                error = stacks_result.get('error') if isinstance(stacks_result, dict) else 'container list failed'
+                self._snapshot['portainer_connected'] = False
+                self._snapshot['last_error'] = error
+                logger.warning(f"[FLEET-STATUS] Refresh failed, keeping previous snapshot: {error}")
+                return self.get_snapshot()
+
+            self._snapshot['stacks'] = stacks_result
+            self._raw_containers = {c.get('Id'): c for c in containers}
+            self._snapshot['portainer_connected'] = True
+            self._snapshot['last_error'] = None
+            self._publish(codes)
+            self.stats['full_refreshes'] += 1
+            return self.get_snapshot()
+
+    async def refresh_containers(self):
+        """Container-only refresh used after Docker events"""
+        async with self._refresh_lock:
+            containers = await self._fetch_raw_containers()
+            if containers is None:
+                return
+            self._raw_containers = {c.get('Id'): c for c in containers}
+            self._publish()
+            self.stats['container_refreshes'] += 1
+
+    # ---------- background loops ----------
+
+    async def _poll_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"[FLEET-STATUS] Refresh error: {str(e)}")
+            await asyncio.sleep(FLEET_STATUS_INTERVAL)
+
+    def _apply_event(self, event: Dict[str, Any]):
+        """Patch the snapshot from one container event, then schedule a debounced refresh"""
+        if event.get('Type') != 'container':
+            return
+        self.stats['events'] += 1
+        action = (event.get('Action') or event.get('status') or '').split(':')[0]
+        container_id = event.get('id') or event.get('Actor', {}).get('ID')
+
+        container = self._raw_containers.get(container_id)
+        if container is not None:
+            if action == 'destroy':
+                self._raw_containers.pop(container_id, None)
+            elif action in EVENT_STATES:
+                container['State'] = EVENT_STATES[action]
+            elif action == 'health_status':
+                health = (event.get('Action') or '').split(':')[-1].strip()
+                container['Status'] = f"{container.get('Status', '').split(' (')[0]} ({health})"
+            self._publish()
+
+        if self._debounce_task is None or self._debounce_task.done():
+            self._debounce_task = asyncio.get_running_loop().create_task(self._debounced_refresh())
+
+    async def _debounced_refresh(self):
+        await asyncio.sleep(FLEET_EVENT_DEBOUNCE)
+        try:
+            await self.refresh_containers()
+        except Exception as e:
+            logger.warning(f"[FLEET-STATUS] Event refresh error: {str(e)}")
+
+    async def _events_loop(self):
+        filters = quote(json.dumps({'type': ['container']}))
+        path = f"endpoints/{self.portainer.endpoint_id}/docker/events?filters={filters}"
+        backoff = 5
+        while True:
+            try:
+                async for line in self.portainer.client.stream_lines(path):
+                    if not self._events_connected:
+                        self._events_connected = True
+                        backoff = 5
+                        logger.info("[FLEET-STATUS] Docker events stream connected")
+                    if line.strip():
+                        self._apply_event(json.loads(line))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"[FLEET-STATUS] Events stream dropped: {str(e)} - reconnecting in {backoff}s")
+            self._events_connected = False
+            self.stats['event_stream_reconnects'] += 1
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+    def start(self):
+        """Start the polling loop and Docker events listener"""
+        if self._tasks:
+            return
+        loop = asyncio.get_running_loop()
+        self._tasks.append(loop.create_task(self._poll_loop()))
+        if FLEET_EVENTS_ENABLED:
+            self._tasks.append(loop.create_task(self._events_loop()))
+        logger.info(f"[FLEET-STATUS] Collector started (interval {FLEET_STATUS_INTERVAL}s, events {FLEET_EVENTS_ENABLED})")
+
+    async def stop(self):
+        for task in self._tasks + ([self._debounce_task] if self._debounce_task else []):
+            task.cancel()
+        self._tasks = []
+
+    # ---------- readers ----------
+
+    def get_snapshot(self) -> Dict[str, Any]:
+        """Current snapshot plus its age"""
+        age = round(time.monotonic() - self._collected_monotonic, 1) if self._collected_monotonic else None
+        return {
+            **self._snapshot,
+            'age_seconds': age,
+            'events_connected': self._events_connected,
+        }
+
+    async def get(self, fresh: bool = False) -> Dict[str, Any]:
+        """Snapshot, refreshed first when `fresh` is set or nothing was collected yet"""
+        if fresh or self._collected_monotonic is None:
+            return await self.refresh()
+        return self.get_snapshot()
+
+    async def get_tenant(self, company_code: str, fresh: bool = False) -> Optional[Dict[str, Any]]:
+        snapshot = await self.get(fresh)
+        return snapshot['tenants'].get(company_code)
+
+
+# Singleton instance
+fleet_status = FleetStatusCollector(portainer_service)
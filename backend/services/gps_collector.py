@@ -0,0 +1,232 @@
+"""
+GPS Position Collector
+Polls Arvento once per interval for every company with an active arvento
+integration_settings entry and keeps the latest position per vehicle in
+memory. /api/gps/vehicles reads this store, so upstream calls no longer
+grow with the number of open map tabs.
+
+- companies are re-read from integration_settings every GPS_SETTINGS_REFRESH
+  seconds; settings changes call reload() to pick them up immediately
+- per-company interval: poll_interval_seconds on the settings entry,
+  default GPS_POLL_INTERVAL
+- at most GPS_POLL_CONCURRENCY Arvento calls run at once over one shared
+  HTTP client
+- a failed poll keeps the last known positions and records the error
+- a company asked for before its first poll is collected once on demand;
+  concurrent viewers wait for the same call
+- listeners (add_listener) get (company_id, positions) after every
+  successful poll, e.g. the history store
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+from typing import Optional, Dict, Any, List, Callable, Awaitable
+from datetime import datetime, timezone
+
+import httpx
+
+from services.arvento_service import ArventoService
+
+logger = logging.getLogger(__name__)
+
+GPS_POLL_INTERVAL = float(os.environ.get('GPS_POLL_INTERVAL', '15'))
+GPS_POLL_CONCURRENCY = int(os.environ.get('GPS_POLL_CONCURRENCY', '8'))
+GPS_LOOP_TICK = float(os.environ.get('GPS_LOOP_TICK', '1'))
+GPS_SETTINGS_REFRESH = float(os.environ.get('GPS_SETTINGS_REFRESH', '60'))
+
+MOCK_ADDRESSES = ["Taksim", "Kadikoy", "Besiktas", "Uskudar"]
+
+
+def mock_position(vehicle: Dict[str, Any]) -> Dict[str, Any]:
+    """Stable demo position per vehicle (no Arvento configured)"""
+    rng = random.Random(vehicle['id'])
+    return {
+        "vehicle_id": vehicle["id"],
+        "plate": vehicle["plate"],
+        "lat": 41.0082 + rng.uniform(-0.1, 0.1),
+        "lng": 28.9784 + rng.uniform(-0.1, 0.1),
+        "speed": rng.randint(0, 120),
+        "heading": rng.randint(0, 360),
+        "ignition": rng.choice([True, False]),
+        "last_update": datetime.now(timezone.utc).isoformat(),
+        "address": rng.choice(MOCK_ADDRESSES) + ", Istanbul",
+        "source": "mock"
+    }
+
+
+class GPSCollector:
+    """Background Arvento poller with an in-memory position store"""
+
+    def __init__(self, db=None):
+        self.db = db
+        # company_id -> vehicle_id -> latest position
+        self._positions: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._status: Dict[str, Dict[str, Any]] = {}
+        self._settings: Dict[str, Dict[str, Any]] = {}
+        self._next_poll: Dict[str, float] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._slots = asyncio.Semaphore(GPS_POLL_CONCURRENCY)
+        self._task: Optional[asyncio.Task] = None
+        self._settings_loaded_at = 0.0
+        self._listeners: List[Callable[[str, List[Dict[str, Any]]], Awaitable[Any]]] = []
+        self.stats = {'polls': 0, 'poll_failures': 0, 'on_demand': 0, 'reads': 0}
+
+    def set_db(self, db):
+        """Database bağlantısını ayarla"""
+        self.db = db
+
+    def add_listener(self, callback: Callable[[str, List[Dict[str, Any]]], Awaitable[Any]]):
+        """Call callback(company_id, positions) after each successful poll"""
+        self._listeners.append(callback)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=30, limits=httpx.Limits(max_connections=GPS_POLL_CONCURRENCY * 2))
+        return self._client
+
+    # ---------- settings ----------
+
+    async def reload(self):
+        """Re-read active Arvento integrations"""
+        settings = await self.db.integration_settings.find(
+            {'type': 'arvento', 'is_active': True}, {'_id': 0}
+        ).to_list(5000)
+        self._settings = {s['company_id']: s for s in settings if s.get('company_id') and s.get('api_key')}
+        self._settings_loaded_at = time.monotonic()
+        for company_id in list(self._positions):
+            if company_id not in self._settings:
+                self._positions.pop(company_id, None)
+                self._status.pop(company_id, None)
+                self._next_poll.pop(company_id, None)
+
+    def is_collected(self, company_id: str) -> bool:
+        return company_id in self._settings
+
+    # ---------- polling ----------
+
+    async def collect_company(self, company_id: str) -> Dict[str, Any]:
+        """Poll one company now; concurrent callers share the call"""
+        task = self._inflight.get(company_id)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._poll(company_id))
+            self._inflight[company_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(company_id, None))
+        return await asyncio.shield(task)
+
+    async def _poll(self, company_id: str) -> Dict[str, Any]:
+        settings = self._settings.get(company_id)
+        if not settings:
+            return {'success': False, 'error': 'GPS entegrasyonu aktif değil'}
+        interval = float(settings.get('poll_interval_seconds') or GPS_POLL_INTERVAL)
+        self._next_poll[company_id] = time.monotonic() + interval
+
+        arvento = ArventoService(
+            api_key=settings.get('api_key'),
+            company_code=settings.get('company_code'),
+            api_url=settings.get('api_url'),
+            client=self.client
+        )
+        started = time.monotonic()
+        async with self._slots:
+            result = await arvento.fetch_positions()
+        self.stats['polls'] += 1
+
+        now = datetime.now(timezone.utc).isoformat()
+        status = self._status.setdefault(company_id, {})
+        status.update({'last_poll_at': now, 'duration_ms': round((time.monotonic() - started) * 1000)})
+        if not result.get('success'):
+            self.stats['poll_failures'] += 1
+            status.update({'error': result.get('error'), 'consecutive_failures': status.get('consecutive_failures', 0) + 1})
+            return result
+
+        store = self._positions.setdefault(company_id, {})
+        polled = []
+        for position in result['vehicles']:
+            key = position.get('vehicle_id') or position.get('plate')
+            if key:
+                store[key] = {**position, 'source': 'arvento_api'}
+                polled.append(store[key])
+        status.update({'error': None, 'consecutive_failures': 0, 'collected_at': now, 'vehicles': len(store)})
+
+        for listener in self._listeners:
+            try:
+                await listener(company_id, polled)
+            except Exception as e:
+                logger.error(f"[GPS-COLLECTOR] Listener failed for {company_id}: {str(e)}")
+        return result
+
+    async def _loop(self):
+        while True:
+            try:
+                now = time.monotonic()
+                if now - self._settings_loaded_at > GPS_SETTINGS_REFRESH:
+                    await self.reload()
+                due = [c for c in self._settings if self._next_poll.get(c, 0) <= now and c not in self._inflight]
+                for company_id in due:
+                    self.collect_company_background(company_id)
+            except Exception as e:
+                logger.error(f"[GPS-COLLECTOR] Loop error: {str(e)}")
+            await asyncio.sleep(GPS_LOOP_TICK)
+
+    def collect_company_background(self, company_id: str):
+        task = asyncio.get_running_loop().create_task(self.collect_company(company_id))
+        # Errors are already recorded in the company status; just mark them retrieved
+        task.add_done_callback(lambda t: t.exception() if not t.cancelled() else None)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+            logger.info(f"[GPS-COLLECTOR] Started (default interval {GPS_POLL_INTERVAL}s)")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for task in list(self._inflight.values()):
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # ---------- readers ----------
+
+    async def get_positions(self, company_id: str) -> List[Dict[str, Any]]:
+        """Latest positions for a company with an active integration"""
+        self.stats['reads'] += 1
+        if company_id not in self._positions and company_id in self._settings:
+            # Only when a poll is due or already running - a failing first poll backs off like any other
+            if company_id in self._inflight or time.monotonic() >= self._next_poll.get(company_id, 0):
+                self.stats['on_demand'] += 1
+                await self.collect_company(company_id)
+        return list(self._positions.get(company_id, {}).values())
+
+    def get_all_positions(self) -> List[Dict[str, Any]]:
+        self.stats['reads'] += 1
+        return [
+            {**position, 'company_id': company_id}
+            for company_id, vehicles in self._positions.items()
+            for position in vehicles.values()
+        ]
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            'running': self._task is not None,
+            'default_interval_seconds': GPS_POLL_INTERVAL,
+            'companies': {
+                company_id: {
+                    **self._status.get(company_id, {}),
+                    'interval_seconds': float(s.get('poll_interval_seconds') or GPS_POLL_INTERVAL),
+                }
+                for company_id, s in self._settings.items()
+            },
+            **self.stats,
+        }
+
+
+# Singleton instance
+gps_collector = GPSCollector()
@@ -0,0 +1,249 @@
+"""
+GPS Geospatial Index and Geofences
+Keeps the latest collected position of each vehicle on its vehicles
+document as a GeoJSON point (2dsphere index) and evaluates company
+geofences against every poll.
+
+- collector positions are matched to vehicles by normalized plate; the
+  plate/status map per company is refreshed every GPS_GEO_VEHICLE_REFRESH
+  seconds
+- vehicles.location {type: Point, coordinates: [lng, lat]} and
+  location_updated_at are written in one bulk_write per poll, only for
+  vehicles whose position changed
+- nearby(): $geoNear over vehicles, optionally filtered by status
+- geofences are GeoJSON polygons with a mode: keep_inside (violation when
+  an eligible vehicle is outside) or keep_outside (violation when inside);
+  eligible vehicles are those whose status is in vehicle_statuses
+  (default: rented)
+- each poll is tested against all company fences at once with NumPy
+  (points x polygon edges); a violation is opened when a vehicle crosses
+  into violation and resolved when it is back or no longer eligible
+
+MongoDB collections: vehicles (location), geofences, geofence_violations
+"""
+
+import os
+import time
+import uuid
+import logging
+from typing import Optional, Dict, Any, List, Set, Tuple
+from datetime import datetime, timezone
+
+import numpy as np
+from pymongo import UpdateOne
+
+from services.gps_history import vehicle_key
+
+logger = logging.getLogger(__name__)
+
+GPS_GEO_VEHICLE_REFRESH = float(os.environ.get('GPS_GEO_VEHICLE_REFRESH', '60'))
+GPS_NEARBY_DEFAULT_RADIUS = float(os.environ.get('GPS_NEARBY_DEFAULT_RADIUS', '5000'))
+GPS_NEARBY_MAX_RESULTS = int(os.environ.get('GPS_NEARBY_MAX_RESULTS', '100'))
+
+GEOFENCE_MODES = ('keep_inside', 'keep_outside')
+
+
+def geojson_point(lat: float, lng: float) -> Dict[str, Any]:
+    return {'type': 'Point', 'coordinates': [float(lng), float(lat)]}
+
+
+def validate_polygon(polygon: Dict[str, Any]) -> Optional[str]:
+    """Error message for an unusable GeoJSON Polygon, None when it is fine"""
+    if not isinstance(polygon, dict) or polygon.get('type') != 'Polygon':
+        return "Geofence bir GeoJSON Polygon olmalı"
+    rings = polygon.get('coordinates')
+    if not isinstance(rings, list) or not rings:
+        return "Polygon koordinatları eksik"
+    for ring in rings:
+        if not isinstance(ring, list) or len(ring) < 4 or ring[0] != ring[-1]:
+            return "Polygon halkaları en az 4 noktalı ve kapalı olmalı"
+        for point in ring:
+            if (not isinstance(point, (list, tuple)) or len(point) < 2
+                    or not -180 <= point[0] <= 180 or not -90 <= point[1] <= 90):
+                return "Geçersiz koordinat (beklenen: [boylam, enlem])"
+    return None
+
+
+def points_in_polygon(lng: np.ndarray, lat: np.ndarray, rings: List[np.ndarray]) -> np.ndarray:
+    """
+    Even-odd ray casting of N points against a polygon with holes,
+    vectorized over points and edges. Each ring is an (E+1, 2) array of lng/lat.
+    """
+    inside = np.zeros(len(lng), dtype=bool)
+    for ring in rings:
+        x1, y1 = ring[:-1, 0][:, None], ring[:-1, 1][:, None]
+        x2, y2 = ring[1:, 0][:, None], ring[1:, 1][:, None]
+        crosses = (y1 > lat) != (y2 > lat)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_at = x1 + (lat - y1) * (x2 - x1) / (y2 - y1)
+        hits = crosses & (lng < x_at)
+        inside ^= (np.count_nonzero(hits, axis=0) % 2).astype(bool)
+    return inside
+
+
+class GPSGeoService:
+    """Vehicle location index, nearby search and batch geofence evaluation"""
+
+    def __init__(self, db=None):
+        self.db = db
+        # company_id -> (loaded_at, {vehicle_key: vehicle})
+        self._vehicles: Dict[str, Tuple[float, Dict[str, Dict[str, Any]]]] = {}
+        # company_id -> active fences with their rings as arrays
+        self._fences: Dict[str, List[Dict[str, Any]]] = {}
+        # vehicle_id -> (last_update, lat, lng) last written to vehicles.location
+        self._written: Dict[str, Any] = {}
+        # (geofence_id, vehicle_id) of unresolved violations
+        self._open: Set[Tuple[str, str]] = set()
+        self.stats = {'locations_written': 0, 'evaluations': 0, 'violations_opened': 0, 'violations_resolved': 0}
+
+    def set_db(self, db):
+        """Database bağlantısını ayarla"""
+        self.db = db
+
+    async def ensure_indexes(self):
+        await self.db.vehicles.create_index('id')
+        await self.db.vehicles.create_index([('location', '2dsphere')])
+        await self.db.geofences.create_index([('company_id', 1), ('is_active', 1)])
+        await self.db.geofences.create_index([('polygon', '2dsphere')])
+        await self.db.geofence_violations.create_index([('company_id', 1), ('resolved_at', 1), ('started_at', -1)])
+        await self.db.geofence_violations.create_index([('geofence_id', 1), ('vehicle_id', 1), ('resolved_at', 1)])
+        open_violations = await self.db.geofence_violations.find(
+            {'resolved_at': None}, {'_id': 0, 'geofence_id': 1, 'vehicle_id': 1}
+        ).to_list(None)
+        self._open = {(v['geofence_id'], v['vehicle_id']) for v in open_violations}
+
+    # ---------- caches ----------
+
+    async def _company_vehicles(self, company_id: str) -> Dict[str, Dict[str, Any]]:
+        cached = self._vehicles.get(company_id)
+        if cached and time.monotonic() - cached[0] < GPS_GEO_VEHICLE_REFRESH:
+            return cached[1]
+        vehicles = await self.db.vehicles.find(
+            {'company_id': company_id}, {'_id': 0, 'id': 1, 'plate': 1, 'status': 1}
+        ).to_list(None)
+        by_key = {vehicle_key(v['plate']): v for v in vehicles if v.get('plate')}
+        self._vehicles[company_id] = (time.monotonic(), by_key)
+        return by_key
+
+    async def _company_fences(self, company_id: str) -> List[Dict[str, Any]]:
+        if company_id not in self._fences:
+            fences = await self.db.geofences.find(
+                {'company_id': company_id, 'is_active': True}, {'_id': 0}
+            ).to_list(1000)
+            for fence in fences:
+                fence['_rings'] = [np.asarray(r, dtype=np.float64)[:, :2] for r in fence['polygon']['coordinates']]
+            self._fences[company_id] = fences
+        return self._fences[company_id]
+
+    def invalidate_fences(self, company_id: str):
+        self._fences.pop(company_id, None)
+
+    # ---------- collector listener ----------
+
+    async def record(self, company_id: str, positions: List[Dict[str, Any]]):
+        """Write changed vehicle locations and evaluate geofences for one poll"""
+        vehicles = await self._company_vehicles(company_id)
+        matched = []
+        updates = []
+        for position in positions:
+            vehicle = vehicles.get(vehicle_key(position.get('plate')))
+            if not vehicle or position.get('lat') is None or position.get('lng') is None:
+                continue
+            matched.append((vehicle, position))
+            stamp = (position.get('last_update'), position['lat'], position['lng'])
+            if self._written.get(vehicle['id']) == stamp:
+                continue
+            self._written[vehicle['id']] = stamp
+            updates.append(UpdateOne({'id': vehicle['id']}, {'$set': {
+                'location': geojson_point(position['lat'], position['lng']),
+                'location_updated_at': position.get('last_update') or datetime.now(timezone.utc).isoformat(),
+            }}))
+        if updates:
+            await self.db.vehicles.bulk_write(updates, ordered=False)
+            self.stats['locations_written'] += len(updates)
+        if matched:
+            await self.evaluate(company_id, matched)
+
+    async def evaluate(self, company_id: str, matched: List[Tuple[Dict[str, Any], Dict[str, Any]]]):
+        fences = await self._company_fences(company_id)
+        if not fences:
+            return
+        self.stats['evaluations'] += 1
+        lat = np.fromiter((p['lat'] for _, p in matched), dtype=np.float64, count=len(matched))
+        lng = np.fromiter((p['lng'] for _, p in matched), dtype=np.float64, count=len(matched))
+        statuses = np.array([v.get('status') or '' for v, _ in matched])
+        now = datetime.now(timezone.utc).isoformat()
+
+        for fence in fences:
+            inside = points_in_polygon(lng, lat, fence['_rings'])
+            eligible = np.isin(statuses, fence.get('vehicle_statuses') or ['rented'])
+            violating = eligible & (~inside if fence['mode'] == 'keep_inside' else inside)
+
+            for i in np.flatnonzero(violating):
+                vehicle, position = matched[i]
+                key = (fence['id'], vehicle['id'])
+                if key in self._open:
+                    continue
+                self._open.add(key)
+                self.stats['violations_opened'] += 1
+                await self.db.geofence_violations.insert_one({
+                    'id': str(uuid.uuid4()),
+                    'company_id': company_id,
+                    'geofence_id': fence['id'],
+                    'geofence_name': fence.get('name'),
+                    'mode': fence['mode'],
+                    'vehicle_id': vehicle['id'],
+                    'plate': vehicle.get('plate'),
+                    'location': geojson_point(position['lat'], position['lng']),
+                    'started_at': now,
+                    'resolved_at': None,
+                })
+                logger.warning(f"[GEOFENCE] {vehicle.get('plate')} violates '{fence.get('name')}' ({fence['mode']})")
+
+            resolved = [matched[i][0]['id'] for i in np.flatnonzero(~violating) if (fence['id'], matched[i][0]['id']) in self._open]
+            if resolved:
+                self._open.difference_update((fence['id'], v) for v in resolved)
+                self.stats['violations_resolved'] += len(resolved)
+                await self.db.geofence_violations.update_many(
+                    {'geofence_id': fence['id'], 'vehicle_id': {'$in': resolved}, 'resolved_at': None},
+                    {'$set': {'resolved_at': now}}
+                )
+
+    # ---------- queries ----------
+
+    async def nearby(self, lat: float, lng: float, radius: float, company_id: Optional[str] = None,
+                     status: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """Vehicles with a known location within radius meters, nearest first"""
+        query: Dict[str, Any] = {}
+        if company_id:
+            query['company_id'] = company_id
+        if status:
+            query['status'] = status
+        pipeline = [
+            {'$geoNear': {
+                'near': geojson_point(lat, lng),
+                'distanceField': 'distance_m',
+                'maxDistance': radius,
+                'query': query,
+                'spherical': True,
+            }},
+            {'$limit': min(limit, GPS_NEARBY_MAX_RESULTS)},
+            {'$project': {'_id': 0, 'id': 1, 'company_id': 1, 'plate': 1, 'brand': 1, 'model': 1, 'status': 1,
+                          'location': 1, 'location_updated_at': 1, 'distance_m': {'$round': ['$distance_m', 0]}}},
+        ]
+        return await self.db.vehicles.aggregate(pipeline).to_list(None)
+
+    async def close_violations(self, geofence_id: str):
+        """Resolve every open violation of a deleted or deactivated fence"""
+        self._open = {k for k in self._open if k[0] != geofence_id}
+        await self.db.geofence_violations.update_many(
+            {'geofence_id': geofence_id, 'resolved_at': None},
+            {'$set': {'resolved_at': datetime.now(timezone.utc).isoformat()}}
+        )
+
+    def get_status(self) -> Dict[str, Any]:
+        return {'open_violations': len(self._open), **self.stats}
+
+
+# Singleton instance
+gps_geo = GPSGeoService()
@@ -0,0 +1,167 @@
+"""
+GPS Position History
+Every position the GPS collector fetches is appended to a MongoDB
+time-series collection, so route history is a local query instead of an
+Arvento call per request.
+
+- collection gps_positions: timeField ts, metaField meta
+  {company_id, vehicle_key (normalized plate), device_id}, so each vehicle
+  gets its own buckets
+- documents expire after GPS_HISTORY_RETENTION_DAYS (expireAfterSeconds,
+  updated with collMod when the setting changes)
+- a position whose last_update did not change since the previous poll is
+  not stored again
+- routes are simplified server-side: with a map zoom level the tolerance is
+  GPS_HISTORY_PIXEL_TOLERANCE pixels at that zoom - Douglas-Peucker from
+  GPS_HISTORY_DP_MIN_ZOOM up, one point per grid cell below it; every
+  response is capped at max_points (default GPS_HISTORY_MAX_POINTS)
+- routes longer than GPS_HISTORY_INLINE_POINTS are simplified in the
+  process pool
+
+MongoDB collection: gps_positions
+"""
+
+import os
+import re
+import logging
+from typing import Optional, Dict, Any, List, Tuple
+from datetime import datetime, timezone
+
+import numpy as np
+from pymongo.errors import CollectionInvalid
+
+from services.executor import blocking_executor
+from services.blocking_tasks import simplify_route
+
+logger = logging.getLogger(__name__)
+
+GPS_HISTORY_RETENTION_DAYS = int(os.environ.get('GPS_HISTORY_RETENTION_DAYS', '90'))
+GPS_HISTORY_MAX_POINTS = int(os.environ.get('GPS_HISTORY_MAX_POINTS', '2000'))
+GPS_HISTORY_PIXEL_TOLERANCE = float(os.environ.get('GPS_HISTORY_PIXEL_TOLERANCE', '1.5'))
+GPS_HISTORY_DP_MIN_ZOOM = int(os.environ.get('GPS_HISTORY_DP_MIN_ZOOM', '12'))
+GPS_HISTORY_INLINE_POINTS = int(os.environ.get('GPS_HISTORY_INLINE_POINTS', '5000'))
+
+COLLECTION = 'gps_positions'
+
+
+def vehicle_key(plate: Optional[str]) -> Optional[str]:
+    """Plate as stored in meta.vehicle_key: no whitespace, upper case"""
+    return re.sub(r'\s+', '', plate).upper() if plate else None
+
+
+def zoom_tolerance(zoom: int) -> float:
+    """Degrees covered by GPS_HISTORY_PIXEL_TOLERANCE pixels of a 256px web-mercator tile at zoom"""
+    return GPS_HISTORY_PIXEL_TOLERANCE * 360.0 / (256 * 2 ** zoom)
+
+
+def parse_timestamp(value: Any) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class GPSHistoryStore:
+    """Time-series position history with downsampled route reads"""
+
+    def __init__(self, db=None):
+        self.db = db
+        # (company_id, vehicle_key) -> last stored ts
+        self._last_ts: Dict[Tuple[str, str], datetime] = {}
+        self.stats = {'stored': 0, 'unchanged': 0, 'queries': 0}
+
+    def set_db(self, db):
+        """Database bağlantısını ayarla"""
+        self.db = db
+
+    async def ensure_collection(self):
+        expire = GPS_HISTORY_RETENTION_DAYS * 86400
+        try:
+            await self.db.create_collection(
+                COLLECTION,
+                timeseries={'timeField': 'ts', 'metaField': 'meta', 'granularity': 'seconds'},
+                expireAfterSeconds=expire
+            )
+            logger.info(f"[GPS-HISTORY] Created time-series collection {COLLECTION} ({GPS_HISTORY_RETENTION_DAYS} days)")
+        except CollectionInvalid:
+            await self.db.command('collMod', COLLECTION, expireAfterSeconds=expire)
+        await self.db[COLLECTION].create_index([('meta.company_id', 1), ('meta.vehicle_key', 1), ('ts', 1)])
+
+    async def record(self, company_id: str, positions: List[Dict[str, Any]]) -> int:
+        """Append the positions of one poll; unchanged positions are skipped"""
+        if self.db is None:
+            return 0
+        now = datetime.now(timezone.utc)
+        documents = []
+        for position in positions:
+            key = vehicle_key(position.get('plate')) or position.get('vehicle_id')
+            if not key or position.get('lat') is None or position.get('lng') is None:
+                continue
+            ts = parse_timestamp(position.get('last_update')) or now
+            if self._last_ts.get((company_id, key)) == ts:
+                self.stats['unchanged'] += 1
+                continue
+            self._last_ts[(company_id, key)] = ts
+            documents.append({
+                'ts': ts,
+                'meta': {'company_id': company_id, 'vehicle_key': key, 'device_id': position.get('vehicle_id')},
+                'lat': float(position['lat']),
+                'lng': float(position['lng']),
+                'speed': position.get('speed'),
+                'heading': position.get('heading'),
+                'ignition': position.get('ignition'),
+            })
+        if documents:
+            await self.db[COLLECTION].insert_many(documents, ordered=False)
+            self.stats['stored'] += len(documents)
+        return len(documents)
+
+    async def history(self, company_id: str, plate: str, start: datetime, end: datetime,
+                      zoom: Optional[int] = None, max_points: Optional[int] = None) -> Dict[str, Any]:
+        """Simplified route of one vehicle between start and end"""
+        self.stats['queries'] += 1
+        max_points = min(max_points or GPS_HISTORY_MAX_POINTS, GPS_HISTORY_MAX_POINTS)
+        cursor = self.db[COLLECTION].find(
+            {'meta.company_id': company_id, 'meta.vehicle_key': vehicle_key(plate), 'ts': {'$gte': start, '$lte': end}},
+            {'_id': 0, 'ts': 1, 'lat': 1, 'lng': 1, 'speed': 1, 'heading': 1}
+        ).sort('ts', 1)
+        points = await cursor.to_list(None)
+
+        if zoom is None:
+            method, tolerance = 'fixed', 0.0
+        else:
+            method = 'douglas_peucker' if zoom >= GPS_HISTORY_DP_MIN_ZOOM else 'grid'
+            tolerance = zoom_tolerance(zoom)
+
+        if points:
+            lat = np.fromiter((p['lat'] for p in points), dtype=np.float64, count=len(points))
+            lng = np.fromiter((p['lng'] for p in points), dtype=np.float64, count=len(points))
+            if len(points) > GPS_HISTORY_INLINE_POINTS:
+                indices = await blocking_executor.run_cpu(simplify_route, lat, lng, method, tolerance, max_points)
+            else:
+                indices = simplify_route(lat, lng, method, tolerance, max_points)
+        else:
+            indices = []
+
+        route = []
+        for i in indices:
+            point = points[int(i)]
+            ts = point['ts'] if point['ts'].tzinfo else point['ts'].replace(tzinfo=timezone.utc)
+            route.append({**point, 'ts': ts.isoformat()})
+
+        return {
+            'method': method,
+            'zoom': zoom,
+            'raw_points': len(points),
+            'returned_points': len(route),
+            'history': route,
+        }
+
+
+# Singleton instance
+gps_history = GPSHistoryStore()
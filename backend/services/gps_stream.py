@@ -0,0 +1,153 @@
+"""
+Live GPS Stream
+Pushes position changes from the GPS collector to open map pages over
+Server-Sent Events, so a map costs one connection plus small deltas
+instead of a full /api/gps/vehicles read every few seconds.
+
+- each poll's positions are compared with the last published ones; only
+  changed vehicles are serialized, once, and fanned out to the company's
+  subscribers (superadmin fleet subscribers get every company)
+- a subscriber keeps at most one pending update per vehicle: updates that
+  arrive faster than the connection drains overwrite each other, so a
+  slow client is never more than one position per vehicle behind and
+  memory per connection is bounded by fleet size
+- pending updates are flushed at most every GPS_STREAM_COALESCE_SECONDS
+- a comment line is sent after GPS_STREAM_HEARTBEAT seconds of silence so
+  proxies keep the connection open
+"""
+
+import os
+import json
+import asyncio
+import logging
+from typing import Optional, Dict, Any, List, Set, AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+GPS_STREAM_COALESCE_SECONDS = float(os.environ.get('GPS_STREAM_COALESCE_SECONDS', '0.5'))
+GPS_STREAM_HEARTBEAT = float(os.environ.get('GPS_STREAM_HEARTBEAT', '15'))
+GPS_STREAM_MAX_SUBSCRIBERS = int(os.environ.get('GPS_STREAM_MAX_SUBSCRIBERS', '1000'))
+
+# Fields that make a position worth pushing again
+TRACKED_FIELDS = ('lat', 'lng', 'speed', 'heading', 'ignition', 'last_update')
+
+ALL_COMPANIES = '*'
+
+
+def position_key(position: Dict[str, Any]) -> Optional[str]:
+    return position.get('vehicle_id') or position.get('plate')
+
+
+def sse_event(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+class GPSStreamFull(Exception):
+    """Raised when GPS_STREAM_MAX_SUBSCRIBERS connections are already open"""
+    pass
+
+
+class GPSSubscriber:
+    """One open stream: pending serialized updates keyed by company/vehicle"""
+
+    def __init__(self, scope: str):
+        self.scope = scope
+        self.pending: Dict[str, str] = {}
+        self.wakeup = asyncio.Event()
+        self.coalesced = 0
+
+    def offer(self, key: str, payload: str):
+        if key in self.pending:
+            self.coalesced += 1
+        self.pending[key] = payload
+        self.wakeup.set()
+
+    def drain(self) -> List[str]:
+        payloads = list(self.pending.values())
+        self.pending.clear()
+        self.wakeup.clear()
+        return payloads
+
+
+class GPSStreamHub:
+    """Per-company fan-out of collector position deltas to SSE subscribers"""
+
+    def __init__(self):
+        # scope (company_id or ALL_COMPANIES) -> subscribers
+        self._subscribers: Dict[str, Set[GPSSubscriber]] = {}
+        # (company_id, vehicle key) -> tracked field values last published
+        self._published: Dict[tuple, tuple] = {}
+        self.stats = {'published': 0, 'unchanged': 0, 'events_sent': 0, 'coalesced': 0, 'rejected': 0}
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(s) for s in self._subscribers.values())
+
+    def subscribe(self, scope: str) -> GPSSubscriber:
+        if self.subscriber_count >= GPS_STREAM_MAX_SUBSCRIBERS:
+            self.stats['rejected'] += 1
+            raise GPSStreamFull(f"{GPS_STREAM_MAX_SUBSCRIBERS} GPS stream connections already open")
+        subscriber = GPSSubscriber(scope)
+        self._subscribers.setdefault(scope, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: GPSSubscriber):
+        subscribers = self._subscribers.get(subscriber.scope)
+        if subscribers:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self._subscribers.pop(subscriber.scope, None)
+        self.stats['coalesced'] += subscriber.coalesced
+
+    async def publish(self, company_id: str, positions: List[Dict[str, Any]]):
+        """Collector listener: push changed positions of one company"""
+        targets = list(self._subscribers.get(company_id, ())) + list(self._subscribers.get(ALL_COMPANIES, ()))
+        for position in positions:
+            key = position_key(position)
+            if not key:
+                continue
+            tracked = tuple(position.get(f) for f in TRACKED_FIELDS)
+            if self._published.get((company_id, key)) == tracked:
+                self.stats['unchanged'] += 1
+                continue
+            self._published[(company_id, key)] = tracked
+            self.stats['published'] += 1
+            if not targets:
+                continue
+            payload = json.dumps({**position, 'company_id': company_id}, default=str)
+            for subscriber in targets:
+                subscriber.offer(f"{company_id}:{key}", payload)
+
+    async def stream(self, subscriber: GPSSubscriber, snapshot: List[Dict[str, Any]]) -> AsyncIterator[str]:
+        """SSE body: one snapshot event, then coalesced position batches"""
+        try:
+            yield sse_event('snapshot', json.dumps(snapshot, default=str))
+            self.stats['events_sent'] += 1
+            while True:
+                try:
+                    await asyncio.wait_for(subscriber.wakeup.wait(), timeout=GPS_STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                # Let updates from the same poll round land in one event
+                await asyncio.sleep(GPS_STREAM_COALESCE_SECONDS)
+                payloads = subscriber.drain()
+                if payloads:
+                    # The send awaits the client; anything arriving meanwhile is coalesced in pending
+                    yield sse_event('positions', '[' + ','.join(payloads) + ']')
+                    self.stats['events_sent'] += 1
+        finally:
+            self.unsubscribe(subscriber)
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            'subscribers': self.subscriber_count,
+            'scopes': {scope: len(s) for scope, s in self._subscribers.items()},
+            'max_subscribers': GPS_STREAM_MAX_SUBSCRIBERS,
+            'coalesce_seconds': GPS_STREAM_COALESCE_SECONDS,
+            **self.stats,
+        }
+
+
+# Singleton instance
+gps_stream = GPSStreamHub()
@@ -4,14 +4,110 @@ Araç bazlı HGS etiket takibi, bakiye ve geçiş kayıtları
 
 NOT: Bu servis manuel takip içindir. 
 PTT HGS API entegrasyonu için ayrı modül gereklidir.
+
+Toplu geçiş yükleme (ingest_passages): sağlayıcı ekstresi (CSV/JSON) tek
+seferde yazılır; geçişler natural_key (etiket|zaman|nokta|tutar) ile
+tekilleştirilir, bakiyeler etiket başına tek $inc ile düşülür.
+
+Aylık geçiş özetleri (hgs_toll_rollups): firma + ay (YYYY-MM) + araç başına
+geçiş sayısı ve tutarı; her geçiş eklendiğinde $inc ile güncellenir, böylece
+özet ekranı geçiş geçmişi büyüdükçe yavaşlamaz.
+
+MongoDB collections: hgs_tags, hgs_passages, hgs_balance_history, hgs_toll_rollups
 """
+import io
+import os
+import csv
+import json
+import asyncio
 import logging
-from typing import Dict, List, Any, Optional
-from datetime import datetime, timezone
+from typing import Dict, List, Any, Optional, Tuple
+from datetime import datetime, timezone, timedelta
 from uuid import uuid4
 
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
 logger = logging.getLogger(__name__)
 
+HGS_BULK_MAX_ROWS = int(os.environ.get('HGS_BULK_MAX_ROWS', '10000'))
+
+# Statement times without an offset are Turkey local time (UTC+3, no DST)
+STATEMENT_TZ = timezone(timedelta(hours=3))
+STATEMENT_TIME_FORMATS = ('%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M')
+
+# Statement column -> passage field
+STATEMENT_COLUMNS = {
+    'tag_number': 'tag_number', 'etiket_no': 'tag_number', 'etiket': 'tag_number', 'hgs_no': 'tag_number',
+    'vehicle_plate': 'vehicle_plate', 'plate': 'vehicle_plate', 'plaka': 'vehicle_plate',
+    'passage_time': 'passage_time', 'tarih': 'passage_time', 'gecis_zamani': 'passage_time', 'gecis_tarihi': 'passage_time',
+    'location': 'location', 'gecis_noktasi': 'location', 'istasyon': 'location', 'nokta': 'location',
+    'amount': 'amount', 'tutar': 'amount', 'ucret': 'amount',
+    'direction': 'direction', 'yon': 'direction',
+}
+ASCII_HEADERS = str.maketrans('çğıöşüÇĞİÖŞÜ', 'cgiosuCGIOSU')
+
+
+def parse_passage_statement(content: bytes, content_type: str = '') -> List[Dict[str, Any]]:
+    """Rows of a provider statement: JSON (list or {'passages': [...]}) or CSV (',' or ';')"""
+    text = content.decode('utf-8-sig') if isinstance(content, bytes) else content
+    if 'json' in content_type or text.lstrip()[:1] in ('[', '{'):
+        data = json.loads(text)
+        rows = data.get('passages', []) if isinstance(data, dict) else data
+    else:
+        try:
+            dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        rows = list(csv.DictReader(io.StringIO(text), dialect=dialect))
+    normalized = []
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+        passage = {}
+        for column, value in row.items():
+            field = STATEMENT_COLUMNS.get(str(column or '').translate(ASCII_HEADERS).strip().lower().replace(' ', '_'))
+            if field:
+                passage[field] = value.strip() if isinstance(value, str) else value
+        normalized.append(passage)
+    return normalized
+
+
+def normalize_amount(value: Any) -> float:
+    if isinstance(value, str):
+        value = value.replace('TL', '').replace(' ', '')
+        # "1.234,50" / "12,50" -> Turkish decimal comma
+        if ',' in value:
+            value = value.replace('.', '').replace(',', '.')
+    return round(float(value), 2)
+
+
+def normalize_passage_time(value: Any) -> str:
+    """UTC ISO timestamp for a statement time"""
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        value = str(value).strip()
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            for fmt in STATEMENT_TIME_FORMATS:
+                try:
+                    parsed = datetime.strptime(value, fmt)
+                    break
+                except ValueError:
+                    continue
+            else:
+                raise ValueError(f"Geçersiz geçiş zamanı: {value}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=STATEMENT_TZ)
+    return parsed.astimezone(timezone.utc).isoformat()
+
+
+def passage_natural_key(tag_id: str, passage_time: str, location: str, amount: float) -> str:
+    """Identity of a passage across statements and re-uploads"""
+    return f"{tag_id}|{passage_time}|{(location or '').strip().lower()}|{amount:.2f}"
+
 
 class HGSService:
     """
@@ -31,7 +127,116 @@ class HGSService:
         """Database bağlantısını ayarla"""
         self.db = db
     
-    async def add_hgs_tag(self, vehicle_id: str, tag_data: Dict[str, Any]) -> Dict[str, Any]:
+    async def ensure_indexes(self):
+        """Indexes, company_id backfill for older records and the initial toll rollup"""
+        await self.db.hgs_tags.create_index('id')
+        await self.db.hgs_tags.create_index([('company_id', 1), ('is_active', 1)])
+        await self.db.hgs_passages.create_index([('tag_id', 1), ('passage_time', -1)])
+        await self.db.hgs_passages.create_index([('company_id', 1), ('passage_time', -1)])
+        await self._backfill_natural_keys()
+        await self.db.hgs_passages.create_index(
+            'natural_key', unique=True, partialFilterExpression={'natural_key': {'$exists': True}}
+        )
+        await self.db.hgs_toll_rollups.create_index(
+            [('company_id', 1), ('month', 1), ('vehicle_id', 1)], unique=True
+        )
+        
+        # Tags created before company_id was stored take it from their vehicle
+        async for tag in self.db.hgs_tags.find({'company_id': {'$exists': False}}, {'_id': 0, 'id': 1, 'vehicle_id': 1}):
+            vehicle = await self.db.vehicles.find_one({'id': tag.get('vehicle_id')}, {'_id': 0, 'company_id': 1})
+            if vehicle and vehicle.get('company_id'):
+                await self.db.hgs_tags.update_one({'id': tag['id']}, {'$set': {'company_id': vehicle['company_id']}})
+                await self.db.hgs_passages.update_many(
+                    {'tag_id': tag['id'], 'company_id': {'$exists': False}},
+                    {'$set': {'company_id': vehicle['company_id']}}
+                )
+        
+        if not await self.db.hgs_toll_rollups.estimated_document_count():
+            await self.rebuild_rollups()
+    
+    async def _backfill_natural_keys(self):
+        """natural_key for passages stored before it existed or entered before times were normalized"""
+        updates, seen = [], set()
+        async for passage in self.db.hgs_passages.find(
+            {'$or': [{'natural_key': {'$exists': False}}, {'source': {'$exists': False}}]},
+            {'_id': 0, 'id': 1, 'tag_id': 1, 'passage_time': 1, 'location': 1, 'amount': 1, 'natural_key': 1}
+        ):
+            try:
+                key = passage_natural_key(
+                    passage['tag_id'], normalize_passage_time(passage['passage_time']),
+                    passage.get('location'), normalize_amount(passage.get('amount') or 0)
+                )
+            except (KeyError, TypeError, ValueError):
+                continue
+            if key in seen:
+                # Legacy duplicate: left without a key so the unique index can be built
+                continue
+            seen.add(key)
+            if key != passage.get('natural_key'):
+                updates.append(UpdateOne({'id': passage['id']}, {'$set': {'natural_key': key}}))
+        if updates:
+            try:
+                await self.db.hgs_passages.bulk_write(updates, ordered=False)
+            except BulkWriteError as e:
+                logger.warning(f"[HGS] {len(e.details.get('writeErrors', []))} passages kept their old natural_key")
+            logger.info(f"[HGS] natural_key backfilled for {len(updates)} passages")
+
+    async def rebuild_rollups(self):
+        """Recompute hgs_toll_rollups from all passages"""
+        await self.db.hgs_toll_rollups.delete_many({})
+        await self.db.hgs_passages.aggregate([
+            {'$match': {'company_id': {'$exists': True}}},
+            {'$group': {
+                '_id': {
+                    'company_id': '$company_id',
+                    'month': {'$substrCP': ['$passage_time', 0, 7]},
+                    'vehicle_id': '$vehicle_id'
+                },
+                'vehicle_plate': {'$last': '$vehicle_plate'},
+                'passages': {'$sum': 1},
+                'amount': {'$sum': '$amount'}
+            }},
+            {'$project': {
+                '_id': 0,
+                'company_id': '$_id.company_id',
+                'month': '$_id.month',
+                'vehicle_id': '$_id.vehicle_id',
+                'vehicle_plate': 1,
+                'passages': 1,
+                'amount': 1,
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            }},
+            {'$merge': {'into': 'hgs_toll_rollups', 'on': ['company_id', 'month', 'vehicle_id'],
+                        'whenMatched': 'replace', 'whenNotMatched': 'insert'}}
+        ]).to_list(None)
+        logger.info("[HGS] Toll rollups rebuilt from passages")
+    
+    async def _add_to_rollups(self, passages: List[Dict[str, Any]]):
+        """Count passages in their company/month/vehicle rollups, one upsert per rollup"""
+        increments: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        for passage in passages:
+            if not passage.get('company_id'):
+                continue
+            key = (passage['company_id'], str(passage['passage_time'])[:7], passage.get('vehicle_id'))
+            entry = increments.setdefault(key, {'passages': 0, 'amount': 0.0, 'vehicle_plate': passage.get('vehicle_plate')})
+            entry['passages'] += 1
+            entry['amount'] += passage.get('amount') or 0.0
+        if not increments:
+            return
+        now = datetime.now(timezone.utc).isoformat()
+        await self.db.hgs_toll_rollups.bulk_write([
+            UpdateOne(
+                {'company_id': company_id, 'month': month, 'vehicle_id': vehicle_id},
+                {
+                    '$inc': {'passages': entry['passages'], 'amount': round(entry['amount'], 2)},
+                    '$set': {'vehicle_plate': entry['vehicle_plate'], 'updated_at': now}
+                },
+                upsert=True
+            )
+            for (company_id, month, vehicle_id), entry in increments.items()
+        ], ordered=False)
+    
+    async def add_hgs_tag(self, vehicle_id: str, tag_data: Dict[str, Any], company_id: str = None) -> Dict[str, Any]:
         """
         Araca HGS etiketi ekle
         
@@ -45,8 +250,11 @@ class HGSService:
         tag_id = str(uuid4())
         now = datetime.now(timezone.utc).isoformat()
         
+        vehicle = await self.db.vehicles.find_one({'id': vehicle_id}, {'_id': 0, 'company_id': 1})
+        
         tag_doc = {
             'id': tag_id,
+            'company_id': (vehicle or {}).get('company_id') or company_id,
             'vehicle_id': vehicle_id,
             'vehicle_plate': tag_data.get('vehicle_plate', ''),
             'tag_number': tag_data.get('tag_number', ''),
@@ -80,26 +288,26 @@ class HGSService:
         """
         HGS bakiyesini güncelle
         """
-        if not self.db:
+        if self.db is None:
             return {'success': False, 'error': 'Database bağlantısı yok'}
         
         now = datetime.now(timezone.utc).isoformat()
         
-        tag = await self.db.hgs_tags.find_one({'id': tag_id})
-        if not tag:
-            return {'success': False, 'error': 'HGS etiketi bulunamadı'}
-        
-        old_balance = tag.get('balance', 0)
-        
-        # Update tag balance
-        await self.db.hgs_tags.update_one(
+        # Atomic set; the pre-image gives the balance that was replaced
+        tag = await self.db.hgs_tags.find_one_and_update(
             {'id': tag_id},
             {'$set': {
                 'balance': new_balance,
                 'last_balance_update': now,
                 'updated_at': now
-            }}
+            }},
+            projection={'_id': 0},
+            return_document=ReturnDocument.BEFORE
         )
+        if not tag:
+            return {'success': False, 'error': 'HGS etiketi bulunamadı'}
+        
+        old_balance = tag.get('balance', 0)
         
         # Create balance history record
         history_doc = {
@@ -141,7 +349,7 @@ class HGSService:
         - amount: Geçiş ücreti
         - passage_time: Geçiş zamanı
         """
-        if not self.db:
+        if self.db is None:
             return {'success': False, 'error': 'Database bağlantısı yok'}
         
         tag = await self.db.hgs_tags.find_one({'id': tag_id})
@@ -150,36 +358,161 @@ class HGSService:
         
         passage_id = str(uuid4())
         now = datetime.now(timezone.utc).isoformat()
+        # Same normalization as statement rows, so both produce the same natural_key
+        try:
+            amount = normalize_amount(passage_data.get('amount') or 0)
+            passage_time = normalize_passage_time(passage_data.get('passage_time') or now)
+        except (TypeError, ValueError) as e:
+            return {'success': False, 'error': str(e) or 'Geçersiz tutar veya zaman'}
+        location = passage_data.get('location', '')
         
         passage_doc = {
             'id': passage_id,
             'tag_id': tag_id,
+            'company_id': tag.get('company_id'),
             'vehicle_id': tag.get('vehicle_id'),
             'vehicle_plate': tag.get('vehicle_plate'),
-            'location': passage_data.get('location', ''),
-            'amount': passage_data.get('amount', 0.0),
-            'passage_time': passage_data.get('passage_time', now),
+            'location': location,
+            'amount': amount,
+            'passage_time': passage_time,
             'direction': passage_data.get('direction', ''),  # Giriş/Çıkış
             'note': passage_data.get('note', ''),
+            'source': 'manual',
+            'natural_key': passage_natural_key(tag_id, passage_time, location, amount),
             'created_at': now
         }
         
-        await self.db.hgs_passages.insert_one(passage_doc)
+        try:
+            await self.db.hgs_passages.insert_one(passage_doc)
+        except DuplicateKeyError:
+            return {'success': False, 'error': 'Bu geçiş zaten kayıtlı'}
+        await self._add_to_rollups([passage_doc])
         
-        # Update balance
-        new_balance = tag.get('balance', 0) - passage_data.get('amount', 0)
-        await self.db.hgs_tags.update_one(
+        # Atomic decrement - concurrent passages on the same tag all count
+        updated = await self.db.hgs_tags.find_one_and_update(
             {'id': tag_id},
-            {'$set': {
-                'balance': new_balance,
-                'updated_at': now
-            }}
+            {'$inc': {'balance': -amount}, '$set': {'updated_at': now}},
+            projection={'_id': 0, 'balance': 1},
+            return_document=ReturnDocument.AFTER
         )
         
         return {
             'success': True,
             'passage_id': passage_id,
-            'new_balance': new_balance
+            'new_balance': (updated or {}).get('balance')
+        }
+    
+    async def ingest_passages(self, rows: List[Dict[str, Any]], company_id: str = None) -> Dict[str, Any]:
+        """
+        Sağlayıcı ekstresinden toplu geçiş kaydı
+        
+        Rows need tag_number or vehicle_plate, passage_time and amount.
+        Already known passages (natural_key) are skipped; balances get one
+        $inc per tag and low-balance alerts are checked once for the batch.
+        """
+        if self.db is None:
+            return {'success': False, 'error': 'Database bağlantısı yok'}
+        if len(rows) > HGS_BULK_MAX_ROWS:
+            return {'success': False, 'error': f'En fazla {HGS_BULK_MAX_ROWS} geçiş tek seferde yüklenebilir'}
+        
+        tag_query: Dict[str, Any] = {'is_active': True, '$or': [
+            {'tag_number': {'$in': list({r['tag_number'] for r in rows if r.get('tag_number')})}},
+            {'vehicle_plate': {'$in': list({r['vehicle_plate'] for r in rows if r.get('vehicle_plate')})}},
+        ]}
+        if company_id:
+            tag_query['company_id'] = company_id
+        tags = await self.db.hgs_tags.find(tag_query, {'_id': 0}).to_list(None)
+        by_number = {t['tag_number']: t for t in tags if t.get('tag_number')}
+        by_plate = {t['vehicle_plate']: t for t in tags if t.get('vehicle_plate')}
+        
+        now = datetime.now(timezone.utc).isoformat()
+        batch_id = str(uuid4())
+        rejected, passages, seen = [], [], set()
+        for index, row in enumerate(rows, start=1):
+            tag = by_number.get(row.get('tag_number')) or by_plate.get(row.get('vehicle_plate'))
+            if not tag:
+                rejected.append({'row': index, 'error': 'HGS etiketi bulunamadı'})
+                continue
+            try:
+                amount = normalize_amount(row.get('amount'))
+                passage_time = normalize_passage_time(row.get('passage_time'))
+            except (TypeError, ValueError) as e:
+                rejected.append({'row': index, 'error': str(e) or 'Geçersiz tutar veya zaman'})
+                continue
+            location = row.get('location') or ''
+            key = passage_natural_key(tag['id'], passage_time, location, amount)
+            if key in seen:
+                continue
+            seen.add(key)
+            passages.append({
+                'id': str(uuid4()),
+                'tag_id': tag['id'],
+                'company_id': tag.get('company_id'),
+                'vehicle_id': tag.get('vehicle_id'),
+                'vehicle_plate': tag.get('vehicle_plate'),
+                'location': location,
+                'amount': amount,
+                'passage_time': passage_time,
+                'direction': row.get('direction') or '',
+                'note': '',
+                'source': 'statement',
+                'batch_id': batch_id,
+                'natural_key': key,
+                'created_at': now
+            })
+        
+        known = set()
+        if passages:
+            known = set(await self.db.hgs_passages.distinct('natural_key', {'natural_key': {'$in': list(seen)}}))
+        new_passages = [p for p in passages if p['natural_key'] not in known]
+        
+        if new_passages:
+            try:
+                await self.db.hgs_passages.insert_many(new_passages, ordered=False)
+            except BulkWriteError as e:
+                # Raced with another upload of the same statement: drop what it already inserted
+                failed = {err['index'] for err in e.details.get('writeErrors', []) if err.get('code') == 11000}
+                if len(failed) != len(e.details.get('writeErrors', [])):
+                    raise
+                new_passages = [p for i, p in enumerate(new_passages) if i not in failed]
+        
+        deltas: Dict[str, float] = {}
+        for passage in new_passages:
+            deltas[passage['tag_id']] = deltas.get(passage['tag_id'], 0.0) + passage['amount']
+        if deltas:
+            await self.db.hgs_tags.bulk_write([
+                UpdateOne({'id': tag_id}, {'$inc': {'balance': -round(total, 2)}, '$set': {'updated_at': now}})
+                for tag_id, total in deltas.items()
+            ], ordered=False)
+            await self._add_to_rollups(new_passages)
+        
+        alerts = []
+        if deltas:
+            updated_tags = await self.db.hgs_tags.find(
+                {'id': {'$in': list(deltas)}}, {'_id': 0, 'id': 1, 'vehicle_plate': 1, 'balance': 1, 'min_balance_alert': 1}
+            ).to_list(None)
+            for tag in updated_tags:
+                min_alert = tag.get('min_balance_alert', 50)
+                if tag.get('balance', 0) < min_alert:
+                    alerts.append({
+                        'type': 'low_balance',
+                        'tag_id': tag['id'],
+                        'message': f"HGS bakiyesi düşük: {tag.get('balance', 0):.2f} TL (Minimum: {min_alert:.2f} TL)",
+                        'vehicle_plate': tag.get('vehicle_plate')
+                    })
+        
+        duplicates = len(rows) - len(rejected) - len(new_passages)
+        logger.info(f"[HGS] Statement: {len(rows)} rows, {len(new_passages)} inserted, "
+                    f"{duplicates} duplicates, {len(rejected)} rejected")
+        return {
+            'success': True,
+            'batch_id': batch_id,
+            'received': len(rows),
+            'inserted': len(new_passages),
+            'duplicates': duplicates,
+            'rejected': rejected,
+            'tags_updated': len(deltas),
+            'alerts': alerts
         }
     
     async def get_vehicle_hgs(self, vehicle_id: str) -> Dict[str, Any]:
@@ -265,34 +598,72 @@ class HGSService:
     async def get_summary(self, company_id: str = None) -> Dict[str, Any]:
         """
         HGS özet bilgisi
+        Tag totals come from one $facet over the company's tags, this month's
+        passages from the monthly rollup - neither grows with passage history.
         """
-        if not self.db:
+        if self.db is None:
             return {
                 'total_tags': 0,
                 'total_balance': 0,
                 'low_balance_count': 0,
-                'total_passages_this_month': 0
+                'total_passages_this_month': 0,
+                'total_amount_this_month': 0
             }
         
-        tags = await self.get_all_tags(company_id)
+        tag_query = {'is_active': True}
+        rollup_query = {'month': datetime.now(timezone.utc).strftime('%Y-%m')}
+        if company_id:
+            tag_query['company_id'] = company_id
+            rollup_query['company_id'] = company_id
+        
+        tag_facets, month = await asyncio.gather(
+            self.db.hgs_tags.aggregate([
+                {'$match': tag_query},
+                {'$facet': {
+                    'totals': [{'$group': {'_id': None, 'count': {'$sum': 1}, 'balance': {'$sum': '$balance'}}}],
+                    'low_balance': [
+                        {'$match': {'$expr': {'$lt': [{'$ifNull': ['$balance', 0]}, {'$ifNull': ['$min_balance_alert', 50]}]}}},
+                        {'$count': 'count'}
+                    ]
+                }}
+            ]).to_list(1),
+            self.db.hgs_toll_rollups.aggregate([
+                {'$match': rollup_query},
+                {'$group': {'_id': None, 'passages': {'$sum': '$passages'}, 'amount': {'$sum': '$amount'}}}
+            ]).to_list(1)
+        )
         
-        total_balance = sum(t.get('balance', 0) for t in tags)
-        low_balance = sum(1 for t in tags if t.get('low_balance'))
+        facets = tag_facets[0] if tag_facets else {}
+        totals = (facets.get('totals') or [{}])[0]
+        low_balance = (facets.get('low_balance') or [{}])[0]
+        month = month[0] if month else {}
         
-        # This month passages
-        from datetime import datetime
-        now = datetime.now()
-        month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0).isoformat()
+        return {
+            'total_tags': totals.get('count', 0),
+            'total_balance': round(totals.get('balance') or 0, 2),
+            'low_balance_count': low_balance.get('count', 0),
+            'total_passages_this_month': month.get('passages', 0),
+            'total_amount_this_month': round(month.get('amount') or 0, 2)
+        }
+    
+    async def get_monthly_tolls(self, company_id: str = None, month: str = None) -> Dict[str, Any]:
+        """
+        Aylık araç bazlı geçiş özeti (month: YYYY-MM, varsayılan bu ay)
+        """
+        if self.db is None:
+            return {'month': month, 'vehicles': [], 'total_passages': 0, 'total_amount': 0}
         
-        passages_count = await self.db.hgs_passages.count_documents({
-            'passage_time': {'$gte': month_start}
-        })
+        month = month or datetime.now(timezone.utc).strftime('%Y-%m')
+        query = {'month': month}
+        if company_id:
+            query['company_id'] = company_id
         
+        vehicles = await self.db.hgs_toll_rollups.find(query, {'_id': 0}).sort('amount', -1).to_list(5000)
         return {
-            'total_tags': len(tags),
-            'total_balance': round(total_balance, 2),
-            'low_balance_count': low_balance,
-            'total_passages_this_month': passages_count
+            'month': month,
+            'vehicles': vehicles,
+            'total_passages': sum(v.get('passages', 0) for v in vehicles),
+            'total_amount': round(sum(v.get('amount', 0) for v in vehicles), 2)
         }
     
     async def delete_tag(self, tag_id: str) -> Dict[str, Any]:
@@ -0,0 +1,431 @@
+"""
+Tenant Hibernation
+Stops idle tenant stacks and wakes them on the next request.
+
+- last request time per tenant comes from Traefik's Prometheus metrics
+  (traefik_service_requests_total for the tenant's api / frontend services)
+- a tenant idle longer than its plan's threshold is hibernated with
+  PortainerService.stop_stack; its memory use is recorded first
+- stopped containers drop out of Traefik's docker provider, so their hosts
+  fall through to the low-priority tenant-waker router (file provider), which
+  sends them to the superadmin backend; the waker starts the stack, waits for
+  routes and the backend, then the request is forwarded
+- reclaimed memory is reported from the recorded per-tenant usage
+
+MongoDB collection: hibernation_events
+"""
+
+import os
+import re
+import time
+import asyncio
+import logging
+from typing import Optional, Dict, Any, List
+from datetime import datetime, timezone, timedelta
+
+import httpx
+
+from services.executor import blocking_executor
+from services import blocking_tasks
+from services.portainer_service import portainer_service, SERVER_IP
+from services.traefik_routes import traefik_routes, traefik_for, tenant_router_names, TRAEFIK_API_URL
+
+logger = logging.getLogger(__name__)
+
+HIBERNATION_ENABLED = os.environ.get('HIBERNATION_ENABLED', 'false').lower() == 'true'
+HIBERNATION_CHECK_INTERVAL = float(os.environ.get('HIBERNATION_CHECK_INTERVAL', '60'))
+HIBERNATION_WAKE_TIMEOUT = float(os.environ.get('HIBERNATION_WAKE_TIMEOUT', '90'))
+# plan:minutes idle before hibernating, 0 = never
+HIBERNATION_THRESHOLDS = os.environ.get(
+    'HIBERNATION_THRESHOLDS', 'free:30,starter:240,professional:1440,enterprise:0'
+)
+# Where the Traefik catch-all router sends hibernated hosts (the superadmin backend)
+WAKER_URL = os.environ.get('HIBERNATION_WAKER_URL', f"http://{SERVER_IP}:9001")
+TRAEFIK_CONTAINER = 'traefik'
+TRAEFIK_DYNAMIC_DIR = '/etc/traefik/dynamic'
+
+_SERVICE_REQUESTS = re.compile(r'^traefik_service_requests_total\{([^}]*)\}\s+(\S+)')
+_SERVICE_LABEL = re.compile(r'service="([^"]+)"')
+TENANT_SERVICE_ROLES = ('api', 'frontend')
+
+
+def parse_plan_thresholds(spec: str) -> Dict[str, int]:
+    thresholds = {}
+    for item in spec.split(','):
+        plan, _, minutes = item.strip().partition(':')
+        if plan and minutes.strip().isdigit():
+            thresholds[plan] = int(minutes)
+    return thresholds
+
+
+def parse_service_requests(metrics: str) -> Dict[str, float]:
+    """Total requests per tenant safe code from Traefik's Prometheus output"""
+    totals: Dict[str, float] = {}
+    for line in metrics.splitlines():
+        match = _SERVICE_REQUESTS.match(line)
+        if not match:
+            continue
+        service = _SERVICE_LABEL.search(match.group(1))
+        if not service:
+            continue
+        name = service.group(1).split('@')[0]
+        safe_code, _, role = name.rpartition('-')
+        if safe_code and role in TENANT_SERVICE_ROLES:
+            totals[safe_code] = totals.get(safe_code, 0.0) + float(match.group(2))
+    return totals
+
+
+def waker_dynamic_config(waker_url: str = WAKER_URL) -> str:
+    """Traefik file-provider config: every host without a live router goes to the waker"""
+    return f"""http:
+  routers:
+    tenant-waker:
+      rule: "HostRegexp(`{{host:.+}}`)"
+      priority: 1
+      entryPoints:
+        - websecure
+      service: tenant-waker
+      tls: {{}}
+  services:
+    tenant-waker:
+      loadBalancer:
+        passHostHeader: true
+        servers:
+          - url: "{waker_url}"
+"""
+
+
+def _safe_code(code: str) -> str:
+    return code.replace('-', '').replace('_', '')
+
+
+def _parse_time(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+class HibernationController:
+    """Idle detection, stop / wake of tenant stacks and reclaimed-memory reporting"""
+
+    def __init__(self, portainer, routes, db=None):
+        self.portainer = portainer
+        self.routes = routes
+        self.db = db
+        self.thresholds = parse_plan_thresholds(HIBERNATION_THRESHOLDS)
+        self._counters: Dict[str, float] = {}
+        self._last_request: Dict[str, float] = {}
+        self._hibernated_hosts: Dict[str, str] = {}
+        self._waking: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._started_at = time.time()
+        self.stats = {'checks': 0, 'metrics_errors': 0, 'hibernated': 0, 'woken': 0, 'wake_failures': 0}
+
+    def set_db(self, db):
+        """Database bağlantısını ayarla"""
+        self.db = db
+
+    # ---------- activity ----------
+
+    async def _scrape(self) -> Optional[Dict[str, float]]:
+        try:
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                response = await client.get(f"{TRAEFIK_API_URL}/metrics")
+                response.raise_for_status()
+        except Exception as e:
+            self.stats['metrics_errors'] += 1
+            logger.warning(f"[HIBERNATION] Traefik metrics unavailable: {str(e)}")
+            return None
+        return parse_service_requests(response.text)
+
+    def threshold_minutes(self, company: Dict[str, Any]) -> int:
+        """Per-company override, else the plan threshold; 0 means never hibernate"""
+        if company.get('hibernate_after_minutes') is not None:
+            return int(company['hibernate_after_minutes'])
+        return self.thresholds.get(company.get('subscription_plan') or 'free', 0)
+
+    def last_request_at(self, company: Dict[str, Any]) -> float:
+        code = company['code']
+        if code not in self._last_request:
+            # Nothing observed yet: trust the stored value, else start the clock now
+            self._last_request[code] = max(
+                _parse_time(company.get('last_request_at')) or 0,
+                _parse_time(company.get('woke_at')) or 0
+            ) or self._started_at
+        return self._last_request[code]
+
+    async def _deployed_companies(self) -> List[Dict[str, Any]]:
+        return await self.db.companies.find(
+            {'portainer_stack_id': {'$ne': None}, 'domain': {'$nin': [None, '']}},
+            {'_id': 0, 'id': 1, 'code': 1, 'name': 1, 'domain': 1, 'ports': 1, 'portainer_stack_id': 1,
+             'subscription_plan': 1, 'hibernate_after_minutes': 1, 'hibernated': 1,
+             'hibernated_memory_bytes': 1, 'last_request_at': 1, 'woke_at': 1,
+             'portainer_endpoint_id': 1, 'server_ip': 1}
+        ).to_list(5000)
+
+    def _index_hosts(self, companies: List[Dict[str, Any]]):
+        hosts = {}
+        for company in companies:
+            if company.get('hibernated'):
+                domain = company['domain']
+                for host in (domain, f"www.{domain}", f"api.{domain}", f"panel.{domain}"):
+                    hosts[host] = company['code']
+        self._hibernated_hosts = hosts
+
+    async def check(self) -> Dict[str, Any]:
+        """Record activity from Traefik metrics and hibernate tenants idle past their threshold"""
+        self.stats['checks'] += 1
+        counters = await self._scrape()
+        companies = await self._deployed_companies()
+        now = time.time()
+        hibernated = []
+
+        for company in companies:
+            code = company['code']
+            total = counters.get(_safe_code(code)) if counters is not None else None
+            previous = self._counters.get(code)
+            if total is not None:
+                self._counters[code] = total
+                # Any change (including a reset after a Traefik restart) means traffic
+                if previous is not None and total != previous:
+                    self._last_request[code] = now
+                    await self.db.companies.update_one(
+                        {'id': company['id']},
+                        {'$set': {'last_request_at': datetime.fromtimestamp(now, timezone.utc).isoformat()}}
+                    )
+
+            if company.get('hibernated') or counters is None:
+                continue
+            threshold = self.threshold_minutes(company)
+            if threshold <= 0 or code in self._waking:
+                continue
+            if now - self.last_request_at(company) >= threshold * 60:
+                result = await self.hibernate(company, reason='idle')
+                if result.get('success'):
+                    company['hibernated'] = True
+                    hibernated.append(code)
+
+        self._index_hosts(companies)
+        return {'success': counters is not None, 'checked': len(companies), 'hibernated': hibernated}
+
+    # ---------- hibernate / wake ----------
+
+    def _portainer_for(self, company: Dict[str, Any]):
+        """Portainer view of the endpoint the company's stack was placed on"""
+        return self.portainer.for_endpoint(company.get('portainer_endpoint_id'), company.get('server_ip'))
+
+    def _routes_for(self, company: Dict[str, Any]):
+        server_ip = company.get('server_ip')
+        return self.routes if not server_ip or server_ip == self.portainer.server_ip else traefik_for(server_ip)
+
+    async def _container_memory(self, company: Dict[str, Any]) -> int:
+        """Current memory use of the tenant's containers, page cache excluded"""
+        safe_code = _safe_code(company['code'])
+        portainer = self._portainer_for(company)
+        containers = await portainer._request(
+            'GET', f"endpoints/{portainer.endpoint_id}/docker/containers/json"
+        )
+        total = 0
+        for container in containers if isinstance(containers, list) else []:
+            if not any(name.lstrip('/').startswith(f"{safe_code}_") for name in container.get('Names', [])):
+                continue
+            stats = await portainer._request(
+                'GET', f"endpoints/{portainer.endpoint_id}/docker/containers/{container['Id']}/stats?stream=false"
+            )
+            memory = stats.get('memory_stats', {}) if isinstance(stats, dict) else {}
+            cache = memory.get('stats', {}).get('inactive_file', memory.get('stats', {}).get('cache', 0))
+            total += max(memory.get('usage', 0) - cache, 0)
+        return total
+
+    async def _record_event(self, company: Dict[str, Any], action: str, **fields):
+        await self.db.hibernation_events.insert_one({
+            'company_code': company['code'],
+            'plan': company.get('subscription_plan'),
+            'action': action,
+            'at': datetime.now(timezone.utc).isoformat(),
+            **fields
+        })
+
+    async def hibernate(self, company: Dict[str, Any], reason: str = 'manual') -> Dict[str, Any]:
+        if company.get('hibernated'):
+            return {'success': False, 'error': 'Firma zaten uyku modunda'}
+        memory_bytes = await self._container_memory(company)
+
+        result = await self._portainer_for(company).stop_stack(company['portainer_stack_id'])
+        if isinstance(result, dict) and 'error' in result:
+            logger.error(f"[HIBERNATION] Could not stop {company['code']}: {result['error']}")
+            return {'success': False, 'error': result['error']}
+
+        now = datetime.now(timezone.utc).isoformat()
+        await self.db.companies.update_one(
+            {'id': company['id']},
+            {'$set': {'hibernated': True, 'hibernated_at': now, 'hibernated_memory_bytes': memory_bytes}}
+        )
+        await self._record_event(company, 'hibernate', reason=reason, memory_bytes=memory_bytes)
+        domain = company['domain']
+        for host in (domain, f"www.{domain}", f"api.{domain}", f"panel.{domain}"):
+            self._hibernated_hosts[host] = company['code']
+        self.stats['hibernated'] += 1
+        logger.info(
+            f"[HIBERNATION] {company['code']} hibernated ({reason}), "
+            f"reclaimed ~{round(memory_bytes / 1024 / 1024)} MB"
+        )
+        return {'success': True, 'company_code': company['code'], 'memory_bytes': memory_bytes}
+
+    async def _wake(self, company: Dict[str, Any], reason: str) -> Dict[str, Any]:
+        started_at = time.monotonic()
+        portainer = self._portainer_for(company)
+        result = await portainer.start_stack(company['portainer_stack_id'])
+        if isinstance(result, dict) and 'error' in result:
+            self.stats['wake_failures'] += 1
+            return {'success': False, 'error': result['error']}
+
+        routes = await self._routes_for(company).wait_for_routes(
+            tenant_router_names(_safe_code(company['code'])),
+            timeout=HIBERNATION_WAKE_TIMEOUT, started_at=started_at
+        )
+        backend_port = (company.get('ports') or {}).get('backend')
+        backend = await portainer.wait_for_backend_ready(
+            backend_port, started_at=started_at, timeout=HIBERNATION_WAKE_TIMEOUT
+        ) if backend_port else {'success': True}
+        if not routes.get('success') or not backend.get('success'):
+            self.stats['wake_failures'] += 1
+            return {'success': False, 'error': 'Firma uyandırılamadı - servisler hazır değil', 'routes': routes.get('routers')}
+
+        wake_seconds = round(time.monotonic() - started_at, 2)
+        now = datetime.now(timezone.utc)
+        await self.db.companies.update_one(
+            {'id': company['id']},
+            {'$set': {'hibernated': False, 'woke_at': now.isoformat(), 'last_request_at': now.isoformat()},
+             '$unset': {'hibernated_at': '', 'hibernated_memory_bytes': ''}}
+        )
+        await self._record_event(company, 'wake', reason=reason, wake_seconds=wake_seconds)
+        self._last_request[company['code']] = now.timestamp()
+        self._hibernated_hosts = {h: c for h, c in self._hibernated_hosts.items() if c != company['code']}
+        self.stats['woken'] += 1
+        logger.info(f"[HIBERNATION] {company['code']} woke in {wake_seconds}s ({reason})")
+        return {'success': True, 'company_code': company['code'], 'wake_seconds': wake_seconds}
+
+    async def wake(self, company: Dict[str, Any], reason: str = 'manual') -> Dict[str, Any]:
+        """Start a hibernated tenant; concurrent callers share one wake-up"""
+        code = company['code']
+        task = self._waking.get(code)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._wake(company, reason))
+            self._waking[code] = task
+            task.add_done_callback(lambda _: self._waking.pop(code, None))
+        return await asyncio.shield(task)
+
+    def hibernated_company_for_host(self, host: str) -> Optional[str]:
+        return self._hibernated_hosts.get(host.split(':')[0].lower())
+
+    async def wake_host(self, host: str) -> Dict[str, Any]:
+        """Waker entry point: wake the tenant a request for `host` was meant for"""
+        code = self.hibernated_company_for_host(host)
+        company = await self.db.companies.find_one({'code': code}, {'_id': 0}) if code else None
+        if not company:
+            return {'success': False, 'error': 'Firma bulunamadı'}
+        if not company.get('hibernated'):
+            self._hibernated_hosts = {h: c for h, c in self._hibernated_hosts.items() if c != code}
+            return {'success': True, 'company_code': code, 'already_awake': True, 'ports': company.get('ports')}
+        result = await self.wake(company, reason='request')
+        result['ports'] = company.get('ports')
+        return result
+
+    # ---------- Traefik waker route ----------
+
+    async def install_waker_route(self) -> Dict[str, Any]:
+        """Write the catch-all waker router into Traefik's file-provider directory"""
+        tar_data = await blocking_executor.run_io(
+            blocking_tasks.build_tar_archive, [], [], {'tenant-waker.yml': waker_dynamic_config()}
+        )
+        result = await self.portainer.upload_to_container(TRAEFIK_CONTAINER, tar_data, TRAEFIK_DYNAMIC_DIR)
+        if result.get('error'):
+            logger.warning(f"[HIBERNATION] Waker route not installed: {result['error']}")
+            return {'success': False, 'error': result['error']}
+        logger.info(f"[HIBERNATION] Waker route installed -> {WAKER_URL}")
+        return {'success': True, 'waker_url': WAKER_URL}
+
+    # ---------- reporting ----------
+
+    async def get_report(self) -> Dict[str, Any]:
+        """Hibernated tenants, memory currently reclaimed and recent activity"""
+        companies = await self._deployed_companies()
+        by_plan: Dict[str, Dict[str, Any]] = {}
+        hibernated = []
+        for company in companies:
+            plan = company.get('subscription_plan') or 'free'
+            entry = by_plan.setdefault(plan, {
+                'tenants': 0, 'hibernated': 0, 'reclaimed_bytes': 0,
+                'threshold_minutes': self.thresholds.get(plan, 0)
+            })
+            entry['tenants'] += 1
+            if company.get('hibernated'):
+                entry['hibernated'] += 1
+                entry['reclaimed_bytes'] += company.get('hibernated_memory_bytes') or 0
+                hibernated.append({
+                    'code': company['code'],
+                    'plan': plan,
+                    'memory_bytes': company.get('hibernated_memory_bytes') or 0
+                })
+
+        since = (datetime.now(timezone.utc) - timedelta(hours=24)).isoformat()
+        recent = await self.db.hibernation_events.aggregate([
+            {'$match': {'at': {'$gte': since}}},
+            {'$group': {'_id': '$action', 'count': {'$sum': 1}, 'avg_wake_seconds': {'$avg': '$wake_seconds'}}}
+        ]).to_list(10)
+
+        reclaimed = sum(t['memory_bytes'] for t in hibernated)
+        return {
+            'enabled': HIBERNATION_ENABLED,
+            'thresholds_minutes': self.thresholds,
+            'hibernated_count': len(hibernated),
+            'reclaimed_bytes': reclaimed,
+            'reclaimed_mb': round(reclaimed / 1024 / 1024, 1),
+            'by_plan': by_plan,
+            'hibernated': sorted(hibernated, key=lambda t: -t['memory_bytes']),
+            'last_24h': {r['_id']: {'count': r['count'], 'avg_wake_seconds': r.get('avg_wake_seconds')} for r in recent},
+            'stats': self.stats
+        }
+
+    # ---------- background loop ----------
+
+    async def _loop(self):
+        if not await self._traefik_has_waker():
+            await self.install_waker_route()
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"[HIBERNATION] Check error: {str(e)}")
+            await asyncio.sleep(HIBERNATION_CHECK_INTERVAL)
+
+    async def _traefik_has_waker(self) -> bool:
+        try:
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                routers = await self.routes.get_routers(client)
+            return 'tenant-waker@file' in routers
+        except Exception:
+            return False
+
+    async def refresh_hosts(self):
+        """Load hibernated hosts so the waker answers right after a restart"""
+        self._index_hosts(await self._deployed_companies())
+
+    def start(self):
+        if self._task or not HIBERNATION_ENABLED:
+            return
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+        logger.info(f"[HIBERNATION] Controller started (interval {HIBERNATION_CHECK_INTERVAL}s, thresholds {self.thresholds})")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+# Singleton instance
+hibernation = HibernationController(portainer_service, traefik_routes)
@@ -0,0 +1,257 @@
+"""
+iyzico Payment Events
+Inbound iyzico callbacks and webhooks are stored in payment_events and
+acknowledged at once; a background worker applies them.
+
+- every event has a unique event_key: "token:{token}" for checkout
+  callbacks, "webhook:{iyziReferenceCode}" for webhooks (falling back to
+  "payment:{iyziEventType}:{paymentId}" or a hash of the payload), so a
+  retried delivery of the same event is stored once
+- statuses: pending -> processed | failed; the worker (services.leased_queue)
+  claims due events with a lease (locked_until) and handles at most
+  IYZICO_EVENTS_CONCURRENCY at once
+- applying an event is idempotent: subscription_payments has a unique
+  payment_id, the company's subscription fields are derived from the event's
+  received_at, and recurring extensions are recorded in
+  companies.iyzico_payment_ids so a payment extends the subscription once
+- iyzico connection errors back off exponentially from
+  IYZICO_EVENTS_RETRY_BASE up to IYZICO_EVENTS_RETRY_MAX seconds; after
+  IYZICO_EVENTS_MAX_ATTEMPTS the event is marked failed
+
+MongoDB collections: payment_events, iyzico_sessions, subscription_payments, companies
+"""
+
+import os
+import hashlib
+import logging
+from typing import Dict, Any
+from datetime import datetime, timezone, timedelta
+from uuid import uuid4
+
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from services.iyzico_service import iyzico_service
+from services.leased_queue import LeasedQueue
+
+logger = logging.getLogger(__name__)
+
+IYZICO_EVENTS_CONCURRENCY = int(os.environ.get('IYZICO_EVENTS_CONCURRENCY', '4'))
+IYZICO_EVENTS_POLL = float(os.environ.get('IYZICO_EVENTS_POLL', '5'))
+IYZICO_EVENTS_LEASE = float(os.environ.get('IYZICO_EVENTS_LEASE', '120'))
+IYZICO_EVENTS_MAX_ATTEMPTS = int(os.environ.get('IYZICO_EVENTS_MAX_ATTEMPTS', '8'))
+IYZICO_EVENTS_RETRY_BASE = float(os.environ.get('IYZICO_EVENTS_RETRY_BASE', '15'))
+IYZICO_EVENTS_RETRY_MAX = float(os.environ.get('IYZICO_EVENTS_RETRY_MAX', '1800'))
+
+
+class RetryEvent(Exception):
+    """The event could not be applied yet and should be retried"""
+
+
+def webhook_event_key(body: Dict[str, Any], payload: bytes) -> str:
+    if body.get('iyziReferenceCode'):
+        return f"webhook:{body['iyziReferenceCode']}"
+    if body.get('paymentId'):
+        return f"payment:{body.get('iyziEventType')}:{body['paymentId']}"
+    return f"webhook:sha256:{hashlib.sha256(payload).hexdigest()}"
+
+
+class IyzicoEventStore(LeasedQueue):
+    """Idempotent store and worker for iyzico callbacks and webhooks"""
+
+    collection_name = 'payment_events'
+    done_status = 'processed'
+    tag = 'IYZICO-EVENTS'
+    created_field = 'received_at'
+
+    def __init__(self, db=None):
+        super().__init__(
+            db, concurrency=IYZICO_EVENTS_CONCURRENCY, poll=IYZICO_EVENTS_POLL, lease=IYZICO_EVENTS_LEASE,
+            max_attempts=IYZICO_EVENTS_MAX_ATTEMPTS, retry_base=IYZICO_EVENTS_RETRY_BASE,
+            retry_max=IYZICO_EVENTS_RETRY_MAX
+        )
+        self.stats.update({'received': 0, 'duplicates': 0})
+
+    async def ensure_indexes(self):
+        await self.db.payment_events.create_index('event_key', unique=True)
+        await self.db.payment_events.create_index([('status', 1), ('next_attempt_at', 1)])
+        await self.db.iyzico_sessions.create_index('token')
+        try:
+            await self.db.subscription_payments.create_index(
+                'payment_id', unique=True, partialFilterExpression={'payment_id': {'$type': 'string'}}
+            )
+        except OperationFailure as e:
+            # Duplicates recorded before the event store existed
+            logger.warning(f"[IYZICO-EVENTS] subscription_payments.payment_id not unique yet: {str(e)}")
+
+    # ---------- intake ----------
+
+    async def record(self, event_key: str, source: str, event_type: str = None,
+                     token: str = None, payload: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Store an inbound event; an event_key seen before returns the stored event"""
+        now = datetime.now(timezone.utc).isoformat()
+        event = {
+            'id': str(uuid4()),
+            'event_key': event_key,
+            'source': source,
+            'event_type': event_type,
+            'token': token,
+            'payload': payload or {},
+            'status': 'pending',
+            'attempts': 0,
+            'next_attempt_at': now,
+            'last_error': None,
+            'received_at': now
+        }
+        try:
+            await self.db.payment_events.insert_one(dict(event))
+        except DuplicateKeyError:
+            self.stats['duplicates'] += 1
+            existing = await self.db.payment_events.find_one({'event_key': event_key}, {'_id': 0})
+            return {'event_id': existing['id'], 'status': existing['status'], 'duplicate': True}
+        self.stats['received'] += 1
+        self.wake()
+        return {'event_id': event['id'], 'status': 'pending', 'duplicate': False}
+
+    # ---------- handlers ----------
+
+    async def _apply_checkout(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        token = event['token']
+        result = await iyzico_service.retrieve_checkout_result(token)
+        if result.get('status') == 'error':
+            # Connection problem or missing keys, iyzico did not answer
+            raise RetryEvent(result.get('message'))
+
+        if result.get('status') != 'success' or result.get('paymentStatus') != 'SUCCESS':
+            await self.db.iyzico_sessions.update_one(
+                {'token': token, 'status': {'$ne': 'completed'}},
+                {'$set': {
+                    'status': 'failed',
+                    'error': result.get('errorMessage'),
+                    'failed_at': datetime.now(timezone.utc).isoformat()
+                }}
+            )
+            logger.error(f"[IYZICO-EVENTS] Payment failed for token {token}: {result.get('errorMessage')}")
+            return {'payment': 'failed', 'error': result.get('errorMessage')}
+
+        payment_id = str(result.get('paymentId') or f"token:{token}")
+        completed_at = datetime.fromisoformat(event['received_at'])
+        session = await self.db.iyzico_sessions.find_one({'token': token}, {'_id': 0})
+        if session:
+            months = 12 if session.get('billing_cycle') == 'yearly' else 1
+            await self.db.companies.update_one(
+                {'id': session['company_id']},
+                {'$set': {
+                    'status': 'active',
+                    'subscription_plan': session['plan'],
+                    'billing_cycle': session['billing_cycle'],
+                    'subscription_start': completed_at.isoformat(),
+                    'subscription_end': (completed_at + timedelta(days=30 * months)).isoformat(),
+                    'last_payment_date': completed_at.isoformat(),
+                    'updated_at': datetime.now(timezone.utc).isoformat()
+                }}
+            )
+            await self._record_payment(payment_id, {
+                'company_id': session['company_id'],
+                'plan': session['plan'],
+                'billing_cycle': session['billing_cycle'],
+                'amount': session['amount'],
+                'payment_method': 'iyzico',
+                'created_at': completed_at.isoformat()
+            })
+            logger.info(f"[IYZICO-EVENTS] Payment completed for company {session['company_id']}: ₺{session['amount']}")
+
+        await self.db.iyzico_sessions.update_one(
+            {'token': token},
+            {'$set': {'status': 'completed', 'payment_id': payment_id, 'completed_at': completed_at.isoformat()}}
+        )
+        return {'payment': 'completed', 'payment_id': payment_id}
+
+    async def _apply_webhook(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        body = event['payload']
+        event_type = event.get('event_type')
+        subscription_ref = body.get('subscriptionReferenceCode')
+        company = await self.db.companies.find_one({'iyzico_subscription_ref': subscription_ref}, {'_id': 0})
+        if not company:
+            return {'ignored': 'company not found'}
+
+        if event_type == 'SUBSCRIPTION_PAYMENT_SUCCESS':
+            payment_id = str(body.get('paymentId') or event['event_key'])
+            if payment_id not in company.get('iyzico_payment_ids', []):
+                now = datetime.now(timezone.utc)
+                current_end = datetime.fromisoformat(
+                    company.get('subscription_end', now.isoformat()).replace('Z', '+00:00')
+                )
+                new_end = max(current_end, now) + timedelta(days=30)
+                # Guarded by the payment id and the subscription_end that was read
+                updated = await self.db.companies.update_one(
+                    {
+                        'id': company['id'],
+                        'subscription_end': company.get('subscription_end'),
+                        'iyzico_payment_ids': {'$ne': payment_id}
+                    },
+                    {
+                        '$set': {
+                            'subscription_end': new_end.isoformat(),
+                            'last_payment_date': now.isoformat(),
+                            'updated_at': now.isoformat()
+                        },
+                        '$push': {'iyzico_payment_ids': {'$each': [payment_id], '$slice': -50}}
+                    }
+                )
+                if not updated.modified_count:
+                    raise RetryEvent('company subscription changed concurrently')
+            await self._record_payment(payment_id, {
+                'company_id': company['id'],
+                'plan': company.get('subscription_plan', 'starter'),
+                'billing_cycle': 'monthly',
+                'amount': body.get('paidPrice', 0),
+                'payment_method': 'iyzico_recurring',
+                'created_at': event['received_at']
+            })
+            logger.info(f"[IYZICO-EVENTS] Recurring payment processed for {company['name']}")
+            return {'payment': 'completed', 'payment_id': payment_id}
+
+        if event_type == 'SUBSCRIPTION_CANCELLED':
+            await self.db.companies.update_one(
+                {'id': company['id']},
+                {'$set': {
+                    'status': 'suspended',
+                    'suspension_reason': 'Subscription cancelled',
+                    'updated_at': datetime.now(timezone.utc).isoformat()
+                }}
+            )
+            logger.info(f"[IYZICO-EVENTS] Subscription cancelled for {company['name']}")
+            return {'subscription': 'cancelled'}
+
+        return {'ignored': event_type}
+
+    async def _record_payment(self, payment_id: str, fields: Dict[str, Any]):
+        """Insert the subscription payment once per iyzico payment id"""
+        await self.db.subscription_payments.update_one(
+            {'payment_id': payment_id},
+            {'$setOnInsert': {
+                'id': str(uuid4()),
+                'payment_id': payment_id,
+                'currency': 'TRY',
+                'status': 'completed',
+                **fields
+            }},
+            upsert=True
+        )
+
+    # ---------- worker ----------
+
+    async def process(self, event: Dict[str, Any]):
+        try:
+            if event['source'] == 'callback':
+                outcome = await self._apply_checkout(event)
+            else:
+                outcome = await self._apply_webhook(event)
+        except RetryEvent as e:
+            await self.settle(event, error=str(e))
+            return
+        await self.settle(event, done={'result': outcome, 'processed_at': datetime.now(timezone.utc).isoformat()})
+
+
+# Singleton instance
+iyzico_events = IyzicoEventStore()
@@ -0,0 +1,184 @@
+"""
+KABİS Notification Outbox
+Rental notifications are written to kabis_notifications as 'pending' and
+the request returns at once; a background worker submits them to KABİS.
+
+- statuses: pending -> submitted | failed; pending_api when the company has
+  no active KABİS settings (manual notification, as before)
+- each notification has an idempotency_key unique within its company (deliveries use
+  "delivery:{reservation_id}"), so enqueuing twice returns the existing
+  entry and KABİS gets the key as Idempotency-Key on every attempt
+- the worker (services.leased_queue) claims due notifications with a lease
+  (locked_until) and submits at most KABIS_OUTBOX_CONCURRENCY at once over
+  one HTTP client
+- retryable failures (connection errors, 429, 5xx) back off exponentially
+  from KABIS_OUTBOX_RETRY_BASE up to KABIS_OUTBOX_RETRY_MAX seconds with
+  jitter; after KABIS_OUTBOX_MAX_ATTEMPTS, or on any other error, the
+  notification is marked failed and can be re-queued with retry()
+- metrics(): per-status counts plus age of the oldest pending notification
+
+MongoDB collection: kabis_notifications
+"""
+
+import os
+import logging
+from typing import Optional, Dict, Any
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import httpx
+from pymongo.errors import DuplicateKeyError
+
+from services.kabis_service import KabisService
+from services.leased_queue import LeasedQueue
+
+logger = logging.getLogger(__name__)
+
+KABIS_OUTBOX_CONCURRENCY = int(os.environ.get('KABIS_OUTBOX_CONCURRENCY', '4'))
+KABIS_OUTBOX_POLL = float(os.environ.get('KABIS_OUTBOX_POLL', '5'))
+KABIS_OUTBOX_LEASE = float(os.environ.get('KABIS_OUTBOX_LEASE', '120'))
+KABIS_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('KABIS_OUTBOX_MAX_ATTEMPTS', '8'))
+KABIS_OUTBOX_RETRY_BASE = float(os.environ.get('KABIS_OUTBOX_RETRY_BASE', '30'))
+KABIS_OUTBOX_RETRY_MAX = float(os.environ.get('KABIS_OUTBOX_RETRY_MAX', '3600'))
+KABIS_OUTBOX_TIMEOUT = float(os.environ.get('KABIS_OUTBOX_TIMEOUT', '30'))
+
+
+class KabisOutbox(LeasedQueue):
+    """Persistent queue of KABİS notifications with a submitting worker"""
+
+    collection_name = 'kabis_notifications'
+    done_status = 'submitted'
+    tag = 'KABIS-OUTBOX'
+
+    def __init__(self, db=None):
+        super().__init__(
+            db, concurrency=KABIS_OUTBOX_CONCURRENCY, poll=KABIS_OUTBOX_POLL, lease=KABIS_OUTBOX_LEASE,
+            max_attempts=KABIS_OUTBOX_MAX_ATTEMPTS, retry_base=KABIS_OUTBOX_RETRY_BASE,
+            retry_max=KABIS_OUTBOX_RETRY_MAX
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=KABIS_OUTBOX_TIMEOUT, limits=httpx.Limits(max_connections=KABIS_OUTBOX_CONCURRENCY * 2)
+            )
+        return self._client
+
+    async def ensure_indexes(self):
+        # Keys come from the client's Idempotency-Key header, so they are only unique per company
+        if 'idempotency_key_1' in await self.db.kabis_notifications.index_information():
+            await self.db.kabis_notifications.drop_index('idempotency_key_1')
+        await self.db.kabis_notifications.create_index(
+            [('company_id', 1), ('idempotency_key', 1)], unique=True,
+            partialFilterExpression={'idempotency_key': {'$type': 'string'}}
+        )
+        await self.db.kabis_notifications.create_index([('status', 1), ('next_attempt_at', 1)])
+        await self.db.kabis_notifications.create_index([('company_id', 1), ('created_at', -1)])
+
+    async def _settings(self, company_id: str) -> Optional[Dict[str, Any]]:
+        settings = await self.db.integration_settings.find_one(
+            {'company_id': company_id, 'type': 'kabis'}, {'_id': 0}
+        )
+        return settings if settings and settings.get('is_active') else None
+
+    # ---------- enqueue ----------
+
+    async def enqueue(self, company_id: str, rental_data: Dict[str, Any], idempotency_key: str = None,
+                      reservation_id: str = None, created_by: str = None) -> Dict[str, Any]:
+        """Store a notification for the worker; an existing idempotency_key returns that entry"""
+        error = KabisService.validate_rental_data(rental_data)
+        if error:
+            return {'success': False, 'error': error}
+
+        now = datetime.now(timezone.utc).isoformat()
+        settings = await self._settings(company_id)
+        notification = {
+            'id': str(uuid4()),
+            'company_id': company_id,
+            'reservation_id': reservation_id,
+            'rental_data': rental_data,
+            'idempotency_key': idempotency_key or str(uuid4()),
+            'status': 'pending' if settings else 'pending_api',
+            'source': 'outbox' if settings else 'local',
+            'attempts': 0,
+            'next_attempt_at': now,
+            'last_error': None,
+            'created_at': now,
+            'created_by': created_by
+        }
+        try:
+            await self.db.kabis_notifications.insert_one(dict(notification))
+        except DuplicateKeyError:
+            existing = await self.db.kabis_notifications.find_one(
+                {'company_id': company_id, 'idempotency_key': notification['idempotency_key']}, {'_id': 0}
+            )
+            return {'success': True, 'duplicate': True, 'notification_id': existing['id'], 'status': existing['status']}
+
+        if settings:
+            self.wake()
+            message = 'Bildirim kuyruğa alındı, KABİS\'e gönderilecek'
+        else:
+            message = 'Bildirim kaydedildi (KABİS API yapılandırılmamış - manuel bildirim gerekli)'
+        return {
+            'success': True,
+            'notification_id': notification['id'],
+            'status': notification['status'],
+            'message': message,
+            'created_at': now
+        }
+
+    async def retry(self, notification_id: str, company_id: str = None) -> bool:
+        """Re-queue a failed notification"""
+        query = {'id': notification_id, 'status': 'failed'}
+        if company_id:
+            query['company_id'] = company_id
+        result = await self.db.kabis_notifications.update_one(query, {'$set': {
+            'status': 'pending', 'attempts': 0, 'next_attempt_at': datetime.now(timezone.utc).isoformat()
+        }})
+        if result.modified_count:
+            self.wake()
+        return result.modified_count > 0
+
+    # ---------- worker ----------
+
+    async def process(self, notification: Dict[str, Any]):
+        settings = await self._settings(notification['company_id'])
+        if not settings:
+            await self.collection.update_one(
+                {'id': notification['id']},
+                {'$set': {'status': 'pending_api', 'source': 'local', 'locked_until': None}}
+            )
+            return
+
+        kabis = KabisService(
+            api_key=settings.get('api_key'),
+            firma_kodu=settings.get('firma_kodu'),
+            api_url=settings.get('api_url'),
+            client=self.client
+        )
+        result = await kabis.submit_notification(notification['rental_data'], notification['idempotency_key'])
+        if result.get('success'):
+            await self.settle(notification, done={
+                'source': 'kabis_api',
+                'kabis_notification_no': result.get('notification_no'),
+                'kabis_response': result.get('kabis_response'),
+                'submitted_at': datetime.now(timezone.utc).isoformat(),
+            })
+        else:
+            await self.settle(notification, error=result.get('error'), retryable=bool(result.get('retryable')))
+
+    async def stop(self):
+        await super().stop()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def metrics(self, company_id: str = None) -> Dict[str, Any]:
+        """Outbox depth per status and age of the oldest pending notification"""
+        return await super().metrics({'company_id': company_id} if company_id else None)
+
+
+# Singleton instance
+kabis_outbox = KabisOutbox()
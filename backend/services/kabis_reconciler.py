@@ -0,0 +1,202 @@
+"""
+KABİS Status Reconciliation
+Periodically asks KABİS for the status of submitted notifications so
+kabis_notifications.status follows what the ministry did with them.
+
+- candidates: status 'submitted' whose status_checked_at is older than
+  KABIS_RECONCILE_RECHECK seconds (status / company_id / status_checked_at
+  index), at most KABIS_RECONCILE_BATCH per company per run
+- at most KABIS_RECONCILE_CONCURRENCY status calls run at once, and each
+  company's KABİS account gets at most KABIS_RECONCILE_COMPANY_RPS calls
+  per second
+- results are written with one bulk_write per run; KABİS states map to
+  approved / rejected / cancelled (final) or stay submitted, the raw value
+  is kept in kabis_status
+
+Run scripts/kabis_reconcile_benchmark.py against scripts/fake_kabis.py to
+measure throughput.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Optional, Dict, Any, List
+from datetime import datetime, timezone, timedelta
+
+import httpx
+from pymongo import UpdateOne
+
+from services.kabis_service import KabisService
+
+logger = logging.getLogger(__name__)
+
+KABIS_RECONCILE_INTERVAL = float(os.environ.get('KABIS_RECONCILE_INTERVAL', '300'))
+KABIS_RECONCILE_RECHECK = float(os.environ.get('KABIS_RECONCILE_RECHECK', '900'))
+KABIS_RECONCILE_BATCH = int(os.environ.get('KABIS_RECONCILE_BATCH', '200'))
+KABIS_RECONCILE_CONCURRENCY = int(os.environ.get('KABIS_RECONCILE_CONCURRENCY', '8'))
+KABIS_RECONCILE_COMPANY_RPS = float(os.environ.get('KABIS_RECONCILE_COMPANY_RPS', '2'))
+
+# KABİS durum -> notification status
+KABIS_STATUS_MAP = {
+    'onaylandi': 'approved', 'onaylandı': 'approved', 'approved': 'approved', 'accepted': 'approved',
+    'reddedildi': 'rejected', 'rejected': 'rejected',
+    'iptal': 'cancelled', 'iptal_edildi': 'cancelled', 'cancelled': 'cancelled',
+}
+
+
+class CompanyRateLimiter:
+    """Spaces calls of one company at least 1/rps seconds apart"""
+
+    def __init__(self, rps: float):
+        self.interval = 1.0 / rps if rps > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class KabisReconciler:
+    """Background status sync for submitted KABİS notifications"""
+
+    def __init__(self, db=None, concurrency: int = KABIS_RECONCILE_CONCURRENCY,
+                 company_rps: float = KABIS_RECONCILE_COMPANY_RPS):
+        self.db = db
+        self.concurrency = concurrency
+        self.company_rps = company_rps
+        self._limiters: Dict[str, CompanyRateLimiter] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._run_lock = asyncio.Lock()
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    def set_db(self, db):
+        """Database bağlantısını ayarla"""
+        self.db = db
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=15, limits=httpx.Limits(max_connections=self.concurrency * 2))
+        return self._client
+
+    async def ensure_indexes(self):
+        await self.db.kabis_notifications.create_index([('status', 1), ('company_id', 1), ('status_checked_at', 1)])
+
+    async def _candidates(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Due submitted notifications grouped by company"""
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=KABIS_RECONCILE_RECHECK)).isoformat()
+        due = {'status': 'submitted', '$or': [{'status_checked_at': None}, {'status_checked_at': {'$lt': cutoff}}]}
+        companies = await self.db.kabis_notifications.distinct('company_id', due)
+        grouped = {}
+        for company_id in companies:
+            grouped[company_id] = await self.db.kabis_notifications.find(
+                {**due, 'company_id': company_id},
+                {'_id': 0, 'id': 1, 'kabis_notification_no': 1}
+            ).sort('status_checked_at', 1).limit(KABIS_RECONCILE_BATCH).to_list(KABIS_RECONCILE_BATCH)
+        return grouped
+
+    async def run_once(self) -> Dict[str, Any]:
+        async with self._run_lock:
+            started = time.monotonic()
+            grouped = await self._candidates()
+            settings = {
+                s['company_id']: s for s in await self.db.integration_settings.find(
+                    {'type': 'kabis', 'is_active': True, 'company_id': {'$in': list(grouped)}}, {'_id': 0}
+                ).to_list(None)
+            }
+            slots = asyncio.Semaphore(self.concurrency)
+            updates: List[UpdateOne] = []
+            counts = {'checked': 0, 'changed': 0, 'errors': 0}
+
+            async def check(kabis: KabisService, limiter: CompanyRateLimiter, notification: Dict[str, Any]):
+                await limiter.wait()
+                async with slots:
+                    result = await kabis.get_notification_status(
+                        notification.get('kabis_notification_no') or notification['id']
+                    )
+                now = datetime.now(timezone.utc).isoformat()
+                counts['checked'] += 1
+                if not result.get('success'):
+                    counts['errors'] += 1
+                    updates.append(UpdateOne({'id': notification['id']}, {'$set': {
+                        'status_checked_at': now, 'status_error': result.get('error')
+                    }}))
+                    return
+                raw = str(result.get('durum') or result.get('status') or '').strip().lower()
+                status = KABIS_STATUS_MAP.get(raw, 'submitted')
+                if status != 'submitted':
+                    counts['changed'] += 1
+                updates.append(UpdateOne({'id': notification['id'], 'status': 'submitted'}, {'$set': {
+                    'status': status, 'kabis_status': raw or None, 'status_checked_at': now, 'status_error': None
+                }}))
+
+            jobs = []
+            for company_id, notifications in grouped.items():
+                company = settings.get(company_id)
+                if not company:
+                    continue
+                kabis = KabisService(
+                    api_key=company.get('api_key'),
+                    firma_kodu=company.get('firma_kodu'),
+                    api_url=company.get('api_url'),
+                    client=self.client
+                )
+                limiter = self._limiters.setdefault(company_id, CompanyRateLimiter(self.company_rps))
+                jobs.extend(check(kabis, limiter, n) for n in notifications)
+            await asyncio.gather(*jobs)
+
+            if updates:
+                await self.db.kabis_notifications.bulk_write(updates, ordered=False)
+
+            duration = time.monotonic() - started
+            self.last_run = {
+                'at': datetime.now(timezone.utc).isoformat(),
+                'companies': len(grouped),
+                **counts,
+                'duration_seconds': round(duration, 2),
+                'per_second': round(counts['checked'] / duration, 1) if duration > 0 else None,
+            }
+            if counts['checked']:
+                logger.info(f"[KABIS-RECONCILE] {counts['checked']} checked, {counts['changed']} changed, "
+                            f"{counts['errors']} errors in {self.last_run['duration_seconds']}s")
+            return self.last_run
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"[KABIS-RECONCILE] Run failed: {str(e)}")
+            await asyncio.sleep(KABIS_RECONCILE_INTERVAL)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            'interval_seconds': KABIS_RECONCILE_INTERVAL,
+            'recheck_seconds': KABIS_RECONCILE_RECHECK,
+            'concurrency': self.concurrency,
+            'company_rps': self.company_rps,
+            'last_run': self.last_run,
+        }
+
+
+# Singleton instance
+kabis_reconciler = KabisReconciler()
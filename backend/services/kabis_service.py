@@ -32,15 +32,19 @@ class KabisService:
     - api_url: KABİS API URL
     """
     
-    def __init__(self, api_key: str = None, firma_kodu: str = None, api_url: str = None):
+    def __init__(self, api_key: str = None, firma_kodu: str = None, api_url: str = None,
+                 client: Optional[httpx.AsyncClient] = None):
         self.api_key = api_key or os.environ.get('KABIS_API_KEY', '')
         self.firma_kodu = firma_kodu or os.environ.get('KABIS_FIRMA_KODU', '')
         self.api_url = api_url or os.environ.get('KABIS_API_URL', 'https://api.kabis.uab.gov.tr/v1')
         self.is_configured = bool(self.api_key and self.firma_kodu)
+        # Shared client of the outbox worker; None = one client per call
+        self.client = client
     
-    async def create_rental_notification(self, rental_data: Dict[str, Any]) -> Dict[str, Any]:
+    @staticmethod
+    def validate_rental_data(rental_data: Dict[str, Any]) -> Optional[str]:
         """
-        Kiralama bildirimi oluştur
+        Bildirim verisini doğrula, hata mesajı döner (geçerliyse None)
         
         Required fields:
         - vehicle_plate: Araç plakası
@@ -52,24 +56,77 @@ class KabisService:
         - pickup_location: Alış lokasyonu
         - dropoff_location: İade lokasyonu
         """
-        
-        # Validate required fields
         required_fields = ['vehicle_plate', 'customer_tc', 'customer_name', 
                           'rental_start', 'rental_end']
         missing = [f for f in required_fields if not rental_data.get(f)]
         if missing:
             missing_str = ', '.join(missing)
-            return {
-                'success': False,
-                'error': f'Eksik alanlar: {missing_str}'
-            }
+            return f'Eksik alanlar: {missing_str}'
         
         # Validate TC Kimlik No (11 digits)
         tc = str(rental_data.get('customer_tc', ''))
         if len(tc) != 11 or not tc.isdigit():
+            return 'Geçersiz T.C. Kimlik No (11 haneli olmalı)'
+        return None
+    
+    async def submit_notification(self, rental_data: Dict[str, Any], idempotency_key: str) -> Dict[str, Any]:
+        """
+        Bildirimi KABİS'e gönder (outbox worker)
+        
+        The Idempotency-Key header lets KABİS drop a resend of a notification
+        it already accepted. 'retryable' tells the caller whether trying
+        again later can help (timeouts, 429, 5xx).
+        """
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'X-Firma-Kodu': self.firma_kodu,
+            'Content-Type': 'application/json',
+            'Idempotency-Key': idempotency_key
+        }
+        payload = {
+            'plaka': rental_data['vehicle_plate'],
+            'kiraci_tc': rental_data['customer_tc'],
+            'kiraci_ad_soyad': rental_data['customer_name'],
+            'kiraci_telefon': rental_data.get('customer_phone', ''),
+            'kiralama_baslangic': rental_data['rental_start'],
+            'kiralama_bitis': rental_data['rental_end'],
+            'alis_lokasyon': rental_data.get('pickup_location', ''),
+            'iade_lokasyon': rental_data.get('dropoff_location', ''),
+            'firma_kodu': self.firma_kodu
+        }
+        try:
+            if self.client is not None:
+                response = await self.client.post(f'{self.api_url}/bildirim', headers=headers, json=payload)
+            else:
+                async with httpx.AsyncClient(timeout=30) as client:
+                    response = await client.post(f'{self.api_url}/bildirim', headers=headers, json=payload)
+        except httpx.HTTPError as e:
+            return {'success': False, 'retryable': True, 'error': f'Bağlantı hatası: {str(e)}'}
+        
+        if response.status_code in [200, 201]:
+            result = response.json()
+            return {
+                'success': True,
+                'notification_no': result.get('bildirim_no'),
+                'kabis_response': result
+            }
+        return {
+            'success': False,
+            'retryable': response.status_code == 429 or response.status_code >= 500,
+            'status_code': response.status_code,
+            'error': f'KABİS API hatası: {response.status_code}',
+            'details': response.text[:1000]
+        }
+    
+    async def create_rental_notification(self, rental_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Kiralama bildirimi oluştur (istek içinde, senkron)
+        """
+        error = self.validate_rental_data(rental_data)
+        if error:
             return {
                 'success': False,
-                'error': 'Geçersiz T.C. Kimlik No (11 haneli olmalı)'
+                'error': error
             }
         
         notification_id = str(uuid4())
@@ -87,58 +144,23 @@ class KabisService:
                 'data': rental_data
             }
         
-        try:
-            # KABİS API call
-            async with httpx.AsyncClient(timeout=30) as client:
-                headers = {
-                    'Authorization': f'Bearer {self.api_key}',
-                    'X-Firma-Kodu': self.firma_kodu,
-                    'Content-Type': 'application/json'
-                }
-                
-                payload = {
-                    'plaka': rental_data['vehicle_plate'],
-                    'kiraci_tc': rental_data['customer_tc'],
-                    'kiraci_ad_soyad': rental_data['customer_name'],
-                    'kiraci_telefon': rental_data.get('customer_phone', ''),
-                    'kiralama_baslangic': rental_data['rental_start'],
-                    'kiralama_bitis': rental_data['rental_end'],
-                    'alis_lokasyon': rental_data.get('pickup_location', ''),
-                    'iade_lokasyon': rental_data.get('dropoff_location', ''),
-                    'firma_kodu': self.firma_kodu
-                }
-                
-                response = await client.post(
-                    f'{self.api_url}/bildirim',
-                    headers=headers,
-                    json=payload
-                )
-                
-                if response.status_code in [200, 201]:
-                    result = response.json()
-                    return {
-                        'success': True,
-                        'notification_id': result.get('bildirim_no', notification_id),
-                        'status': 'submitted',
-                        'message': 'Bildirim KABIS sistemine basariyla gonderildi',
-                        'source': 'kabis_api',
-                        'kabis_response': result,
-                        'created_at': now
-                    }
-                else:
-                    logger.error(f'KABİS API error: {response.status_code} - {response.text}')
-                    return {
-                        'success': False,
-                        'error': f'KABİS API hatası: {response.status_code}',
-                        'details': response.text
-                    }
-                    
-        except Exception as e:
-            logger.error(f'KABİS connection error: {str(e)}')
+        result = await self.submit_notification(rental_data, notification_id)
+        if result.get('success'):
             return {
-                'success': False,
-                'error': f'Bağlantı hatası: {str(e)}'
+                'success': True,
+                'notification_id': result.get('notification_no') or notification_id,
+                'status': 'submitted',
+                'message': 'Bildirim KABIS sistemine basariyla gonderildi',
+                'source': 'kabis_api',
+                'kabis_response': result.get('kabis_response'),
+                'created_at': now
             }
+        logger.error(f"KABİS API error: {result.get('error')} - {result.get('details', '')}")
+        return {
+            'success': False,
+            'error': result.get('error'),
+            'details': result.get('details')
+        }
     
     async def cancel_notification(self, notification_id: str, reason: str = '') -> Dict[str, Any]:
         """
@@ -189,23 +211,23 @@ class KabisService:
                 'message': 'KABİS API yapılandırılmamış'
             }
         
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'X-Firma-Kodu': self.firma_kodu
+        }
         try:
-            async with httpx.AsyncClient(timeout=30) as client:
-                headers = {
-                    'Authorization': f'Bearer {self.api_key}',
-                    'X-Firma-Kodu': self.firma_kodu
+            if self.client is not None:
+                response = await self.client.get(f'{self.api_url}/bildirim/{notification_id}', headers=headers)
+            else:
+                async with httpx.AsyncClient(timeout=30) as client:
+                    response = await client.get(f'{self.api_url}/bildirim/{notification_id}', headers=headers)
+            
+            if response.status_code == 200:
+                return {
+                    'success': True,
+                    **response.json()
                 }
-                
-                response = await client.get(
-                    f'{self.api_url}/bildirim/{notification_id}',
-                    headers=headers
-                )
-                
-                if response.status_code == 200:
-                    return {
-                        'success': True,
-                        **response.json()
-                    }
+            return {'success': False, 'status_code': response.status_code, 'error': 'Durum sorgulanamadı'}
                     
         except Exception as e:
             logger.error(f'KABİS status error: {str(e)}')
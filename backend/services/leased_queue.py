@@ -0,0 +1,191 @@
+"""
+Leased Job Queue
+Base for background workers that process documents of one MongoDB
+collection as jobs (KABİS outbox, iyzico payment events).
+
+- a job is a document with id, status 'pending', attempts, next_attempt_at
+  and locked_until; the worker claims due jobs with a lease so a crashed
+  run is picked up again once the lease expires
+- at most `concurrency` jobs are processed at once; wake() starts a drain
+  immediately, otherwise the collection is polled every `poll` seconds
+- settle() records the outcome: done_status on success, a retry with
+  exponential backoff (+-20% jitter, from retry_base up to retry_max
+  seconds), or 'failed' after max_attempts / a non-retryable error; an
+  exception raised by process() is settled as a retryable error
+
+Subclasses set collection_name, done_status and tag and implement process().
+"""
+
+import random
+import asyncio
+import logging
+from typing import Optional, Dict, Any
+from datetime import datetime, timezone, timedelta
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+
+class LeasedQueue:
+    """Leased, retrying worker over the pending documents of one collection"""
+
+    collection_name = ''
+    done_status = 'done'
+    tag = 'QUEUE'
+    created_field = 'created_at'
+
+    def __init__(self, db=None, concurrency: int = 4, poll: float = 5, lease: float = 120,
+                 max_attempts: int = 8, retry_base: float = 30, retry_max: float = 3600):
+        self.db = db
+        self.concurrency = concurrency
+        self.poll = poll
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(concurrency)
+        self._inflight: set = set()
+        self.stats = {self.done_status: 0, 'retried': 0, 'failed': 0}
+
+    def set_db(self, db):
+        """Database bağlantısını ayarla"""
+        self.db = db
+
+    @property
+    def collection(self):
+        return self.db[self.collection_name]
+
+    def retry_delay(self, attempts: int) -> float:
+        """Seconds before attempt number attempts + 1: exponential with +-20% jitter"""
+        delay = min(self.retry_base * 2 ** (attempts - 1), self.retry_max)
+        return delay * random.uniform(0.8, 1.2)
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def process(self, job: Dict[str, Any]):
+        """Handle one claimed job and settle() it; an exception is settled as a retryable error"""
+        raise NotImplementedError
+
+    async def settle(self, job: Dict[str, Any], done: Optional[Dict[str, Any]] = None,
+                     error: str = None, retryable: bool = True):
+        """Store the outcome of one attempt: done fields on success, otherwise a retry or failure"""
+        now = datetime.now(timezone.utc)
+        attempts = job.get('attempts', 0) + 1
+        if done is not None:
+            self.stats[self.done_status] += 1
+            update = {'status': self.done_status, 'last_error': None, **done}
+        elif retryable and attempts < self.max_attempts:
+            self.stats['retried'] += 1
+            update = {
+                'last_error': error,
+                'next_attempt_at': (now + timedelta(seconds=self.retry_delay(attempts))).isoformat(),
+            }
+        else:
+            self.stats['failed'] += 1
+            update = {'status': 'failed', 'last_error': error, 'failed_at': now.isoformat()}
+            logger.warning(f"[{self.tag}] {job['id']} failed after {attempts} attempts: {error}")
+
+        await self.collection.update_one(
+            {'id': job['id']},
+            {'$set': {**update, 'attempts': attempts, 'last_attempt_at': now.isoformat(), 'locked_until': None}}
+        )
+
+    # ---------- worker ----------
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        now = datetime.now(timezone.utc)
+        return await self.collection.find_one_and_update(
+            {
+                'status': 'pending',
+                'next_attempt_at': {'$lte': now.isoformat()},
+                '$or': [{'locked_until': None}, {'locked_until': {'$lt': now.isoformat()}}]
+            },
+            {'$set': {'locked_until': (now + timedelta(seconds=self.lease)).isoformat()}},
+            sort=[('next_attempt_at', 1)],
+            projection={'_id': 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _run(self, job: Dict[str, Any]):
+        try:
+            await self.process(job)
+        except Exception as e:
+            # Counts as a failed attempt so max_attempts still applies
+            logger.error(f"[{self.tag}] Processing error for {job['id']}: {str(e)}")
+            try:
+                await self.settle(job, error=str(e))
+            except Exception as settle_error:
+                # The lease expires and the job is picked up again
+                logger.error(f"[{self.tag}] Could not settle {job['id']}: {str(settle_error)}")
+        finally:
+            self._slots.release()
+
+    async def drain(self) -> int:
+        """Start processing every due job, up to the concurrency limit at a time"""
+        started = 0
+        while True:
+            await self._slots.acquire()
+            try:
+                job = await self._claim()
+            except Exception:
+                self._slots.release()
+                raise
+            if not job:
+                self._slots.release()
+                return started
+            task = asyncio.get_running_loop().create_task(self._run(job))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+            started += 1
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.drain()
+            except Exception as e:
+                logger.error(f"[{self.tag}] Loop error: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+            logger.info(f"[{self.tag}] Started (concurrency {self.concurrency})")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for task in list(self._inflight):
+            task.cancel()
+
+    # ---------- metrics ----------
+
+    async def metrics(self, match: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Queue depth per status and age of the oldest pending job"""
+        groups = await self.collection.aggregate([
+            {'$match': match or {}},
+            {'$group': {'_id': '$status', 'count': {'$sum': 1}, 'oldest': {'$min': f"${self.created_field}"}}}
+        ]).to_list(None)
+        by_status = {g['_id']: g for g in groups}
+
+        oldest = (by_status.get('pending') or {}).get('oldest')
+        oldest_age = None
+        if oldest:
+            oldest_age = round((datetime.now(timezone.utc) - datetime.fromisoformat(oldest)).total_seconds())
+        return {
+            'depth': (by_status.get('pending') or {}).get('count', 0),
+            'oldest_pending_age_seconds': oldest_age,
+            'by_status': {status: g['count'] for status, g in by_status.items()},
+            'in_flight': len(self._inflight),
+            'concurrency': self.concurrency,
+            'running': self._task is not None,
+            **self.stats,
+        }
@@ -0,0 +1,406 @@
+"""
+Tenant Placement Scheduler
+Spreads tenant stacks over several Docker hosts managed by one Portainer.
+
+- endpoints come from PLACEMENT_ENDPOINTS (JSON) and the placement_endpoints
+  collection: {endpoint_id, name, server_ip, enabled, max_memory_fraction, max_containers}
+- capacity per endpoint from docker info (memory, CPUs, containers) plus
+  one-shot container stats (memory in use, recent CPU)
+- new tenants go to the least-loaded eligible endpoint; placements still
+  starting count with an estimated footprint so parallel provisions spread out
+- the chosen endpoint is stored on the company (portainer_endpoint_id, server_ip)
+  and every lifecycle call goes through portainer_for(company)
+- migrate() moves a tenant stack and its data to another endpoint
+
+MongoDB collection: placement_endpoints
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Optional, Dict, Any, List
+from datetime import datetime, timezone
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from services.portainer_service import (
+    portainer_service, portainer_for, PORTAINER_ENDPOINT_ID, SERVER_IP
+)
+from services.tenant_mongo import tenant_mongo, copy_database, tenant_db_name
+from services.traefik_routes import traefik_for, tenant_router_names
+
+logger = logging.getLogger(__name__)
+
+PLACEMENT_ENDPOINTS = os.environ.get(
+    'PLACEMENT_ENDPOINTS',
+    json.dumps([{'endpoint_id': PORTAINER_ENDPOINT_ID, 'name': 'default', 'server_ip': SERVER_IP}])
+)
+PLACEMENT_MAX_MEMORY_FRACTION = float(os.environ.get('PLACEMENT_MAX_MEMORY_FRACTION', '0.85'))
+PLACEMENT_MAX_CONTAINERS = int(os.environ.get('PLACEMENT_MAX_CONTAINERS', '400'))
+# Footprint assumed for a tenant whose containers are not visible in stats yet
+PLACEMENT_TENANT_MEMORY_MB = int(os.environ.get('PLACEMENT_TENANT_MEMORY_MB', '700'))
+PLACEMENT_PENDING_SECONDS = float(os.environ.get('PLACEMENT_PENDING_SECONDS', '600'))
+PLACEMENT_CAPACITY_TTL = float(os.environ.get('PLACEMENT_CAPACITY_TTL', '60'))
+PLACEMENT_STATS_CONCURRENCY = int(os.environ.get('PLACEMENT_STATS_CONCURRENCY', '8'))
+
+# Score weights: memory is what runs out first on tenant hosts
+SCORE_WEIGHTS = {'memory': 0.6, 'cpu': 0.3, 'containers': 0.1}
+
+
+def container_memory_bytes(stats: Dict[str, Any]) -> int:
+    """Docker stats memory use without reclaimable page cache (cgroup v1 and v2)"""
+    memory = stats.get('memory_stats') or {}
+    detail = memory.get('stats') or {}
+    cache = detail.get('inactive_file', detail.get('cache', 0))
+    return max(memory.get('usage', 0) - cache, 0)
+
+
+def container_cpu_percent(stats: Dict[str, Any]) -> float:
+    """CPU use over the stats sampling window, 100 = one full core"""
+    cpu, precpu = stats.get('cpu_stats') or {}, stats.get('precpu_stats') or {}
+    cpu_delta = (cpu.get('cpu_usage') or {}).get('total_usage', 0) - (precpu.get('cpu_usage') or {}).get('total_usage', 0)
+    system_delta = cpu.get('system_cpu_usage', 0) - precpu.get('system_cpu_usage', 0)
+    if cpu_delta <= 0 or system_delta <= 0:
+        return 0.0
+    return cpu_delta / system_delta * cpu.get('online_cpus', 1) * 100
+
+
+class PlacementScheduler:
+    """Least-loaded placement of tenant stacks across Portainer endpoints"""
+
+    def __init__(self, portainer, db=None):
+        self.portainer = portainer
+        self.db = db
+        self._capacity: Dict[int, Dict[str, Any]] = {}
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = asyncio.Lock()
+
+    def set_db(self, db):
+        """Database bağlantısını ayarla"""
+        self.db = db
+
+    # ---------- endpoints ----------
+
+    async def ensure_endpoints(self):
+        """Seed placement_endpoints from PLACEMENT_ENDPOINTS without overwriting edits"""
+        if self.db is None:
+            return
+        await self.db.placement_endpoints.create_index('endpoint_id', unique=True)
+        for endpoint in json.loads(PLACEMENT_ENDPOINTS):
+            await self.db.placement_endpoints.update_one(
+                {'endpoint_id': int(endpoint['endpoint_id'])},
+                {'$setOnInsert': {
+                    'name': endpoint.get('name') or f"endpoint-{endpoint['endpoint_id']}",
+                    'server_ip': endpoint['server_ip'],
+                    'enabled': endpoint.get('enabled', True),
+                    'max_memory_fraction': endpoint.get('max_memory_fraction'),
+                    'max_containers': endpoint.get('max_containers'),
+                    'created_at': datetime.now(timezone.utc).isoformat()
+                }},
+                upsert=True
+            )
+
+    async def get_endpoints(self) -> List[Dict[str, Any]]:
+        if self.db is None:
+            return [{'enabled': True, **e, 'endpoint_id': int(e['endpoint_id'])} for e in json.loads(PLACEMENT_ENDPOINTS)]
+        return await self.db.placement_endpoints.find({}, {'_id': 0}).sort('endpoint_id', 1).to_list(100)
+
+    async def upsert_endpoint(self, endpoint_id: int, server_ip: str, name: str = None, enabled: bool = True,
+                              max_memory_fraction: float = None, max_containers: int = None) -> Dict[str, Any]:
+        await self.db.placement_endpoints.update_one(
+            {'endpoint_id': endpoint_id},
+            {'$set': {
+                'name': name or f"endpoint-{endpoint_id}",
+                'server_ip': server_ip,
+                'enabled': enabled,
+                'max_memory_fraction': max_memory_fraction,
+                'max_containers': max_containers,
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            }},
+            upsert=True
+        )
+        self._capacity.pop(endpoint_id, None)
+        return await self.db.placement_endpoints.find_one({'endpoint_id': endpoint_id}, {'_id': 0})
+
+    # ---------- capacity ----------
+
+    async def _measure(self, endpoint: Dict[str, Any]) -> Dict[str, Any]:
+        endpoint_id = endpoint['endpoint_id']
+        view = self.portainer.for_endpoint(endpoint_id, endpoint['server_ip'])
+        info, containers = await asyncio.gather(
+            view._request('GET', f"endpoints/{endpoint_id}/docker/info"),
+            view._request('GET', f"endpoints/{endpoint_id}/docker/containers/json")
+        )
+        if not isinstance(info, dict) or 'MemTotal' not in info or not isinstance(containers, list):
+            error = info.get('error') if isinstance(info, dict) else 'unexpected response'
+            return {'endpoint_id': endpoint_id, 'reachable': False, 'error': error}
+
+        slots = asyncio.Semaphore(PLACEMENT_STATS_CONCURRENCY)
+
+        async def sample(container):
+            async with slots:
+                stats = await view._request(
+                    'GET', f"endpoints/{endpoint_id}/docker/containers/{container['Id']}/stats?stream=false"
+                )
+            if not isinstance(stats, dict) or 'memory_stats' not in stats:
+                return 0, 0.0
+            return container_memory_bytes(stats), container_cpu_percent(stats)
+
+        samples = await asyncio.gather(*(sample(c) for c in containers))
+        mem_total = info['MemTotal']
+        cpus = info.get('NCPU') or 1
+        mem_used = sum(m for m, _ in samples)
+        return {
+            'endpoint_id': endpoint_id,
+            'reachable': True,
+            'mem_total_bytes': mem_total,
+            'mem_used_bytes': mem_used,
+            'memory_fraction': round(mem_used / mem_total, 4) if mem_total else 1.0,
+            'cpus': cpus,
+            'cpu_fraction': round(sum(c for _, c in samples) / (cpus * 100), 4),
+            'containers_running': info.get('ContainersRunning', len(containers)),
+            'containers_total': info.get('Containers', len(containers)),
+            'measured_at': time.monotonic(),
+        }
+
+    async def capacity(self, endpoint: Dict[str, Any], fresh: bool = False) -> Dict[str, Any]:
+        cached = self._capacity.get(endpoint['endpoint_id'])
+        if not fresh and cached and time.monotonic() - cached['measured_at'] < PLACEMENT_CAPACITY_TTL:
+            return cached
+        measured = await self._measure(endpoint)
+        if measured.get('reachable'):
+            self._capacity[endpoint['endpoint_id']] = measured
+        return measured
+
+    def _pending_count(self, endpoint_id: int) -> int:
+        now = time.monotonic()
+        self._pending = [p for p in self._pending if p['expires_at'] > now]
+        return sum(1 for p in self._pending if p['endpoint_id'] == endpoint_id)
+
+    def _evaluate(self, endpoint: Dict[str, Any], capacity: Dict[str, Any]) -> Dict[str, Any]:
+        """Effective load including pending placements, eligibility and score"""
+        result = {**endpoint, **capacity}
+        result.pop('measured_at', None)
+        if not capacity.get('reachable'):
+            return {**result, 'eligible': False, 'reason': 'unreachable'}
+
+        pending = self._pending_count(endpoint['endpoint_id'])
+        reserved = pending * PLACEMENT_TENANT_MEMORY_MB * 1024 * 1024
+        memory = (capacity['mem_used_bytes'] + reserved) / capacity['mem_total_bytes']
+        containers = capacity['containers_total'] + pending * 5
+        max_memory = endpoint.get('max_memory_fraction') or PLACEMENT_MAX_MEMORY_FRACTION
+        max_containers = endpoint.get('max_containers') or PLACEMENT_MAX_CONTAINERS
+        headroom = PLACEMENT_TENANT_MEMORY_MB * 1024 * 1024 / capacity['mem_total_bytes']
+
+        reason = None
+        if not endpoint.get('enabled', True):
+            reason = 'disabled'
+        elif memory + headroom > max_memory:
+            reason = 'memory'
+        elif containers + 5 > max_containers:
+            reason = 'containers'
+
+        score = (
+            SCORE_WEIGHTS['memory'] * memory
+            + SCORE_WEIGHTS['cpu'] * min(capacity['cpu_fraction'], 1.0)
+            + SCORE_WEIGHTS['containers'] * containers / max_containers
+        )
+        return {
+            **result,
+            'pending_placements': pending,
+            'effective_memory_fraction': round(memory, 4),
+            'score': round(score, 4),
+            'eligible': reason is None,
+            'reason': reason,
+        }
+
+    async def overview(self, fresh: bool = False) -> List[Dict[str, Any]]:
+        """Every endpoint with capacity, score and tenant count"""
+        endpoints = await self.get_endpoints()
+        capacities = await asyncio.gather(*(self.capacity(e, fresh) for e in endpoints))
+        tenants: Dict[Any, int] = {}
+        if self.db is not None:
+            for row in await self.db.companies.aggregate([
+                {'$match': {'portainer_stack_id': {'$ne': None}}},
+                {'$group': {'_id': {'$ifNull': ['$portainer_endpoint_id', PORTAINER_ENDPOINT_ID]}, 'count': {'$sum': 1}}}
+            ]).to_list(100):
+                tenants[row['_id']] = row['count']
+        return [
+            {**self._evaluate(e, c), 'tenants': tenants.get(e['endpoint_id'], 0)}
+            for e, c in zip(endpoints, capacities)
+        ]
+
+    # ---------- placement ----------
+
+    async def place(self, company_id: str, exclude: Optional[List[int]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Pick the least-loaded eligible endpoint and reserve room on it.
+        Returns the endpoint evaluation (endpoint_id, server_ip, score, ...) or None.
+        """
+        async with self._lock:
+            candidates = [
+                e for e in await self.overview()
+                if e['eligible'] and e['endpoint_id'] not in (exclude or [])
+            ]
+            if not candidates:
+                logger.error(f"[PLACEMENT] No endpoint has room for company {company_id}")
+                return None
+            chosen = min(candidates, key=lambda e: e['score'])
+            self._pending.append({
+                'endpoint_id': chosen['endpoint_id'],
+                'company_id': company_id,
+                'expires_at': time.monotonic() + PLACEMENT_PENDING_SECONDS
+            })
+        logger.info(
+            f"[PLACEMENT] Company {company_id} -> {chosen.get('name')} (endpoint {chosen['endpoint_id']}, "
+            f"score {chosen['score']}, memory {chosen['effective_memory_fraction']})"
+        )
+        return chosen
+
+    def release(self, company_id: str):
+        """Drop a pending reservation once the stack runs (or provisioning failed)"""
+        self._pending = [p for p in self._pending if p['company_id'] != company_id]
+
+    @staticmethod
+    def placement_fields(endpoint: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'portainer_endpoint_id': endpoint['endpoint_id'],
+            'server_ip': endpoint['server_ip'],
+            'placement': {
+                'endpoint_name': endpoint.get('name'),
+                'score': endpoint.get('score'),
+                'memory_fraction': endpoint.get('effective_memory_fraction'),
+                'placed_at': datetime.now(timezone.utc).isoformat()
+            }
+        }
+
+    # ---------- migration ----------
+
+    async def migrate(self, company: Dict[str, Any], target_endpoint_id: int = None) -> Dict[str, Any]:
+        """
+        Move a tenant stack to another endpoint (least-loaded one if not given).
+
+        1. create the stack on the target (same compose, ports and image)
+        2. stop the source backend and copy the tenant database (dedicated mongod)
+        3. deploy frontend / admin setup on the target, wait for its routes
+        4. remove the source stack and point the company at the target
+
+        On failure the target stack is removed and the source backend restarted.
+        DNS for the tenant domain must be pointed at the target host afterwards.
+        """
+        if not company.get('portainer_stack_id') or not company.get('domain'):
+            return {'success': False, 'error': 'Sadece domain ile deploy edilmiş firmalar taşınabilir'}
+
+        source = portainer_for(company)
+        endpoints = {e['endpoint_id']: e for e in await self.get_endpoints()}
+        if target_endpoint_id is None:
+            target_endpoint = await self.place(company['id'], exclude=[source.endpoint_id])
+            if not target_endpoint:
+                return {'success': False, 'error': 'Uygun hedef sunucu bulunamadı'}
+        else:
+            target_endpoint = endpoints.get(target_endpoint_id)
+            if not target_endpoint:
+                return {'success': False, 'error': f'Endpoint {target_endpoint_id} tanımlı değil'}
+        if target_endpoint['endpoint_id'] == source.endpoint_id:
+            self.release(company['id'])
+            return {'success': False, 'error': 'Firma zaten bu sunucuda'}
+
+        target = self.portainer.for_endpoint(target_endpoint['endpoint_id'], target_endpoint['server_ip'])
+        safe_code = tenant_db_name(company)[:-3]
+        shared_mongo = tenant_mongo.is_shared(company)
+        started_at = time.monotonic()
+        backend_image = company.get('backend_image')
+
+        if backend_image and not await target.image_exists(backend_image):
+            from services.tenant_image import TenantImageBuilder
+            built = await TenantImageBuilder(target, self.db).get_or_build(built_by='placement-migration')
+            if not built.get('success'):
+                self.release(company['id'])
+                return {'success': False, 'error': f"Hedefte image hazırlanamadı: {built.get('error')}"}
+            backend_image = built['image']['tag']
+
+        created = await target.create_full_stack(
+            company['code'], company['name'], company['domain'], company['port_offset'],
+            backend_image, company.get('mongo_url') if shared_mongo else None
+        )
+        if not created.get('success'):
+            self.release(company['id'])
+            return {'success': False, 'error': f"Hedef stack oluşturulamadı: {created.get('error')}"}
+
+        collections = {}
+        try:
+            stopped = await source.stop_container(f"{safe_code}_backend")
+            if stopped.get('error'):
+                raise RuntimeError(f"Kaynak backend durdurulamadı: {stopped['error']}")
+
+            if not shared_mongo:
+                mongo_port = (company.get('ports') or {}).get('mongodb')
+                source_client = AsyncIOMotorClient(f"mongodb://{source.server_ip}:{mongo_port}", serverSelectionTimeoutMS=15000)
+                target_client = AsyncIOMotorClient(f"mongodb://{target.server_ip}:{mongo_port}", serverSelectionTimeoutMS=60000)
+                try:
+                    collections = await copy_database(
+                        source_client[tenant_db_name(company)], target_client[tenant_db_name(company)]
+                    )
+                finally:
+                    source_client.close()
+                    target_client.close()
+
+            # Admin user already exists in the copied data, so this only deploys code
+            deployment = await target.full_tenant_deployment(
+                company_code=company['code'],
+                domain=company['domain'],
+                admin_email=company.get('admin_email', f"admin@{company['domain']}"),
+                admin_password=company.get('admin_password', 'admin123'),
+                mongo_port=(company.get('ports') or {}).get('mongodb'),
+                backend_port=(company.get('ports') or {}).get('backend'),
+                backend_image=backend_image,
+                stack_started_at=started_at,
+                mongo_url=tenant_mongo.admin_url(company) if shared_mongo else None
+            )
+            if not deployment.get('success'):
+                raise RuntimeError(f"Hedef deploy başarısız: {deployment.get('error')}")
+
+            routes = await traefik_for(target.server_ip).wait_for_routes(
+                tenant_router_names(safe_code), started_at=started_at
+            )
+        except Exception as e:
+            logger.error(f"[PLACEMENT] Migration of {company['code']} failed: {str(e)} - rolling back")
+            await target.delete_stack(created['stack_id'])
+            await source.restart_container(f"{safe_code}_backend")
+            self.release(company['id'])
+            return {'success': False, 'error': str(e), 'collections': collections}
+
+        removed = await source.delete_stack(company['portainer_stack_id'])
+        self.release(company['id'])
+        fields = {
+            **self.placement_fields(target_endpoint),
+            'portainer_stack_id': created['stack_id'],
+            'urls': created.get('urls'),
+            'backend_image': backend_image,
+            'placement_migrated_from': source.endpoint_id,
+            'updated_at': datetime.now(timezone.utc).isoformat()
+        }
+        if self.db is not None:
+            await self.db.companies.update_one({'id': company['id']}, {'$set': fields})
+
+        duration = round(time.monotonic() - started_at, 1)
+        logger.info(f"[PLACEMENT] {company['code']} moved endpoint {source.endpoint_id} -> {target.endpoint_id} in {duration}s")
+        return {
+            'success': True,
+            'company_code': company['code'],
+            'from_endpoint': source.endpoint_id,
+            'to_endpoint': target.endpoint_id,
+            'collections': collections,
+            'routes_ready': routes.get('success', False),
+            'source_stack_removed': removed.get('success', False),
+            'duration_seconds': duration,
+            'company_fields': fields,
+            # Traefik on the target host only receives traffic once DNS points there
+            'dns': {'domain': company['domain'], 'point_to': target.server_ip}
+        }
+
+
+# Singleton instance
+placement_scheduler = PlacementScheduler(portainer_service)
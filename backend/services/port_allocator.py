@@ -0,0 +1,217 @@
+"""
+Port Offset Allocator
+Collision-free port offset allocation for company stacks.
+
+All state lives in a single MongoDB document (port_allocations/_id=port_offsets):
+- next_offset: next never-used offset
+- free:        offsets released by deprovisioned companies, reused first
+- leases:      {offset: {company_id, allocated_at}} for offsets handed out
+               whose company record may not be written yet
+
+Every allocation is one conditional update that takes the offset and records
+its lease together, and reconcile only changes the offsets it checked, so
+parallel provisions and reconciles never hand out the same offset twice.
+"""
+
+import os
+import logging
+from typing import Optional, Dict, Any, Iterable, Set
+from datetime import datetime, timezone, timedelta
+
+from services.portainer_service import BASE_FRONTEND_PORT, BASE_BACKEND_PORT, BASE_MONGO_PORT
+
+logger = logging.getLogger(__name__)
+
+ALLOCATOR_DOC_ID = 'port_offsets'
+PORT_OFFSET_START = int(os.environ.get('PORT_OFFSET_START', '5'))
+# Offsets must stay below the gap between the frontend/backend/mongo port bases
+PORT_OFFSET_MAX = BASE_BACKEND_PORT - BASE_FRONTEND_PORT - 1
+# Leases younger than this are treated as in use by reconcile
+LEASE_GRACE_MINUTES = int(os.environ.get('PORT_LEASE_GRACE_MINUTES', '15'))
+
+
+def offsets_from_ports(ports: Iterable[int]) -> Set[int]:
+    """Map published host ports back to the offsets that produced them"""
+    offsets = set()
+    for port in ports:
+        for base in (BASE_FRONTEND_PORT, BASE_BACKEND_PORT, BASE_MONGO_PORT):
+            if base <= port <= base + PORT_OFFSET_MAX:
+                offsets.add(port - base)
+                break
+    return offsets
+
+
+class PortAllocator:
+    """Atomic port offset allocator backed by one MongoDB document"""
+
+    def __init__(self, db=None):
+        self.db = db
+
+    def set_db(self, db):
+        """Database bağlantısını ayarla"""
+        self.db = db
+
+    @property
+    def _collection(self):
+        return self.db.port_allocations
+
+    async def ensure_initialized(self) -> Dict[str, Any]:
+        """Create the allocator document, seeding next_offset from existing companies"""
+        state = await self._collection.find_one({'_id': ALLOCATOR_DOC_ID})
+        if state:
+            return state
+
+        last = await self.db.companies.find_one(
+            {'port_offset': {'$ne': None}}, {'_id': 0, 'port_offset': 1},
+            sort=[('port_offset', -1)]
+        )
+        next_offset = max((last or {}).get('port_offset', PORT_OFFSET_START - 1) + 1, PORT_OFFSET_START)
+
+        # $setOnInsert keeps concurrent initializers from overwriting each other
+        await self._collection.update_one(
+            {'_id': ALLOCATOR_DOC_ID},
+            {'$setOnInsert': {'next_offset': next_offset, 'free': [], 'leases': {}}},
+            upsert=True
+        )
+        logger.info(f"[PORT] Allocator initialized (next offset: {next_offset})")
+        return await self._collection.find_one({'_id': ALLOCATOR_DOC_ID})
+
+    async def allocate(self, company_id: str) -> Optional[int]:
+        """Allocate an offset for a company - a released one if available, else a new one"""
+        lease = {'company_id': company_id, 'allocated_at': datetime.now(timezone.utc).isoformat()}
+
+        while True:
+            state = await self._collection.find_one(
+                {'_id': ALLOCATOR_DOC_ID}, {'next_offset': 1, 'free': {'$slice': 1}}
+            )
+            if not state:
+                state = await self.ensure_initialized()
+
+            if state.get('free'):
+                # Reuse the lowest released offset
+                offset = state['free'][0]
+                source = 'free list'
+                query = {'_id': ALLOCATOR_DOC_ID, 'free.0': offset}
+                update = {'$pop': {'free': -1}, '$set': {f'leases.{offset}': lease}}
+            else:
+                offset = state['next_offset']
+                if offset > PORT_OFFSET_MAX:
+                    logger.error(f"[PORT] Port offset range exhausted (max {PORT_OFFSET_MAX})")
+                    return None
+                source = 'new'
+                query = {'_id': ALLOCATOR_DOC_ID, 'next_offset': offset}
+                update = {'$inc': {'next_offset': 1}, '$set': {f'leases.{offset}': lease}}
+
+            result = await self._collection.update_one(query, update)
+            if result.modified_count:
+                break
+            # Another allocation or a reconcile changed the document - read it again
+
+        logger.info(f"[PORT] Allocated offset {offset} to company {company_id} ({source})")
+        return offset
+
+    async def release(self, offset: Optional[int]) -> bool:
+        """Return an offset to the free list"""
+        if offset is None:
+            return False
+        await self._collection.update_one(
+            {'_id': ALLOCATOR_DOC_ID},
+            {
+                '$addToSet': {'free': offset},
+                '$unset': {f'leases.{offset}': ''}
+            }
+        )
+        # Keep the free list sorted so the lowest offset is reused first
+        await self._collection.update_one(
+            {'_id': ALLOCATOR_DOC_ID},
+            {'$push': {'free': {'$each': [], '$sort': 1}}}
+        )
+        logger.info(f"[PORT] Released offset {offset}")
+        return True
+
+    async def reconcile(self, published_ports: Iterable[int]) -> Dict[str, Any]:
+        """
+        Reconcile allocator state with companies and actual container ports.
+
+        - offsets in use (company records, published ports, fresh leases) are
+          removed from the free list
+        - next_offset is raised above every offset in use
+        - unused offsets below next_offset that nobody holds are returned to
+          the free list
+        - stale leases are dropped
+
+        Each change is conditional on the current document, so an allocation
+        that commits while reconcile runs is never undone.
+        """
+        state = await self.ensure_initialized()
+
+        company_offsets = set(await self.db.companies.distinct('port_offset', {'port_offset': {'$ne': None}}))
+        container_offsets = offsets_from_ports(published_ports)
+
+        grace_cutoff = datetime.now(timezone.utc) - timedelta(minutes=LEASE_GRACE_MINUTES)
+        leases = state.get('leases') or {}
+        stale_leases = {
+            key: lease for key, lease in leases.items()
+            if datetime.fromisoformat(lease.get('allocated_at')) < grace_cutoff
+        }
+        leased_offsets = {int(key) for key in leases if key not in stale_leases}
+
+        in_use = company_offsets | container_offsets | leased_offsets
+        next_offset = max([state.get('next_offset', PORT_OFFSET_START)] + [o + 1 for o in in_use])
+        previous_free = set(state.get('free') or [])
+        removed_from_free = sorted(previous_free & in_use)
+        unknown_containers = sorted(container_offsets - company_offsets - leased_offsets)
+
+        await self._collection.update_one(
+            {'_id': ALLOCATOR_DOC_ID},
+            {
+                '$pull': {'free': {'$in': removed_from_free}},
+                '$max': {'next_offset': next_offset},
+                '$set': {'reconciled_at': datetime.now(timezone.utc).isoformat()}
+            }
+        )
+
+        # Drop a stale lease only if it was not replaced by a new allocation meanwhile
+        for key, lease in stale_leases.items():
+            await self._collection.update_one(
+                {'_id': ALLOCATOR_DOC_ID, f'leases.{key}.allocated_at': lease.get('allocated_at')},
+                {'$unset': {f'leases.{key}': ''}}
+            )
+
+        # An offset allocated since the snapshot holds a lease, so it is never reclaimed
+        reclaimed = []
+        for offset in range(PORT_OFFSET_START, next_offset):
+            if offset in in_use or offset in previous_free:
+                continue
+            result = await self._collection.update_one(
+                {'_id': ALLOCATOR_DOC_ID, f'leases.{offset}': {'$exists': False}, 'free': {'$ne': offset}},
+                {'$push': {'free': {'$each': [offset], '$sort': 1}}}
+            )
+            if result.modified_count:
+                reclaimed.append(offset)
+
+        state = await self._collection.find_one({'_id': ALLOCATOR_DOC_ID})
+        result = {
+            'success': True,
+            'next_offset': state['next_offset'],
+            'free': state.get('free') or [],
+            'reclaimed': reclaimed,
+            'removed_from_free': removed_from_free,
+            'orphan_container_offsets': unknown_containers,
+            'in_use': len(in_use)
+        }
+        logger.info(
+            f"[PORT] Reconciled: next={result['next_offset']}, free={len(result['free'])}, "
+            f"reclaimed={reclaimed}, orphans={unknown_containers}"
+        )
+        return result
+
+    async def get_state(self) -> Dict[str, Any]:
+        """Current allocator document"""
+        state = await self.ensure_initialized()
+        state.pop('_id', None)
+        return state
+
+
+# Singleton instance
+port_allocator = PortAllocator()
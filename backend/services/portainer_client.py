@@ -0,0 +1,314 @@
+"""
+Resilient Portainer HTTP Client
+Shared transport for every Portainer API call made by PortainerService.
+
+- per-endpoint token bucket (requests/second with burst)
+- bounded in-flight requests per endpoint
+- jittered exponential retries for idempotent calls (GET/PUT/DELETE/HEAD
+  or explicitly flagged); non-idempotent calls retry only when the request
+  never reached Portainer (connect errors)
+- circuit breaker per endpoint: after consecutive failures calls fail fast
+  until a cool-down passes, then a single probe decides whether to close
+- latency / error counters for the superadmin system endpoint
+"""
+
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Optional, Dict, Any, AsyncIterator
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+PORTAINER_RATE_PER_SECOND = float(os.environ.get('PORTAINER_RATE_PER_SECOND', '10'))
+PORTAINER_BURST = int(os.environ.get('PORTAINER_BURST', '20'))
+PORTAINER_MAX_IN_FLIGHT = int(os.environ.get('PORTAINER_MAX_IN_FLIGHT', '8'))
+PORTAINER_MAX_RETRIES = int(os.environ.get('PORTAINER_MAX_RETRIES', '3'))
+PORTAINER_RETRY_BASE_DELAY = float(os.environ.get('PORTAINER_RETRY_BASE_DELAY', '0.5'))
+PORTAINER_RETRY_MAX_DELAY = float(os.environ.get('PORTAINER_RETRY_MAX_DELAY', '8'))
+PORTAINER_BREAKER_THRESHOLD = int(os.environ.get('PORTAINER_BREAKER_THRESHOLD', '5'))
+PORTAINER_BREAKER_RESET_SECONDS = float(os.environ.get('PORTAINER_BREAKER_RESET_SECONDS', '30'))
+PORTAINER_DEFAULT_TIMEOUT = float(os.environ.get('PORTAINER_DEFAULT_TIMEOUT', '60'))
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+# Gateway errors / throttling - retried, and (except 429) counted by the breaker
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+_ENDPOINT_PATTERNS = (
+    re.compile(r'endpoints/(\d+)'),
+    re.compile(r'[?&]endpointId=(\d+)'),
+)
+
+
+class PortainerCircuitOpen(Exception):
+    """Raised without contacting Portainer while the circuit breaker is open"""
+
+
+class TokenBucket:
+    """Async token bucket - `rate` tokens per second, up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """closed -> open after `threshold` consecutive failures -> half_open after `reset_seconds`"""
+
+    def __init__(self, threshold: int, reset_seconds: float):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == 'closed':
+            return True
+        if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = 'half_open'
+        if self.state == 'half_open' and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def release_probe(self):
+        self._probe_in_flight = False
+
+    def record_success(self):
+        self.state = 'closed'
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> bool:
+        """Returns True when this failure opened the circuit"""
+        self.failures += 1
+        was_open = self.state == 'open'
+        if self.state == 'half_open' or self.failures >= self.threshold:
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+        return self.state == 'open' and not was_open
+
+
+class _EndpointGuard:
+    """Rate limit, concurrency cap, breaker and counters for one Portainer endpoint"""
+
+    def __init__(self):
+        self.bucket = TokenBucket(PORTAINER_RATE_PER_SECOND, PORTAINER_BURST)
+        self.slots = asyncio.Semaphore(PORTAINER_MAX_IN_FLIGHT)
+        self.breaker = CircuitBreaker(PORTAINER_BREAKER_THRESHOLD, PORTAINER_BREAKER_RESET_SECONDS)
+        self.latencies = deque(maxlen=500)
+        self.in_flight = 0
+        self.counters = {
+            'requests': 0, 'errors': 0, 'http_errors': 0, 'retries': 0,
+            'rejected_open_circuit': 0, 'breaker_trips': 0
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        percentile = lambda p: round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) if latencies else None
+        return {
+            **self.counters,
+            'in_flight': self.in_flight,
+            'breaker_state': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+            'latency_ms': {
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'max': round(latencies[-1] * 1000, 1) if latencies else None,
+                'samples': len(latencies)
+            }
+        }
+
+
+class ResilientPortainerClient:
+    """Pooled httpx client with per-endpoint rate limiting, retries and circuit breaking"""
+
+    def __init__(self, base_url: str, api_key: str):
+        self.base_url = base_url
+        self.api_key = api_key
+        self._client: Optional[httpx.AsyncClient] = None
+        self._guards: Dict[str, _EndpointGuard] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                verify=False,
+                timeout=PORTAINER_DEFAULT_TIMEOUT,
+                limits=httpx.Limits(max_connections=PORTAINER_MAX_IN_FLIGHT * 4, max_keepalive_connections=PORTAINER_MAX_IN_FLIGHT)
+            )
+        return self._client
+
+    def _guard_for(self, path: str) -> _EndpointGuard:
+        key = 'global'
+        for pattern in _ENDPOINT_PATTERNS:
+            match = pattern.search(path)
+            if match:
+                key = match.group(1)
+                break
+        if key not in self._guards:
+            self._guards[key] = _EndpointGuard()
+        return self._guards[key]
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        # Full jitter keeps parallel fleet operations from retrying in lockstep
+        return random.uniform(0, min(PORTAINER_RETRY_MAX_DELAY, PORTAINER_RETRY_BASE_DELAY * (2 ** attempt)))
+
+    async def request(self, method: str, path: str, *, headers: Optional[Dict[str, str]] = None,
+                      json: Any = None, data: Any = None, files: Any = None, content: bytes = None,
+                      timeout: Optional[float] = None, idempotent: Optional[bool] = None) -> httpx.Response:
+        """
+        Send a request to {base_url}/api/{path}.
+
+        Returns the final httpx.Response (including 4xx/5xx responses once
+        retries are exhausted). Raises PortainerCircuitOpen when the breaker
+        is open, or the last transport error.
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+
+        guard = self._guard_for(path)
+        url = f"{self.base_url}/api/{path}"
+        request_headers = {'X-API-Key': self.api_key}
+        if headers:
+            request_headers.update(headers)
+
+        attempt = 0
+        while True:
+            if not guard.breaker.allow():
+                guard.counters['rejected_open_circuit'] += 1
+                raise PortainerCircuitOpen(f"Portainer circuit open - {method} {path} rejected")
+
+            await guard.bucket.acquire()
+            async with guard.slots:
+                guard.counters['requests'] += 1
+                guard.in_flight += 1
+                started = time.monotonic()
+                try:
+                    response = await self._get_client().request(
+                        method, url, headers=request_headers, json=json, data=data,
+                        files=files, content=content,
+                        timeout=timeout if timeout is not None else PORTAINER_DEFAULT_TIMEOUT
+                    )
+                    error = None
+                except httpx.TransportError as e:
+                    response = None
+                    error = e
+                except BaseException:
+                    # Cancelled / unexpected - don't leave a half-open probe slot taken
+                    guard.breaker.release_probe()
+                    raise
+                finally:
+                    guard.in_flight -= 1
+                    guard.latencies.append(time.monotonic() - started)
+
+            if error is None and response.status_code not in RETRYABLE_STATUS:
+                # Any other answer (including 4xx/500 application errors) means Portainer is up
+                guard.breaker.record_success()
+                if response.status_code >= 400:
+                    guard.counters['http_errors'] += 1
+                return response
+
+            guard.counters['errors'] += 1
+            # 429 is back-pressure, not an outage - it is retried but does not trip the breaker
+            if error is not None or response.status_code != 429:
+                if guard.breaker.record_failure():
+                    guard.counters['breaker_trips'] += 1
+                    logger.error(f"[PORTAINER-CLIENT] Circuit opened after {guard.breaker.failures} consecutive failures")
+            else:
+                guard.breaker.record_success()
+
+            # Connect errors never reached Portainer, so any method is safe to resend
+            retryable = idempotent or isinstance(error, httpx.ConnectError)
+            if not retryable or attempt >= PORTAINER_MAX_RETRIES or guard.breaker.state == 'open':
+                if error is not None:
+                    raise error
+                return response
+
+            delay = self._backoff(attempt)
+            if response is not None and response.status_code == 429:
+                retry_after = response.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    delay = max(delay, float(retry_after))
+            attempt += 1
+            guard.counters['retries'] += 1
+            logger.warning(
+                f"[PORTAINER-CLIENT] {method} {path} failed "
+                f"({error or response.status_code}), retry {attempt}/{PORTAINER_MAX_RETRIES} in {delay:.2f}s"
+            )
+            await asyncio.sleep(delay)
+
+    async def stream_lines(self, path: str, connect_timeout: float = 10.0) -> AsyncIterator[str]:
+        """
+        Long-lived GET yielding response lines (Docker events stream).
+        Checked against the breaker but not rate limited or counted as in-flight.
+        """
+        guard = self._guard_for(path)
+        if not guard.breaker.allow():
+            guard.counters['rejected_open_circuit'] += 1
+            raise PortainerCircuitOpen(f"Portainer circuit open - stream {path} rejected")
+
+        try:
+            async with self._get_client().stream(
+                'GET', f"{self.base_url}/api/{path}",
+                headers={'X-API-Key': self.api_key},
+                timeout=httpx.Timeout(connect_timeout, read=None)
+            ) as response:
+                if response.status_code >= 400:
+                    guard.breaker.release_probe()
+                    await response.aread()
+                    raise httpx.HTTPStatusError(
+                        f"Stream {path} failed: {response.status_code}", request=response.request, response=response
+                    )
+                guard.breaker.record_success()
+                async for line in response.aiter_lines():
+                    yield line
+        except httpx.TransportError:
+            if guard.breaker.record_failure():
+                guard.counters['breaker_trips'] += 1
+            raise
+        except BaseException:
+            guard.breaker.release_probe()
+            raise
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-endpoint counters, latency percentiles and breaker state"""
+        return {
+            'limits': {
+                'rate_per_second': PORTAINER_RATE_PER_SECOND,
+                'burst': PORTAINER_BURST,
+                'max_in_flight': PORTAINER_MAX_IN_FLIGHT,
+                'max_retries': PORTAINER_MAX_RETRIES,
+                'breaker_threshold': PORTAINER_BREAKER_THRESHOLD,
+                'breaker_reset_seconds': PORTAINER_BREAKER_RESET_SECONDS
+            },
+            'endpoints': {key: guard.stats() for key, guard in self._guards.items()}
+        }
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
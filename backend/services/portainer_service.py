@@ -8,9 +8,13 @@ import httpx
 import logging
 import tarfile
 import io as std_io
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from datetime import datetime, timezone
 
+from services.executor import blocking_executor
+from services.portainer_client import ResilientPortainerClient, PortainerCircuitOpen
+from services import blocking_tasks
+
 logger = logging.getLogger(__name__)
 
 # Portainer Configuration
@@ -25,6 +29,18 @@ BASE_FRONTEND_PORT = 10000
 BASE_BACKEND_PORT = 11000
 BASE_MONGO_PORT = 12000
 
+# Prebuilt tenant backend image (services/tenant_image.py), code and deps baked in
+TENANT_BACKEND_IMAGE = os.environ.get('TENANT_BACKEND_IMAGE', 'rentacar-tenant-backend:latest')
+LEGACY_BACKEND_IMAGE = 'tiangolo/uvicorn-gunicorn-fastapi:python3.11-slim'
+
+# Consolidated tenant MongoDB (services/tenant_mongo.py) - one mongod holding every tenant database
+SHARED_MONGO_CONTAINER = 'rentacar_shared_mongodb'
+SHARED_MONGO_PORT = int(os.environ.get('SHARED_MONGO_PORT', '27100'))
+SHARED_MONGO_CACHE_GB = os.environ.get('SHARED_MONGO_CACHE_GB', '2')
+SHARED_MONGO_ROOT_USER = os.environ.get('SHARED_MONGO_ROOT_USER', 'rentacar_root')
+# No default: the shared mongod is published on SHARED_MONGO_PORT, shared-mode deploys refuse to run without it
+SHARED_MONGO_ROOT_PASSWORD = os.environ.get('SHARED_MONGO_ROOT_PASSWORD', '')
+
 
 def get_docker_compose_template(company_code: str, company_name: str, port_offset: int) -> str:
     """
@@ -51,13 +67,10 @@ services:
       - {company_code}_network
 
   backend:
-    image: python:3.11-slim
+    image: {TENANT_BACKEND_IMAGE}
     container_name: {company_code}_backend
     restart: unless-stopped
-    working_dir: /app
-    command: >
-      bash -c "pip install fastapi uvicorn motor pydantic python-jose passlib python-dotenv bcrypt &&
-               uvicorn server:app --host 0.0.0.0 --port 8001"
+    command: ["uvicorn", "server:app", "--host", "0.0.0.0", "--port", "8001"]
     environment:
       - MONGO_URL=mongodb://mongodb:27017
       - DB_NAME={company_code}_db
@@ -71,8 +84,6 @@ services:
       - mongodb
     networks:
       - {company_code}_network
-    volumes:
-      - {company_code}_backend_data:/app
 
   frontend:
     image: node:20-alpine
@@ -96,7 +107,6 @@ services:
 
 volumes:
   {company_code}_mongo_data:
-  {company_code}_backend_data:
   {company_code}_frontend_data:
 
 networks:
@@ -136,10 +146,14 @@ networks:
 """
 
 
-def get_full_company_stack_template(company_code: str, company_name: str, domain: str, port_offset: int) -> str:
+def get_full_company_stack_template(company_code: str, company_name: str, domain: str, port_offset: int, backend_image: str = None,
+                                    mongo_url: str = None) -> str:
     """
     Generate Docker Compose for a complete company stack with Traefik SSL.
-    Template files will be copied via Portainer API after stack creation.
+    With backend_image the backend runs the prebuilt tenant image; otherwise
+    template files are copied via Portainer API after stack creation.
+    With mongo_url the tenant database lives on the consolidated tenant
+    mongod and the stack has no MongoDB container of its own.
     Includes mobile app containers for Customer and Operation apps.
     """
     safe_code = company_code.replace('-', '').replace('_', '')
@@ -151,10 +165,13 @@ def get_full_company_stack_template(company_code: str, company_name: str, domain
     # Expo token from environment
     expo_token = os.environ.get("EXPO_TOKEN", "")
     
-    return f"""version: '3.8'
-
-services:
-  {safe_code}_mongodb:
+    if mongo_url:
+        mongodb_service = ""
+        backend_depends_on = ""
+        volumes = ""
+    else:
+        mongo_url = f"mongodb://{safe_code}_mongodb:27017"
+        mongodb_service = f"""  {safe_code}_mongodb:
     image: mongo:6.0
     container_name: {safe_code}_mongodb
     restart: unless-stopped
@@ -168,12 +185,24 @@ services:
       - {safe_code}_network
       - traefik_network
 
-  {safe_code}_backend:
-    image: tiangolo/uvicorn-gunicorn-fastapi:python3.11-slim
+"""
+        backend_depends_on = f"""    depends_on:
+      - {safe_code}_mongodb
+"""
+        volumes = f"""volumes:
+  {safe_code}_mongo_data:
+
+"""
+    
+    return f"""version: '3.8'
+
+services:
+{mongodb_service}  {safe_code}_backend:
+    image: {backend_image or LEGACY_BACKEND_IMAGE}
     container_name: {safe_code}_backend
     restart: unless-stopped
     environment:
-      - MONGO_URL=mongodb://{safe_code}_mongodb:27017
+      - MONGO_URL={mongo_url}
       - DB_NAME={safe_code}_db
       - JWT_SECRET={safe_code}_jwt_secret_2024
       - COMPANY_CODE={company_code}
@@ -184,9 +213,7 @@ services:
       - VARIABLE_NAME=app
     ports:
       - "{backend_port}:80"
-    depends_on:
-      - {safe_code}_mongodb
-    networks:
+{backend_depends_on}    networks:
       - {safe_code}_network
       - traefik_network
     labels:
@@ -249,10 +276,7 @@ services:
     networks:
       - {safe_code}_network
 
-volumes:
-  {safe_code}_mongo_data:
-
-networks:
+{volumes}networks:
   {safe_code}_network:
     driver: bridge
   traefik_network:
@@ -348,8 +372,13 @@ services:
       - "--api.dashboard=true"
       - "--api.insecure=true"
       - "--providers.docker=true"
+      - "--providers.docker.watch=true"
       - "--providers.docker.exposedbydefault=false"
       - "--providers.docker.network=traefik_network"
+      - "--providers.file.directory=/etc/traefik/dynamic"
+      - "--providers.file.watch=true"
+      - "--metrics.prometheus=true"
+      - "--metrics.prometheus.addServicesLabels=true"
       - "--entrypoints.web.address=:80"
       - "--entrypoints.web.http.redirections.entrypoint.to=websecure"
       - "--entrypoints.web.http.redirections.entrypoint.scheme=https"
@@ -365,6 +394,7 @@ services:
     volumes:
       - /var/run/docker.sock:/var/run/docker.sock:ro
       - traefik_certs:/letsencrypt
+      - traefik_dynamic:/etc/traefik/dynamic
     networks:
       - traefik_network
     labels:
@@ -374,6 +404,7 @@ services:
 
 volumes:
   traefik_certs:
+  traefik_dynamic:
 
 networks:
   traefik_network:
@@ -382,6 +413,40 @@ networks:
 """
 
 
+def get_shared_mongo_compose_template() -> str:
+    """
+    Consolidated MongoDB for tenant databases.
+    Tenant backends reach it on traefik_network; the published port is for
+    superadmin setup and migrations. The WiredTiger cache is sized once for
+    the whole fleet instead of per tenant.
+    """
+    return f"""version: '3.8'
+
+services:
+  {SHARED_MONGO_CONTAINER}:
+    image: mongo:6.0
+    container_name: {SHARED_MONGO_CONTAINER}
+    restart: unless-stopped
+    command: ["--auth", "--wiredTigerCacheSizeGB", "{SHARED_MONGO_CACHE_GB}"]
+    environment:
+      - MONGO_INITDB_ROOT_USERNAME={SHARED_MONGO_ROOT_USER}
+      - MONGO_INITDB_ROOT_PASSWORD={SHARED_MONGO_ROOT_PASSWORD}
+    volumes:
+      - rentacar_shared_mongo_data:/data/db
+    ports:
+      - "{SHARED_MONGO_PORT}:27017"
+    networks:
+      - traefik_network
+
+volumes:
+  rentacar_shared_mongo_data:
+
+networks:
+  traefik_network:
+    external: true
+"""
+
+
 def get_superadmin_compose_template() -> str:
     """
     Generate Docker Compose YAML for SuperAdmin stack
@@ -448,48 +513,54 @@ networks:
 
 
 class PortainerService:
-    def __init__(self):
+    def __init__(self, endpoint_id: int = PORTAINER_ENDPOINT_ID, server_ip: str = SERVER_IP,
+                 client: Optional[ResilientPortainerClient] = None):
         self.base_url = PORTAINER_URL
         self.api_key = PORTAINER_API_KEY
-        self.endpoint_id = PORTAINER_ENDPOINT_ID
+        self.endpoint_id = endpoint_id
+        self.server_ip = server_ip
         self.headers = {
             'X-API-Key': self.api_key,
             'Content-Type': 'application/json'
         }
+        self.client = client or ResilientPortainerClient(self.base_url, self.api_key)
+    
+    def for_endpoint(self, endpoint_id: Optional[int], server_ip: Optional[str] = None) -> 'PortainerService':
+        """
+        The same Portainer connection bound to another Docker endpoint (host).
+        The HTTP client is shared, so rate limits and breakers stay per endpoint.
+        """
+        server_ip = server_ip or self.server_ip
+        if endpoint_id is None or (endpoint_id == self.endpoint_id and server_ip == self.server_ip):
+            return self
+        return PortainerService(endpoint_id, server_ip, client=self.client)
     
     async def _request(self, method: str, endpoint: str, data: Optional[Dict] = None, files: Optional[Dict] = None) -> Dict[str, Any]:
-        """Make request to Portainer API"""
-        url = f"{self.base_url}/api/{endpoint}"
-        
-        # Create SSL context that ignores certificate verification
-        import ssl
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-        
-        async with httpx.AsyncClient(verify=False, timeout=60.0, http2=False) as client:
+        """Make request to Portainer API through the resilient client"""
+        try:
+            if files:
+                # For file uploads, don't use JSON
+                response = await self.client.request(method, endpoint, data=data, files=files)
+            else:
+                response = await self.client.request(method, endpoint, headers=self.headers, json=data)
+            
+            if response.status_code >= 400:
+                logger.error(f"Portainer API error: {response.status_code} - {response.text}")
+                return {'error': response.text, 'status_code': response.status_code}
+            
             try:
-                if files:
-                    # For file uploads, don't use JSON
-                    headers = {'X-API-Key': self.api_key}
-                    response = await client.request(method, url, headers=headers, data=data, files=files)
-                else:
-                    response = await client.request(method, url, headers=self.headers, json=data)
+                return response.json()
+            except:
+                return {'text': response.text, 'status_code': response.status_code}
                 
-                if response.status_code >= 400:
-                    logger.error(f"Portainer API error: {response.status_code} - {response.text}")
-                    return {'error': response.text, 'status_code': response.status_code}
-                
-                try:
-                    return response.json()
-                except:
-                    return {'text': response.text, 'status_code': response.status_code}
-                    
-            except Exception as e:
-                logger.error(f"Portainer API request failed: {str(e)}")
-                import traceback
-                logger.error(f"Traceback: {traceback.format_exc()}")
-                return {'error': str(e)}
+        except PortainerCircuitOpen as e:
+            logger.warning(f"Portainer API request skipped: {str(e)}")
+            return {'error': str(e), 'circuit_open': True}
+        except Exception as e:
+            logger.error(f"Portainer API request failed: {str(e)}")
+            import traceback
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            return {'error': str(e)}
     
     async def get_stacks(self) -> list:
         """Get all stacks"""
@@ -534,55 +605,42 @@ class PortainerService:
         """Delete a stack by ID"""
         endpoint = f"stacks/{stack_id}?endpointId={self.endpoint_id}"
         
-        async with httpx.AsyncClient(verify=False, timeout=60.0) as client:
-            try:
-                url = f"{self.base_url}/api/{endpoint}"
-                response = await client.delete(url, headers=self.headers)
-                
-                if response.status_code < 400:
-                    logger.info(f"Stack {stack_id} deleted successfully")
-                    return {'success': True}
-                else:
-                    logger.error(f"Stack delete failed: {response.status_code} - {response.text}")
-                    return {'error': response.text, 'status_code': response.status_code}
-            except Exception as e:
-                logger.error(f"Stack delete error: {str(e)}")
-                return {'error': str(e)}
-    
-    async def get_next_port_offset(self, db) -> int:
-        """Get next available port offset based on existing companies and Portainer stacks"""
-        # Find the highest port_offset used in database
-        companies = await db.companies.find(
-            {'port_offset': {'$exists': True, '$ne': None}},
-            {'port_offset': 1}
-        ).to_list(1000)
-        
-        # Also check Portainer for existing stacks to avoid conflicts
         try:
-            stacks = await self.get_stacks()
-            stack_count = len([s for s in stacks if isinstance(s, dict) and s.get('Name', '').startswith('rentacar_')])
-        except:
-            stack_count = 0
-        
-        if not companies:
-            # Start from offset that accounts for existing Portainer stacks
-            # Add +5 buffer to avoid any potential conflicts
-            return max(stack_count + 5, 5)
-        
-        max_offset = max(c.get('port_offset', 0) for c in companies)
-        # Ensure new offset is higher than both max in DB and stack count
-        next_offset = max(max_offset + 1, stack_count + 5)
+            response = await self.client.request('DELETE', endpoint, headers=self.headers)
+            
+            if response.status_code < 400:
+                logger.info(f"Stack {stack_id} deleted successfully")
+                return {'success': True}
+            else:
+                logger.error(f"Stack delete failed: {response.status_code} - {response.text}")
+                return {'error': response.text, 'status_code': response.status_code}
+        except Exception as e:
+            logger.error(f"Stack delete error: {str(e)}")
+            return {'error': str(e)}
+    
+    async def get_published_ports(self) -> Optional[list]:
+        """Public host ports of all containers on the endpoint, None if the list fails"""
+        endpoint = f"endpoints/{self.endpoint_id}/docker/containers/json?all=true"
+        result = await self._request('GET', endpoint)
+        if not isinstance(result, list):
+            return None
         
-        logger.info(f"[PORT] Next port offset: {next_offset} (DB max: {max_offset}, Portainer stacks: {stack_count})")
-        return next_offset
+        ports = set()
+        for c in result:
+            for p in c.get('Ports', []):
+                if p.get('PublicPort'):
+                    ports.add(p['PublicPort'])
+        return sorted(ports)
     
-    async def create_full_stack(self, company_code: str, company_name: str, domain: str, port_offset: int) -> Dict[str, Any]:
+    async def create_full_stack(self, company_code: str, company_name: str, domain: str, port_offset: int, backend_image: str = None,
+                                mongo_url: str = None) -> Dict[str, Any]:
         """
         Create a full company stack with Frontend + Backend + MongoDB
+        (no MongoDB container when mongo_url points at the shared tenant mongod)
         With Traefik labels for domain-based routing
         """
         stack_name = f"rentacar_{company_code}"
-        compose_content = get_full_company_stack_template(company_code, company_name, domain, port_offset)
+        compose_content = get_full_company_stack_template(company_code, company_name, domain, port_offset, backend_image, mongo_url)
         
         endpoint = f"stacks/create/standalone/string?endpointId={self.endpoint_id}"
         
@@ -603,14 +661,14 @@ class PortainerService:
                 'ports': {
                     'frontend': BASE_FRONTEND_PORT + port_offset,
                     'backend': BASE_BACKEND_PORT + port_offset,
-                    'mongodb': BASE_MONGO_PORT + port_offset
+                    'mongodb': None if mongo_url else BASE_MONGO_PORT + port_offset
                 },
                 'urls': {
                     'website': f"https://{domain}",
                     'panel': f"https://panel.{domain}",
                     'api': f"https://api.{domain}",
-                    'ip_frontend': f"http://{SERVER_IP}:{BASE_FRONTEND_PORT + port_offset}",
-                    'ip_backend': f"http://{SERVER_IP}:{BASE_BACKEND_PORT + port_offset}"
+                    'ip_frontend': f"http://{self.server_ip}:{BASE_FRONTEND_PORT + port_offset}",
+                    'ip_backend': f"http://{self.server_ip}:{BASE_BACKEND_PORT + port_offset}"
                 }
             }
         else:
@@ -655,9 +713,9 @@ class PortainerService:
                     'mongodb': BASE_MONGO_PORT + port_offset
                 },
                 'urls': {
-                    'frontend': f"http://{SERVER_IP}:{BASE_FRONTEND_PORT + port_offset}",
-                    'backend': f"http://{SERVER_IP}:{BASE_BACKEND_PORT + port_offset}",
-                    'api': f"http://{SERVER_IP}:{BASE_BACKEND_PORT + port_offset}/api"
+                    'frontend': f"http://{self.server_ip}:{BASE_FRONTEND_PORT + port_offset}",
+                    'backend': f"http://{self.server_ip}:{BASE_BACKEND_PORT + port_offset}",
+                    'api': f"http://{self.server_ip}:{BASE_BACKEND_PORT + port_offset}/api"
                 }
             }
         else:
@@ -673,6 +731,89 @@ class PortainerService:
             return {'success': True}
         return {'success': False, 'error': result.get('error')}
     
+    async def update_stack(self, stack_id: int, compose_content: str, prune: bool = False) -> Dict[str, Any]:
+        """
+        Redeploy a stack with new compose content (e.g. a new tenant backend image).
+        prune removes containers of services no longer in the compose file.
+        """
+        endpoint = f"stacks/{stack_id}?endpointId={self.endpoint_id}"
+        result = await self._request('PUT', endpoint, data={
+            'stackFileContent': compose_content,
+            'env': [],
+            'prune': prune,
+            'pullImage': False
+        })
+        if isinstance(result, dict) and 'error' in result:
+            return {'success': False, 'error': result['error']}
+        return {'success': True}
+    
+    async def image_exists(self, tag: str) -> bool:
+        """Check whether an image tag exists on the Docker host"""
+        result = await self._request('GET', f"endpoints/{self.endpoint_id}/docker/images/{tag}/json")
+        return isinstance(result, dict) and 'Id' in result
+    
+    async def build_image(self, tags: list, context_tar: bytes, timeout: float = 900.0) -> Dict[str, Any]:
+        """
+        Build an image on the Docker host from a tar build context (Docker /build via Portainer).
+        The build output is a stream of JSON lines; an 'error' line means the build failed.
+        """
+        import json
+        from urllib.parse import urlencode
+        
+        query = urlencode([('t', tag) for tag in tags] + [('rm', '1'), ('forcerm', '1')])
+        endpoint = f"endpoints/{self.endpoint_id}/docker/build?{query}"
+        
+        try:
+            response = await self.client.request(
+                'POST', endpoint,
+                headers={'Content-Type': 'application/x-tar'},
+                content=context_tar,
+                timeout=timeout
+            )
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+        
+        if response.status_code >= 400:
+            return {'success': False, 'error': response.text, 'status_code': response.status_code}
+        
+        output = []
+        for line in response.text.splitlines():
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if message.get('error'):
+                logger.error(f"[IMAGE-BUILD] {tags[0]} failed: {message['error']}")
+                return {'success': False, 'error': message['error'], 'output': output[-20:]}
+            if message.get('stream'):
+                output.append(message['stream'].rstrip())
+        
+        logger.info(f"[IMAGE-BUILD] Built {', '.join(tags)}")
+        return {'success': True, 'tags': tags, 'output': output[-20:]}
+    
+    async def wait_for_backend_ready(self, backend_port: int, started_at: float = None, timeout: float = 180.0) -> Dict[str, Any]:
+        """Poll a tenant backend's /api/health until it answers; reports cold-start time"""
+        import time
+        import asyncio
+        
+        started_at = started_at or time.monotonic()
+        deadline = time.monotonic() + timeout
+        url = f"http://{self.server_ip}:{backend_port}/api/health"
+        
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            while time.monotonic() < deadline:
+                try:
+                    response = await client.get(url)
+                    if response.status_code == 200:
+                        cold_start = round(time.monotonic() - started_at, 2)
+                        logger.info(f"[COLD-START] Backend on :{backend_port} ready in {cold_start}s")
+                        return {'success': True, 'cold_start_seconds': cold_start}
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(1)
+        
+        return {'success': False, 'error': f'Backend not ready after {timeout}s'}
+    
     async def get_stack_status(self, stack_id: int) -> Dict[str, Any]:
         """Get stack status"""
         endpoint = f"stacks/{stack_id}"
@@ -723,13 +864,48 @@ class PortainerService:
                 'success': True,
                 'stack_id': result.get('Id'),
                 'stack_name': stack_name,
-                'dashboard_url': f"http://{SERVER_IP}:8080",
+                'dashboard_url': f"http://{self.server_ip}:8080",
                 'message': 'Traefik deployed successfully'
             }
         else:
             logger.error(f"Traefik deployment failed: {result}")
             return {'success': False, 'error': result.get('error', 'Unknown error')}
 
+    async def deploy_shared_mongo(self) -> Dict[str, Any]:
+        """Deploy the consolidated tenant MongoDB stack"""
+        if not SHARED_MONGO_ROOT_PASSWORD:
+            return {'success': False, 'error': 'SHARED_MONGO_ROOT_PASSWORD is not set'}
+        stack_name = SHARED_MONGO_CONTAINER
+        
+        existing_stacks = await self.get_stacks()
+        for stack in existing_stacks:
+            if isinstance(stack, dict) and stack.get("Name") == stack_name:
+                return {
+                    'success': True,
+                    'message': 'Shared tenant MongoDB already deployed',
+                    'stack_id': stack.get('Id'),
+                    'already_exists': True
+                }
+        
+        endpoint = f"stacks/create/standalone/string?endpointId={self.endpoint_id}"
+        result = await self._request('POST', endpoint, data={
+            'name': stack_name,
+            'stackFileContent': get_shared_mongo_compose_template(),
+            'env': []
+        })
+        
+        if 'error' not in result:
+            logger.info("Shared tenant MongoDB stack deployed successfully")
+            return {
+                'success': True,
+                'stack_id': result.get('Id'),
+                'stack_name': stack_name,
+                'port': SHARED_MONGO_PORT,
+                'cache_gb': SHARED_MONGO_CACHE_GB
+            }
+        logger.error(f"Shared tenant MongoDB deployment failed: {result}")
+        return {'success': False, 'error': result.get('error', 'Unknown error')}
+
     async def check_traefik_status(self) -> Dict[str, Any]:
         """
         Check if Traefik is deployed and running
@@ -747,7 +923,7 @@ class PortainerService:
                     'installed': True,
                     'stack_id': traefik_stack.get('Id'),
                     'status': 'active',
-                    'dashboard_url': f"http://{SERVER_IP}:8080"
+                    'dashboard_url': f"http://{self.server_ip}:8080"
                 }
             else:
                 return {
@@ -801,10 +977,10 @@ class PortainerService:
                     'mongodb': 27017
                 },
                 'urls': {
-                    'frontend': f"http://{SERVER_IP}:9000",
-                    'backend': f"http://{SERVER_IP}:9001",
-                    'api': f"http://{SERVER_IP}:9001/api",
-                    'health': f"http://{SERVER_IP}:9001/api/health"
+                    'frontend': f"http://{self.server_ip}:9000",
+                    'backend': f"http://{self.server_ip}:9001",
+                    'api': f"http://{self.server_ip}:9001/api",
+                    'health': f"http://{self.server_ip}:9001/api/health"
                 }
             }
         else:
@@ -923,22 +1099,21 @@ class PortainerService:
         
         # Upload archive to container
         upload_endpoint = f"endpoints/{self.endpoint_id}/docker/containers/{container_id}/archive?path={dest_path}"
-        url = f"{self.base_url}/api/{upload_endpoint}"
         
-        async with httpx.AsyncClient(verify=False, timeout=120.0) as client:
-            try:
-                headers = {
-                    'X-API-Key': self.api_key,
-                    'Content-Type': 'application/x-tar'
-                }
-                response = await client.put(url, headers=headers, content=tar_data)
-                
-                if response.status_code < 400:
-                    return {'success': True}
-                else:
-                    return {'error': response.text, 'status_code': response.status_code}
-            except Exception as e:
-                return {'error': str(e)}
+        try:
+            response = await self.client.request(
+                'PUT', upload_endpoint,
+                headers={'Content-Type': 'application/x-tar'},
+                content=tar_data,
+                timeout=120.0
+            )
+            
+            if response.status_code < 400:
+                return {'success': True}
+            else:
+                return {'error': response.text, 'status_code': response.status_code}
+        except Exception as e:
+            return {'error': str(e)}
 
 
     async def configure_nginx_spa(self, container_name: str) -> Dict[str, Any]:
@@ -961,6 +1136,7 @@ class PortainerService:
     }
 
     gzip on;
+    gzip_static on;
     gzip_types text/plain text/css application/json application/javascript text/xml application/xml;
 }
 '''
@@ -996,6 +1172,30 @@ class PortainerService:
         
         return {'success': True, 'message': 'Nginx configured for SPA routing'}
 
+    async def deploy_frontend_bundle(self, container_name: str, bundle: bytes, api_url: str) -> Dict[str, Any]:
+        """
+        Deploy a prebuilt (gzip tar) frontend bundle to an Nginx container,
+        then write the runtime config.js and SPA config.
+        """
+        upload_result = await self.upload_to_container(
+            container_name=container_name,
+            tar_data=bundle,
+            dest_path="/usr/share/nginx/html"
+        )
+        if upload_result.get('error'):
+            return {'success': False, 'error': upload_result.get('error')}
+        
+        config_result = await self.create_config_js(container_name, api_url)
+        if config_result.get('error'):
+            return {'success': False, 'error': config_result.get('error')}
+        
+        nginx_result = await self.configure_nginx_spa(container_name)
+        if nginx_result.get('error'):
+            return {'success': False, 'error': nginx_result.get('error')}
+        
+        logger.info(f"[ARTIFACT] Bundle deployed to {container_name} ({len(bundle)} bytes, API_URL={api_url})")
+        return {'success': True, 'bytes_uploaded': len(bundle)}
+
     async def restart_container(self, container_name: str) -> Dict[str, Any]:
         """
         Restart a container by name
@@ -1021,17 +1221,32 @@ class PortainerService:
         # Restart container
         restart_endpoint = f"endpoints/{self.endpoint_id}/docker/containers/{container_id}/restart"
         
-        async with httpx.AsyncClient(verify=False, timeout=60.0) as client:
-            try:
-                url = f"{self.base_url}/api/{restart_endpoint}"
-                response = await client.post(url, headers=self.headers)
-                
-                if response.status_code < 400:
-                    return {'success': True}
-                else:
-                    return {'error': response.text, 'status_code': response.status_code}
-            except Exception as e:
-                return {'error': str(e)}
+        try:
+            # Restarting twice leaves the same state, so the call is safe to retry
+            response = await self.client.request('POST', restart_endpoint, headers=self.headers, idempotent=True)
+            
+            if response.status_code < 400:
+                return {'success': True}
+            else:
+                return {'error': response.text, 'status_code': response.status_code}
+        except Exception as e:
+            return {'error': str(e)}
+
+    async def stop_container(self, container_name: str) -> Dict[str, Any]:
+        """Stop a container by name (no-op if it is already stopped)"""
+        container_id = await self.get_container_id(container_name)
+        if not container_id:
+            return {'error': f'Container {container_name} not found'}
+        
+        stop_endpoint = f"endpoints/{self.endpoint_id}/docker/containers/{container_id}/stop"
+        try:
+            response = await self.client.request('POST', stop_endpoint, headers=self.headers, idempotent=True)
+            # 304: already stopped
+            if response.status_code < 400:
+                return {'success': True}
+            return {'error': response.text, 'status_code': response.status_code}
+        except Exception as e:
+            return {'error': str(e)}
 
     async def restart_container_by_id(self, container_id: str) -> Dict[str, Any]:
         """
@@ -1039,17 +1254,16 @@ class PortainerService:
         """
         restart_endpoint = f"endpoints/{self.endpoint_id}/docker/containers/{container_id}/restart"
         
-        async with httpx.AsyncClient(verify=False, timeout=60.0) as client:
-            try:
-                url = f"{self.base_url}/api/{restart_endpoint}"
-                response = await client.post(url, headers=self.headers)
-                
-                if response.status_code < 400:
-                    return {'success': True}
-                else:
-                    return {'error': response.text, 'status_code': response.status_code}
-            except Exception as e:
-                return {'error': str(e)}
+        try:
+            # Restarting twice leaves the same state, so the call is safe to retry
+            response = await self.client.request('POST', restart_endpoint, headers=self.headers, idempotent=True)
+            
+            if response.status_code < 400:
+                return {'success': True}
+            else:
+                return {'error': response.text, 'status_code': response.status_code}
+        except Exception as e:
+            return {'error': str(e)}
 
     async def get_container_id(self, container_name: str) -> str:
         """Get container ID by name"""
@@ -1085,51 +1299,44 @@ class PortainerService:
         if not target_id:
             return {'error': f'Target container {target_container} not found'}
         
-        async with httpx.AsyncClient(verify=False, timeout=120.0) as client:
-            try:
-                # Step 1: Download from template container
-                download_url = f"{self.base_url}/api/endpoints/{self.endpoint_id}/docker/containers/{template_id}/archive?path={source_path}"
-                download_resp = await client.get(download_url, headers=self.headers)
-                
-                if download_resp.status_code != 200:
-                    return {'error': f'Failed to download from template: {download_resp.status_code}'}
-                
-                tar_data = download_resp.content
-                logger.info(f"[TEMPLATE-COPY] Downloaded {len(tar_data)} bytes from template")
-                
-                # Step 2: Filter out excluded files if specified
-                if exclude_files:
-                    filtered_tar = std_io.BytesIO()
-                    with tarfile.open(fileobj=std_io.BytesIO(tar_data), mode='r') as src_tar:
-                        with tarfile.open(fileobj=filtered_tar, mode='w') as dst_tar:
-                            for member in src_tar.getmembers():
-                                # Check if this file should be excluded
-                                filename = os.path.basename(member.name)
-                                if filename in exclude_files:
-                                    logger.info(f"[TEMPLATE-COPY] Excluding: {member.name}")
-                                    continue
-                                # Copy the member
-                                if member.isfile():
-                                    dst_tar.addfile(member, src_tar.extractfile(member))
-                                else:
-                                    dst_tar.addfile(member)
-                    tar_data = filtered_tar.getvalue()
-                    logger.info(f"[TEMPLATE-COPY] Filtered tar size: {len(tar_data)} bytes")
-                
-                # Step 3: Upload to target container
-                upload_url = f"{self.base_url}/api/endpoints/{self.endpoint_id}/docker/containers/{target_id}/archive?path={dest_path}"
-                upload_headers = {**self.headers, 'Content-Type': 'application/x-tar'}
-                upload_resp = await client.put(upload_url, headers=upload_headers, content=tar_data)
-                
-                if upload_resp.status_code != 200:
-                    return {'error': f'Failed to upload to target: {upload_resp.status_code} - {upload_resp.text}'}
-                
-                logger.info(f"[TEMPLATE-COPY] Successfully copied to {target_container}")
-                return {'success': True, 'bytes_copied': len(tar_data)}
-                
-            except Exception as e:
-                logger.error(f"[TEMPLATE-COPY] Error: {str(e)}")
-                return {'error': str(e)}
+        try:
+            # Step 1: Download from template container
+            download_endpoint = f"endpoints/{self.endpoint_id}/docker/containers/{template_id}/archive?path={source_path}"
+            download_resp = await self.client.request('GET', download_endpoint, timeout=120.0)
+            
+            if download_resp.status_code != 200:
+                return {'error': f'Failed to download from template: {download_resp.status_code}'}
+            
+            tar_data = download_resp.content
+            logger.info(f"[TEMPLATE-COPY] Downloaded {len(tar_data)} bytes from template")
+            
+            # Step 2: Filter out excluded files if specified
+            if exclude_files:
+                tar_data, excluded = await blocking_executor.run_io(
+                    blocking_tasks.filter_tar_archive, tar_data, exclude_files
+                )
+                for name in excluded:
+                    logger.info(f"[TEMPLATE-COPY] Excluding: {name}")
+                logger.info(f"[TEMPLATE-COPY] Filtered tar size: {len(tar_data)} bytes")
+            
+            # Step 3: Upload to target container
+            upload_endpoint = f"endpoints/{self.endpoint_id}/docker/containers/{target_id}/archive?path={dest_path}"
+            upload_resp = await self.client.request(
+                'PUT', upload_endpoint,
+                headers={'Content-Type': 'application/x-tar'},
+                content=tar_data,
+                timeout=120.0
+            )
+            
+            if upload_resp.status_code != 200:
+                return {'error': f'Failed to upload to target: {upload_resp.status_code} - {upload_resp.text}'}
+            
+            logger.info(f"[TEMPLATE-COPY] Successfully copied to {target_container}")
+            return {'success': True, 'bytes_copied': len(tar_data)}
+            
+        except Exception as e:
+            logger.error(f"[TEMPLATE-COPY] Error: {str(e)}")
+            return {'error': str(e)}
 
     async def _get_existing_config_url(self, container_name: str) -> Optional[str]:
         """
@@ -1218,10 +1425,10 @@ class PortainerService:
                         break
             await asyncio.sleep(2)
         
-        # Create and run exec - bcrypt version pinned to avoid passlib compatibility issues
+        # Install from the template's requirements.txt (copied to /app) - bcrypt is pinned there
         exec_endpoint = f"endpoints/{self.endpoint_id}/docker/containers/{container_id}/exec"
         exec_payload = {
-            'Cmd': ['pip', 'install', 'motor', 'python-jose', 'passlib[bcrypt]', 'python-dotenv', 'httpx', 'bcrypt==4.0.1', '--quiet'],
+            'Cmd': ['pip', 'install', '-r', '/app/requirements.txt', '--quiet'],
             'AttachStdout': True,
             'AttachStderr': True
         }
@@ -1230,26 +1437,31 @@ class PortainerService:
         
         if 'Id' in result:
             exec_id = result['Id']
-            async with httpx.AsyncClient(verify=False, timeout=180.0) as client:
-                start_url = f"{self.base_url}/api/endpoints/{self.endpoint_id}/docker/exec/{exec_id}/start"
-                await client.post(start_url, headers=self.headers, json={'Detach': False})
+            await self.client.request(
+                'POST', f"endpoints/{self.endpoint_id}/docker/exec/{exec_id}/start",
+                headers=self.headers, json={'Detach': False}, timeout=180.0
+            )
             
             logger.info(f"[DEPS] Dependencies installed in {container_name}")
             return {'success': True}
         
         return {'error': 'Failed to create exec', 'details': result}
 
-    async def full_tenant_deployment(self, company_code: str, domain: str, admin_email: str, admin_password: str, mongo_port: int, backend_port: int = None) -> Dict[str, Any]:
+    async def full_tenant_deployment(self, company_code: str, domain: str, admin_email: str, admin_password: str, mongo_port: int, backend_port: int = None,
+                                     backend_image: str = None, stack_started_at: float = None, mongo_url: str = None) -> Dict[str, Any]:
         """
         Complete tenant deployment after stack creation:
         1. Copy frontend from template
-        2. Copy backend from template
-        3. Install backend dependencies
+        2. Copy backend from template      (skipped with a prebuilt backend_image)
+        3. Install backend dependencies    (skipped with a prebuilt backend_image)
         4. Create config.js with API URL
         5. Setup database with admin user
         6. Restart containers
         
-        All operations via Portainer API - no external dependencies
+        All operations via Portainer API - no external dependencies.
+        Reports backend cold-start time measured from stack_started_at.
+        mongo_url: direct connection for step 5 (shared tenant mongod); defaults
+        to the tenant's own MongoDB on mongo_port.
         """
         safe_code = company_code.replace('-', '').replace('_', '')
         frontend_container = f"{safe_code}_frontend"
@@ -1258,7 +1470,7 @@ class PortainerService:
         
         # Use IP-based URL for API (domain DNS may not be configured)
         if backend_port:
-            api_url = f"http://{SERVER_IP}:{backend_port}"
+            api_url = f"http://{self.server_ip}:{backend_port}"
         else:
             api_url = f"https://api.{domain}"
         
@@ -1288,19 +1500,25 @@ class PortainerService:
                 exclude_files=["config.js"]
             )
             
-            # Step 2: Copy backend from template (exclude .env - will be created with tenant settings)
-            logger.info(f"[FULL-DEPLOY] Step 2: Copying backend...")
-            results['backend_copy'] = await self.copy_from_template(
-                template_container="rentacar_template_backend",
-                target_container=backend_container,
-                source_path="/app",
-                dest_path="/",
-                exclude_files=[".env"]
-            )
-            
-            # Step 3: Install backend dependencies
-            logger.info(f"[FULL-DEPLOY] Step 3: Installing dependencies...")
-            results['deps_install'] = await self.install_backend_dependencies(backend_container)
+            if backend_image:
+                # Code and dependencies are baked into the image
+                logger.info(f"[FULL-DEPLOY] Steps 2-3: Backend runs prebuilt image {backend_image}")
+                results['backend_copy'] = {'skipped': True, 'reason': 'prebuilt image', 'image': backend_image}
+                results['deps_install'] = {'skipped': True, 'reason': 'prebuilt image'}
+            else:
+                # Step 2: Copy backend from template (exclude .env - will be created with tenant settings)
+                logger.info(f"[FULL-DEPLOY] Step 2: Copying backend...")
+                results['backend_copy'] = await self.copy_from_template(
+                    template_container="rentacar_template_backend",
+                    target_container=backend_container,
+                    source_path="/app",
+                    dest_path="/",
+                    exclude_files=[".env"]
+                )
+                
+                # Step 3: Install backend dependencies
+                logger.info(f"[FULL-DEPLOY] Step 3: Installing dependencies...")
+                results['deps_install'] = await self.install_backend_dependencies(backend_container)
             
             # Step 4: Create config.js
             logger.info(f"[FULL-DEPLOY] Step 4: Creating config.js...")
@@ -1316,20 +1534,27 @@ class PortainerService:
                 mongo_port=mongo_port,
                 db_name=db_name,
                 admin_email=admin_email,
-                admin_password=admin_password
+                admin_password=admin_password,
+                mongo_url=mongo_url
             )
             
-            # Step 7: Restart containers
+            # Step 7: Restart containers (a prebuilt backend is already serving)
             logger.info(f"[FULL-DEPLOY] Step 7: Restarting containers...")
-            await self.restart_container(backend_container)
-            await asyncio.sleep(3)
+            if not backend_image:
+                await self.restart_container(backend_container)
+                await asyncio.sleep(3)
             await self.restart_container(frontend_container)
             
+            # Step 8: Cold start - time from stack creation until the backend answers
+            if backend_port:
+                results['backend_ready'] = await self.wait_for_backend_ready(backend_port, started_at=stack_started_at)
+            
             logger.info(f"[FULL-DEPLOY] Deployment complete for {company_code}")
             
             return {
                 'success': True,
                 'message': f'Tenant {company_code} fully deployed',
+                'cold_start_seconds': (results.get('backend_ready') or {}).get('cold_start_seconds'),
                 'results': results,
                 'urls': {
                     'website': f'https://{domain}',
@@ -1350,10 +1575,13 @@ class PortainerService:
                 'results': results
             }
 
-    async def setup_tenant_database(self, mongo_port: int, db_name: str, admin_email: str, admin_password: str) -> Dict[str, Any]:
+    async def setup_tenant_database(self, mongo_port: int, db_name: str, admin_email: str, admin_password: str,
+                                    mongo_url: str = None) -> Dict[str, Any]:
         """
         Setup tenant MongoDB with admin user.
-        Creates password hash inside the backend container for bcrypt compatibility.
+        Connects directly to the tenant database (mongo_url, or the tenant's own
+        MongoDB on mongo_port); the bcrypt hash is made here, matching the
+        tenant backend's passlib bcrypt scheme.
         """
         import uuid
         from datetime import datetime, timezone
@@ -1363,59 +1591,10 @@ class PortainerService:
             user_id = str(uuid.uuid4())
             created_at = datetime.now(timezone.utc).isoformat()
             
-            # Get backend container name from db_name
-            safe_code = db_name.replace('_db', '')
-            backend_container = f"{safe_code}_backend"
-            
-            container_id = await self.get_container_id(backend_container)
-            if not container_id:
-                # Fallback: hash locally
-                from passlib.context import CryptContext
-                pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-                password_hash = pwd_context.hash(admin_password)
-            else:
-                # Create hash inside container for bcrypt compatibility
-                import asyncio
-                await asyncio.sleep(5)  # Wait for container to be ready
-                
-                exec_endpoint = f"endpoints/{self.endpoint_id}/docker/containers/{container_id}/exec"
-                hash_cmd = f"python3 -c \"from passlib.context import CryptContext; print(CryptContext(schemes=['bcrypt']).hash('{admin_password}'))\""
-                
-                exec_result = await self._request('POST', exec_endpoint, data={
-                    'Cmd': ['sh', '-c', hash_cmd],
-                    'AttachStdout': True,
-                    'AttachStderr': True
-                })
-                
-                if 'Id' in exec_result:
-                    exec_id = exec_result['Id']
-                    async with httpx.AsyncClient(verify=False, timeout=30) as client:
-                        start_resp = await client.post(
-                            f"{self.base_url}/api/endpoints/{self.endpoint_id}/docker/exec/{exec_id}/start",
-                            headers=self.headers,
-                            json={"Detach": False}
-                        )
-                        # Parse hash from output
-                        output = start_resp.text.strip()
-                        # Find the bcrypt hash in output
-                        import re
-                        hash_match = re.search(r'\$2[aby]\$\d+\$[A-Za-z0-9./]{53}', output)
-                        if hash_match:
-                            password_hash = hash_match.group()
-                        else:
-                            # Fallback to local hash
-                            from passlib.context import CryptContext
-                            pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-                            password_hash = pwd_context.hash(admin_password)
-                else:
-                    from passlib.context import CryptContext
-                    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-                    password_hash = pwd_context.hash(admin_password)
-            
             # Connect to tenant MongoDB and create user
             from motor.motor_asyncio import AsyncIOMotorClient
             
-            mongo_url = f"mongodb://{SERVER_IP}:{mongo_port}"
+            mongo_url = mongo_url or f"mongodb://{self.server_ip}:{mongo_port}"
             client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=30000)
             tenant_db = client[db_name]
             
@@ -1423,6 +1602,7 @@ class PortainerService:
             existing = await tenant_db.users.find_one({"email": admin_email})
             
             if not existing:
+                password_hash = await blocking_executor.run_cpu(blocking_tasks.hash_password, admin_password)
                 admin_user = {
                     "id": user_id,
                     "email": admin_email,
@@ -1482,35 +1662,31 @@ class PortainerService:
             # Download from superadmin
             download_endpoint = f"endpoints/{self.endpoint_id}/docker/containers/{superadmin_frontend_id}/archive?path=/usr/share/nginx/html"
             
-            async with httpx.AsyncClient(verify=False, timeout=120.0) as client:
-                # Download from superadmin
-                download_response = await client.get(
-                    f"{self.base_url}/api/{download_endpoint}",
-                    headers=self.headers
-                )
-                
-                if download_response.status_code != 200:
-                    return {
-                        'success': False,
-                        'error': f'Superadmin frontend dosyaları alınamadı: {download_response.status_code}'
-                    }
-                
-                tar_content = download_response.content
-                logger.info(f"[MASTER-TEMPLATE] Downloaded {len(tar_content)} bytes from superadmin")
-                
-                # Upload to template
-                upload_endpoint = f"endpoints/{self.endpoint_id}/docker/containers/{template_frontend_id}/archive?path=/usr/share/nginx"
-                upload_response = await client.put(
-                    f"{self.base_url}/api/{upload_endpoint}",
-                    headers={'X-API-Key': self.api_key, 'Content-Type': 'application/x-tar'},
-                    content=tar_content
-                )
-                
-                if upload_response.status_code in [200, 204]:
-                    results['frontend_copy'] = {'success': True, 'size': len(tar_content)}
-                    logger.info("[MASTER-TEMPLATE] Frontend files copied to template")
-                else:
-                    results['frontend_copy'] = {'success': False, 'error': upload_response.text}
+            download_response = await self.client.request('GET', download_endpoint, timeout=120.0)
+            
+            if download_response.status_code != 200:
+                return {
+                    'success': False,
+                    'error': f'Superadmin frontend dosyaları alınamadı: {download_response.status_code}'
+                }
+            
+            tar_content = download_response.content
+            logger.info(f"[MASTER-TEMPLATE] Downloaded {len(tar_content)} bytes from superadmin")
+            
+            # Upload to template
+            upload_endpoint = f"endpoints/{self.endpoint_id}/docker/containers/{template_frontend_id}/archive?path=/usr/share/nginx"
+            upload_response = await self.client.request(
+                'PUT', upload_endpoint,
+                headers={'Content-Type': 'application/x-tar'},
+                content=tar_content,
+                timeout=120.0
+            )
+            
+            if upload_response.status_code in [200, 204]:
+                results['frontend_copy'] = {'success': True, 'size': len(tar_content)}
+                logger.info("[MASTER-TEMPLATE] Frontend files copied to template")
+            else:
+                results['frontend_copy'] = {'success': False, 'error': upload_response.text}
             
             # Step 2: Restart template container
             logger.info("[MASTER-TEMPLATE] Step 2: Restarting template container...")
@@ -1567,17 +1743,11 @@ class PortainerService:
             if os.path.exists(frontend_build_path) and template_frontend_id:
                 logger.info(f"[MASTER-TEMPLATE-LOCAL] Uploading frontend from {frontend_build_path}")
                 
-                # Create tar of build folder
-                tar_buffer = std_io.BytesIO()
-                with tarfile.open(fileobj=tar_buffer, mode='w') as tar:
-                    for root, dirs, files in os.walk(frontend_build_path):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            arcname = os.path.relpath(file_path, frontend_build_path)
-                            if not arcname.startswith('downloads/'):
-                                tar.add(file_path, arcname=arcname)
-                
-                tar_data = tar_buffer.getvalue()
+                # Create tar of build folder (skip downloads)
+                tar_data = await blocking_executor.run_io(
+                    blocking_tasks.build_tar_archive,
+                    [], [(frontend_build_path, frontend_build_path)], None, ('downloads/',)
+                )
                 logger.info(f"[MASTER-TEMPLATE-LOCAL] Frontend tar size: {len(tar_data)} bytes")
                 
                 # Clean and upload
@@ -1599,17 +1769,12 @@ class PortainerService:
                 logger.info(f"[MASTER-TEMPLATE-LOCAL] Uploading backend from {backend_path}")
                 
                 # Create tar of backend folder
-                tar_buffer = std_io.BytesIO()
-                with tarfile.open(fileobj=tar_buffer, mode='w') as tar:
-                    server_py = os.path.join(backend_path, 'server.py')
-                    requirements = os.path.join(backend_path, 'requirements.txt')
-                    
-                    if os.path.exists(server_py):
-                        tar.add(server_py, arcname='server.py')
-                    if os.path.exists(requirements):
-                        tar.add(requirements, arcname='requirements.txt')
-                
-                tar_data = tar_buffer.getvalue()
+                template_files = [
+                    (os.path.join(backend_path, name), name)
+                    for name in ('server.py', 'requirements.txt')
+                    if os.path.exists(os.path.join(backend_path, name))
+                ]
+                tar_data = await blocking_executor.run_io(blocking_tasks.build_tar_archive, template_files)
                 
                 upload_result = await self.upload_to_container(
                     container_name="rentacar_template_backend",
@@ -1640,14 +1805,21 @@ class PortainerService:
                 'results': results
             }
 
-    async def update_tenant_from_template(self, company_code: str, domain: str) -> Dict[str, Any]:
+    async def update_tenant_from_template(self, company_code: str, domain: str, backend_image: str = None,
+                                          requirements_hash: str = None, installed_requirements_hash: str = None,
+                                          components: Optional[List[str]] = None) -> Dict[str, Any]:
         """
         Update existing tenant from template WITHOUT touching database.
         Only updates:
         1. Frontend code (new features, UI updates)
-        2. Backend code (new API endpoints, bug fixes)
+        2. Backend code (new API endpoints, bug fixes) - skipped for tenants on
+           a prebuilt backend_image, whose stack is redeployed with the new image
         3. Nginx configuration
         
+        Dependencies are only reinstalled when requirements_hash differs from
+        the tenant's installed_requirements_hash. components limits the update to
+        frontend / backend / customer_app / operation_app (None = all).
+        
         DOES NOT TOUCH:
         - MongoDB data (customers, vehicles, reservations, etc.)
         - Admin credentials
@@ -1673,9 +1845,9 @@ class PortainerService:
             # Last resort fallback - should never happen for production tenants
             backend_port = await self._get_container_port(backend_container)
             if backend_port:
-                api_url = f"http://72.61.158.147:{backend_port}"
+                api_url = f"http://{self.server_ip}:{backend_port}"
             else:
-                api_url = f"http://72.61.158.147:8001"
+                api_url = f"http://{self.server_ip}:8001"
             logger.warning(f"[UPDATE-TEMPLATE] WARNING: No domain, using HTTP fallback: {api_url}")
         
         results = {
@@ -1689,82 +1861,112 @@ class PortainerService:
             'preserved_url': existing_api_url
         }
         
-        logger.info(f"[UPDATE-TEMPLATE] Starting template update for {company_code} ({domain})")
+        components = set(components) if components is not None else {'frontend', 'backend', 'customer_app', 'operation_app'}
+        up_to_date = {'skipped': True, 'reason': 'up to date'}
+        logger.info(f"[UPDATE-TEMPLATE] Starting template update for {company_code} ({domain}) - {', '.join(sorted(components))}")
         
         try:
             import asyncio
             
             # Step 1: Copy frontend from template (EXCLUDE config.js to preserve tenant API URL)
-            logger.info(f"[UPDATE-TEMPLATE] Step 1: Copying frontend code (excluding config.js)...")
-            results['frontend_copy'] = await self.copy_from_template(
-                template_container="rentacar_template_frontend",
-                target_container=frontend_container,
-                source_path="/usr/share/nginx/html",
-                dest_path="/usr/share/nginx",
-                exclude_files=["config.js"]
-            )
-            
-            # Step 2: Copy backend from template (EXCLUDE .env to preserve tenant DB config)
-            logger.info(f"[UPDATE-TEMPLATE] Step 2: Copying backend code (excluding .env)...")
-            results['backend_copy'] = await self.copy_from_template(
-                template_container="rentacar_template_backend",
-                target_container=backend_container,
-                source_path="/app",
-                dest_path="/",
-                exclude_files=[".env"]
-            )
-            
-            # Step 3: Install/Update backend dependencies
-            logger.info(f"[UPDATE-TEMPLATE] Step 3: Installing dependencies...")
-            results['deps_install'] = await self.install_backend_dependencies(backend_container)
+            if 'frontend' in components:
+                logger.info(f"[UPDATE-TEMPLATE] Step 1: Copying frontend code (excluding config.js)...")
+                results['frontend_copy'] = await self.copy_from_template(
+                    template_container="rentacar_template_frontend",
+                    target_container=frontend_container,
+                    source_path="/usr/share/nginx/html",
+                    dest_path="/usr/share/nginx",
+                    exclude_files=["config.js"]
+                )
+            else:
+                results['frontend_copy'] = up_to_date
+            
+            if 'backend' not in components:
+                results['backend_copy'] = up_to_date
+                results['deps_install'] = up_to_date
+            elif backend_image:
+                logger.info(f"[UPDATE-TEMPLATE] Steps 2-3: Backend runs prebuilt image {backend_image}")
+                results['backend_copy'] = {'skipped': True, 'reason': 'prebuilt image', 'image': backend_image}
+                results['deps_install'] = {'skipped': True, 'reason': 'prebuilt image'}
+            else:
+                # Step 2: Copy backend from template (EXCLUDE .env to preserve tenant DB config)
+                logger.info(f"[UPDATE-TEMPLATE] Step 2: Copying backend code (excluding .env)...")
+                results['backend_copy'] = await self.copy_from_template(
+                    template_container="rentacar_template_backend",
+                    target_container=backend_container,
+                    source_path="/app",
+                    dest_path="/",
+                    exclude_files=[".env"]
+                )
+                
+                # Step 3: Install/Update backend dependencies - only when requirements changed
+                if requirements_hash and requirements_hash == installed_requirements_hash:
+                    logger.info(f"[UPDATE-TEMPLATE] Step 3: Requirements unchanged, skipping install")
+                    results['deps_install'] = {'skipped': True, 'reason': 'requirements unchanged'}
+                else:
+                    logger.info(f"[UPDATE-TEMPLATE] Step 3: Installing dependencies...")
+                    results['deps_install'] = await self.install_backend_dependencies(backend_container)
+                    if results['deps_install'].get('success'):
+                        results['installed_requirements_hash'] = requirements_hash
             
             # Step 4: Re-configure Nginx for SPA
-            logger.info(f"[UPDATE-TEMPLATE] Step 4: Updating Nginx config...")
-            results['nginx_config'] = await self.configure_nginx_spa(frontend_container)
+            if 'frontend' in components:
+                logger.info(f"[UPDATE-TEMPLATE] Step 4: Updating Nginx config...")
+                results['nginx_config'] = await self.configure_nginx_spa(frontend_container)
+            
+            # Step 5: Restart backend container (a redeployed image stack already restarted it)
+            if 'backend' in components and not backend_image:
+                logger.info(f"[UPDATE-TEMPLATE] Step 5: Restarting backend...")
+                results['backend_restart'] = await self.restart_container(backend_container)
+                await asyncio.sleep(3)
+            
+            # Steps 6-9 only follow a frontend copy
+            if 'frontend' in components:
+                # Step 6: CRITICAL - Write config.js with correct HTTPS URL BEFORE frontend restart
+                # This must happen AFTER frontend copy but BEFORE restart to ensure it persists
+                logger.info(f"[UPDATE-TEMPLATE] Step 6: Writing config.js with URL: {api_url}")
+                results['config_js'] = await self.create_config_js(frontend_container, api_url)
+            
+                # Step 7: Verify config.js was written correctly
+                verify_url = await self._get_existing_config_url(frontend_container)
+                if verify_url != api_url:
+                    logger.error(f"[UPDATE-TEMPLATE] Config.js verification FAILED! Expected: {api_url}, Got: {verify_url}")
+                    # Try writing again
+                    await self.create_config_js(frontend_container, api_url)
+                    logger.info(f"[UPDATE-TEMPLATE] Retried config.js write")
+                else:
+                    logger.info(f"[UPDATE-TEMPLATE] Config.js verified: {verify_url}")
             
-            # Step 5: Restart backend container
-            logger.info(f"[UPDATE-TEMPLATE] Step 5: Restarting backend...")
-            results['backend_restart'] = await self.restart_container(backend_container)
-            await asyncio.sleep(3)
+                # Step 8: Reload nginx to pick up new config (don't restart, just reload)
+                logger.info(f"[UPDATE-TEMPLATE] Step 8: Reloading Nginx...")
+                await self.exec_in_container(frontend_container, "nginx -s reload")
+                results['frontend_restart'] = {'success': True, 'method': 'nginx_reload'}
             
-            # Step 6: CRITICAL - Write config.js with correct HTTPS URL BEFORE frontend restart
-            # This must happen AFTER frontend copy but BEFORE restart to ensure it persists
-            logger.info(f"[UPDATE-TEMPLATE] Step 6: Writing config.js with URL: {api_url}")
-            results['config_js'] = await self.create_config_js(frontend_container, api_url)
+                # Step 9: Final verification
+                await asyncio.sleep(2)
+                final_url = await self._get_existing_config_url(frontend_container)
+                results['final_config_url'] = final_url
+                logger.info(f"[UPDATE-TEMPLATE] Final config.js URL: {final_url}")
             
-            # Step 7: Verify config.js was written correctly
-            verify_url = await self._get_existing_config_url(frontend_container)
-            if verify_url != api_url:
-                logger.error(f"[UPDATE-TEMPLATE] Config.js verification FAILED! Expected: {api_url}, Got: {verify_url}")
-                # Try writing again
-                await self.create_config_js(frontend_container, api_url)
-                logger.info(f"[UPDATE-TEMPLATE] Retried config.js write")
+                if final_url and final_url.startswith("https://"):
+                    logger.info(f"[UPDATE-TEMPLATE] Template update complete for {company_code} - URL preserved!")
             else:
-                logger.info(f"[UPDATE-TEMPLATE] Config.js verified: {verify_url}")
-            
-            # Step 8: Reload nginx to pick up new config (don't restart, just reload)
-            logger.info(f"[UPDATE-TEMPLATE] Step 8: Reloading Nginx...")
-            await self.exec_in_container(frontend_container, "nginx -s reload")
-            results['frontend_restart'] = {'success': True, 'method': 'nginx_reload'}
-            
-            # Step 9: Final verification
-            await asyncio.sleep(2)
-            final_url = await self._get_existing_config_url(frontend_container)
-            results['final_config_url'] = final_url
-            logger.info(f"[UPDATE-TEMPLATE] Final config.js URL: {final_url}")
-            
-            if final_url and final_url.startswith("https://"):
-                logger.info(f"[UPDATE-TEMPLATE] Template update complete for {company_code} - URL preserved!")
+                results['frontend_restart'] = up_to_date
             
             # Step 10: Optional - Update mobile apps if containers exist
             try:
-                containers = await self.get_containers()
+                containers = await self.get_containers() if components & {'customer_app', 'operation_app'} else []
                 container_names = [c.get('Names', [''])[0].replace('/', '') for c in containers]
                 
                 customer_app_container = f"{safe_code}_customer_app"
                 operation_app_container = f"{safe_code}_operation_app"
                 
-                if customer_app_container in container_names:
+                for component, container in (('customer_app', customer_app_container),
+                                             ('operation_app', operation_app_container)):
+                    if component in components and container not in container_names:
+                        results[f"{component}_copy"] = {'skipped': True, 'reason': 'no container'}
+                
+                if 'customer_app' in components and customer_app_container in container_names:
                     logger.info(f"[UPDATE-TEMPLATE] Step 10a: Updating customer mobile app...")
                     # Get company name from environment or use default
                     company_name = os.environ.get('COMPANY_NAME', company_code.replace('_', ' ').title())
@@ -1775,7 +1977,7 @@ class PortainerService:
                         domain=domain
                     )
                 
-                if operation_app_container in container_names:
+                if 'operation_app' in components and operation_app_container in container_names:
                     logger.info(f"[UPDATE-TEMPLATE] Step 10b: Updating operation mobile app...")
                     company_name = os.environ.get('COMPANY_NAME', company_code.replace('_', ' ').title())
                     results['operation_app_copy'] = await self.copy_mobile_app_to_tenant(
@@ -1786,6 +1988,8 @@ class PortainerService:
                     )
             except Exception as mobile_error:
                 logger.warning(f"[UPDATE-TEMPLATE] Mobile app update skipped: {mobile_error}")
+                for component in components & {'customer_app', 'operation_app'}:
+                    results.setdefault(f"{component}_copy", {'success': False, 'error': str(mobile_error)})
             
             return {
                 'success': True,
@@ -1834,9 +2038,8 @@ class PortainerService:
                 copy_cmd = f"docker cp {frontend_tar_path} {template_frontend}:/tmp/frontend_update.tar.gz"
                 extract_cmd = f"docker exec {template_frontend} sh -c 'cd /usr/share/nginx/html && tar -xzf /tmp/frontend_update.tar.gz --strip-components=1 && rm /tmp/frontend_update.tar.gz'"
                 
-                import subprocess
-                copy_result = subprocess.run(copy_cmd, shell=True, capture_output=True, text=True)
-                extract_result = subprocess.run(extract_cmd, shell=True, capture_output=True, text=True)
+                copy_result = await blocking_executor.run_subprocess(copy_cmd, shell=True, timeout=120)
+                extract_result = await blocking_executor.run_subprocess(extract_cmd, shell=True, timeout=120)
                 
                 results['frontend_update'] = {
                     'copy': copy_result.returncode == 0,
@@ -1846,9 +2049,7 @@ class PortainerService:
             # Update backend files if provided
             if backend_files:
                 logger.info("[MASTER-TEMPLATE] Updating backend template...")
-                import subprocess
                 import tempfile
-                import os
                 
                 for filename, content in backend_files.items():
                     # Write to temp file
@@ -1859,7 +2060,7 @@ class PortainerService:
                     # Copy to container
                     dest_path = f"/app/{filename}"
                     copy_cmd = f"docker cp {temp_path} {template_backend}:{dest_path}"
-                    result = subprocess.run(copy_cmd, shell=True, capture_output=True, text=True)
+                    result = await blocking_executor.run_subprocess(copy_cmd, shell=True, timeout=120)
                     
                     # Cleanup temp file
                     os.unlink(temp_path)
@@ -1893,41 +2094,6 @@ class PortainerService:
                 'results': results
             }
 
-    async def get_tenant_support_tickets(self, company_code: str) -> list:
-        """Get support tickets from tenant's database via container exec"""
-        try:
-            backend_container = f"{company_code}_backend"
-            mongo_host = f"{company_code}_mongodb"
-            db_name = f"{company_code}_db"
-            
-            cmd = f'''python3 -c "
-from motor.motor_asyncio import AsyncIOMotorClient
-import asyncio, json
-
-async def get():
-    c = AsyncIOMotorClient('mongodb://{mongo_host}:27017')
-    db = c['{db_name}']
-    tickets = await db.support_tickets.find({{}}, {{'_id': 0}}).to_list(50)
-    print(json.dumps(tickets, default=str))
-
-asyncio.run(get())
-"'''
-            
-            result = await self.exec_in_container(backend_container, cmd)
-            if result.get("success"):
-                output = result.get("output", {}).get("text", "[]")
-                # Clean control characters and find JSON array
-                output = output.replace("\x01", " ").strip()
-                import re
-                match = re.search(r'\[.*\]', output, re.DOTALL)
-                if match:
-                    import json
-                    return json.loads(match.group())
-            return []
-        except Exception as e:
-            logger.warning(f"Error getting tickets from {company_code}: {e}")
-            return []
-
     # ============== MOBILE APP TEMPLATE FUNCTIONS ==============
     
     async def update_mobile_template_from_github(self, app_type: str, github_repo: str) -> Dict[str, Any]:
@@ -2260,3 +2426,8 @@ cd /app && git clone --depth 1 https://github.com/{github_repo}.git . 2>&1
 
 # Singleton instance
 portainer_service = PortainerService()
+
+
+def portainer_for(company: Dict[str, Any]) -> PortainerService:
+    """PortainerService bound to the endpoint a company's stack was placed on"""
+    return portainer_service.for_endpoint(company.get('portainer_endpoint_id'), company.get('server_ip'))
@@ -0,0 +1,197 @@
+"""
+Template Version Manifest
+Content hash per template component, recorded on each company after a
+successful deploy, so template rollouts only touch components that changed.
+
+Components (template container, path, files that stay tenant-specific):
+- frontend       rentacar_template_frontend:/usr/share/nginx/html  (config.js)
+- backend        rentacar_template_backend:/app                     (.env)
+- customer_app   rentacar_template_customer_app:/app                (node_modules, app.config.js, .env, .expo)
+- operation_app  rentacar_template_operation_app:/app               (same)
+
+Tenants on a prebuilt backend image are compared on the image tag instead
+of the backend container hash (backend_image component).
+
+MongoDB collection: template_manifests
+Company fields: template_versions {component: hash}, template_manifest_version
+"""
+
+import os
+import re
+import time
+import asyncio
+import logging
+from typing import Optional, Dict, Any, List
+from datetime import datetime, timezone
+
+from services.portainer_service import portainer_service
+from services.tenant_image import tenant_image_builder, TENANT_IMAGE_REPOSITORY
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_MANIFEST_TTL = float(os.environ.get('TEMPLATE_MANIFEST_TTL', '60'))
+
+TEMPLATE_COMPONENTS = {
+    'frontend': ('rentacar_template_frontend', '/usr/share/nginx/html', ['config.js']),
+    'backend': ('rentacar_template_backend', '/app', ['.env', '__pycache__']),
+    'customer_app': ('rentacar_template_customer_app', '/app', ['node_modules', 'app.config.js', '.env', '.expo', '.git']),
+    'operation_app': ('rentacar_template_operation_app', '/app', ['node_modules', 'app.config.js', '.env', '.expo', '.git']),
+}
+
+# update_tenant_from_template result steps that must succeed (or be skipped) per component
+COMPONENT_STEPS = {
+    'frontend': ('frontend_copy', 'config_js'),
+    'backend': ('backend_copy', 'deps_install'),
+    'customer_app': ('customer_app_copy',),
+    'operation_app': ('operation_app_copy',),
+}
+
+SHA256_RE = re.compile(r'\b([0-9a-f]{64})\b')
+
+
+def content_hash_command(path: str, exclude: List[str]) -> str:
+    """Shell command printing one sha256 over every file (name + content) under path"""
+    prune = ' -o '.join(f"-name '{name}'" for name in exclude)
+    return (
+        f"cd {path} && find . \\( {prune} \\) -prune -o -type f -exec sha256sum {{}} + "
+        f"| LC_ALL=C sort -k2 | sha256sum"
+    )
+
+
+class TemplateVersionService:
+    """Template manifest, per-company pending components and fleet drift"""
+
+    def __init__(self, portainer, db=None):
+        self.portainer = portainer
+        self.db = db
+        self._manifest: Optional[Dict[str, Any]] = None
+        self._manifest_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def set_db(self, db):
+        """Database bağlantısını ayarla"""
+        self.db = db
+
+    async def component_hash(self, component: str) -> Optional[str]:
+        container, path, exclude = TEMPLATE_COMPONENTS[component]
+        result = await self.portainer.exec_in_container(container, content_hash_command(path, exclude))
+        if not result.get('success'):
+            logger.warning(f"[TEMPLATE-VERSION] Could not hash {component}: {result.get('error')}")
+            return None
+        output = result.get('output')
+        text = output.get('text', '') if isinstance(output, dict) else str(output)
+        matches = SHA256_RE.findall(text)
+        return matches[-1] if matches else None
+
+    async def get_manifest(self, refresh: bool = False) -> Dict[str, Any]:
+        """
+        Current template manifest. Hashes are recomputed at most every
+        TEMPLATE_MANIFEST_TTL seconds; a new version is stored only when a hash changed.
+        """
+        async with self._lock:
+            if not refresh and self._manifest and time.monotonic() - self._manifest_at < TEMPLATE_MANIFEST_TTL:
+                return self._manifest
+
+            names = list(TEMPLATE_COMPONENTS)
+            hashes = await asyncio.gather(*(self.component_hash(n) for n in names))
+            components = dict(zip(names, hashes))
+            try:
+                components['backend_image'] = f"{TENANT_IMAGE_REPOSITORY}:{(await tenant_image_builder.code_hash())[:12]}"
+            except OSError:
+                components['backend_image'] = None
+
+            latest = await self.db.template_manifests.find_one({}, {'_id': 0}, sort=[('version', -1)]) if self.db is not None else None
+            if latest and latest['components'] == components:
+                manifest = latest
+            else:
+                manifest = {
+                    'version': (latest['version'] + 1) if latest else 1,
+                    'components': components,
+                    'changed': [c for c in components if not latest or latest['components'].get(c) != components[c]],
+                    'created_at': datetime.now(timezone.utc).isoformat()
+                }
+                # Nothing hashed means the template host was unreachable - not a new version
+                if self.db is not None and any(components.values()):
+                    await self.db.template_manifests.insert_one(dict(manifest))
+                    logger.info(f"[TEMPLATE-VERSION] Manifest v{manifest['version']} - changed: {', '.join(manifest['changed'])}")
+
+            self._manifest, self._manifest_at = manifest, time.monotonic()
+            return manifest
+
+    @staticmethod
+    def pending_components(company: Dict[str, Any], manifest: Dict[str, Any]) -> List[str]:
+        """Components whose deployed version differs from the manifest"""
+        deployed = company.get('template_versions') or {}
+        pending = []
+        for component in TEMPLATE_COMPONENTS:
+            if component == 'backend' and company.get('backend_image'):
+                if company['backend_image'] != manifest['components'].get('backend_image'):
+                    pending.append(component)
+                continue
+            expected = manifest['components'].get(component)
+            if not expected:
+                # Unhashable frontend/backend is redeployed to be safe; a missing mobile template has nothing to copy
+                if component in ('frontend', 'backend'):
+                    pending.append(component)
+            elif deployed.get(component) != expected:
+                pending.append(component)
+        return pending
+
+    @staticmethod
+    def completed_components(components: List[str], results: Optional[Dict[str, Any]]) -> List[str]:
+        """Components whose update steps all succeeded or were skipped"""
+        results = results or {}
+        completed = []
+        for component in components:
+            steps = [results.get(step) for step in COMPONENT_STEPS[component]]
+            if all(isinstance(s, dict) and (s.get('success') or s.get('skipped')) for s in steps):
+                completed.append(component)
+        return completed
+
+    async def record(self, company: Dict[str, Any], manifest: Dict[str, Any], components: List[str] = None):
+        """
+        Mark the company as running this manifest after a successful update.
+        components limits the record to those components after a partial
+        update; the manifest version is only stored for a full one (None).
+        """
+        versions = {
+            c: h for c, h in manifest['components'].items()
+            if c in TEMPLATE_COMPONENTS and h and (components is None or c in components)
+        }
+        update = {f"template_versions.{c}": h for c, h in versions.items()}
+        if components is None:
+            update['template_manifest_version'] = manifest['version']
+        if update:
+            await self.db.companies.update_one({'id': company['id']}, {'$set': update})
+
+    async def drift_report(self) -> Dict[str, Any]:
+        """Per component: how many deployed companies run the current template, and which do not"""
+        manifest = await self.get_manifest()
+        companies = await self.db.companies.find(
+            {'portainer_stack_id': {'$ne': None}, 'domain': {'$nin': [None, '']}},
+            {'_id': 0, 'id': 1, 'code': 1, 'name': 1, 'template_versions': 1,
+             'template_manifest_version': 1, 'backend_image': 1, 'last_template_update': 1}
+        ).to_list(5000)
+
+        components = {c: {'current': 0, 'outdated': []} for c in TEMPLATE_COMPONENTS}
+        up_to_date = 0
+        for company in companies:
+            pending = self.pending_components(company, manifest)
+            if not pending:
+                up_to_date += 1
+            for component in TEMPLATE_COMPONENTS:
+                if component in pending:
+                    components[component]['outdated'].append(company['code'])
+                else:
+                    components[component]['current'] += 1
+
+        return {
+            'manifest': manifest,
+            'companies': len(companies),
+            'up_to_date': up_to_date,
+            'components': components,
+        }
+
+
+# Singleton instance
+template_versions = TemplateVersionService(portainer_service)
@@ -0,0 +1,181 @@
+"""
+Tenant Database Connections
+Pooled Motor clients for superadmin reads from tenant databases (support
+tickets, stats, exports) - plain async queries instead of exec'ing a Python
+script in each tenant backend container.
+
+- clients are created on first use, keyed by connection URL, so every
+  tenant on the shared mongod reuses one client
+- at most TENANT_DB_MAX_CLIENTS are kept; the least recently used is closed
+- a client is pinged before use when its last check is older than
+  TENANT_DB_HEALTH_INTERVAL; the background loop also pings idle clients
+  and closes those unused for TENANT_DB_IDLE_SECONDS
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+
+from services.tenant_mongo import tenant_mongo, tenant_db_name
+
+logger = logging.getLogger(__name__)
+
+TENANT_DB_MAX_CLIENTS = int(os.environ.get('TENANT_DB_MAX_CLIENTS', '50'))
+TENANT_DB_POOL_SIZE = int(os.environ.get('TENANT_DB_POOL_SIZE', '5'))
+TENANT_DB_TIMEOUT_MS = int(os.environ.get('TENANT_DB_TIMEOUT_MS', '3000'))
+TENANT_DB_HEALTH_INTERVAL = float(os.environ.get('TENANT_DB_HEALTH_INTERVAL', '30'))
+TENANT_DB_IDLE_SECONDS = float(os.environ.get('TENANT_DB_IDLE_SECONDS', '900'))
+
+
+class TenantDatabaseUnavailable(Exception):
+    """Raised when a tenant's MongoDB cannot be reached"""
+    pass
+
+
+class TenantDatabaseRegistry:
+    """LRU registry of Motor clients for tenant databases"""
+
+    def __init__(self, max_clients: int = TENANT_DB_MAX_CLIENTS):
+        self.db = None
+        self.max_clients = max_clients
+        self._clients: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'health_failures': 0}
+
+    def set_db(self, db):
+        """Database bağlantısını ayarla"""
+        self.db = db
+
+    @staticmethod
+    def connection_url(company: Dict[str, Any]) -> Optional[str]:
+        if tenant_mongo.is_shared(company):
+            return tenant_mongo.admin_url(company)
+        if not (company.get('ports') or {}).get('mongodb'):
+            return None
+        return tenant_mongo.admin_url(company)
+
+    def _close(self, url: str, reason: str):
+        entry = self._clients.pop(url, None)
+        if entry:
+            entry['client'].close()
+            logger.info(f"[TENANT-DB] Closed client for {entry['label']} ({reason})")
+
+    async def _ping(self, entry: Dict[str, Any]) -> bool:
+        try:
+            await entry['client'].admin.command('ping')
+            entry['healthy'], entry['checked_at'], entry['error'] = True, time.monotonic(), None
+            return True
+        except Exception as e:
+            entry['healthy'], entry['checked_at'], entry['error'] = False, time.monotonic(), str(e)
+            self.stats['health_failures'] += 1
+            return False
+
+    async def get_database(self, company: Dict[str, Any]) -> AsyncIOMotorDatabase:
+        """Tenant database handle; raises TenantDatabaseUnavailable if it cannot be reached"""
+        url = self.connection_url(company)
+        if not url:
+            raise TenantDatabaseUnavailable(f"{company.get('code')}: MongoDB bağlantı bilgisi yok")
+
+        async with self._locks.setdefault(url, asyncio.Lock()):
+            entry = self._clients.get(url)
+            if entry:
+                self.stats['hits'] += 1
+                self._clients.move_to_end(url)
+            else:
+                self.stats['misses'] += 1
+                entry = {
+                    'client': AsyncIOMotorClient(
+                        url, maxPoolSize=TENANT_DB_POOL_SIZE, minPoolSize=0,
+                        serverSelectionTimeoutMS=TENANT_DB_TIMEOUT_MS, connectTimeoutMS=TENANT_DB_TIMEOUT_MS
+                    ),
+                    'label': 'shared mongod' if tenant_mongo.is_shared(company) else company['code'],
+                    'checked_at': 0.0,
+                    'healthy': None,
+                    'error': None,
+                }
+                self._clients[url] = entry
+                while len(self._clients) > self.max_clients:
+                    self._close(next(iter(self._clients)), 'evicted')
+                    self.stats['evictions'] += 1
+
+            entry['last_used'] = time.monotonic()
+            if time.monotonic() - entry['checked_at'] > TENANT_DB_HEALTH_INTERVAL and not await self._ping(entry):
+                error = entry['error']
+                self._close(url, 'unhealthy')
+                raise TenantDatabaseUnavailable(f"{company.get('code')}: {error}")
+
+        return entry['client'][tenant_db_name(company)]
+
+    async def find(self, company: Dict[str, Any], collection: str, query: Dict[str, Any] = None,
+                   sort: List = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """Read documents from a tenant collection (without _id)"""
+        database = await self.get_database(company)
+        cursor = database[collection].find(query or {}, {'_id': 0})
+        if sort:
+            cursor = cursor.sort(sort)
+        return await cursor.to_list(limit)
+
+    async def get_support_tickets(self, company: Dict[str, Any], limit: int = 50) -> List[Dict[str, Any]]:
+        return await self.find(company, 'support_tickets', limit=limit)
+
+    # ---------- health ----------
+
+    async def check_health(self) -> Dict[str, Any]:
+        """Ping every cached client, close failing and long-idle ones"""
+        now = time.monotonic()
+        for url, entry in list(self._clients.items()):
+            if now - entry.get('last_used', now) > TENANT_DB_IDLE_SECONDS:
+                self._close(url, 'idle')
+        entries = list(self._clients.items())
+        results = await asyncio.gather(*(self._ping(e) for _, e in entries))
+        for (url, _), healthy in zip(entries, results):
+            if not healthy:
+                self._close(url, 'unhealthy')
+        return self.get_status()
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(TENANT_DB_HEALTH_INTERVAL)
+            try:
+                await self.check_health()
+            except Exception as e:
+                logger.error(f"[TENANT-DB] Health check failed: {str(e)}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._health_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for url in list(self._clients):
+            self._close(url, 'shutdown')
+
+    def get_status(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            'clients': [
+                {
+                    'tenant': e['label'],
+                    'healthy': e['healthy'],
+                    'error': e['error'],
+                    'idle_seconds': round(now - e.get('last_used', now), 1),
+                    'checked_seconds_ago': round(now - e['checked_at'], 1) if e['checked_at'] else None,
+                }
+                for e in self._clients.values()
+            ],
+            'max_clients': self.max_clients,
+            'pool_size': TENANT_DB_POOL_SIZE,
+            **self.stats,
+        }
+
+
+# Singleton instance
+tenant_databases = TenantDatabaseRegistry()
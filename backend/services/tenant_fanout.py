@@ -0,0 +1,87 @@
+"""
+Tenant Fan-out
+Runs one read against many tenants concurrently for superadmin aggregate
+pages, so page latency follows the slowest tenant instead of the sum.
+
+- at most TENANT_FANOUT_CONCURRENCY tenants are queried at once
+- each tenant gets TENANT_FANOUT_TIMEOUT seconds; slow or failing tenants are
+  reported per tenant and the rest of the results are still returned
+- successful per-tenant results are cached for TENANT_FANOUT_CACHE_TTL
+  seconds under (key, company code)
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, Any, List, Callable, Awaitable, Tuple
+
+logger = logging.getLogger(__name__)
+
+TENANT_FANOUT_CONCURRENCY = int(os.environ.get('TENANT_FANOUT_CONCURRENCY', '16'))
+TENANT_FANOUT_TIMEOUT = float(os.environ.get('TENANT_FANOUT_TIMEOUT', '3'))
+TENANT_FANOUT_CACHE_TTL = float(os.environ.get('TENANT_FANOUT_CACHE_TTL', '30'))
+
+
+class TenantFanOut:
+    """Concurrent per-tenant reads with timeouts, partial results and a TTL cache"""
+
+    def __init__(self, concurrency: int = TENANT_FANOUT_CONCURRENCY, timeout: float = TENANT_FANOUT_TIMEOUT,
+                 cache_ttl: float = TENANT_FANOUT_CACHE_TTL):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self._cache: Dict[Tuple[str, str], Tuple[float, Any]] = {}
+        self.stats = {'runs': 0, 'cache_hits': 0, 'timeouts': 0, 'errors': 0}
+
+    def invalidate(self, key: str = None, company_code: str = None):
+        """Drop cached results for a key and/or company"""
+        self._cache = {
+            k: v for k, v in self._cache.items()
+            if not ((key is None or k[0] == key) and (company_code is None or k[1] == company_code))
+        }
+
+    async def run(self, companies: List[Dict[str, Any]], key: str,
+                  fetch: Callable[[Dict[str, Any]], Awaitable[Any]], use_cache: bool = True) -> Dict[str, Any]:
+        """
+        Call fetch(company) for every company.
+        Returns {'results': {code: value}, 'tenants': {code: status}, 'partial': bool}.
+        """
+        self.stats['runs'] += 1
+        slots = asyncio.Semaphore(self.concurrency)
+        results: Dict[str, Any] = {}
+        tenants: Dict[str, Dict[str, Any]] = {}
+
+        async def one(company: Dict[str, Any]):
+            code = company['code']
+            cached = self._cache.get((key, code))
+            if use_cache and cached and time.monotonic() - cached[0] < self.cache_ttl:
+                self.stats['cache_hits'] += 1
+                results[code] = cached[1]
+                tenants[code] = {'ok': True, 'cached': True, 'age_seconds': round(time.monotonic() - cached[0], 1)}
+                return
+
+            async with slots:
+                started = time.monotonic()
+                try:
+                    value = await asyncio.wait_for(fetch(company), timeout=self.timeout)
+                except asyncio.TimeoutError:
+                    self.stats['timeouts'] += 1
+                    tenants[code] = {'ok': False, 'error': 'timeout', 'duration_ms': round(self.timeout * 1000)}
+                    return
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    logger.warning(f"[FANOUT] {key} failed for {code}: {str(e)}")
+                    tenants[code] = {'ok': False, 'error': str(e), 'duration_ms': round((time.monotonic() - started) * 1000)}
+                    return
+
+            self._cache[(key, code)] = (time.monotonic(), value)
+            results[code] = value
+            tenants[code] = {'ok': True, 'cached': False, 'duration_ms': round((time.monotonic() - started) * 1000)}
+
+        await asyncio.gather(*(one(c) for c in companies if c.get('code')))
+        return {
+            'results': results,
+            'tenants': tenants,
+            'partial': any(not t['ok'] for t in tenants.values()),
+        }
@@ -0,0 +1,190 @@
+"""
+Tenant Backend Image Builder
+Builds a versioned Docker image for tenant backends so containers start with
+code and dependencies baked in instead of copying files and pip-installing
+into every tenant.
+
+Two layers, each built only when its input changes:
+- deps image  rentacar-tenant-deps:{requirements hash}  - pip install -r requirements.txt
+- app image   rentacar-tenant-backend:{code hash}       - FROM deps + server.py
+
+Images are built on the Docker host through Portainer's Docker API proxy.
+Metadata is kept in MongoDB: tenant_images
+"""
+
+import os
+import asyncio
+import hashlib
+import logging
+from typing import Optional, Dict, Any, List
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from pymongo.errors import DuplicateKeyError
+
+from services.executor import blocking_executor
+from services import blocking_tasks
+from services.portainer_service import portainer_service
+
+logger = logging.getLogger(__name__)
+
+TENANT_BACKEND_SOURCE = os.environ.get('TENANT_BACKEND_SOURCE', '/app/backend/template/backend')
+TENANT_DEPS_REPOSITORY = 'rentacar-tenant-deps'
+TENANT_IMAGE_REPOSITORY = 'rentacar-tenant-backend'
+TENANT_PYTHON_BASE = os.environ.get('TENANT_PYTHON_BASE', 'python:3.11-slim')
+VERSION_ALLOCATION_ATTEMPTS = 5
+
+DEPS_DOCKERFILE = f"""FROM {TENANT_PYTHON_BASE}
+WORKDIR /app
+COPY requirements.txt .
+RUN pip install --no-cache-dir -r requirements.txt
+"""
+
+# Port 80 matches the tenant compose port mapping and Traefik service labels
+APP_DOCKERFILE = """FROM {deps_image}
+WORKDIR /app
+COPY server.py requirements.txt ./
+RUN echo "from server import app" > main.py
+EXPOSE 80
+CMD ["uvicorn", "server:app", "--host", "0.0.0.0", "--port", "80"]
+"""
+
+
+def file_sha256(*paths: str) -> str:
+    """SHA-256 over the contents of the given files, in order"""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class TenantImageBuilder:
+    """Build-once tenant backend images keyed by source hashes"""
+
+    def __init__(self, portainer, db=None, source_dir: str = TENANT_BACKEND_SOURCE):
+        self.portainer = portainer
+        self.db = db
+        self.source_dir = source_dir
+
+    def set_db(self, db):
+        """Database bağlantısını ayarla"""
+        self.db = db
+
+    @property
+    def requirements_path(self) -> str:
+        return os.path.join(self.source_dir, 'requirements.txt')
+
+    @property
+    def server_path(self) -> str:
+        return os.path.join(self.source_dir, 'server.py')
+
+    async def requirements_hash(self) -> str:
+        return await blocking_executor.run_io(file_sha256, self.requirements_path)
+
+    async def code_hash(self) -> str:
+        return await blocking_executor.run_io(file_sha256, self.requirements_path, self.server_path)
+
+    async def _build(self, tags: List[str], files, dockerfile: str) -> Dict[str, Any]:
+        context = await blocking_executor.run_io(
+            blocking_tasks.build_tar_archive, files, [], {'Dockerfile': dockerfile}
+        )
+        return await self.portainer.build_image(tags, context)
+
+    async def ensure_deps_image(self, requirements_hash: str) -> Dict[str, Any]:
+        """Build the dependency layer unless an image for this requirements hash exists"""
+        tag = f"{TENANT_DEPS_REPOSITORY}:{requirements_hash[:12]}"
+        if await self.portainer.image_exists(tag):
+            return {'success': True, 'tag': tag, 'reused': True}
+
+        logger.info(f"[TENANT-IMAGE] Requirements changed - building {tag}")
+        result = await self._build([tag], [(self.requirements_path, 'requirements.txt')], DEPS_DOCKERFILE)
+        return {**result, 'tag': tag, 'reused': False}
+
+    async def get_latest(self) -> Optional[Dict[str, Any]]:
+        if self.db is None:
+            return None
+        return await self.db.tenant_images.find_one(
+            {'status': 'ready'}, {'_id': 0}, sort=[('version', -1)]
+        )
+
+    async def list_images(self, limit: int = 20) -> List[Dict[str, Any]]:
+        if self.db is None:
+            return []
+        return await self.db.tenant_images.find({}, {'_id': 0}).sort('version', -1).to_list(limit)
+
+    async def get_or_build(self, built_by: str = None, force: bool = False) -> Dict[str, Any]:
+        """Return the image for the current template backend, building only what changed"""
+        if self.db is None:
+            return {'success': False, 'error': 'Database bağlantısı yok'}
+        if not os.path.exists(self.server_path) or not os.path.exists(self.requirements_path):
+            return {'success': False, 'error': f'Tenant backend source not found in {self.source_dir}'}
+        try:
+            return await self._get_or_build(built_by, force)
+        except asyncio.TimeoutError:
+            # Hashing / archiving timed out in the executor; callers fall back to copying files
+            logger.warning("[TENANT-IMAGE] Build context preparation timed out")
+            return {'success': False, 'error': 'Tenant image build context timed out'}
+
+    async def _get_or_build(self, built_by: str, force: bool) -> Dict[str, Any]:
+        requirements_hash = await self.requirements_hash()
+        code_hash = await self.code_hash()
+        tag = f"{TENANT_IMAGE_REPOSITORY}:{code_hash[:12]}"
+
+        if not force:
+            existing = await self.db.tenant_images.find_one(
+                {'code_hash': code_hash, 'status': 'ready'}, {'_id': 0}
+            )
+            if existing and await self.portainer.image_exists(existing['tag']):
+                return {'success': True, 'image': existing, 'reused': True}
+
+        started = datetime.now(timezone.utc)
+
+        deps = await self.ensure_deps_image(requirements_hash)
+        if not deps.get('success'):
+            return {'success': False, 'error': f"Deps image build failed: {deps.get('error')}"}
+
+        logger.info(f"[TENANT-IMAGE] Building {tag} on {deps['tag']}")
+        build = await self._build(
+            [tag, f"{TENANT_IMAGE_REPOSITORY}:latest"],
+            [(self.server_path, 'server.py'), (self.requirements_path, 'requirements.txt')],
+            APP_DOCKERFILE.format(deps_image=deps['tag'])
+        )
+        if not build.get('success'):
+            return {'success': False, 'error': f"Image build failed: {build.get('error')}"}
+
+        image = {
+            'id': str(uuid4()),
+            'tag': tag,
+            'deps_tag': deps['tag'],
+            'code_hash': code_hash,
+            'requirements_hash': requirements_hash,
+            'deps_reused': deps.get('reused', False),
+            'status': 'ready',
+            'build_seconds': round((datetime.now(timezone.utc) - started).total_seconds(), 1),
+            'built_by': built_by,
+            'created_at': datetime.now(timezone.utc).isoformat()
+        }
+        # version is unique: a concurrent build that took the same number makes us take the next one
+        for _ in range(VERSION_ALLOCATION_ATTEMPTS):
+            last = await self.db.tenant_images.find_one({}, {'_id': 0, 'version': 1}, sort=[('version', -1)])
+            image['version'] = (last.get('version', 0) if last else 0) + 1
+            try:
+                await self.db.tenant_images.insert_one(image)
+                break
+            except DuplicateKeyError:
+                image.pop('_id', None)
+        else:
+            return {'success': False, 'error': 'Could not allocate a tenant image version'}
+        image.pop('_id', None)
+
+        logger.info(
+            f"[TENANT-IMAGE] {tag} v{image['version']} ready in {image['build_seconds']}s "
+            f"(deps {'reused' if image['deps_reused'] else 'rebuilt'})"
+        )
+        return {'success': True, 'image': image, 'reused': False}
+
+
+# Singleton instance
+tenant_image_builder = TenantImageBuilder(portainer_service)
@@ -0,0 +1,284 @@
+"""
+Tenant MongoDB Placement
+Tenant databases ({safe_code}_db) either live in the tenant stack's own
+mongod (dedicated, the original layout) or on one consolidated mongod
+shared by the fleet, each with its own database user.
+
+- TENANT_MONGO_MODE=shared provisions new full-stack tenants on the shared mongod;
+  SHARED_MONGO_ROOT_PASSWORD (or SHARED_MONGO_ADMIN_URL) must be set, otherwise
+  provisioning keeps dedicated mongods and migrate() refuses to run
+- migrate() moves an existing dedicated tenant over: stop backend, copy
+  collections + indexes, verify counts, redeploy the stack without its
+  MongoDB container
+- admin_url() gives superadmin code a direct connection either way
+
+Company fields: mongo_mode, mongo_user, mongo_password, mongo_url
+"""
+
+import os
+import secrets
+import logging
+from typing import Optional, Dict, Any, List
+from datetime import datetime, timezone
+from urllib.parse import quote_plus
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure
+
+from services.portainer_service import (
+    portainer_for, get_full_company_stack_template, SERVER_IP,
+    SHARED_MONGO_CONTAINER, SHARED_MONGO_PORT, SHARED_MONGO_ROOT_USER, SHARED_MONGO_ROOT_PASSWORD
+)
+
+logger = logging.getLogger(__name__)
+
+TENANT_MONGO_MODE = os.environ.get('TENANT_MONGO_MODE', 'dedicated').lower()
+SHARED_MONGO_ADMIN_URL = os.environ.get('SHARED_MONGO_ADMIN_URL') or (
+    f"mongodb://{quote_plus(SHARED_MONGO_ROOT_USER)}:{quote_plus(SHARED_MONGO_ROOT_PASSWORD)}"
+    f"@{SERVER_IP}:{SHARED_MONGO_PORT}/?authSource=admin"
+    if SHARED_MONGO_ROOT_PASSWORD else ''
+)
+SHARED_MONGO_NOT_CONFIGURED = 'Paylaşımlı MongoDB yapılandırılmamış (SHARED_MONGO_ROOT_PASSWORD tanımlı değil)'
+# Tenant backends reach the shared mongod over traefik_network
+SHARED_MONGO_INTERNAL_HOST = os.environ.get('SHARED_MONGO_INTERNAL_HOST', f"{SHARED_MONGO_CONTAINER}:27017")
+MIGRATION_BATCH_SIZE = int(os.environ.get('TENANT_MONGO_MIGRATION_BATCH', '1000'))
+
+# index_information() keys that create_index accepts as options
+INDEX_OPTIONS = ('unique', 'sparse', 'expireAfterSeconds', 'partialFilterExpression', 'collation', 'weights', 'default_language')
+
+
+def tenant_db_name(company: Dict[str, Any]) -> str:
+    return f"{company['code'].replace('-', '').replace('_', '')}_db"
+
+
+async def copy_collection(source, target, name: str) -> Dict[str, Any]:
+    """Copy one collection's documents and indexes, then compare counts"""
+    source_coll, target_coll = source[name], target[name]
+    copied = 0
+    batch: List[Dict[str, Any]] = []
+    async for document in source_coll.find({}):
+        batch.append(document)
+        if len(batch) >= MIGRATION_BATCH_SIZE:
+            await target_coll.insert_many(batch, ordered=False)
+            copied += len(batch)
+            batch = []
+    if batch:
+        await target_coll.insert_many(batch, ordered=False)
+        copied += len(batch)
+
+    indexes = 0
+    for index_name, info in (await source_coll.index_information()).items():
+        if index_name == '_id_':
+            continue
+        options = {k: info[k] for k in INDEX_OPTIONS if k in info}
+        await target_coll.create_index(info['key'], name=index_name, **options)
+        indexes += 1
+
+    source_count = await source_coll.count_documents({})
+    target_count = await target_coll.count_documents({})
+    return {'documents': copied, 'indexes': indexes, 'verified': source_count == target_count == copied}
+
+
+async def copy_database(source, target) -> Dict[str, Any]:
+    """Copy every non-system collection; raises if any count does not match"""
+    collections: Dict[str, Any] = {}
+    for name in await source.list_collection_names():
+        if name.startswith('system.'):
+            continue
+        collections[name] = await copy_collection(source, target, name)
+
+    unverified = [n for n, r in collections.items() if not r['verified']]
+    if unverified:
+        raise RuntimeError(f"Document counts differ for: {', '.join(unverified)}")
+    return collections
+
+
+class TenantMongoService:
+    """Creates tenant databases / users on the shared mongod and migrates tenants onto it"""
+
+    def __init__(self, db=None):
+        self.db = db
+        self._admin_client: Optional[AsyncIOMotorClient] = None
+
+    def set_db(self, db):
+        """Database bağlantısını ayarla"""
+        self.db = db
+
+    @property
+    def shared_enabled(self) -> bool:
+        return TENANT_MONGO_MODE == 'shared'
+
+    @property
+    def configured(self) -> bool:
+        return bool(SHARED_MONGO_ADMIN_URL)
+
+    @property
+    def admin_client(self) -> AsyncIOMotorClient:
+        if not self.configured:
+            raise RuntimeError(SHARED_MONGO_NOT_CONFIGURED)
+        if self._admin_client is None:
+            self._admin_client = AsyncIOMotorClient(SHARED_MONGO_ADMIN_URL, serverSelectionTimeoutMS=15000)
+        return self._admin_client
+
+    def close(self):
+        if self._admin_client is not None:
+            self._admin_client.close()
+            self._admin_client = None
+
+    @staticmethod
+    def is_shared(company: Dict[str, Any]) -> bool:
+        return company.get('mongo_mode') == 'shared'
+
+    def admin_url(self, company: Dict[str, Any], mongo_port: int = None) -> str:
+        """Direct connection URL for superadmin-side setup of a tenant database"""
+        if self.is_shared(company):
+            return SHARED_MONGO_ADMIN_URL
+        mongo_port = mongo_port or (company.get('ports') or {}).get('mongodb')
+        return f"mongodb://{company.get('server_ip') or SERVER_IP}:{mongo_port}"
+
+    @staticmethod
+    def backend_url(db_name: str, user: str, password: str) -> str:
+        """Connection URL baked into the tenant backend's environment"""
+        return f"mongodb://{quote_plus(user)}:{quote_plus(password)}@{SHARED_MONGO_INTERNAL_HOST}/{db_name}?authSource={db_name}"
+
+    async def ensure_tenant_user(self, company: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Create (or re-sync) the tenant's database user on the shared mongod.
+        Returns the company fields to store; the password is kept if one exists.
+        """
+        db_name = tenant_db_name(company)
+        user = company.get('mongo_user') or f"{db_name}_user"
+        password = company.get('mongo_password') or secrets.token_urlsafe(24)
+        roles = [{'role': 'readWrite', 'db': db_name}, {'role': 'dbAdmin', 'db': db_name}]
+
+        tenant_db = self.admin_client[db_name]
+        try:
+            await tenant_db.command('createUser', user, pwd=password, roles=roles)
+            logger.info(f"[TENANT-MONGO] Created user {user} on shared mongod")
+        except OperationFailure as e:
+            # 51003: user already exists
+            if e.code != 51003:
+                raise
+            await tenant_db.command('updateUser', user, pwd=password, roles=roles)
+
+        return {
+            'mongo_mode': 'shared',
+            'mongo_user': user,
+            'mongo_password': password,
+            'mongo_url': self.backend_url(db_name, user, password),
+        }
+
+    async def migrate(self, company: Dict[str, Any], force: bool = False) -> Dict[str, Any]:
+        """
+        Move a dedicated tenant database onto the shared mongod.
+
+        The tenant backend is stopped for the copy so no writes are lost; on
+        any failure before the redeploy it is started again on the old database.
+        The old MongoDB volume is left in place for rollback.
+        """
+        if self.is_shared(company):
+            return {'success': False, 'error': 'Firma zaten paylaşımlı MongoDB üzerinde'}
+        if not self.configured:
+            return {'success': False, 'error': SHARED_MONGO_NOT_CONFIGURED}
+        if not company.get('portainer_stack_id') or not company.get('domain'):
+            return {'success': False, 'error': 'Sadece domain ile deploy edilmiş firmalar taşınabilir'}
+        mongo_port = (company.get('ports') or {}).get('mongodb')
+        if not mongo_port:
+            return {'success': False, 'error': 'Firmanın MongoDB portu bilinmiyor'}
+
+        db_name = tenant_db_name(company)
+        safe_code = db_name[:-3]
+        backend_container = f"{safe_code}_backend"
+        target = self.admin_client[db_name]
+
+        existing = [n for n in await target.list_collection_names() if not n.startswith('system.')]
+        if existing and not force:
+            return {'success': False, 'error': f'{db_name} paylaşımlı MongoDB üzerinde zaten veri içeriyor', 'collections': existing}
+
+        started = datetime.now(timezone.utc)
+        if existing:
+            # force: replace what an earlier, interrupted attempt left behind
+            await self.admin_client.drop_database(db_name)
+        fields = await self.ensure_tenant_user(company)
+
+        logger.info(f"[TENANT-MONGO] Migrating {company['code']} - stopping {backend_container}")
+        portainer = portainer_for(company)
+        stopped = await portainer.stop_container(backend_container)
+        if stopped.get('error'):
+            return {'success': False, 'error': f"Backend durdurulamadı: {stopped['error']}"}
+
+        source_client = AsyncIOMotorClient(self.admin_url(company), serverSelectionTimeoutMS=15000)
+        collections: Dict[str, Any] = {}
+        try:
+            collections = await copy_database(source_client[db_name], target)
+
+            compose = get_full_company_stack_template(
+                company['code'], company['name'], company['domain'], company['port_offset'],
+                company.get('backend_image'), fields['mongo_url']
+            )
+            # prune removes the tenant's own MongoDB container - that is the memory we reclaim
+            redeploy = await portainer.update_stack(company['portainer_stack_id'], compose, prune=True)
+            if not redeploy.get('success'):
+                raise RuntimeError(f"Stack redeploy failed: {redeploy.get('error')}")
+        except Exception as e:
+            logger.error(f"[TENANT-MONGO] Migration of {company['code']} failed: {str(e)} - restarting backend on old database")
+            await portainer.restart_container(backend_container)
+            return {'success': False, 'error': str(e), 'collections': collections}
+        finally:
+            source_client.close()
+
+        ports = {**(company.get('ports') or {}), 'mongodb': None}
+        duration = round((datetime.now(timezone.utc) - started).total_seconds(), 1)
+        if self.db is not None:
+            await self.db.companies.update_one(
+                {'id': company['id']},
+                {'$set': {
+                    **fields,
+                    'ports': ports,
+                    'mongo_migrated_at': datetime.now(timezone.utc).isoformat(),
+                    'mongo_legacy_port': mongo_port,
+                    'updated_at': datetime.now(timezone.utc).isoformat()
+                }}
+            )
+
+        logger.info(
+            f"[TENANT-MONGO] {company['code']} migrated to shared mongod in {duration}s "
+            f"({sum(r['documents'] for r in collections.values())} documents)"
+        )
+        return {
+            'success': True,
+            'company_code': company['code'],
+            'db_name': db_name,
+            'collections': collections,
+            'duration_seconds': duration,
+            'company_fields': {**fields, 'ports': ports},
+        }
+
+    async def get_status(self) -> Dict[str, Any]:
+        """Tenant placement counts and shared mongod memory"""
+        placement = {'shared': 0, 'dedicated': 0}
+        if self.db is not None:
+            async for company in self.db.companies.find(
+                {'portainer_stack_id': {'$ne': None}}, {'_id': 0, 'mongo_mode': 1}
+            ):
+                placement['shared' if company.get('mongo_mode') == 'shared' else 'dedicated'] += 1
+
+        shared = {'reachable': False}
+        try:
+            status = await self.admin_client.admin.command('serverStatus')
+            cache = status.get('wiredTiger', {}).get('cache', {})
+            shared = {
+                'reachable': True,
+                'resident_mb': status.get('mem', {}).get('resident'),
+                'cache_bytes': cache.get('bytes currently in the cache'),
+                'cache_max_bytes': cache.get('maximum bytes configured'),
+                'connections': status.get('connections', {}).get('current'),
+            }
+        except Exception as e:
+            shared['error'] = str(e)
+
+        return {'mode': TENANT_MONGO_MODE, 'placement': placement, 'shared_mongod': shared}
+
+
+# Singleton instance
+tenant_mongo = TenantMongoService()
@@ -0,0 +1,89 @@
+"""
+Shared Runtime Tenant Registry
+Entries read by tenant backends running with TENANT_MODE=shared: one process
+serves many tenants and looks each request's tenant up here by Host header
+(or token claim) to find its database and JWT secret.
+
+Entries mirror what the per-tenant compose passes to a dedicated backend
+container, so a tenant can move between runtimes without invalidating tokens.
+MongoDB collection: tenant_registry
+"""
+
+import logging
+from typing import Optional, Dict, Any, List
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+
+def tenant_registry_entry(company: Dict[str, Any]) -> Dict[str, Any]:
+    """Registry entry for a provisioned full-stack company"""
+    code = company['code']
+    safe_code = code.replace('-', '').replace('_', '')
+    domain = company['domain']
+    return {
+        'code': code,
+        'company_id': company['id'],
+        'company_name': company.get('name'),
+        'domain': domain,
+        'api_url': f"https://api.{domain}",
+        'hosts': [f"api.{domain}", domain, f"panel.{domain}"],
+        # Tenant MongoDB containers (and the shared tenant mongod) are on traefik_network,
+        # where the shared runtime runs
+        'mongo_url': company.get('mongo_url') or f"mongodb://{safe_code}_mongodb:27017",
+        'db_name': f"{safe_code}_db",
+        'jwt_secret': f"{safe_code}_jwt_secret_2024",
+        'active': True,
+    }
+
+
+class TenantRegistryService:
+    """Keeps tenant_registry in step with provisioned companies"""
+
+    def __init__(self, db=None):
+        self.db = db
+
+    def set_db(self, db):
+        """Database bağlantısını ayarla"""
+        self.db = db
+
+    async def ensure_indexes(self):
+        await self.db.tenant_registry.create_index('code', unique=True)
+        await self.db.tenant_registry.create_index('hosts')
+
+    async def register(self, company: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if self.db is None or not company.get('domain'):
+            return None
+        entry = tenant_registry_entry(company)
+        entry['updated_at'] = datetime.now(timezone.utc).isoformat()
+        await self.db.tenant_registry.update_one({'code': entry['code']}, {'$set': entry}, upsert=True)
+        logger.info(f"[TENANT-REGISTRY] Registered {entry['code']} ({', '.join(entry['hosts'])})")
+        return entry
+
+    async def unregister(self, company_code: str) -> bool:
+        if self.db is None:
+            return False
+        result = await self.db.tenant_registry.delete_one({'code': company_code})
+        return result.deleted_count > 0
+
+    async def sync(self) -> Dict[str, Any]:
+        """Register every provisioned full-stack company and drop entries for the rest"""
+        companies = await self.db.companies.find(
+            {'portainer_stack_id': {'$ne': None}, 'domain': {'$nin': [None, '']}},
+            {'_id': 0, 'id': 1, 'code': 1, 'name': 1, 'domain': 1, 'mongo_url': 1}
+        ).to_list(5000)
+        for company in companies:
+            await self.register(company)
+        codes = [c['code'] for c in companies]
+        removed = await self.db.tenant_registry.delete_many({'code': {'$nin': codes}})
+        return {'success': True, 'registered': len(codes), 'removed': removed.deleted_count}
+
+    async def list_entries(self) -> List[Dict[str, Any]]:
+        # Secrets stay in the registry; listings only show routing data
+        return await self.db.tenant_registry.find(
+            {}, {'_id': 0, 'jwt_secret': 0, 'mongo_url': 0}
+        ).sort('code', 1).to_list(5000)
+
+
+# Singleton instance
+tenant_registry = TenantRegistryService()
@@ -0,0 +1,295 @@
+"""
+Tenant Ticket Replication
+Copies support tickets from tenant databases into the superadmin
+support_tickets collection, so the superadmin ticket list is one indexed
+local query whatever the number of tenants.
+
+- per tenant high-water mark on updated_at (ticket_replication_state); each
+  run only pulls tickets changed since then and upserts them by source_key
+  ("{company_code}:{tenant ticket id}")
+- tenants are pulled concurrently through TenantFanOut; a failing tenant
+  keeps its watermark and is retried next run
+- superadmin replies and status changes are written back to the tenant
+  ticket (responses / status / updated_at) and replicate back unchanged;
+  they are kept in the superadmin ticket's pending_push until the tenant
+  has them, and a tenant's pending pushes are retried before it is pulled
+  so a pull never overwrites a change the tenant has not seen
+
+Superadmin-only fields (messages, assigned_to, resolved_*) are never
+overwritten by replication.
+MongoDB collections: support_tickets, ticket_replication_state
+"""
+
+import os
+import asyncio
+import logging
+from typing import Optional, Dict, Any, List
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+from services.tenant_db import tenant_databases
+from services.tenant_fanout import TenantFanOut
+
+logger = logging.getLogger(__name__)
+
+TICKET_REPLICATION_INTERVAL = float(os.environ.get('TICKET_REPLICATION_INTERVAL', '30'))
+TICKET_REPLICATION_TIMEOUT = float(os.environ.get('TICKET_REPLICATION_TIMEOUT', '20'))
+TICKET_REPLICATION_BATCH = int(os.environ.get('TICKET_REPLICATION_BATCH', '500'))
+
+# Kept from the superadmin copy, never taken from the tenant document
+SUPERADMIN_FIELDS = ('_id', 'messages', 'assigned_to', 'resolved_at', 'resolved_by', 'ticket_number')
+
+
+def source_key(company_code: str, ticket_id: str) -> str:
+    return f"{company_code}:{ticket_id}"
+
+
+def ticket_changed_at(ticket: Dict[str, Any]) -> str:
+    # Tickets created before tenants stamped updated_at only have created_at
+    return ticket.get('updated_at') or ticket.get('created_at') or ''
+
+
+def replicated_ticket_update(company: Dict[str, Any], ticket: Dict[str, Any],
+                             insert_only: bool = False) -> UpdateOne:
+    """Upsert of one tenant ticket into superadmin support_tickets; insert_only never touches an existing one"""
+    key = source_key(company['code'], ticket['id'])
+    created_at = ticket.get('created_at') or datetime.now(timezone.utc).isoformat()
+    fields = {k: v for k, v in ticket.items() if k not in SUPERADMIN_FIELDS}
+    fields.update({
+        'source': 'tenant_db',
+        'source_key': key,
+        'tenant_ticket_id': ticket['id'],
+        'company_id': company['id'],
+        'company_code': company['code'],
+        'company_name': company.get('name') or ticket.get('company_name'),
+        'updated_at': ticket_changed_at(ticket),
+        'replicated_at': datetime.now(timezone.utc).isoformat(),
+    })
+    on_insert = {
+        'ticket_number': f"TKT-{created_at[:10].replace('-', '')}-{ticket['id'][:6].upper()}",
+        'messages': [{
+            'id': ticket['id'],
+            'sender_id': ticket.get('created_by'),
+            'sender_name': ticket.get('created_by_name') or ticket.get('created_by_email'),
+            'sender_type': 'customer',
+            'message': ticket.get('message', ''),
+            'created_at': created_at
+        }],
+        'assigned_to': None,
+        'resolved_at': None,
+    }
+    if insert_only:
+        return UpdateOne({'source_key': key}, {'$setOnInsert': {**fields, **on_insert}}, upsert=True)
+    return UpdateOne({'source_key': key}, {'$set': fields, '$setOnInsert': on_insert}, upsert=True)
+
+
+class TicketReplicator:
+    """Background pull of tenant tickets plus write-back of superadmin replies"""
+
+    def __init__(self, databases, db=None):
+        self.databases = databases
+        self.db = db
+        self.fanout = TenantFanOut(timeout=TICKET_REPLICATION_TIMEOUT, cache_ttl=0)
+        self._task: Optional[asyncio.Task] = None
+        self._run_lock = asyncio.Lock()
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    def set_db(self, db):
+        """Database bağlantısını ayarla"""
+        self.db = db
+
+    async def ensure_indexes(self):
+        # Tickets pushed by tenants before replication existed take over their source key
+        await self.db.support_tickets.update_many(
+            {'source': 'tenant_panel', 'source_key': {'$exists': False},
+             'company_code': {'$type': 'string'}, 'id': {'$type': 'string'}},
+            [{'$set': {'source_key': {'$concat': ['$company_code', ':', '$id']}, 'tenant_ticket_id': '$id'}}]
+        )
+        await self.db.support_tickets.create_index(
+            'source_key', unique=True, partialFilterExpression={'source_key': {'$exists': True}}
+        )
+        await self.db.support_tickets.create_index('id')
+        await self.db.support_tickets.create_index([('updated_at', -1)])
+        await self.db.support_tickets.create_index([('status', 1), ('updated_at', -1)])
+        await self.db.support_tickets.create_index([('priority', 1), ('updated_at', -1)])
+        await self.db.support_tickets.create_index([('company_id', 1), ('updated_at', -1)])
+        await self.db.support_tickets.create_index(
+            'company_id', name='pending_push_company', partialFilterExpression={'pending_push': {'$exists': True}}
+        )
+        await self.db.ticket_replication_state.create_index('company_code', unique=True)
+
+    async def _companies(self) -> List[Dict[str, Any]]:
+        companies = await self.db.companies.find(
+            {'is_active': True},
+            {'_id': 0, 'id': 1, 'code': 1, 'name': 1, 'ports': 1, 'mongo_mode': 1, 'server_ip': 1}
+        ).to_list(5000)
+        return [c for c in companies if c.get('code') and self.databases.connection_url(c)]
+
+    async def upsert_tickets(self, company: Dict[str, Any], tickets: List[Dict[str, Any]],
+                             insert_only: bool = False) -> int:
+        if not tickets:
+            return 0
+        await self.db.support_tickets.bulk_write(
+            [replicated_ticket_update(company, t, insert_only) for t in tickets], ordered=False
+        )
+        return len(tickets)
+
+    async def replicate_tenant(self, company: Dict[str, Any]) -> Dict[str, Any]:
+        """Pull tickets changed since the tenant's watermark and advance it"""
+        state = await self.db.ticket_replication_state.find_one({'company_code': company['code']}, {'_id': 0}) or {}
+        watermark = state.get('watermark')
+
+        tenant_db = await self.databases.get_database(company)
+        # A push that fails here fails the tenant, so the pull below cannot undo it
+        await self.flush_pending(company, tenant_db)
+
+        # $gte: tickets sharing the watermark timestamp are re-read, upserts make that harmless
+        # Tickets from tenants on older templates have no updated_at and are tracked by created_at
+        query = {'$or': [
+            {'updated_at': {'$gte': watermark}},
+            {'updated_at': {'$exists': False}, 'created_at': {'$gte': watermark}}
+        ]} if watermark else {}
+        cursor = tenant_db.support_tickets.find(query, {'_id': 0}).sort('updated_at', 1)
+
+        replicated, batch = 0, []
+        new_watermark = watermark
+        async for ticket in cursor:
+            if not ticket.get('id'):
+                continue
+            batch.append(ticket)
+            changed_at = ticket_changed_at(ticket)
+            if changed_at != watermark:
+                replicated += 1
+            new_watermark = max(new_watermark or '', changed_at)
+            if len(batch) >= TICKET_REPLICATION_BATCH:
+                await self.upsert_tickets(company, batch)
+                batch = []
+        await self.upsert_tickets(company, batch)
+
+        await self.db.ticket_replication_state.update_one(
+            {'company_code': company['code']},
+            {'$set': {
+                'watermark': new_watermark,
+                'last_run_at': datetime.now(timezone.utc).isoformat(),
+                'last_error': None
+            }, '$inc': {'replicated_total': replicated}},
+            upsert=True
+        )
+        return {'replicated': replicated, 'watermark': new_watermark}
+
+    async def run_once(self) -> Dict[str, Any]:
+        async with self._run_lock:
+            started = datetime.now(timezone.utc)
+            companies = await self._companies()
+            run = await self.fanout.run(companies, 'ticket_replication', self.replicate_tenant, use_cache=False)
+
+            for code, status in run['tenants'].items():
+                if not status['ok']:
+                    await self.db.ticket_replication_state.update_one(
+                        {'company_code': code},
+                        {'$set': {'last_error': status['error'], 'last_error_at': started.isoformat()}},
+                        upsert=True
+                    )
+            self.last_run = {
+                'at': started.isoformat(),
+                'tenants': len(companies),
+                'replicated': sum(r['replicated'] for r in run['results'].values()),
+                'failed': [code for code, s in run['tenants'].items() if not s['ok']],
+                'duration_seconds': round((datetime.now(timezone.utc) - started).total_seconds(), 2),
+            }
+            if self.last_run['replicated'] or self.last_run['failed']:
+                logger.info(
+                    f"[TICKET-REPLICATION] {self.last_run['replicated']} tickets from {len(companies)} tenants "
+                    f"({len(self.last_run['failed'])} failed) in {self.last_run['duration_seconds']}s"
+                )
+            return self.last_run
+
+    async def push_to_tenant(self, ticket: Dict[str, Any], status: str = None,
+                             response: Dict[str, Any] = None) -> bool:
+        """Write a superadmin reply / status change back to the tenant's own ticket"""
+        if not ticket.get('tenant_ticket_id'):
+            return False
+
+        # Recorded first, so a failed push is retried before the tenant is pulled again
+        pending: Dict[str, Any] = {'$set': {'pending_push.updated_at': datetime.now(timezone.utc).isoformat()}}
+        if status:
+            pending['$set']['pending_push.status'] = status
+        if response:
+            pending['$push'] = {'pending_push.responses': response}
+        await self.db.support_tickets.update_one({'id': ticket['id']}, pending)
+
+        company = await self.db.companies.find_one({'id': ticket.get('company_id')}, {'_id': 0})
+        if not company:
+            return False
+        try:
+            tenant_db = await self.databases.get_database(company)
+            return await self._push_pending(tenant_db, ticket['id'])
+        except Exception as e:
+            logger.warning(f"[TICKET-REPLICATION] Could not update ticket on {company['code']}, will retry: {str(e)}")
+            return False
+
+    async def _push_pending(self, tenant_db, ticket_id: str) -> bool:
+        """Apply a superadmin ticket's pending_push to the tenant ticket and clear it"""
+        ticket = await self.db.support_tickets.find_one(
+            {'id': ticket_id, 'pending_push': {'$exists': True}},
+            {'_id': 0, 'id': 1, 'tenant_ticket_id': 1, 'pending_push': 1}
+        )
+        if not ticket:
+            return False
+        pending = ticket['pending_push']
+
+        update: Dict[str, Any] = {'$set': {'updated_at': pending['updated_at']}}
+        if pending.get('status'):
+            update['$set']['status'] = pending['status']
+        if pending.get('responses'):
+            # $addToSet: a retry after a lost acknowledgement adds each response once
+            update['$addToSet'] = {'responses': {'$each': pending['responses']}}
+        result = await tenant_db.support_tickets.update_one({'id': ticket['tenant_ticket_id']}, update)
+
+        # A change recorded meanwhile keeps pending_push and is pushed on the next attempt
+        await self.db.support_tickets.update_one(
+            {'id': ticket_id, 'pending_push': pending}, {'$unset': {'pending_push': ''}}
+        )
+        return result.matched_count > 0
+
+    async def flush_pending(self, company: Dict[str, Any], tenant_db) -> int:
+        """Retry every superadmin change the tenant has not received yet"""
+        pushed = 0
+        async for ticket in self.db.support_tickets.find(
+            {'company_id': company['id'], 'pending_push': {'$exists': True}}, {'_id': 0, 'id': 1}
+        ):
+            await self._push_pending(tenant_db, ticket['id'])
+            pushed += 1
+        if pushed:
+            logger.info(f"[TICKET-REPLICATION] Pushed {pushed} pending ticket changes to {company['code']}")
+        return pushed
+
+    async def get_status(self) -> Dict[str, Any]:
+        states = await self.db.ticket_replication_state.find({}, {'_id': 0}).sort('company_code', 1).to_list(5000)
+        return {
+            'interval_seconds': TICKET_REPLICATION_INTERVAL,
+            'last_run': self.last_run,
+            'tenants': states,
+        }
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"[TICKET-REPLICATION] Run failed: {str(e)}")
+            await asyncio.sleep(TICKET_REPLICATION_INTERVAL)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+# Singleton instance
+ticket_replicator = TicketReplicator(tenant_databases)
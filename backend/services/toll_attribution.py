@@ -0,0 +1,200 @@
+"""
+Toll-to-Rental Attribution
+Links HGS passages to the reservation (and customer) that had the vehicle
+at passage time, so tolls can be charged back on return.
+
+- rental interval per reservation: delivered_at .. returned_at (open
+  rentals run until now, start_date / end_date when a stamp is missing);
+  reservations delivered before these fields were stamped are backfilled
+  at startup from deliveries / returns (only those still missing a stamp,
+  in bulk writes)
+- passages and intervals are joined per vehicle with a NumPy sort-merge
+  (blocking_tasks.match_intervals); runs larger than
+  TOLL_ATTRIBUTION_INLINE passages go to the process pool
+- matched passages get reservation_id / customer_id in one UpdateMany per
+  reservation; only unattributed passages are scanned unless reattribute
+- reservation_tolls() sums a reservation's passages for the return's
+  extra charges
+
+MongoDB collections: hgs_passages (reservation_id, customer_id), reservations
+"""
+
+import os
+import time
+import logging
+from typing import Optional, Dict, Any, List
+from datetime import datetime, timezone
+
+import numpy as np
+from pymongo import UpdateMany, UpdateOne
+
+from services.executor import blocking_executor
+from services.blocking_tasks import match_intervals
+from services.hgs_service import STATEMENT_TZ
+
+logger = logging.getLogger(__name__)
+
+TOLL_ATTRIBUTION_INLINE = int(os.environ.get('TOLL_ATTRIBUTION_INLINE', '20000'))
+TOLL_BACKFILL_BATCH = 1000
+
+# Statements usually arrive after the rental is closed
+RENTAL_STATUSES = ['delivered', 'returned', 'closed']
+
+
+def to_epoch(value: Any) -> Optional[float]:
+    """Epoch seconds of an ISO timestamp; naive values are Turkey local time"""
+    if not value:
+        return None
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=STATEMENT_TZ)
+    return value.timestamp()
+
+
+class TollAttributionService:
+    """Batch join of HGS passages with reservation rental intervals"""
+
+    def __init__(self, db=None):
+        self.db = db
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    def set_db(self, db):
+        """Database bağlantısını ayarla"""
+        self.db = db
+
+    async def ensure_indexes(self):
+        await self.db.hgs_passages.create_index('reservation_id')
+        await self.db.hgs_passages.create_index('batch_id', sparse=True)
+        await self.db.reservations.create_index([('vehicle_id', 1), ('status', 1)])
+
+        # Rentals from before delivered_at / returned_at were stamped on the reservation
+        await self._backfill_stamp('deliveries', 'delivered_at')
+        await self._backfill_stamp('returns', 'returned_at')
+
+    async def _backfill_stamp(self, source: str, field: str):
+        """Copy field from the delivery / return record onto reservations that lack it, in bulk"""
+        missing = await self.db.reservations.distinct(
+            'id', {field: {'$exists': False}, 'status': {'$in': RENTAL_STATUSES}}
+        )
+        for i in range(0, len(missing), TOLL_BACKFILL_BATCH):
+            records = await self.db[source].find(
+                {'reservation_id': {'$in': missing[i:i + TOLL_BACKFILL_BATCH]}, field: {'$ne': None}},
+                {'_id': 0, 'reservation_id': 1, field: 1}
+            ).to_list(None)
+            if records:
+                await self.db.reservations.bulk_write([
+                    UpdateOne({'id': r['reservation_id'], field: {'$exists': False}}, {'$set': {field: r[field]}})
+                    for r in records
+                ], ordered=False)
+                logger.info(f"[TOLL-ATTRIBUTION] Backfilled {field} on {len(records)} reservations")
+
+    async def attribute(self, company_id: str = None, vehicle_ids: List[str] = None, batch_id: str = None,
+                        reattribute: bool = False) -> Dict[str, Any]:
+        """Attribute passages (optionally of some vehicles / one import batch) to reservations"""
+        started = time.monotonic()
+        query: Dict[str, Any] = {}
+        if company_id:
+            query['company_id'] = company_id
+        if vehicle_ids:
+            query['vehicle_id'] = {'$in': list(vehicle_ids)}
+        if batch_id:
+            query['batch_id'] = batch_id
+        if not reattribute:
+            query['reservation_id'] = None
+
+        passages = await self.db.hgs_passages.find(
+            query, {'_id': 0, 'id': 1, 'vehicle_id': 1, 'passage_time': 1}
+        ).to_list(None)
+        passages = [p for p in passages if p.get('vehicle_id') and to_epoch(p.get('passage_time')) is not None]
+        if not passages:
+            return {'passages': 0, 'attributed': 0, 'reservations': 0, 'duration_ms': round((time.monotonic() - started) * 1000)}
+
+        reservation_query: Dict[str, Any] = {
+            'vehicle_id': {'$in': list({p['vehicle_id'] for p in passages})},
+            'status': {'$in': RENTAL_STATUSES},
+        }
+        if company_id:
+            reservation_query['company_id'] = company_id
+        reservations = await self.db.reservations.find(
+            reservation_query,
+            {'_id': 0, 'id': 1, 'vehicle_id': 1, 'customer_id': 1, 'status': 1,
+             'delivered_at': 1, 'returned_at': 1, 'start_date': 1, 'end_date': 1}
+        ).to_list(None)
+
+        intervals = []
+        for r in reservations:
+            start = to_epoch(r.get('delivered_at') or r.get('start_date'))
+            if r['status'] != 'delivered':
+                end = to_epoch(r.get('returned_at') or r.get('end_date'))
+            else:
+                end = float('inf')
+            if start is not None and end is not None:
+                intervals.append((r, start, end))
+
+        # Shared integer codes for vehicle ids on both sides of the join
+        vehicle_codes, codes = np.unique(
+            [p['vehicle_id'] for p in passages] + [r['vehicle_id'] for r, _, _ in intervals], return_inverse=True
+        )
+        p_vehicle, i_vehicle = codes[:len(passages)], codes[len(passages):]
+        p_time = np.fromiter((to_epoch(p['passage_time']) for p in passages), dtype=np.float64, count=len(passages))
+        i_start = np.fromiter((s for _, s, _ in intervals), dtype=np.float64, count=len(intervals))
+        i_end = np.fromiter((e for _, _, e in intervals), dtype=np.float64, count=len(intervals))
+
+        args = (p_vehicle, p_time, i_vehicle, i_start, i_end)
+        if len(passages) > TOLL_ATTRIBUTION_INLINE:
+            matches = await blocking_executor.run_cpu(match_intervals, *args)
+        else:
+            matches = match_intervals(*args)
+
+        by_interval: Dict[int, List[str]] = {}
+        for passage, match in zip(passages, matches.tolist()):
+            by_interval.setdefault(match, []).append(passage['id'])
+
+        now = datetime.now(timezone.utc).isoformat()
+        updates = []
+        for match, ids in by_interval.items():
+            if match < 0:
+                if reattribute:
+                    updates.append(UpdateMany({'id': {'$in': ids}}, {'$set': {'reservation_id': None, 'customer_id': None}}))
+                continue
+            reservation = intervals[match][0]
+            updates.append(UpdateMany({'id': {'$in': ids}}, {'$set': {
+                'reservation_id': reservation['id'],
+                'customer_id': reservation.get('customer_id'),
+                'attributed_at': now,
+            }}))
+        if updates:
+            await self.db.hgs_passages.bulk_write(updates, ordered=False)
+
+        attributed = sum(len(ids) for match, ids in by_interval.items() if match >= 0)
+        self.last_run = {
+            'passages': len(passages),
+            'attributed': attributed,
+            'reservations': sum(1 for match in by_interval if match >= 0),
+            'duration_ms': round((time.monotonic() - started) * 1000),
+        }
+        if attributed:
+            logger.info(f"[TOLL-ATTRIBUTION] {attributed}/{len(passages)} passages -> "
+                        f"{self.last_run['reservations']} reservations in {self.last_run['duration_ms']}ms")
+        return self.last_run
+
+    async def reservation_tolls(self, reservation_id: str) -> Dict[str, Any]:
+        """Toll passages and total of one reservation"""
+        passages = await self.db.hgs_passages.find(
+            {'reservation_id': reservation_id},
+            {'_id': 0, 'id': 1, 'vehicle_plate': 1, 'location': 1, 'amount': 1, 'passage_time': 1, 'direction': 1}
+        ).sort('passage_time', 1).to_list(None)
+        return {
+            'reservation_id': reservation_id,
+            'passages': passages,
+            'count': len(passages),
+            'total_amount': round(sum(p.get('amount') or 0 for p in passages), 2),
+        }
+
+
+# Singleton instance
+toll_attribution = TollAttributionService()
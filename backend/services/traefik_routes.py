@@ -0,0 +1,117 @@
+"""
+Traefik Route Readiness
+Tenant routes come from Docker labels, which Traefik's docker provider picks
+up from the events stream as soon as the containers start - no Traefik
+restart is needed. This module waits until Traefik's API reports the
+tenant's routers enabled and measures how long that took.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional
+
+import httpx
+
+from services.portainer_service import SERVER_IP
+
+logger = logging.getLogger(__name__)
+
+# Traefik runs with --api.insecure=true, so the API is served on :8080
+TRAEFIK_API_URL = os.environ.get('TRAEFIK_API_URL', f"http://{SERVER_IP}:8080")
+ROUTE_READY_TIMEOUT = float(os.environ.get('TRAEFIK_ROUTE_READY_TIMEOUT', '120'))
+ROUTE_POLL_INTERVAL = float(os.environ.get('TRAEFIK_ROUTE_POLL_INTERVAL', '1'))
+
+
+def tenant_router_names(safe_code: str) -> List[str]:
+    """Routers declared by the labels of a full company stack"""
+    return [f"{safe_code}-api@docker", f"{safe_code}-web@docker", f"{safe_code}-panel@docker"]
+
+
+class TraefikRouteWatcher:
+    """Reads router / service state from the Traefik API"""
+
+    def __init__(self, api_url: str = TRAEFIK_API_URL):
+        self.api_url = api_url.rstrip('/')
+
+    async def get_routers(self, client: httpx.AsyncClient) -> Dict[str, Dict[str, Any]]:
+        response = await client.get(f"{self.api_url}/api/http/routers", params={'per_page': 1000})
+        response.raise_for_status()
+        return {r.get('name'): r for r in response.json()}
+
+    async def get_service_servers(self, client: httpx.AsyncClient, service: str) -> Dict[str, str]:
+        """{server url: UP/DOWN} for a service, empty if Traefik has none yet"""
+        response = await client.get(f"{self.api_url}/api/http/services/{service}")
+        if response.status_code == 404:
+            return {}
+        response.raise_for_status()
+        return response.json().get('serverStatus') or {}
+
+    async def wait_for_routes(self, routers: List[str], timeout: float = ROUTE_READY_TIMEOUT,
+                              started_at: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Poll until every router is enabled and its service has an UP server.
+
+        started_at: time.monotonic() of when the containers were created, so
+        the reported time_to_route covers the whole provision, not just the wait.
+        """
+        started_at = started_at or time.monotonic()
+        wait_started = time.monotonic()
+        deadline = wait_started + timeout
+        pending = set(routers)
+        status: Dict[str, Any] = {}
+
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            while True:
+                status.pop('_error', None)
+                try:
+                    current = await self.get_routers(client)
+                    for name in list(pending):
+                        router = current.get(name)
+                        if not router or router.get('status') != 'enabled':
+                            status[name] = router.get('status') if router else 'missing'
+                            continue
+                        service = router.get('service', '')
+                        if '@' not in service:
+                            service = f"{service}@docker"
+                        servers = await self.get_service_servers(client, service)
+                        if servers and 'UP' in servers.values():
+                            status[name] = 'ready'
+                            pending.discard(name)
+                        else:
+                            status[name] = 'no_healthy_server'
+                except Exception as e:
+                    status['_error'] = str(e)
+
+                if not pending:
+                    elapsed = round(time.monotonic() - started_at, 2)
+                    logger.info(f"[TRAEFIK] Routes ready in {elapsed}s: {', '.join(routers)}")
+                    return {
+                        'success': True,
+                        'time_to_route_seconds': elapsed,
+                        'wait_seconds': round(time.monotonic() - wait_started, 2),
+                        'routers': status
+                    }
+
+                if time.monotonic() >= deadline:
+                    logger.warning(f"[TRAEFIK] Routes not ready after {timeout}s: {status}")
+                    return {
+                        'success': False,
+                        'error': f'Routes not ready after {timeout}s',
+                        'wait_seconds': round(time.monotonic() - wait_started, 2),
+                        'routers': status
+                    }
+
+                await asyncio.sleep(ROUTE_POLL_INTERVAL)
+
+
+# Singleton instance
+traefik_routes = TraefikRouteWatcher()
+
+
+def traefik_for(server_ip: Optional[str]) -> TraefikRouteWatcher:
+    """Route watcher for the Traefik on a given Docker host - every host runs its own"""
+    if not server_ip or server_ip == SERVER_IP:
+        return traefik_routes
+    return TraefikRouteWatcher(f"http://{server_ip}:8080")
@@ -5,14 +5,18 @@ SuperAdmin kodları bu dosyada YOK - sadece firma işlevselliği var.
 """
 
 import os
+import time
 import uuid
 import logging
+from collections import OrderedDict
+from contextvars import ContextVar
 from datetime import datetime, timezone, timedelta
 from typing import Optional, List
 from enum import Enum
 
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -36,9 +40,125 @@ JWT_SECRET = os.environ.get("JWT_SECRET", "tenant_jwt_secret_key_2024")
 JWT_ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24
 
+# Runtime mode
+# single: one tenant per container, configured from the environment (default)
+# shared: one process serves many tenants; the tenant is resolved per request
+#         and its database / secrets come from the tenant registry
+TENANT_MODE = os.environ.get("TENANT_MODE", "single").lower()
+SHARED_RUNTIME = TENANT_MODE == "shared"
+TENANT_REGISTRY_URL = os.environ.get("TENANT_REGISTRY_URL", MONGO_URL)
+TENANT_REGISTRY_DB = os.environ.get("TENANT_REGISTRY_DB", "superadmin_db")
+TENANT_CONFIG_TTL = float(os.environ.get("TENANT_CONFIG_TTL", "60"))
+TENANT_CLIENT_CACHE_SIZE = int(os.environ.get("TENANT_CLIENT_CACHE_SIZE", "200"))
+TENANT_MONGO_POOL_SIZE = int(os.environ.get("TENANT_MONGO_POOL_SIZE", "10"))
+
+# Per-tenant settings and the environment variable used in single mode
+TENANT_ENV_SETTINGS = {
+    "code": "COMPANY_CODE",
+    "company_name": "COMPANY_NAME",
+    "domain": "DOMAIN",
+    "api_url": "API_URL",
+    "tenant_secret": "TENANT_SECRET",
+}
+
+current_tenant: ContextVar[Optional[dict]] = ContextVar("current_tenant", default=None)
+
+def tenant_setting(key: str, default: Optional[str] = None) -> Optional[str]:
+    """Setting for the current tenant - registry entry in shared mode, environment otherwise"""
+    tenant = current_tenant.get()
+    value = tenant.get(key) if tenant is not None else os.environ.get(TENANT_ENV_SETTINGS[key])
+    return value or default
+
+def tenant_jwt_secret() -> str:
+    tenant = current_tenant.get()
+    return tenant["jwt_secret"] if tenant is not None else JWT_SECRET
+
+def tenant_claims() -> dict:
+    """Extra token claims; shared-mode tokens carry their tenant code"""
+    tenant = current_tenant.get()
+    return {"tenant": tenant["code"]} if tenant is not None else {}
+
+class TenantRegistry:
+    """Tenant lookup by host / code from the registry collection, cached for TENANT_CONFIG_TTL"""
+
+    def __init__(self, mongo_url: str, db_name: str):
+        self._client = AsyncIOMotorClient(mongo_url, maxPoolSize=TENANT_MONGO_POOL_SIZE)
+        self._collection = self._client[db_name].tenant_registry
+        self._cache = {}
+
+    async def _lookup(self, field: str, value: str) -> Optional[dict]:
+        key = (field, value)
+        cached = self._cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        tenant = await self._collection.find_one({field: value, "active": {"$ne": False}}, {"_id": 0})
+        self._cache[key] = (time.monotonic() + TENANT_CONFIG_TTL, tenant)
+        return tenant
+
+    async def by_host(self, host: str) -> Optional[dict]:
+        return await self._lookup("hosts", host.split(":")[0].lower())
+
+    async def by_code(self, code: str) -> Optional[dict]:
+        return await self._lookup("code", code)
+
+class TenantDatabases:
+    """
+    Motor handles per tenant. One client (connection pool) per MongoDB URL,
+    shared by every tenant database on that server; least recently used
+    clients are closed beyond TENANT_CLIENT_CACHE_SIZE.
+    """
+
+    def __init__(self):
+        self._clients: "OrderedDict[str, AsyncIOMotorClient]" = OrderedDict()
+        self._indexed = set()
+
+    def get(self, tenant: dict):
+        url = tenant["mongo_url"]
+        mongo = self._clients.get(url)
+        if mongo is None:
+            mongo = AsyncIOMotorClient(url, maxPoolSize=TENANT_MONGO_POOL_SIZE)
+            self._clients[url] = mongo
+            while len(self._clients) > TENANT_CLIENT_CACHE_SIZE:
+                evicted_url, evicted = self._clients.popitem(last=False)
+                evicted.close()
+                self._indexed = {i for i in self._indexed if i[0] != evicted_url}
+        else:
+            self._clients.move_to_end(url)
+        return mongo[tenant["db_name"]]
+
+    async def ensure_indexes(self, tenant: dict):
+        key = (tenant["mongo_url"], tenant["db_name"])
+        if key not in self._indexed:
+            await create_indexes(self.get(tenant))
+            self._indexed.add(key)
+
+    def stats(self) -> dict:
+        return {"clients": len(self._clients), "indexed_databases": len(self._indexed)}
+
+class TenantDatabaseProxy:
+    """Module-level `db` for shared mode - resolves to the current tenant's database"""
+
+    def _database(self):
+        tenant = current_tenant.get()
+        if tenant is None:
+            raise RuntimeError("No tenant in request context")
+        return tenant_databases.get(tenant)
+
+    def __getattr__(self, name):
+        return getattr(self._database(), name)
+
+    def __getitem__(self, name):
+        return self._database()[name]
+
 # MongoDB Connection
-client = AsyncIOMotorClient(MONGO_URL)
-db = client[DB_NAME]
+if SHARED_RUNTIME:
+    client = None
+    tenant_registry = TenantRegistry(TENANT_REGISTRY_URL, TENANT_REGISTRY_DB)
+    tenant_databases = TenantDatabases()
+    db = TenantDatabaseProxy()
+else:
+    client = AsyncIOMotorClient(MONGO_URL)
+    db = client[DB_NAME]
 
 # Password Hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -221,15 +341,18 @@ def hash_password(password: str) -> str:
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    to_encode.update({"exp": expire, **tenant_claims()})
+    return jwt.encode(to_encode, tenant_jwt_secret(), algorithm=JWT_ALGORITHM)
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        payload = jwt.decode(credentials.credentials, tenant_jwt_secret(), algorithms=[JWT_ALGORITHM])
         user_id = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
+        # A token from another tenant never authenticates here, even if secrets were shared
+        if SHARED_RUNTIME and payload.get("tenant") != current_tenant.get()["code"]:
+            raise HTTPException(status_code=401, detail="Invalid token")
         user = await db.users.find_one({"id": user_id}, {"_id": 0})
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
@@ -240,6 +363,39 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 # ============== FASTAPI APP ==============
 app = FastAPI(title="Rent A Car API", version="1.0.0")
 
+async def resolve_tenant(request: Request) -> Optional[dict]:
+    """Tenant from the Host header, else from the bearer token's tenant claim"""
+    tenant = await tenant_registry.by_host(request.headers.get("host", ""))
+    if tenant:
+        return tenant
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        try:
+            # Unverified here - get_current_user verifies it with this tenant's secret
+            code = jwt.get_unverified_claims(authorization[7:]).get("tenant")
+        except JWTError:
+            code = None
+        if code:
+            return await tenant_registry.by_code(code)
+    return None
+
+# Registered before CORS so CORS stays the outer middleware
+@app.middleware("http")
+async def tenant_context_middleware(request: Request, call_next):
+    if not SHARED_RUNTIME or request.url.path == "/api/health":
+        return await call_next(request)
+
+    tenant = await resolve_tenant(request)
+    if tenant is None:
+        return JSONResponse(status_code=404, content={"detail": "Firma bulunamadı"})
+
+    token = current_tenant.set(tenant)
+    try:
+        await tenant_databases.ensure_indexes(tenant)
+        return await call_next(request)
+    finally:
+        current_tenant.reset(token)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -1102,8 +1258,8 @@ async def get_company_info(user: dict = Depends(get_current_user)):
     
     if not company:
         # Return default company info from environment or settings
-        company_name = os.environ.get("COMPANY_NAME", "Rent A Car")
-        company_code = os.environ.get("COMPANY_CODE", "rentacar")
+        company_name = tenant_setting("company_name", "Rent A Car")
+        company_code = tenant_setting("code", "rentacar")
         return {
             "id": company_id,
             "name": company_name,
@@ -1287,7 +1443,7 @@ async def get_public_company_info():
     company = await db.company.find_one({}, {"_id": 0})
     if not company:
         return {
-            "name": os.environ.get("COMPANY_NAME", "Rent A Car"),
+            "name": tenant_setting("company_name", "Rent A Car"),
             "phone": None,
             "email": None,
             "address": None,
@@ -1393,8 +1549,8 @@ async def login_public_customer(data: PublicCustomerLogin):
         raise HTTPException(status_code=401, detail="Geçersiz email veya şifre")
     
     token = jwt.encode(
-        {"sub": customer["id"], "role": "customer", "exp": datetime.now(timezone.utc) + timedelta(hours=24)},
-        JWT_SECRET, algorithm=JWT_ALGORITHM
+        {"sub": customer["id"], "role": "customer", "exp": datetime.now(timezone.utc) + timedelta(hours=24), **tenant_claims()},
+        tenant_jwt_secret(), algorithm=JWT_ALGORITHM
     )
     
     return {
@@ -1519,9 +1675,10 @@ async def create_support_ticket(data: SupportTicketCreate, user: dict = Depends(
         "created_by_email": user["email"],
         "created_by_name": user.get("full_name", ""),
         "company_name": company_name,
-        "company_code": os.environ.get("COMPANY_CODE", "unknown"),
+        "company_code": tenant_setting("code", "unknown"),
         "source": "tenant_panel",
         "created_at": datetime.now(timezone.utc).isoformat(),
+        "updated_at": datetime.now(timezone.utc).isoformat(),
         "responses": []
     }
     
@@ -1535,7 +1692,7 @@ async def create_support_ticket(data: SupportTicketCreate, user: dict = Depends(
             await client.post(
                 f"{superadmin_url}/api/superadmin/support/tickets/incoming",
                 json=ticket,
-                headers={"X-Tenant-Secret": os.environ.get("TENANT_SECRET", "")}
+                headers={"X-Tenant-Secret": tenant_setting("tenant_secret", "")}
             )
     except Exception as e:
         logger.warning(f"Could not send ticket to SuperAdmin: {e}")
@@ -1578,8 +1735,8 @@ async def start_mobile_build(data: MobileBuildRequest, user: dict = Depends(get_
     # Get company info for customization
     company = await db.company.find_one({}, {"_id": 0})
     company_name = company.get("name", "Rent A Car") if company else "Rent A Car"
-    company_code = os.environ.get("COMPANY_CODE", "tenant")
-    api_url = os.environ.get("API_URL", f"https://api.{os.environ.get('DOMAIN', 'example.com')}")
+    company_code = tenant_setting("code", "tenant")
+    api_url = tenant_setting("api_url", f"https://api.{tenant_setting('domain', 'example.com')}")
     
     # Determine which app to build
     if data.app_type == "customer":
@@ -1773,8 +1930,8 @@ async def get_mobile_config(user: dict = Depends(get_current_user)):
     """Get mobile app configuration for this tenant"""
     company = await db.company.find_one({}, {"_id": 0})
     company_name = company.get("name", "Rent A Car") if company else "Rent A Car"
-    company_code = os.environ.get("COMPANY_CODE", "tenant")
-    api_url = os.environ.get("API_URL", f"https://api.{os.environ.get('DOMAIN', 'example.com')}")
+    company_code = tenant_setting("code", "tenant")
+    api_url = tenant_setting("api_url", f"https://api.{tenant_setting('domain', 'example.com')}")
     
     return {
         "customer_app": {
@@ -1824,18 +1981,31 @@ async def complete_build(build_id: str, data: dict, user: dict = Depends(get_cur
 # ============== HEALTH CHECK ==============
 @app.get("/api/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat()}
+    health = {"status": "healthy", "mode": TENANT_MODE, "timestamp": datetime.now(timezone.utc).isoformat()}
+    if SHARED_RUNTIME:
+        health["tenant_databases"] = tenant_databases.stats()
+    return health
 
 # ============== STARTUP EVENT ==============
+async def create_indexes(database):
+    await database.users.create_index("email", unique=True)
+    await database.vehicles.create_index("plate")
+    await database.customers.create_index("email")
+    await database.reservations.create_index("vehicle_id")
+    # SuperAdmin replicates tickets by updated_at watermark
+    await database.support_tickets.create_index("updated_at")
+
 @app.on_event("startup")
 async def startup_event():
+    if SHARED_RUNTIME:
+        # Tenant indexes are created on each tenant's first request
+        logger.info(f"Tenant API started - shared runtime, registry: {TENANT_REGISTRY_DB}.tenant_registry")
+        return
+
     logger.info(f"Tenant API started - DB: {DB_NAME}")
     
     # Create indexes
-    await db.users.create_index("email", unique=True)
-    await db.vehicles.create_index("plate")
-    await db.customers.create_index("email")
-    await db.reservations.create_index("vehicle_id")
+    await create_indexes(db)
 
 if __name__ == "__main__":
     import uvicorn
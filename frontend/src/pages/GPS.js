@@ -15,9 +15,69 @@ export function GPS() {
   const [selectedVehicle, setSelectedVehicle] = useState(null);
 
   useEffect(() => {
-    fetchLocations();
-    const interval = setInterval(fetchLocations, 30000); // Refresh every 30 seconds
-    return () => clearInterval(interval);
+    // Live positions over Server-Sent Events; fall back to polling if the stream is unavailable
+    const controller = new AbortController();
+    let interval = null;
+
+    const startPolling = () => {
+      if (!interval && !controller.signal.aborted) {
+        fetchLocations();
+        interval = setInterval(fetchLocations, 30000); // Refresh every 30 seconds
+      }
+    };
+
+    const applyEvent = (event, data) => {
+      if (event === "snapshot") {
+        setLocations(data);
+        setLoading(false);
+      } else if (event === "positions") {
+        const key = (loc) => loc.vehicle_id || loc.plate;
+        setLocations((current) => {
+          const byVehicle = new Map(current.map((loc) => [key(loc), loc]));
+          data.forEach((loc) => byVehicle.set(key(loc), { ...byVehicle.get(key(loc)), ...loc }));
+          return Array.from(byVehicle.values());
+        });
+      }
+    };
+
+    const openStream = async () => {
+      try {
+        const response = await fetch(`${getApiUrl()}/api/gps/stream`, {
+          headers: { Authorization: axios.defaults.headers.common["Authorization"] },
+          signal: controller.signal,
+        });
+        if (!response.ok || !response.body) throw new Error(`stream ${response.status}`);
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        for (;;) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          let boundary;
+          while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let event = "message";
+            let data = "";
+            block.split("\n").forEach((line) => {
+              if (line.startsWith("event: ")) event = line.slice(7);
+              else if (line.startsWith("data: ")) data += line.slice(6);
+            });
+            if (data) applyEvent(event, JSON.parse(data));
+          }
+        }
+        startPolling();
+      } catch (error) {
+        if (!controller.signal.aborted) startPolling();
+      }
+    };
+
+    openStream();
+    return () => {
+      controller.abort();
+      if (interval) clearInterval(interval);
+    };
   }, []);
 
   const fetchLocations = async () => {